@@ -34,6 +34,7 @@ class RedisProtocol(protocol.Protocol):
         only_if_exists: bool = False,
     ) -> "Deferred[None]": ...
     def get(self, key: str) -> "Deferred[Any]": ...
+    def mget(self, keys: List[str]) -> "Deferred[List[Any]]": ...
 
 class SubscriberProtocol(RedisProtocol):
     def __init__(self, *args: object, **kwargs: object): ...
@@ -70,7 +70,10 @@ from synapse.metrics.background_process_metrics import wrap_as_background_proces
 from synapse.metrics.jemalloc import setup_jemalloc_stats
 from synapse.types import ISynapseReactor
 from synapse.util import SYNAPSE_VERSION
-from synapse.util.caches.lrucache import setup_expire_lru_cache_entries
+from synapse.util.caches.lrucache import (
+    setup_cache_memory_budget,
+    setup_expire_lru_cache_entries,
+)
 from synapse.util.daemonize import daemonize_process
 from synapse.util.gai_resolver import GAIResolver
 from synapse.util.rlimit import change_resource_limit
@@ -539,6 +542,17 @@ async def start(hs: "HomeServer") -> None:
     # If we've configured an expiry time for caches, start the background job now.
     setup_expire_lru_cache_entries(hs)
 
+    # Likewise if we've configured a memory budget for the caches.
+    setup_cache_memory_budget(hs)
+
+    # Reload the caches saved when we last shut down, and save them again when
+    # we next do, if configured to.
+    cache_snapshot = hs.get_storage_controllers().cache_snapshot
+    await cache_snapshot.restore_snapshot()
+    hs.get_reactor().addSystemEventTrigger(
+        "before", "shutdown", cache_snapshot.write_snapshot
+    )
+
     # It is now safe to start your Synapse.
     hs.start_listening()
     hs.get_datastores().main.db_pool.start_profiling()
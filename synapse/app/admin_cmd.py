@@ -12,12 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
+import gzip
 import json
 import logging
 import os
 import sys
 import tempfile
-from typing import List, Optional
+from typing import IO, List, Optional
 
 from twisted.internet import defer, task
 
@@ -29,6 +30,7 @@ from synapse.config.logger import setup_logging
 from synapse.events import EventBase
 from synapse.handlers.admin import ExfiltrationWriter
 from synapse.server import HomeServer
+from synapse.state.snapshot import export_state_res_snapshot
 from synapse.storage.database import DatabasePool, LoggingDatabaseConnection
 from synapse.storage.databases.main.account_data import AccountDataWorkerStore
 from synapse.storage.databases.main.appservice import (
@@ -112,6 +114,27 @@ async def export_data_command(hs: HomeServer, args: argparse.Namespace) -> None:
     print(res)
 
 
+async def export_state_res_snapshot_command(
+    hs: HomeServer, args: argparse.Namespace
+) -> None:
+    """Export a snapshot of the inputs to resolving the state of a room."""
+
+    snapshot = await export_state_res_snapshot(hs, args.room_id, args.event_id)
+
+    f: IO[str]
+    if args.output.endswith(".gz"):
+        f = gzip.open(args.output, "wt", encoding="utf-8")
+    else:
+        f = open(args.output, "w", encoding="utf-8")
+    with f:
+        snapshot.dump(f)
+
+    print(
+        "Wrote %d state groups and %d events to %s"
+        % (len(snapshot.state_groups), len(snapshot.events), args.output)
+    )
+
+
 class FileExfiltrationWriter(ExfiltrationWriter):
     """An ExfiltrationWriter that writes the users data to a directory.
     Returns the directory location on completion.
@@ -221,6 +244,28 @@ def start(config_options: List[str]) -> None:
     )
     export_data_parser.set_defaults(func=export_data_command)
 
+    export_snapshot_parser = subparser.add_parser(
+        "export-state-res-snapshot",
+        help="Export the inputs to resolving the state of a room, for replaying"
+        " with synmark/state_res_replay.py",
+    )
+    export_snapshot_parser.add_argument("room_id", help="The room to export")
+    export_snapshot_parser.add_argument(
+        "--event-id",
+        action="store",
+        required=False,
+        help="Export the state at the prev events of the given event. Defaults"
+        " to the room's forward extremities.",
+    )
+    export_snapshot_parser.add_argument(
+        "--output",
+        action="store",
+        metavar="FILE",
+        required=True,
+        help="The file to write the snapshot to. Compressed if it ends in .gz.",
+    )
+    export_snapshot_parser.set_defaults(func=export_state_res_snapshot_command)
+
     try:
         config, args = HomeServerConfig.load_config_with_parser(parser, config_options)
     except ConfigError as e:
@@ -33,11 +33,21 @@ _CACHE_PREFIX = "SYNAPSE_CACHE_FACTOR"
 # Map from canonicalised cache name to cache.
 _CACHES: Dict[str, Callable[[float], None]] = {}
 
-# a lock on the contents of _CACHES
+# Map from canonicalised cache name to a callback which sets the eviction policy
+# of that cache.
+_CACHE_EVICTION_POLICIES: Dict[str, Callable[[str], None]] = {}
+
+# a lock on the contents of _CACHES and _CACHE_EVICTION_POLICIES
 _CACHES_LOCK = threading.Lock()
 
 _DEFAULT_FACTOR_SIZE = 0.5
 _DEFAULT_EVENT_CACHE_SIZE = "10K"
+_DEFAULT_SHARED_EVENT_CACHE_SIZE = "512M"
+
+# The eviction policies that caches can be configured to use.
+EVICTION_POLICY_LRU = "lru"
+EVICTION_POLICY_TINYLFU = "tinylfu"
+_EVICTION_POLICIES = (EVICTION_POLICY_LRU, EVICTION_POLICY_TINYLFU)
 
 
 @attr.s(slots=True, auto_attribs=True)
@@ -52,6 +62,17 @@ class CacheProperties:
 properties = CacheProperties()
 
 
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class ResponseCacheSettings:
+    """The settings for a `ResponseCache`. See `ResponseCache.__init__`."""
+
+    # None means the cache's default timeout.
+    timeout_ms: Optional[int] = None
+    stale_timeout_ms: int = 0
+    max_entries: Optional[int] = None
+    max_memory_bytes: Optional[int] = None
+
+
 def _canonicalise_cache_name(cache_name: str) -> str:
     """Gets the canonical form of the cache name.
 
@@ -67,7 +88,9 @@ def _canonicalise_cache_name(cache_name: str) -> str:
 
 
 def add_resizable_cache(
-    cache_name: str, cache_resize_callback: Callable[[float], None]
+    cache_name: str,
+    cache_resize_callback: Callable[[float], None],
+    eviction_policy_callback: Optional[Callable[[str], None]] = None,
 ) -> None:
     """Register a cache whose size can dynamically change
 
@@ -75,6 +98,9 @@ def add_resizable_cache(
         cache_name: A reference to the cache
         cache_resize_callback: A callback function that will run whenever
             the cache needs to be resized
+        eviction_policy_callback: If given, a callback function that will be
+            called with the name of the eviction policy the cache should use
+            whenever the cache config is (re)loaded.
     """
     # Some caches have '*' in them which we strip out.
     cache_name = _canonicalise_cache_name(cache_name)
@@ -83,6 +109,8 @@ def add_resizable_cache(
     # sure we don't conflict with another thread running a resize operation
     with _CACHES_LOCK:
         _CACHES[cache_name] = cache_resize_callback
+        if eviction_policy_callback is not None:
+            _CACHE_EVICTION_POLICIES[cache_name] = eviction_policy_callback
 
     # Ensure all loaded caches are sized appropriately
     #
@@ -102,6 +130,15 @@ class CacheConfig(Config):
     track_memory_usage: bool
     expiry_time_msec: Optional[int]
     sync_response_cache_duration: int
+    eviction_policy: str
+    cache_eviction_policies: Dict[str, str]
+    global_max_memory: Optional[int]
+    shared_event_cache_path: Optional[str]
+    shared_event_cache_size: int
+    snapshot_directory: Optional[str]
+    event_existence_filter_enabled: bool
+    event_existence_filter_error_rate: float
+    response_caches: Dict[str, ResponseCacheSettings]
 
     @staticmethod
     def reset() -> None:
@@ -112,6 +149,7 @@ class CacheConfig(Config):
         properties.resize_all_caches_func = None
         with _CACHES_LOCK:
             _CACHES.clear()
+            _CACHE_EVICTION_POLICIES.clear()
 
     def read_config(self, config: JsonDict, **kwargs: Any) -> None:
         """Populate this config object with values from `config`.
@@ -157,6 +195,91 @@ class CacheConfig(Config):
                 )
             self.cache_factors[cache] = factor
 
+        self.eviction_policy = cache_config.get("eviction_policy", EVICTION_POLICY_LRU)
+        if self.eviction_policy not in _EVICTION_POLICIES:
+            raise ConfigError(
+                "caches.eviction_policy must be one of: %s"
+                % (", ".join(_EVICTION_POLICIES),)
+            )
+
+        individual_policies = cache_config.get("per_cache_eviction_policy") or {}
+        if not isinstance(individual_policies, dict):
+            raise ConfigError("caches.per_cache_eviction_policy must be a dictionary")
+
+        self.cache_eviction_policies = {}
+        for cache, policy in individual_policies.items():
+            if policy not in _EVICTION_POLICIES:
+                raise ConfigError(
+                    "caches.per_cache_eviction_policy.%s must be one of: %s"
+                    % (cache, ", ".join(_EVICTION_POLICIES))
+                )
+            self.cache_eviction_policies[_canonicalise_cache_name(cache)] = policy
+
+        global_max_memory = cache_config.get("global_max_memory")
+        self.global_max_memory = (
+            self.parse_size(global_max_memory) if global_max_memory else None
+        )
+
+        shared_event_cache = cache_config.get("shared_event_cache") or {}
+        if not isinstance(shared_event_cache, dict):
+            raise ConfigError("caches.shared_event_cache must be a dictionary")
+
+        self.shared_event_cache_path = shared_event_cache.get("path")
+        self.shared_event_cache_size = self.parse_size(
+            shared_event_cache.get("size", _DEFAULT_SHARED_EVENT_CACHE_SIZE)
+        )
+
+        self.snapshot_directory = cache_config.get("snapshot_directory")
+
+        event_existence_filter = cache_config.get("event_existence_filter") or {}
+        if not isinstance(event_existence_filter, dict):
+            raise ConfigError("caches.event_existence_filter must be a dictionary")
+
+        self.event_existence_filter_enabled = event_existence_filter.get(
+            "enabled", False
+        )
+        self.event_existence_filter_error_rate = event_existence_filter.get(
+            "error_rate", 0.01
+        )
+        if (
+            not isinstance(self.event_existence_filter_error_rate, float)
+            or not 0 < self.event_existence_filter_error_rate < 1
+        ):
+            raise ConfigError(
+                "caches.event_existence_filter.error_rate must be a number between 0 and 1"
+            )
+
+        response_caches = cache_config.get("response_caches") or {}
+        if not isinstance(response_caches, dict):
+            raise ConfigError("caches.response_caches must be a dictionary")
+
+        self.response_caches = {}
+        for cache, settings in response_caches.items():
+            if not isinstance(settings, dict):
+                raise ConfigError(
+                    "caches.response_caches.%s must be a dictionary" % (cache,)
+                )
+
+            max_entries = settings.get("max_entries")
+            if max_entries is not None and not isinstance(max_entries, int):
+                raise ConfigError(
+                    "caches.response_caches.%s.max_entries must be an integer"
+                    % (cache,)
+                )
+
+            timeout = settings.get("timeout")
+            max_memory = settings.get("max_memory")
+            self.response_caches[
+                _canonicalise_cache_name(cache)
+            ] = ResponseCacheSettings(
+                timeout_ms=self.parse_duration(timeout)
+                if timeout is not None
+                else None,
+                stale_timeout_ms=self.parse_duration(settings.get("stale_timeout", 0)),
+                max_entries=max_entries,
+                max_memory_bytes=self.parse_size(max_memory) if max_memory else None,
+            )
+
         self.track_memory_usage = cache_config.get("track_memory_usage", False)
         if self.track_memory_usage:
             check_requirements("cache-memory")
@@ -204,11 +327,18 @@ class CacheConfig(Config):
             cache_config.get("sync_response_cache_duration", "2m")
         )
 
+    def get_response_cache_settings(self, cache_name: str) -> ResponseCacheSettings:
+        """Get the configured settings for the named `ResponseCache`."""
+        return self.response_caches.get(
+            _canonicalise_cache_name(cache_name), ResponseCacheSettings()
+        )
+
     def resize_all_caches(self) -> None:
-        """Ensure all cache sizes are up-to-date.
+        """Ensure all cache sizes and eviction policies are up-to-date.
 
         For each cache, run the mapped callback function with either
-        a specific cache factor or the default, global one.
+        a specific cache factor or the default, global one. Likewise, set the
+        eviction policy of each cache that supports it.
         """
         # Set the global factor size, so that new caches are appropriately sized.
         properties.default_factor_size = self.global_factor
@@ -222,3 +352,8 @@ class CacheConfig(Config):
             for cache_name, callback in _CACHES.items():
                 new_factor = self.cache_factors.get(cache_name, self.global_factor)
                 callback(new_factor)
+
+            for cache_name, policy_callback in _CACHE_EVICTION_POLICIES.items():
+                policy_callback(
+                    self.cache_eviction_policies.get(cache_name, self.eviction_policy)
+                )
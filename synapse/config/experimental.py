@@ -104,6 +104,10 @@ class ExperimentalConfig(Config):
         # MSC3773: Thread notifications
         self.msc3773_enabled: bool = experimental.get("msc3773_enabled", False)
 
+        # MSC3575 (sliding sync): a subset, allowing a window of the user's rooms
+        # ordered by recency to be requested from /sync.
+        self.msc3575_enabled: bool = experimental.get("msc3575_enabled", False)
+
         # MSC3664: Pushrules to match on related events
         self.msc3664_enabled: bool = experimental.get("msc3664_enabled", False)
 
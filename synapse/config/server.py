@@ -664,6 +664,41 @@ class ServerConfig(Config):
         # The number of forward extremities in a room needed to send a dummy event.
         self.dummy_events_threshold = config.get("dummy_events_threshold", 10)
 
+        state_res_pool_config = config.get("state_resolution_process_pool") or {}
+        if not isinstance(state_res_pool_config, dict):
+            raise ConfigError(
+                "'state_resolution_process_pool' must be a dictionary",
+                ("state_resolution_process_pool",),
+            )
+
+        # The number of subprocesses to do large state resolutions in, or 0 to do
+        # them all on the reactor thread.
+        self.state_res_process_pool_workers: int = state_res_pool_config.get(
+            "max_workers", 0
+        )
+        if (
+            not isinstance(self.state_res_process_pool_workers, int)
+            or self.state_res_process_pool_workers < 0
+        ):
+            raise ConfigError(
+                "'max_workers' must be a non-negative integer",
+                ("state_resolution_process_pool", "max_workers"),
+            )
+
+        # The size of the full conflicted set at which state resolutions are done
+        # in a subprocess.
+        self.state_res_process_pool_min_conflicted_events: int = (
+            state_res_pool_config.get("min_conflicted_events", 500)
+        )
+        if (
+            not isinstance(self.state_res_process_pool_min_conflicted_events, int)
+            or self.state_res_process_pool_min_conflicted_events < 0
+        ):
+            raise ConfigError(
+                "'min_conflicted_events' must be a non-negative integer",
+                ("state_resolution_process_pool", "min_conflicted_events"),
+            )
+
         self.enable_ephemeral_messages = config.get("enable_ephemeral_messages", False)
 
         # Inhibits the /requestToken endpoints from returning an error that might leak
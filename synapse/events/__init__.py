@@ -40,8 +40,9 @@ from unpaddedbase64 import encode_base64
 from synapse.api.constants import RelationTypes
 from synapse.api.room_versions import EventFormatVersions, RoomVersion, RoomVersions
 from synapse.types import JsonDict, RoomStreamToken
-from synapse.util.caches import intern_dict
+from synapse.util.caches import estimate_json_size, intern_dict
 from synapse.util.frozenutils import freeze
+from synapse.util.json_codec import json_codec
 from synapse.util.stringutils import strtobool
 
 if TYPE_CHECKING:
@@ -177,6 +178,53 @@ class DefaultDictProperty(DictProperty, Generic[T]):
         return instance._dict.get(self.key, self.default)
 
 
+# The fields of an event which can be read from its header (see
+# `make_event_from_json`) without decoding the rest of it.
+_EVENT_HEADER_KEYS = frozenset(("type", "room_id", "sender", "state_key"))
+
+
+class _EventHeaderProperty(DictProperty, Generic[T]):
+    """An extension of DictProperty for the fields in `_EVENT_HEADER_KEYS`, which
+    reads them from the event's header if it hasn't been decoded yet.
+    """
+
+    __slots__: List[str] = []
+
+    @overload
+    def __get__(
+        self,
+        instance: Literal[None],
+        owner: Optional[Type[_DictPropertyInstance]] = None,
+    ) -> "_EventHeaderProperty":
+        ...
+
+    @overload
+    def __get__(
+        self,
+        instance: _DictPropertyInstance,
+        owner: Optional[Type[_DictPropertyInstance]] = None,
+    ) -> T:
+        ...
+
+    def __get__(
+        self,
+        instance: Optional[_DictPropertyInstance],
+        owner: Optional[Type[_DictPropertyInstance]] = None,
+    ) -> Union[T, "_EventHeaderProperty"]:
+        if instance is None:
+            return self
+        assert isinstance(instance, EventBase)
+        header = instance._header
+        if header is None:
+            return super().__get__(instance, owner)
+        try:
+            return header[self.key]
+        except KeyError as e1:
+            raise AttributeError(
+                "'%s' has no '%s' property" % (type(instance), self.key)
+            ) from e1.__context__
+
+
 class _EventInternalMetadata:
     __slots__ = ["_dict", "stream_ordering", "outlier"]
 
@@ -301,6 +349,13 @@ class EventBase(metaclass=abc.ABCMeta):
         """The EventFormatVersion implemented by this event"""
         ...
 
+    # Events loaded from the database by `make_event_from_json` are only decoded
+    # when first needed. Until then, these hold the JSON of the event and the
+    # fields in `_EVENT_HEADER_KEYS` that it has, and `_dict`, `signatures` and
+    # `unsigned` are unset.
+    _lazy_json: Optional[str] = None
+    _header: Optional[JsonDict] = None
+
     def __init__(
         self,
         event_dict: JsonDict,
@@ -327,16 +382,16 @@ class EventBase(metaclass=abc.ABCMeta):
     origin: DictProperty[str] = DictProperty("origin")
     origin_server_ts: DictProperty[int] = DictProperty("origin_server_ts")
     redacts: DefaultDictProperty[Optional[str]] = DefaultDictProperty("redacts", None)
-    room_id: DictProperty[str] = DictProperty("room_id")
-    sender: DictProperty[str] = DictProperty("sender")
+    room_id: _EventHeaderProperty[str] = _EventHeaderProperty("room_id")
+    sender: _EventHeaderProperty[str] = _EventHeaderProperty("sender")
     # TODO state_key should be Optional[str]. This is generally asserted in Synapse
     # by calling is_state() first (which ensures it is not None), but it is hard (not possible?)
     # to properly annotate that calling is_state() asserts that state_key exists
     # and is non-None. It would be better to replace such direct references with
     # get_state_key() (and a check for None).
-    state_key: DictProperty[str] = DictProperty("state_key")
-    type: DictProperty[str] = DictProperty("type")
-    user_id: DictProperty[str] = DictProperty("sender")
+    state_key: _EventHeaderProperty[str] = _EventHeaderProperty("state_key")
+    type: _EventHeaderProperty[str] = _EventHeaderProperty("type")
+    user_id: _EventHeaderProperty[str] = _EventHeaderProperty("sender")
 
     @property
     def event_id(self) -> str:
@@ -351,6 +406,8 @@ class EventBase(metaclass=abc.ABCMeta):
 
     def get_state_key(self) -> Optional[str]:
         """Get the state key of this event, or None if it's not a state event"""
+        if self._header is not None:
+            return self._header.get("state_key")
         return self._dict.get("state_key")
 
     def get_dict(self) -> JsonDict:
@@ -360,8 +417,88 @@ class EventBase(metaclass=abc.ABCMeta):
         return d
 
     def get(self, key: str, default: Optional[Any] = None) -> Any:
+        if self._header is not None and key in _EVENT_HEADER_KEYS:
+            return self._header.get(key, default)
         return self._dict.get(key, default)
 
+    def get_json_size_estimate(self) -> int:
+        """Estimate the length of the JSON encoding of the event, without decoding
+        it if it hasn't been already.
+        """
+        if self._lazy_json is not None:
+            return len(self._lazy_json)
+        return estimate_json_size(self.get_dict())
+
+    if not TYPE_CHECKING:
+        # This is only called for attributes which aren't set, so doesn't slow
+        # down events which have been decoded. (It is hidden from mypy so that it
+        # still checks attribute accesses.)
+
+        def __getattr__(self, name: str) -> Any:
+            if name in ("_dict", "signatures", "unsigned") and self._lazy_json:
+                self._decode()
+                return getattr(self, name)
+
+            raise AttributeError(
+                "'%s' object has no attribute '%s'" % (type(self).__name__, name)
+            )
+
+    def _decode(self) -> None:
+        """Decode the JSON of an event created by `make_event_from_json`."""
+        assert self._lazy_json is not None
+        event_dict = json_codec.decode(self._lazy_json)
+
+        self._dict, self.signatures, self.unsigned = _split_event_dict(event_dict)
+
+        # Consistency check: if the event has been modified in the database, then
+        # the event ID calculated from its contents will not match the event ID it
+        # was stored under.
+        stored_event_id = self.event_id
+        self._set_event_id(event_dict.get("event_id"))
+        calculated_event_id = self.event_id
+        if calculated_event_id != stored_event_id:
+            # Leave the event undecoded, so that we fail again next time.
+            self._set_event_id(stored_event_id)
+            del self._dict, self.signatures, self.unsigned
+
+            # it's difficult to see what to do here. Pretty much all bets are off
+            # if Synapse cannot rely on the consistency of its database.
+            raise RuntimeError(
+                f"Database corruption: Event {stored_event_id} in room "
+                f"{self.room_id} from the database appears to have been modified "
+                f"(calculated event id {calculated_event_id})"
+            )
+
+        self._lazy_json = None
+        self._header = None
+
+    def check_lazy_json(self) -> None:
+        """Check that the JSON of an event created by `make_event_from_json` can
+        be decoded, and matches the event ID, without keeping the decoded event.
+
+        Raises:
+            ValueError: if the JSON can't be decoded.
+            RuntimeError: if the event doesn't match its event ID.
+        """
+        lazy_json, header = self._lazy_json, self._header
+        if lazy_json is None:
+            return
+
+        self._decode()
+
+        # Drop the decoded fields again, so that they're only kept in memory
+        # once they're needed.
+        del self._dict, self.signatures, self.unsigned
+        self._lazy_json, self._header = lazy_json, header
+
+    @abc.abstractmethod
+    def _set_event_id(self, event_id: Optional[str]) -> None:
+        """Set the event ID of the event, or clear it so that it is recalculated
+        from the contents of the event (for event formats where it isn't
+        included in them).
+        """
+        ...
+
     def get_internal_metadata_dict(self) -> JsonDict:
         return self.internal_metadata.get_dict()
 
@@ -457,27 +594,9 @@ class FrozenEvent(EventBase):
     ):
         internal_metadata_dict = internal_metadata_dict or {}
 
-        event_dict = dict(event_dict)
-
-        # Signatures is a dict of dicts, and this is faster than doing a
-        # copy.deepcopy
-        signatures = {
-            name: {sig_id: sig for sig_id, sig in sigs.items()}
-            for name, sigs in event_dict.pop("signatures", {}).items()
-        }
+        frozen_dict, signatures, unsigned = _split_event_dict(event_dict)
 
-        unsigned = dict(event_dict.pop("unsigned", {}))
-
-        # We intern these strings because they turn up a lot (especially when
-        # caching).
-        event_dict = intern_dict(event_dict)
-
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
-        else:
-            frozen_dict = event_dict
-
-        self._event_id = event_dict["event_id"]
+        self._event_id = frozen_dict["event_id"]
 
         super().__init__(
             frozen_dict,
@@ -492,6 +611,10 @@ class FrozenEvent(EventBase):
     def event_id(self) -> str:
         return self._event_id
 
+    def _set_event_id(self, event_id: Optional[str]) -> None:
+        assert event_id is not None
+        self._event_id = event_id
+
 
 class FrozenEventV2(EventBase):
     format_version = EventFormatVersions.ROOM_V3  # All events of this type are V2
@@ -505,27 +628,9 @@ class FrozenEventV2(EventBase):
     ):
         internal_metadata_dict = internal_metadata_dict or {}
 
-        event_dict = dict(event_dict)
-
-        # Signatures is a dict of dicts, and this is faster than doing a
-        # copy.deepcopy
-        signatures = {
-            name: {sig_id: sig for sig_id, sig in sigs.items()}
-            for name, sigs in event_dict.pop("signatures", {}).items()
-        }
-
         assert "event_id" not in event_dict
 
-        unsigned = dict(event_dict.pop("unsigned", {}))
-
-        # We intern these strings because they turn up a lot (especially when
-        # caching).
-        event_dict = intern_dict(event_dict)
-
-        if USE_FROZEN_DICTS:
-            frozen_dict = freeze(event_dict)
-        else:
-            frozen_dict = event_dict
+        frozen_dict, signatures, unsigned = _split_event_dict(event_dict)
 
         self._event_id: Optional[str] = None
 
@@ -549,6 +654,9 @@ class FrozenEventV2(EventBase):
         self._event_id = "$" + encode_base64(compute_event_reference_hash(self)[1])
         return self._event_id
 
+    def _set_event_id(self, event_id: Optional[str]) -> None:
+        self._event_id = event_id
+
     def prev_event_ids(self) -> Sequence[str]:
         """Returns the list of prev event IDs. The order matches the order
         specified in the event, though there is no meaning to it.
@@ -587,6 +695,33 @@ class FrozenEventV3(FrozenEventV2):
         return self._event_id
 
 
+def _split_event_dict(
+    event_dict: JsonDict,
+) -> Tuple[JsonDict, Dict[str, Dict[str, str]], JsonDict]:
+    """Split an event dict into the event itself, its signatures and its unsigned
+    data, as stored by `EventBase`.
+    """
+    event_dict = dict(event_dict)
+
+    # Signatures is a dict of dicts, and this is faster than doing a
+    # copy.deepcopy
+    signatures = {
+        name: {sig_id: sig for sig_id, sig in sigs.items()}
+        for name, sigs in event_dict.pop("signatures", {}).items()
+    }
+
+    unsigned = dict(event_dict.pop("unsigned", {}))
+
+    # We intern these strings because they turn up a lot (especially when
+    # caching).
+    event_dict = intern_dict(event_dict)
+
+    if USE_FROZEN_DICTS:
+        event_dict = freeze(event_dict)
+
+    return event_dict, signatures, unsigned
+
+
 def _event_type_from_format_version(
     format_version: int,
 ) -> Type[Union[FrozenEvent, FrozenEventV2, FrozenEventV3]]:
@@ -623,6 +758,47 @@ def make_event_from_dict(
     )
 
 
+def make_event_from_json(
+    event_json: str,
+    event_id: str,
+    header: JsonDict,
+    room_version: RoomVersion,
+    internal_metadata_dict: JsonDict,
+    rejected_reason: Optional[str] = None,
+) -> EventBase:
+    """Construct an EventBase from the JSON of an event, which is only decoded
+    once a field other than those in the given header is needed.
+
+    This is useful when loading lots of events (e.g. the state of a room) of
+    which most will only be looked at to check their type or state key.
+
+    Args:
+        event_json: the JSON encoding of the event.
+        event_id: the ID of the event. This is checked against the decoded
+            event, if it is ever decoded.
+        header: the fields in `_EVENT_HEADER_KEYS` that the event has. Any field
+            missing from this must be missing from the event.
+        room_version: the version of the room the event is in.
+        internal_metadata_dict: the internal metadata of the event.
+        rejected_reason: if the event was rejected, the reason why.
+    """
+    assert header.keys() <= _EVENT_HEADER_KEYS
+
+    event_type = _event_type_from_format_version(room_version.event_format)
+    event = event_type.__new__(event_type)
+
+    # These are the attributes that `EventBase.__init__` would set, other than
+    # those which are set when the event is decoded.
+    event.room_version = room_version
+    event.rejected_reason = rejected_reason
+    event.internal_metadata = _EventInternalMetadata(internal_metadata_dict)
+    event._set_event_id(event_id)
+    event._lazy_json = event_json
+    event._header = intern_dict(header)
+
+    return event
+
+
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class _EventRelation:
     # The target event of the relation.
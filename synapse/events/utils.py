@@ -19,11 +19,13 @@ from typing import (
     Any,
     Callable,
     Dict,
+    FrozenSet,
     Iterable,
     List,
     Mapping,
     MutableMapping,
     Optional,
+    Tuple,
     Union,
 )
 
@@ -39,6 +41,7 @@ from synapse.api.constants import (
 from synapse.api.errors import Codes, SynapseError
 from synapse.api.room_versions import RoomVersion
 from synapse.types import JsonDict
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.frozenutils import unfreeze
 
 from . import EventBase
@@ -368,11 +371,7 @@ def serialize_event(
             e.unsigned["redacted_because"], time_now_ms, config=config
         )
 
-    if config.token_id is not None:
-        if config.token_id == getattr(e.internal_metadata, "token_id", None):
-            txn_id = getattr(e.internal_metadata, "txn_id", None)
-            if txn_id is not None:
-                d["unsigned"]["transaction_id"] = txn_id
+    _add_transaction_id(e, d["unsigned"], config)
 
     # invite_room_state and knock_room_state are a list of stripped room state events
     # that are meant to provide metadata about a room to an invitee/knocker. They are
@@ -385,6 +384,23 @@ def serialize_event(
     if config.as_client_event:
         d = config.event_format(d)
 
+    return _apply_only_event_fields(d, config)
+
+
+def _add_transaction_id(
+    e: EventBase, unsigned: JsonDict, config: SerializeEventConfig
+) -> None:
+    """Add the transaction ID of the event to its serialized `unsigned` field, if
+    it was sent by the access token we are serializing it for.
+    """
+    if config.token_id is not None:
+        if config.token_id == getattr(e.internal_metadata, "token_id", None):
+            txn_id = getattr(e.internal_metadata, "txn_id", None)
+            if txn_id is not None:
+                unsigned["transaction_id"] = txn_id
+
+
+def _apply_only_event_fields(d: JsonDict, config: SerializeEventConfig) -> JsonDict:
     only_event_fields = config.only_event_fields
     if only_event_fields:
         if not isinstance(only_event_fields, list) or not all(
@@ -396,6 +412,19 @@ def serialize_event(
     return d
 
 
+# The event formats which leave the `unsigned` field of the event where it is,
+# so that the per-request fields in it can be added to a cached serialization.
+_CACHEABLE_EVENT_FORMATS = (
+    format_event_raw,
+    format_event_for_client_v2,
+    format_event_for_client_v2_without_room_id,
+)
+
+# The maximum number of serialized events that `EventClientSerializer` caches,
+# before the cache factor is applied.
+_SERIALIZED_EVENT_CACHE_SIZE = 10000
+
+
 class EventClientSerializer:
     """Serializes events that are to be sent to clients.
 
@@ -411,6 +440,15 @@ class EventClientSerializer:
         """
         self._inhibit_replacement_via_edits = inhibit_replacement_via_edits
 
+        # A cache of the serialized forms of persisted events, minus the fields
+        # which depend on the request: see `_serialize_event`.
+        self._serialized_event_cache: LruCache[
+            Tuple[str, bool, FrozenSet[str], Optional[Callable], bool], JsonDict
+        ] = LruCache(
+            max_size=_SERIALIZED_EVENT_CACHE_SIZE,
+            cache_name="serialized_client_events",
+        )
+
     def serialize_event(
         self,
         event: Union[JsonDict, EventBase],
@@ -439,7 +477,7 @@ class EventClientSerializer:
         if not isinstance(event, EventBase):
             return event
 
-        serialized_event = serialize_event(event, time_now, config=config)
+        serialized_event = self._serialize_event(event, time_now, config)
 
         # Check if there are any bundled aggregations to include with the event.
         if bundle_aggregations:
@@ -455,6 +493,62 @@ class EventClientSerializer:
 
         return serialized_event
 
+    def _serialize_event(
+        self, event: EventBase, time_now: int, config: SerializeEventConfig
+    ) -> JsonDict:
+        """Serialize an event in the same way as `serialize_event`.
+
+        In a busy room the same event is serialized for every user that syncs, so
+        we cache the serialized form of persisted events without the fields which
+        vary between requests (`age`, `transaction_id` and `redacted_because`),
+        and add those to a copy of it each time.
+        """
+        if event.internal_metadata.stream_ordering is None or (
+            config.as_client_event
+            and config.event_format not in _CACHEABLE_EVENT_FORMATS
+        ):
+            # The event may still change, or the cached form can't be used for
+            # this format.
+            return serialize_event(event, time_now, config=config)
+
+        # The `unsigned` field of an event can gain new keys after it has been
+        # persisted (e.g. `prev_content`), so they are part of the key.
+        cache_key = (
+            event.event_id,
+            event.internal_metadata.is_redacted(),
+            frozenset(event.unsigned),
+            config.event_format if config.as_client_event else None,
+            config.include_stripped_room_state,
+        )
+        cached = self._serialized_event_cache.get(cache_key)
+        if cached is None:
+            cached = serialize_event(
+                event,
+                time_now,
+                config=attr.evolve(config, token_id=None, only_event_fields=None),
+            )
+            cached["unsigned"].pop("age", None)
+            cached["unsigned"].pop("redacted_because", None)
+            self._serialized_event_cache.set(cache_key, cached)
+
+        # Take a copy of the fields we add to, so that the cached entry is left
+        # alone.
+        serialized_event = dict(cached)
+        unsigned = dict(cached["unsigned"])
+        serialized_event["unsigned"] = unsigned
+
+        if "age_ts" in event.unsigned:
+            unsigned["age"] = int(time_now) - event.unsigned["age_ts"]
+
+        if "redacted_because" in event.unsigned:
+            unsigned["redacted_because"] = self._serialize_event(
+                event.unsigned["redacted_because"], time_now, config
+            )
+
+        _add_transaction_id(event, unsigned, config)
+
+        return _apply_only_event_fields(serialized_event, config)
+
     def _apply_edit(
         self, orig_event: EventBase, serialized_event: JsonDict, edit: EventBase
     ) -> None:
@@ -154,9 +154,13 @@ class FederationServer(FederationBase):
         # come in waves.
         self._state_resp_cache: ResponseCache[
             Tuple[str, Optional[str]]
-        ] = ResponseCache(hs.get_clock(), "state_resp", timeout_ms=30000)
-        self._state_ids_resp_cache: ResponseCache[Tuple[str, str]] = ResponseCache(
-            hs.get_clock(), "state_ids_resp", timeout_ms=30000
+        ] = ResponseCache.from_config(
+            hs.config.caches, hs.get_clock(), "state_resp", timeout_ms=30000
+        )
+        self._state_ids_resp_cache: ResponseCache[
+            Tuple[str, str]
+        ] = ResponseCache.from_config(
+            hs.config.caches, hs.get_clock(), "state_ids_resp", timeout_ms=30000
         )
 
         self._federation_metrics_domains = (
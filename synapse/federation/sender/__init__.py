@@ -375,6 +375,23 @@ class FederationSender(AbstractFederationSender):
                     logger.debug("All events processed")
                     break
 
+                # Look up the prev state groups of the events we might send, and
+                # then the joined hosts at those state groups, in the external
+                # cache up front. This means we make two requests to the cache
+                # for the whole batch, rather than two per event.
+                prev_state_groups = await self._external_cache.get_many(
+                    "event_to_prev_state_group",
+                    [
+                        entry.event.event_id
+                        for entry in event_entries.values()
+                        if self.is_mine_id(entry.event.sender)
+                        or entry.event.internal_metadata.get_send_on_behalf_of()
+                    ],
+                )
+                joined_hosts_by_state_group = await self._external_cache.get_many(
+                    "get_joined_hosts", {str(sg) for sg in prev_state_groups.values()}
+                )
+
                 async def handle_event(event: EventBase) -> None:
                     # Only send events for this server.
                     send_on_behalf_of = event.internal_metadata.get_send_on_behalf_of()
@@ -454,13 +471,9 @@ class FederationSender(AbstractFederationSender):
                         # We check the external cache for the destinations, which is
                         # stored per state group.
 
-                        sg = await self._external_cache.get(
-                            "event_to_prev_state_group", event.event_id
-                        )
+                        sg = prev_state_groups.get(event.event_id)
                         if sg:
-                            destinations = await self._external_cache.get(
-                                "get_joined_hosts", str(sg)
-                            )
+                            destinations = joined_hosts_by_state_group.get(str(sg))
                             if destinations is None:
                                 # Add logging to help track down #13444
                                 logger.info(
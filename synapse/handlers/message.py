@@ -1537,6 +1537,11 @@ class EventCreationHandler:
         # If external cache is enabled we should always have this.
         assert self._external_cache_joined_hosts_updates is not None
 
+        # The values to cache, which are written together once we've worked
+        # them out for all the events.
+        prev_state_groups: Dict[str, int] = {}
+        joined_hosts_by_state_group: Dict[str, List[str]] = {}
+
         for event, event_context in events_and_context:
             if event_context.partial_state:
                 # To populate the cache for a partial-state event, we either have to
@@ -1564,15 +1569,13 @@ class EventCreationHandler:
             )
 
             if state_entry.state_group:
-                await self._external_cache.set(
-                    "event_to_prev_state_group",
-                    event.event_id,
-                    state_entry.state_group,
-                    expiry_ms=60 * 60 * 1000,
-                )
+                prev_state_groups[event.event_id] = state_entry.state_group
 
-                if state_entry.state_group in self._external_cache_joined_hosts_updates:
-                    return
+                if (
+                    state_entry.state_group in self._external_cache_joined_hosts_updates
+                    or str(state_entry.state_group) in joined_hosts_by_state_group
+                ):
+                    continue
 
                 state = await state_entry.get_state(
                     self._storage_controllers.state, StateFilter.all()
@@ -1582,18 +1585,28 @@ class EventCreationHandler:
                         event.room_id, state, state_entry
                     )
 
-                # Note that the expiry times must be larger than the expiry time in
-                # _external_cache_joined_hosts_updates.
-                await self._external_cache.set(
-                    "get_joined_hosts",
-                    str(state_entry.state_group),
-                    list(joined_hosts),
-                    expiry_ms=60 * 60 * 1000,
+                joined_hosts_by_state_group[str(state_entry.state_group)] = list(
+                    joined_hosts
                 )
 
-                self._external_cache_joined_hosts_updates[
-                    state_entry.state_group
-                ] = None
+        # Write the joined hosts first, so that the federation senders don't
+        # find an event's prev state group before its joined hosts.
+        #
+        # Note that the expiry times must be larger than the expiry time in
+        # _external_cache_joined_hosts_updates.
+        await self._external_cache.set_many(
+            "get_joined_hosts",
+            joined_hosts_by_state_group,
+            expiry_ms=60 * 60 * 1000,
+        )
+        await self._external_cache.set_many(
+            "event_to_prev_state_group",
+            prev_state_groups,
+            expiry_ms=60 * 60 * 1000,
+        )
+
+        for state_group in joined_hosts_by_state_group:
+            self._external_cache_joined_hosts_updates[int(state_group)] = None
 
     async def _validate_canonical_alias(
         self,
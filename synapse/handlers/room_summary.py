@@ -101,7 +101,8 @@ class RoomSummaryHandler:
         # only process the first attempt and return its result to subsequent requests.
         self._pagination_response_cache: ResponseCache[
             Tuple[str, str, bool, Optional[int], Optional[int], Optional[str]]
-        ] = ResponseCache(
+        ] = ResponseCache.from_config(
+            hs.config.caches,
             hs.get_clock(),
             "get_room_hierarchy",
         )
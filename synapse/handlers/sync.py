@@ -13,6 +13,7 @@
 # limitations under the License.
 import itertools
 import logging
+import sys
 from typing import (
     TYPE_CHECKING,
     AbstractSet,
@@ -68,8 +69,7 @@ from synapse.types import (
 )
 from synapse.types.state import StateFilter
 from synapse.util.async_helpers import concurrently_execute
-from synapse.util.caches.expiringcache import ExpiringCache
-from synapse.util.caches.lrucache import LruCache
+from synapse.util.caches.lazy_loaded_members import LazyLoadedMembersCache
 from synapse.util.caches.response_cache import ResponseCache, ResponseCacheContext
 from synapse.util.metrics import Measure, measure_func
 from synapse.visibility import filter_events_for_client
@@ -95,9 +95,19 @@ non_empty_sync_counter = Counter(
 # client for no more than 30 minutes.
 LAZY_LOADED_MEMBERS_CACHE_MAX_AGE = 30 * 60 * 1000
 
-# Remember the last 100 members we sent to a client for the purposes of
-# avoiding redundantly sending the same lazy-loaded members to the client
-LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE = 100
+# The names of the external caches which the lazy-loaded members sent to each
+# client are shared between workers in: one has the IDs of the rooms with members
+# sent to each client, and the other the members sent to a client in each room,
+# so that only the rooms which have changed need to be written after each sync.
+LAZY_LOADED_MEMBERS_ROOMS_EXTERNAL_CACHE_NAME = "lazy_loaded_member_rooms"
+LAZY_LOADED_MEMBERS_EXTERNAL_CACHE_NAME = "lazy_loaded_members"
+
+# How long to keep the parts of a room's sync entry which are the same for every
+# user (the events in a stream range, and the state at a stream position). Many
+# users in the same room sync from and to the same tokens, as they are woken up by
+# the same events, but the tokens soon move on, so there's no point keeping them
+# for long.
+SYNC_ROOM_CACHE_DURATION_MS = 10 * 1000
 
 
 SyncRequestKey = Tuple[Any, ...]
@@ -110,6 +120,9 @@ class SyncConfig:
     is_guest: bool
     request_key: SyncRequestKey
     device_id: Optional[str]
+    # If set, only the joined rooms in this (inclusive) range of the user's rooms,
+    # ordered by recency, are included in the response. See `RoomWindow`.
+    room_range: Optional[Tuple[int, int]] = None
 
 
 @attr.s(slots=True, frozen=True, auto_attribs=True)
@@ -206,6 +219,22 @@ class _RoomChanges:
     newly_left_rooms: List[str]
 
 
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class RoomWindow:
+    """The window of a user's joined rooms included in a sync response, when
+    the client asked for one.
+
+    Attributes:
+        count: The number of rooms the user is joined to.
+        range: The requested range of rooms.
+        room_ids: The rooms in the window, most recently active first.
+    """
+
+    count: int
+    range: Tuple[int, int]
+    room_ids: List[str]
+
+
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class SyncResult:
     """
@@ -223,6 +252,7 @@ class SyncResult:
             for this device
         device_unused_fallback_key_types: List of key types that have an unused fallback
             key
+        room_window: The window of joined rooms included, if one was requested.
     """
 
     next_batch: StreamToken
@@ -236,6 +266,7 @@ class SyncResult:
     device_lists: DeviceListUpdates
     device_one_time_keys_count: JsonDict
     device_unused_fallback_key_types: List[str]
+    room_window: Optional[RoomWindow] = None
 
     def __bool__(self) -> bool:
         """Make the result appear empty if there are no updates. This is used
@@ -280,14 +311,36 @@ class SyncHandler:
             timeout_ms=hs.config.caches.sync_response_cache_duration,
         )
 
-        # ExpiringCache((User, Device)) -> LruCache(user_id => event_id)
-        self.lazy_loaded_members_cache: ExpiringCache[
-            Tuple[str, Optional[str]], LruCache[str, str]
-        ] = ExpiringCache(
-            "lazy_loaded_members_cache",
+        # The membership events we have sent to each client which is lazy-loading
+        # members, so that we don't send them again.
+        self.lazy_loaded_members = LazyLoadedMembersCache(
+            self.clock, expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE
+        )
+        self._external_cache = hs.get_external_cache()
+
+        # Caches of the parts of a room's sync entry which don't depend on the
+        # syncing user, so that they are shared between everyone in the room.
+        # Visibility filtering is still done per user.
+        #
+        # (room_id, from_key, to_key, limit) -> (events, end_key)
+        self._room_timeline_cache: ResponseCache[
+            Tuple[str, Optional[RoomStreamToken], RoomStreamToken, int]
+        ] = ResponseCache.from_config(
+            hs.config.caches,
             self.clock,
-            max_len=0,
-            expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
+            "sync_room_timeline",
+            timeout_ms=SYNC_ROOM_CACHE_DURATION_MS,
+            memory_size_callback=_estimate_timeline_memory,
+        )
+        # (room_id, room_key) -> full state at that stream position
+        self._room_state_cache: ResponseCache[
+            Tuple[str, RoomStreamToken]
+        ] = ResponseCache.from_config(
+            hs.config.caches,
+            self.clock,
+            "sync_room_state",
+            timeout_ms=SYNC_ROOM_CACHE_DURATION_MS,
+            memory_size_callback=_estimate_state_map_memory,
         )
 
         self.rooms_to_exclude = hs.config.server.rooms_to_exclude_from_sync
@@ -581,22 +634,9 @@ class SyncHandler:
                 since_key = since_token.room_key
 
             while limited and len(recents) < timeline_limit and max_repeat:
-                # If we have a since_key then we are trying to get any events
-                # that have happened since `since_key` up to `end_key`, so we
-                # can just use `get_room_events_stream_for_room`.
-                # Otherwise, we want to return the last N events in the room
-                # in topological ordering.
-                if since_key:
-                    events, end_key = await self.store.get_room_events_stream_for_room(
-                        room_id,
-                        limit=load_limit + 1,
-                        from_key=since_key,
-                        to_key=end_key,
-                    )
-                else:
-                    events, end_key = await self.store.get_recent_events_for_room(
-                        room_id, limit=load_limit + 1, end_token=end_key
-                    )
+                events, end_key = await self._load_room_timeline(
+                    room_id, load_limit + 1, since_key, end_key
+                )
 
                 log_kv({"loaded_recents": len(events)})
 
@@ -666,6 +706,49 @@ class SyncHandler:
             bundled_aggregations=bundled_aggregations,
         )
 
+    async def _load_room_timeline(
+        self,
+        room_id: str,
+        limit: int,
+        from_key: Optional[RoomStreamToken],
+        to_key: RoomStreamToken,
+    ) -> Tuple[Sequence[EventBase], RoomStreamToken]:
+        """Load up to `limit` of the latest events in a room before `to_key`, for
+        a sync timeline, before any filtering.
+
+        The result is shared between all the users syncing the same room over the
+        same range, so must not be modified.
+
+        Args:
+            room_id
+            limit: The maximum number of events to return.
+            from_key: If given, only return events after this token, in stream
+                ordering. Otherwise, return the events in topological ordering.
+            to_key: The token to return events before.
+
+        Returns:
+            The events, in chronological order, and a token to paginate from.
+        """
+
+        async def load() -> Tuple[Sequence[EventBase], RoomStreamToken]:
+            # If we have a from_key then we are trying to get any events that
+            # have happened since `from_key` up to `to_key`, so we can just use
+            # `get_room_events_stream_for_room`. Otherwise, we want to return the
+            # last N events in the room in topological ordering.
+            if from_key:
+                events, end_key = await self.store.get_room_events_stream_for_room(
+                    room_id, limit=limit, from_key=from_key, to_key=to_key
+                )
+            else:
+                events, end_key = await self.store.get_recent_events_for_room(
+                    room_id, limit=limit, end_token=to_key
+                )
+            return tuple(events), end_key
+
+        return await self._room_timeline_cache.wrap(
+            (room_id, from_key, to_key, limit), load
+        )
+
     async def get_state_after_event(
         self,
         event_id: str,
@@ -720,6 +803,29 @@ class SyncHandler:
                 at the last event in the room before `stream_position` and
                 `state_filter` is not satisfied by partial state. Defaults to `True`.
         """
+        if await_full_state and (state_filter is None or state_filter.is_full()):
+            # The full state doesn't depend on who is asking, so we share it
+            # between everyone syncing the room at the same position.
+            return await self._room_state_cache.wrap(
+                (room_id, stream_position.room_key),
+                self._get_state_at,
+                room_id,
+                stream_position,
+                StateFilter.all(),
+                await_full_state,
+            )
+
+        return await self._get_state_at(
+            room_id, stream_position, state_filter, await_full_state
+        )
+
+    async def _get_state_at(
+        self,
+        room_id: str,
+        stream_position: StreamToken,
+        state_filter: Optional[StateFilter],
+        await_full_state: bool,
+    ) -> StateMap[str]:
         # FIXME: This gets the state at the latest event before the stream ordering,
         # which might not be the same as the "current state" of the room at the time
         # of the stream token if there were multiple forward extremities at the time.
@@ -837,7 +943,6 @@ class SyncHandler:
 
         # ensure we send membership events for heroes if needed
         cache_key = (sync_config.user.to_string(), sync_config.device_id)
-        cache = self.get_lazy_loaded_members_cache(cache_key)
 
         # track which members the client should already know about via LL:
         # Ones which are already in state...
@@ -855,7 +960,9 @@ class SyncHandler:
             member_ids[hero_id]
             for hero_id in summary["m.heroes"]
             if (
-                cache.get(hero_id) != member_ids[hero_id]
+                not self.lazy_loaded_members.has_sent(
+                    cache_key, room_id, member_ids[hero_id]
+                )
                 and hero_id not in existing_members
             )
         ]
@@ -863,24 +970,87 @@ class SyncHandler:
         missing_hero_state = await self.store.get_events(missing_hero_event_ids)
 
         for s in missing_hero_state.values():
-            cache.set(s.state_key, s.event_id)
             state[(EventTypes.Member, s.state_key)] = s
+        self.lazy_loaded_members.mark_sent(
+            cache_key, room_id, missing_hero_state.keys()
+        )
 
         return summary
 
-    def get_lazy_loaded_members_cache(
-        self, cache_key: Tuple[str, Optional[str]]
-    ) -> LruCache[str, str]:
-        cache: Optional[LruCache[str, str]] = self.lazy_loaded_members_cache.get(
-            cache_key
+    async def _load_lazy_loaded_members(
+        self, sync_config: SyncConfig, since_token: Optional[StreamToken]
+    ) -> None:
+        """Make sure we know which membership events have been sent to the
+        client, if it is lazy-loading members.
+        """
+        cache_key = (sync_config.user.to_string(), sync_config.device_id)
+
+        # If it's a new sync sequence, then assume the client has had amnesia and
+        # doesn't want any recent lazy-loaded members de-duplicated.
+        if since_token is None:
+            logger.debug("clearing lazy-loaded members for %r", cache_key)
+            self.lazy_loaded_members.clear(cache_key)
+            return
+
+        # If the client's previous sync was handled by another worker (or before
+        # a restart), fetch what it sent.
+        if self._external_cache.is_enabled() and not (
+            self.lazy_loaded_members.is_current(cache_key, since_token)
+        ):
+            room_ids = await self._external_cache.get(
+                LAZY_LOADED_MEMBERS_ROOMS_EXTERNAL_CACHE_NAME,
+                _lazy_loaded_members_external_key(cache_key),
+            )
+            if room_ids is not None:
+                room_keys = {
+                    _lazy_loaded_members_external_key(cache_key, room_id): room_id
+                    for room_id in room_ids
+                }
+                # Rooms which haven't changed for a while may have expired, in
+                # which case their members will be sent again.
+                results = await self._external_cache.get_many(
+                    LAZY_LOADED_MEMBERS_EXTERNAL_CACHE_NAME, room_keys
+                )
+                logger.debug("loaded lazy-loaded members for %r", cache_key)
+                self.lazy_loaded_members.load(
+                    cache_key,
+                    {room_keys[key]: event_ids for key, event_ids in results.items()},
+                )
+
+    async def _save_lazy_loaded_members(
+        self, sync_config: SyncConfig, now_token: StreamToken
+    ) -> None:
+        """Share which membership events have been sent to the client with the
+        other workers, for the rooms where they have changed.
+        """
+        cache_key = (sync_config.user.to_string(), sync_config.device_id)
+        self.lazy_loaded_members.set_token(cache_key, now_token)
+
+        if not (
+            self._external_cache.is_enabled()
+            and self.lazy_loaded_members.has_changed(cache_key)
+        ):
+            return
+
+        changes = self.lazy_loaded_members.export_changes(cache_key)
+
+        # The rooms are written before the list of them, so that the list never
+        # refers to a room that hasn't been written yet.
+        await self._external_cache.set_many(
+            LAZY_LOADED_MEMBERS_EXTERNAL_CACHE_NAME,
+            {
+                _lazy_loaded_members_external_key(cache_key, room_id): event_ids
+                for room_id, event_ids in changes.rooms.items()
+            },
+            expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
         )
-        if cache is None:
-            logger.debug("creating LruCache for %r", cache_key)
-            cache = LruCache(LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE)
-            self.lazy_loaded_members_cache[cache_key] = cache
-        else:
-            logger.debug("found LruCache for %r", cache_key)
-        return cache
+        if changes.room_ids is not None:
+            await self._external_cache.set(
+                LAZY_LOADED_MEMBERS_ROOMS_EXTERNAL_CACHE_NAME,
+                _lazy_loaded_members_external_key(cache_key),
+                changes.room_ids,
+                expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
+            )
 
     async def compute_state_delta(
         self,
@@ -1137,32 +1307,35 @@ class SyncHandler:
             # of memberships we send to those that we have not already sent to this client.
             if lazy_load_members and not include_redundant_members:
                 cache_key = (sync_config.user.to_string(), sync_config.device_id)
-                cache = self.get_lazy_loaded_members_cache(cache_key)
-
-                # if it's a new sync sequence, then assume the client has had
-                # amnesia and doesn't want any recent lazy-loaded members
-                # de-duplicated.
-                if since_token is None:
-                    logger.debug("clearing LruCache for %r", cache_key)
-                    cache.clear()
-                else:
-                    # only send members which aren't in our LruCache (either
-                    # because they're new to this client or have been pushed out
-                    # of the cache)
+
+                # The client won't have any members of rooms which it is being
+                # sent for the first time (which `_load_lazy_loaded_members`
+                # takes care of for initial syncs).
+                if since_token is not None:
+                    # only send members which we haven't already sent (either
+                    # because they're new to this client or have been forgotten)
                     logger.debug("filtering state from %r...", state_ids)
                     state_ids = {
                         t: event_id
                         for t, event_id in state_ids.items()
-                        if cache.get(t[1]) != event_id
+                        if not self.lazy_loaded_members.has_sent(
+                            cache_key, room_id, event_id
+                        )
                     }
                     logger.debug("...to %r", state_ids)
 
-                # add any member IDs we are about to send into our LruCache
-                for t, event_id in itertools.chain(
-                    state_ids.items(), timeline_state.items()
-                ):
-                    if t[0] == EventTypes.Member:
-                        cache.set(t[1], event_id)
+                # record any member events we are about to send
+                self.lazy_loaded_members.mark_sent(
+                    cache_key,
+                    room_id,
+                    (
+                        event_id
+                        for t, event_id in itertools.chain(
+                            state_ids.items(), timeline_state.items()
+                        )
+                        if t[0] == EventTypes.Member
+                    ),
+                )
 
         state: Dict[str, EventBase] = {}
         if state_ids:
@@ -1408,6 +1581,10 @@ class SyncHandler:
 
         logger.debug("Fetching room data")
 
+        lazy_load_members = sync_config.filter_collection.lazy_load_members()
+        if lazy_load_members:
+            await self._load_lazy_loaded_members(sync_config, since_token)
+
         (
             newly_joined_rooms,
             newly_joined_or_invited_or_knocked_users,
@@ -1468,6 +1645,11 @@ class SyncHandler:
             }
         )
 
+        if lazy_load_members:
+            await self._save_lazy_loaded_members(
+                sync_config, sync_result_builder.now_token
+            )
+
         logger.debug("Sync response calculation complete")
         return SyncResult(
             presence=sync_result_builder.presence,
@@ -1481,6 +1663,7 @@ class SyncHandler:
             device_one_time_keys_count=one_time_keys_count,
             device_unused_fallback_key_types=unused_fallback_key_types,
             next_batch=sync_result_builder.now_token,
+            room_window=sync_result_builder.room_window,
         )
 
     @measure_func("_generate_sync_entry_for_device_list")
@@ -1847,6 +2030,11 @@ class SyncHandler:
         log_kv({"rooms_changed": len(room_changes.room_entries)})
 
         room_entries = room_changes.room_entries
+        if sync_result_builder.sync_config.room_range is not None:
+            room_entries = await self._apply_room_window(
+                sync_result_builder, room_changes
+            )
+            log_kv({"rooms_in_window": len(room_entries)})
         invited = room_changes.invited
         knocked = room_changes.knocked
         newly_joined_rooms = room_changes.newly_joined_rooms
@@ -2233,6 +2421,100 @@ class SyncHandler:
 
         return _RoomChanges(room_entries, invited, knocked, [], [])
 
+    async def _apply_room_window(
+        self,
+        sync_result_builder: "SyncResultBuilder",
+        room_changes: _RoomChanges,
+    ) -> List["RoomSyncResultBuilder"]:
+        """Restrict the joined rooms in the sync response to the requested window
+        of the user's rooms, ordered by how recently they were active. Populates
+        `sync_result_builder.room_window`.
+
+        Rooms outside the window are left out altogether, so the cost of the sync
+        is proportional to the size of the window rather than the number of
+        rooms. For incremental syncs, rooms which have moved into the window since
+        the previous sync are sent in full, as in an initial sync, as the client
+        won't have seen them before.
+
+        Returns:
+            The room entries to include in the sync response.
+        """
+        sync_config = sync_result_builder.sync_config
+        since_token = sync_result_builder.since_token
+        now_token = sync_result_builder.now_token
+        joined_room_ids = sync_result_builder.joined_room_ids
+
+        assert sync_config.room_range is not None
+        start, end = sync_config.room_range
+
+        recency = await self.store.get_room_last_stream_orderings(
+            joined_room_ids | set(room_changes.newly_left_rooms)
+        )
+
+        ordered_room_ids = _order_rooms_by_recency(
+            {room_id: recency.get(room_id) for room_id in joined_room_ids}
+        )
+        window = ordered_room_ids[start : end + 1]
+        sync_result_builder.room_window = RoomWindow(
+            count=len(ordered_room_ids), range=(start, end), room_ids=window
+        )
+        in_window = set(window)
+
+        # Work out which rooms were in the window as of the previous sync. Only
+        # the rooms which have had events since then can have moved.
+        newly_in_window: Set[str] = set()
+        if since_token is not None:
+            joined_at_since = (
+                joined_room_ids - set(room_changes.newly_joined_rooms)
+            ) | set(room_changes.newly_left_rooms)
+            recency_at_since = {
+                room_id: recency.get(room_id) for room_id in joined_at_since
+            }
+
+            since_stream = since_token.room_key.stream
+            changed_room_ids = [
+                room_id
+                for room_id, stream_ordering in recency_at_since.items()
+                if stream_ordering is None or stream_ordering > since_stream
+            ]
+            if changed_room_ids:
+                recency_at_since.update(
+                    await self.store.get_room_last_stream_orderings_before(
+                        changed_room_ids, since_stream
+                    )
+                )
+
+            window_at_since = _order_rooms_by_recency(recency_at_since)[start : end + 1]
+            newly_in_window = in_window.difference(window_at_since)
+
+        room_entries = []
+        for room_entry in room_changes.room_entries:
+            if room_entry.rtype != "joined":
+                room_entries.append(room_entry)
+            elif room_entry.room_id in in_window:
+                if room_entry.newly_joined:
+                    newly_in_window.discard(room_entry.room_id)
+                elif room_entry.room_id in newly_in_window:
+                    # We replace this with a full entry below.
+                    continue
+                room_entries.append(room_entry)
+
+        for room_id in window:
+            if room_id in newly_in_window:
+                room_entries.append(
+                    RoomSyncResultBuilder(
+                        room_id=room_id,
+                        rtype="joined",
+                        events=None,
+                        newly_joined=False,
+                        full_state=True,
+                        since_token=None,
+                        upto_token=now_token,
+                    )
+                )
+
+        return room_entries
+
     async def _generate_room_entry(
         self,
         sync_result_builder: "SyncResultBuilder",
@@ -2481,6 +2763,38 @@ def _action_has_highlight(actions: List[JsonDict]) -> bool:
     return False
 
 
+def _lazy_loaded_members_external_key(
+    cache_key: Tuple[str, Optional[str]], room_id: Optional[str] = None
+) -> str:
+    user_id, device_id = cache_key
+    if room_id is None:
+        return "%s:%s" % (user_id, device_id or "")
+    return "%s:%s:%s" % (user_id, device_id or "", room_id)
+
+
+def _order_rooms_by_recency(recency: Mapping[str, Optional[int]]) -> List[str]:
+    """Order rooms by the stream ordering of their most recent event, most recent
+    first. Ties are broken by room ID, so that the order is stable.
+    """
+    return sorted(
+        recency,
+        key=lambda room_id: (-(recency[room_id] or 0), room_id),
+    )
+
+
+def _estimate_timeline_memory(
+    result: Tuple[Sequence[EventBase], RoomStreamToken]
+) -> int:
+    # The events themselves are shared with the event cache, so we only count
+    # the references to them.
+    return sys.getsizeof(result[0])
+
+
+def _estimate_state_map_memory(state: StateMap[str]) -> int:
+    # The keys are shared with other state maps, but the event IDs mostly aren't.
+    return sys.getsizeof(state) + sum(sys.getsizeof(e) for e in state.values())
+
+
 def _calculate_state(
     timeline_contains: StateMap[str],
     timeline_start: StateMap[str],
@@ -2549,6 +2863,7 @@ class SyncResultBuilder:
         since_token: The token supplied by user, or None.
         now_token: The token to sync up to.
         joined_room_ids: List of rooms the user is joined to
+        room_window: The window of joined rooms included, if one was requested
 
         # The following mirror the fields in a sync response
         presence
@@ -2567,6 +2882,7 @@ class SyncResultBuilder:
     joined_room_ids: FrozenSet[str]
     membership_change_events: List[EventBase]
 
+    room_window: Optional[RoomWindow] = None
     presence: List[UserPresenceState] = attr.Factory(list)
     account_data: List[JsonDict] = attr.Factory(list)
     joined: List[JoinedSyncResult] = attr.Factory(list)
@@ -15,6 +15,7 @@
 
 import abc
 import html
+import itertools
 import logging
 import types
 import urllib
@@ -62,10 +63,10 @@ from synapse.config.homeserver import HomeServerConfig
 from synapse.http.site import SynapseRequest
 from synapse.logging.context import defer_to_thread, preserve_fn, run_in_background
 from synapse.logging.opentracing import active_span, start_active_span, trace_servlet
-from synapse.util import json_encoder
 from synapse.util.caches import intern_dict
 from synapse.util.cancellation import is_function_cancellable
 from synapse.util.iterutils import chunk_seq
+from synapse.util.json_codec import json_codec
 
 if TYPE_CHECKING:
     import opentracing
@@ -644,14 +645,31 @@ class _ByteProducer:
     # usually be smaller than this.
     min_chunk_size = 1024
 
+    # If given a reactor, the number of bytes to write in each call to
+    # `resumeProducing` before letting the reactor get on with other work.
+    max_bytes_per_resume = 64 * 1024
+
     def __init__(
         self,
         request: Request,
         iterator: Iterator[bytes],
+        reactor: Optional[interfaces.IReactorTime] = None,
     ):
+        """
+        Args:
+            request: The request to write to.
+            iterator: The bytes to write.
+            reactor: If given, at most (roughly) `max_bytes_per_resume` bytes
+                are written at a time before yielding to the reactor, even if
+                the client is keeping up. Use this when the iterator does work
+                to produce the bytes (e.g. encoding JSON), so that a large
+                response doesn't block the reactor.
+        """
         self._request: Optional[Request] = request
         self._iterator = iterator
         self._paused = False
+        self._reactor = reactor
+        self._delayed_call: Optional[interfaces.IDelayedCall] = None
 
         try:
             self._request.registerProducer(self, True)
@@ -676,16 +694,26 @@ class _ByteProducer:
             return
         self._request.write(b"".join(data))
 
+    def _cancel_delayed_call(self) -> None:
+        if self._delayed_call is not None:
+            if self._delayed_call.active():
+                self._delayed_call.cancel()
+            self._delayed_call = None
+
     def pauseProducing(self) -> None:
         self._paused = True
+        self._cancel_delayed_call()
 
     def resumeProducing(self) -> None:
+        self._cancel_delayed_call()
+
         # We've stopped producing in the meantime (note that this might be
         # re-entrant after calling write).
         if not self._request:
             return
 
         self._paused = False
+        written_bytes = 0
 
         # Write until there's backpressure telling us to stop.
         while not self._paused:
@@ -715,21 +743,36 @@ class _ByteProducer:
                     self._request.finish()
                     self.stopProducing()
                     return
+                except Exception:
+                    # The response is being encoded as it is written, and failed
+                    # part way through. We've already sent the start of it, so
+                    # all we can do is drop the connection.
+                    logger.exception("Failed to encode response to %r", self._request)
+                    self._request.unregisterProducer()
+                    self._request.loseConnection()
+                    self.stopProducing()
+                    return
 
             self._send_data(buffer)
 
+            written_bytes += buffered_bytes
+            if (
+                self._reactor is not None
+                and written_bytes >= self.max_bytes_per_resume
+                and not self._paused
+                and self._request
+            ):
+                # Carry on once the reactor has had a chance to run.
+                self._delayed_call = self._reactor.callLater(0, self.resumeProducing)
+                return
+
     def stopProducing(self) -> None:
+        self._cancel_delayed_call()
+
         # Clear a circular reference.
         self._request = None
 
 
-def _encode_json_bytes(json_object: object) -> bytes:
-    """
-    Encode an object into JSON. Returns an iterator of bytes.
-    """
-    return json_encoder.encode(json_object).encode("utf-8")
-
-
 def respond_with_json(
     request: SynapseRequest,
     code: int,
@@ -763,20 +806,22 @@ def respond_with_json(
         )
         return None
 
-    if canonical_json:
-        encoder: Callable[[object], bytes] = encode_canonical_json
-    else:
-        encoder = _encode_json_bytes
-
     request.setHeader(b"Content-Type", b"application/json")
     request.setHeader(b"Cache-Control", b"no-cache, no-store, must-revalidate")
 
     if send_cors:
         set_cors_headers(request)
 
-    run_in_background(
-        _async_write_json_to_request_in_thread, request, encoder, json_object
-    )
+    if canonical_json:
+        run_in_background(
+            _async_write_json_to_request_in_thread,
+            request,
+            encode_canonical_json,
+            json_object,
+        )
+    else:
+        run_in_background(_async_stream_json_to_request, request, json_object)
+
     return NOT_DONE_YET
 
 
@@ -852,6 +897,58 @@ async def _async_write_json_to_request_in_thread(
     _write_bytes_to_request(request, json_str)
 
 
+async def _async_stream_json_to_request(
+    request: SynapseRequest, json_object: Any
+) -> None:
+    """Encodes the given JSON object and writes it to the request.
+
+    The first `_ByteProducer.max_bytes_per_resume` bytes are encoded on a thread,
+    which covers most responses entirely. The rest of a larger response (e.g. an
+    initial sync) is encoded as it is written, so that it is never held in memory
+    all at once: the producer only asks for more once the client has caught up,
+    and yields to the reactor between batches.
+    """
+    iterator = json_codec.iterencode_bytes(json_object)
+
+    def encode(opentracing_span: "Optional[opentracing.Span]") -> Tuple[bytes, bool]:
+        if opentracing_span:
+            opentracing_span.log_kv({"event": "scheduled"})
+
+        batch: List[bytes] = []
+        batch_bytes = 0
+        finished = True
+        for data in iterator:
+            batch.append(data)
+            batch_bytes += len(data)
+            if batch_bytes >= _ByteProducer.max_bytes_per_resume:
+                finished = False
+                break
+
+        if opentracing_span:
+            opentracing_span.log_kv({"event": "encoded", "finished": finished})
+        return b"".join(batch), finished
+
+    with start_active_span("encode_json_response"):
+        span = active_span()
+        try:
+            json_bytes, finished = await defer_to_thread(request.reactor, encode, span)
+        except Exception:
+            # Nothing has been written yet, so we can still send an error.
+            logger.exception("Failed to encode response to %r", request)
+            respond_with_json(
+                request,
+                500,
+                {"error": "Internal server error", "errcode": Codes.UNKNOWN},
+                send_cors=True,
+            )
+            return
+
+    if finished:
+        _write_bytes_to_request(request, json_bytes)
+    else:
+        _ByteProducer(request, itertools.chain([json_bytes], iterator), request.reactor)
+
+
 def _write_bytes_to_request(request: Request, bytes_to_write: bytes) -> None:
     """Writes the bytes to the request using an appropriate producer.
 
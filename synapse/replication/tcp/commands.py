@@ -22,6 +22,7 @@ from typing import Optional, Tuple, Type, TypeVar
 
 from synapse.replication.tcp.streams._base import StreamRow
 from synapse.util import json_decoder, json_encoder
+from synapse.util.json_codec import json_codec
 
 logger = logging.getLogger(__name__)
 
@@ -139,7 +140,7 @@ class RdataCommand(Command):
             stream_name,
             instance_name,
             None if token == "batch" else int(token),
-            json_decoder.decode(row_json),
+            json_codec.decode(row_json),
         )
 
     def to_line(self) -> str:
@@ -148,7 +149,7 @@ class RdataCommand(Command):
                 self.stream_name,
                 self.instance_name,
                 str(self.token) if self.token is not None else "batch",
-                json_encoder.encode(self.row),
+                json_codec.encode(self.row),
             )
         )
 
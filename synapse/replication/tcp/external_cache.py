@@ -13,13 +13,15 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Any, Optional
+from typing import TYPE_CHECKING, Any, Collection, Dict, Mapping, Optional
 
 from prometheus_client import Counter, Histogram
 
+from twisted.internet import defer
+
 from synapse.logging import opentracing
 from synapse.logging.context import make_deferred_yieldable
-from synapse.util import json_decoder, json_encoder
+from synapse.util import json_decoder, json_encoder, unwrapFirstError
 
 if TYPE_CHECKING:
     from txredisapi import ConnectionHandler
@@ -41,7 +43,7 @@ get_counter = Counter(
 response_timer = Histogram(
     "synapse_external_cache_response_time_seconds",
     "Time taken to get a response from Redis for a cache get/set request",
-    labelnames=["method"],
+    labelnames=["method", "cache_name"],
     buckets=(
         0.001,
         0.002,
@@ -98,7 +100,7 @@ class ExternalCache:
             "ExternalCache.set",
             tags={opentracing.SynapseTags.CACHE_NAME: cache_name},
         ):
-            with response_timer.labels("set").time():
+            with response_timer.labels("set", cache_name).time():
                 return await make_deferred_yieldable(
                     self._redis_connection.set(
                         self._get_redis_key(cache_name, key),
@@ -117,7 +119,7 @@ class ExternalCache:
             "ExternalCache.get",
             tags={opentracing.SynapseTags.CACHE_NAME: cache_name},
         ):
-            with response_timer.labels("get").time():
+            with response_timer.labels("get", cache_name).time():
                 result = await make_deferred_yieldable(
                     self._redis_connection.get(self._get_redis_key(cache_name, key))
                 )
@@ -126,6 +128,87 @@ class ExternalCache:
 
         get_counter.labels(cache_name, result is not None).inc()
 
+        return self._decode_value(result)
+
+    async def set_many(
+        self, cache_name: str, values: Mapping[str, Any], expiry_ms: int
+    ) -> None:
+        """Add the given key/values to the named cache, with the expiry time given.
+
+        The requests are pipelined, rather than waiting for each to complete
+        before sending the next.
+        """
+
+        if self._redis_connection is None or not values:
+            return
+
+        set_counter.labels(cache_name).inc(len(values))
+
+        with opentracing.start_active_span(
+            "ExternalCache.set_many",
+            tags={
+                opentracing.SynapseTags.CACHE_NAME: cache_name,
+                "count": str(len(values)),
+            },
+        ):
+            with response_timer.labels("set_many", cache_name).time():
+                # We only use a single connection to Redis, so sending all the
+                # commands before waiting for any responses pipelines them.
+                await make_deferred_yieldable(
+                    defer.gatherResults(
+                        [
+                            self._redis_connection.set(
+                                self._get_redis_key(cache_name, key),
+                                json_encoder.encode(value),
+                                pexpire=expiry_ms,
+                            )
+                            for key, value in values.items()
+                        ],
+                        consumeErrors=True,
+                    )
+                ).addErrback(unwrapFirstError)
+
+    async def get_many(self, cache_name: str, keys: Collection[str]) -> Dict[str, Any]:
+        """Look up multiple keys in the named cache, with a single request.
+
+        Returns:
+            A map from key to value, for the keys that were found in the cache.
+        """
+
+        if self._redis_connection is None or not keys:
+            return {}
+
+        # Fix the order of the keys, to match them up with the results.
+        keys = list(keys)
+
+        with opentracing.start_active_span(
+            "ExternalCache.get_many",
+            tags={
+                opentracing.SynapseTags.CACHE_NAME: cache_name,
+                "count": str(len(keys)),
+            },
+        ):
+            with response_timer.labels("get_many", cache_name).time():
+                results = await make_deferred_yieldable(
+                    self._redis_connection.mget(
+                        [self._get_redis_key(cache_name, key) for key in keys]
+                    )
+                )
+
+        logger.debug("Got cache results %s %s: %r", cache_name, keys, results)
+
+        values = {}
+        for key, result in zip(keys, results):
+            value = self._decode_value(result)
+            if value is not None:
+                values[key] = value
+
+        get_counter.labels(cache_name, True).inc(len(values))
+        get_counter.labels(cache_name, False).inc(len(keys) - len(values))
+
+        return values
+
+    def _decode_value(self, result: Any) -> Optional[Any]:
         if not result:
             return None
 
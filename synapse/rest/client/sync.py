@@ -101,6 +101,7 @@ class SyncRestServlet(RestServlet):
         self._event_serializer = hs.get_event_client_serializer()
         self._msc2654_enabled = hs.config.experimental.msc2654_enabled
         self._msc3773_enabled = hs.config.experimental.msc3773_enabled
+        self._msc3575_enabled = hs.config.experimental.msc3575_enabled
 
     async def on_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         # This will always be set by the time Twisted calls us.
@@ -128,6 +129,12 @@ class SyncRestServlet(RestServlet):
         filter_id = parse_string(request, "filter")
         full_state = parse_boolean(request, "full_state", default=False)
 
+        room_range = None
+        if self._msc3575_enabled:
+            room_range = self._parse_room_range(
+                parse_string(request, "org.matrix.msc3575.range")
+            )
+
         logger.debug(
             "/sync: user=%r, timeout=%r, since=%r, "
             "set_presence=%r, filter_id=%r, device_id=%r",
@@ -139,7 +146,15 @@ class SyncRestServlet(RestServlet):
             device_id,
         )
 
-        request_key = (user, timeout, since, filter_id, full_state, device_id)
+        request_key = (
+            user,
+            timeout,
+            since,
+            filter_id,
+            full_state,
+            device_id,
+            room_range,
+        )
 
         if filter_id is None:
             filter_collection = self.filtering.DEFAULT_FILTER_COLLECTION
@@ -170,6 +185,7 @@ class SyncRestServlet(RestServlet):
             is_guest=requester.is_guest,
             request_key=request_key,
             device_id=device_id,
+            room_range=room_range,
         )
 
         since_token = None
@@ -211,6 +227,28 @@ class SyncRestServlet(RestServlet):
         logger.debug("Event formatting complete")
         return 200, response_content
 
+    @staticmethod
+    def _parse_room_range(room_range: Optional[str]) -> Optional[Tuple[int, int]]:
+        """Parse a range of rooms, of the form `<start>,<end>` (inclusive)."""
+        if room_range is None:
+            return None
+
+        try:
+            start, end = (int(i) for i in room_range.split(","))
+        except ValueError:
+            raise SynapseError(
+                400,
+                "org.matrix.msc3575.range must be of the form <start>,<end>",
+                errcode=Codes.INVALID_PARAM,
+            )
+
+        if not 0 <= start <= end:
+            raise SynapseError(
+                400, "Invalid org.matrix.msc3575.range", errcode=Codes.INVALID_PARAM
+            )
+
+        return start, end
+
     @trace_with_opname("sync.encode_response")
     async def encode_response(
         self,
@@ -290,6 +328,13 @@ class SyncRestServlet(RestServlet):
             "device_unused_fallback_key_types"
         ] = sync_result.device_unused_fallback_key_types
 
+        if sync_result.room_window is not None:
+            response["org.matrix.msc3575.rooms"] = {
+                "count": sync_result.room_window.count,
+                "range": list(sync_result.room_window.range),
+                "room_ids": sync_result.room_window.room_ids,
+            }
+
         if joined:
             response["rooms"][Membership.JOIN] = joined
         if invited:
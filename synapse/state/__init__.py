@@ -37,18 +37,24 @@ from frozendict import frozendict
 from prometheus_client import Counter, Histogram
 
 from synapse.api.constants import EventTypes
-from synapse.api.room_versions import KNOWN_ROOM_VERSIONS, StateResolutionVersions
+from synapse.api.room_versions import (
+    KNOWN_ROOM_VERSIONS,
+    RoomVersion,
+    StateResolutionVersions,
+)
 from synapse.events import EventBase
 from synapse.events.snapshot import EventContext
 from synapse.logging.context import ContextResourceUsage
 from synapse.replication.http.state import ReplicationUpdateCurrentStateRestServlet
 from synapse.state import v1, v2
 from synapse.storage.databases.main.events_worker import EventRedactBehaviour
-from synapse.types import StateMap
+from synapse.types import StateKey, StateMap
 from synapse.types.state import StateFilter
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches.expiringcache import ExpiringCache
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.metrics import Measure, measure_func
+from synapse.util.process_pool import ProcessPool
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -68,6 +74,14 @@ state_groups_histogram = Histogram(
 
 EVICTION_TIMEOUT_SECONDS = 60 * 60
 
+# The most state groups to follow back through `state_group_edges` from a state
+# group, looking for one in a previous resolution.
+MAX_INCREMENTAL_RESOLUTION_DEPTH = 10
+
+# The most keys at which a set of state groups can differ from a previously
+# resolved set for it to be resolved incrementally from it.
+MAX_INCREMENTAL_RESOLUTION_CHANGED_KEYS = 100
+
 
 _NEXT_STATE_ID = 1
 
@@ -553,7 +567,9 @@ class StateHandler:
             room_version,
             state_to_resolve,
             None,
-            state_res_store=StateResolutionStore(self.store),
+            state_res_store=StateResolutionStore(
+                self.store, self._state_storage_controller
+            ),
         )
         return result
 
@@ -590,6 +606,11 @@ class _StateResMetrics:
     # number of events fetched from the db.
     db_events: int = 0
 
+    # number of resolutions done from scratch, and incrementally from a previous
+    # resolution.
+    full_resolutions: int = 0
+    incremental_resolutions: int = 0
+
 
 _biggest_room_by_cpu_counter = Counter(
     "synapse_state_res_cpu_for_biggest_room_seconds",
@@ -602,6 +623,13 @@ _biggest_room_by_db_counter = Counter(
     "expensive room for state resolution",
 )
 
+_resolutions_counter = Counter(
+    "synapse_state_res_resolutions",
+    "Number of state resolutions of state groups, by whether they were done "
+    "incrementally from a previous resolution",
+    ["kind"],
+)
+
 _cpu_times = Histogram(
     "synapse_state_res_cpu_for_all_rooms_seconds",
     "CPU time (utime+stime) spent computing a single state resolution",
@@ -647,6 +675,25 @@ class StateResolutionHandler:
 
         self.clock.looping_call(self._report_metrics, 120 * 1000)
 
+        # The pool to do large v2 state resolutions in, if any.
+        self._process_pool: Optional[ProcessPool] = None
+        if hs.config.server.state_res_process_pool_workers:
+            self._process_pool = ProcessPool(
+                hs.get_reactor(),
+                "state resolution",
+                hs.config.server.state_res_process_pool_workers,
+            )
+        self._process_pool_min_conflicted_events = (
+            hs.config.server.state_res_process_pool_min_conflicted_events
+        )
+
+        # The last state groups resolved in each room (with v2 state resolution),
+        # and the summary of their resolution, to resolve the next state groups
+        # incrementally from.
+        self._resolution_summaries: LruCache[
+            str, Tuple[FrozenSet[int], v2.ResolutionSummary]
+        ] = LruCache(max_size=1000, cache_name="state_resolution_summaries")
+
     async def resolve_state_groups(
         self,
         room_id: str,
@@ -695,13 +742,25 @@ class StateResolutionHandler:
 
             state_groups_histogram.observe(len(state_groups_ids))
 
-            new_state = await self.resolve_events_with_store(
-                room_id,
-                room_version,
-                list(state_groups_ids.values()),
-                event_map=event_map,
-                state_res_store=state_res_store,
-            )
+            if (
+                KNOWN_ROOM_VERSIONS[room_version].state_res
+                == StateResolutionVersions.V1
+            ):
+                new_state = await self.resolve_events_with_store(
+                    room_id,
+                    room_version,
+                    list(state_groups_ids.values()),
+                    event_map=event_map,
+                    state_res_store=state_res_store,
+                )
+            else:
+                new_state = await self._resolve_state_groups_v2(
+                    room_id,
+                    KNOWN_ROOM_VERSIONS[room_version],
+                    state_groups_ids,
+                    event_map,
+                    state_res_store,
+                )
 
             # if the new state matches any of the input state groups, we can
             # use that state group again. Otherwise we will generate a state_id
@@ -764,13 +823,137 @@ class StateResolutionHandler:
                         state_sets,
                         event_map,
                         state_res_store,
+                        process_pool=self._process_pool,
+                        process_pool_min_conflicted_events=self._process_pool_min_conflicted_events,
                     )
         finally:
             self._record_state_res_metrics(room_id, m.get_resource_usage())
 
+    async def _resolve_state_groups_v2(
+        self,
+        room_id: str,
+        room_version: RoomVersion,
+        state_groups_ids: Mapping[int, StateMap[str]],
+        event_map: Optional[Dict[str, EventBase]],
+        state_res_store: "StateResolutionStore",
+    ) -> StateMap[str]:
+        """Resolves state groups with v2 state resolution, incrementally from the
+        last state groups resolved in the room if possible.
+
+        Args:
+            room_id: the room we are working in
+            room_version: Version of the room
+            state_groups_ids: A map from state group id to the state in that
+                state group.
+            event_map: as for `resolve_events_with_store`.
+            state_res_store: a place to fetch events from
+
+        Returns:
+            a map from (type, state_key) to event_id.
+        """
+        group_names = frozenset(state_groups_ids)
+        state_sets = list(state_groups_ids.values())
+
+        result = None
+        try:
+            with Measure(self.clock, "state._resolve_events") as m:
+                previous = self._resolution_summaries.get(room_id)
+                if previous is not None:
+                    previous_group_names, summary = previous
+                    changed_keys = await self._get_changed_keys(
+                        previous_group_names, group_names, state_res_store
+                    )
+                    if changed_keys is not None:
+                        result = await v2.resolve_events_incrementally(
+                            self.clock,
+                            room_id,
+                            room_version,
+                            state_sets,
+                            changed_keys,
+                            summary,
+                            event_map,
+                            state_res_store,
+                        )
+
+                incremental = result is not None
+                if result is None:
+                    result = await v2.resolve_events_with_summary(
+                        self.clock,
+                        room_id,
+                        room_version,
+                        state_sets,
+                        event_map,
+                        state_res_store,
+                        process_pool=self._process_pool,
+                        process_pool_min_conflicted_events=self._process_pool_min_conflicted_events,
+                    )
+        finally:
+            self._record_state_res_metrics(
+                room_id,
+                m.get_resource_usage(),
+                incremental=None if result is None else incremental,
+            )
+
+        new_state, summary = result
+        self._resolution_summaries[room_id] = (group_names, summary)
+        return new_state
+
+    async def _get_changed_keys(
+        self,
+        previous_group_names: FrozenSet[int],
+        group_names: FrozenSet[int],
+        state_res_store: "StateResolutionStore",
+    ) -> Optional[Set[StateKey]]:
+        """Work out the keys at which the state of the given groups can differ
+        from that of the previous groups, by following `state_group_edges` back
+        from the new groups to the previous ones.
+
+        Returns:
+            The keys, or None if the groups aren't a small change from the
+            previous ones: that is, if not every new group descends from a
+            previous group, or not every previous group is either still there or
+            an ancestor of a new group.
+        """
+        changed_keys: Set[StateKey] = set()
+        ancestors = set()
+
+        for group in group_names - previous_group_names:
+            for _ in range(MAX_INCREMENTAL_RESOLUTION_DEPTH):
+                prev_group, delta_ids = await state_res_store.get_state_group_delta(
+                    group
+                )
+                if prev_group is None or delta_ids is None:
+                    return None
+
+                changed_keys.update(delta_ids)
+                if len(changed_keys) > MAX_INCREMENTAL_RESOLUTION_CHANGED_KEYS:
+                    return None
+
+                group = prev_group
+                if group in previous_group_names:
+                    ancestors.add(group)
+                    break
+            else:
+                return None
+
+        if not (previous_group_names - group_names).issubset(ancestors):
+            return None
+
+        return changed_keys
+
     def _record_state_res_metrics(
-        self, room_id: str, rusage: ContextResourceUsage
+        self,
+        room_id: str,
+        rusage: ContextResourceUsage,
+        incremental: Optional[bool] = None,
     ) -> None:
+        """
+        Args:
+            room_id
+            rusage: The resources used by the resolution.
+            incremental: Whether the resolution was done incrementally from a
+                previous one, if it was of state groups.
+        """
         room_metrics = self._state_res_metrics[room_id]
         room_metrics.cpu_time += rusage.ru_utime + rusage.ru_stime
         room_metrics.db_time += rusage.db_txn_duration_sec
@@ -779,6 +962,13 @@ class StateResolutionHandler:
         _cpu_times.observe(rusage.ru_utime + rusage.ru_stime)
         _db_times.observe(rusage.db_txn_duration_sec)
 
+        if incremental:
+            room_metrics.incremental_resolutions += 1
+            _resolutions_counter.labels("incremental").inc()
+        elif incremental is not None:
+            room_metrics.full_resolutions += 1
+            _resolutions_counter.labels("full").inc()
+
     def _report_metrics(self) -> None:
         if not self._state_res_metrics:
             # no state res has happened since the last iteration: don't bother logging.
@@ -796,6 +986,12 @@ class StateResolutionHandler:
             _biggest_room_by_db_counter,
         )
 
+        metrics_logger.debug(
+            "%i full and %i incremental resolutions of state groups",
+            sum(m.full_resolutions for m in self._state_res_metrics.values()),
+            sum(m.incremental_resolutions for m in self._state_res_metrics.values()),
+        )
+
         self._state_res_metrics.clear()
 
     def _report_biggest(
@@ -908,6 +1104,10 @@ class StateResolutionStore:
 
     store: "DataStore"
 
+    # Used to follow state groups back to their previous groups. If None, state
+    # groups are always resolved from scratch.
+    state_storage: Optional["StateStorageController"] = None
+
     def get_events(
         self, event_ids: Collection[str], allow_rejected: bool = False
     ) -> Awaitable[Dict[str, EventBase]]:
@@ -943,3 +1143,16 @@ class StateResolutionStore:
         """
 
         return self.store.get_auth_chain_difference(room_id, state_sets)
+
+    async def get_state_group_delta(
+        self, state_group: int
+    ) -> Tuple[Optional[int], Optional[StateMap[str]]]:
+        """Get the previous group of a state group, and the delta between them.
+
+        Returns:
+            The previous group and the delta, or (None, None) if the state group
+            doesn't have a previous group.
+        """
+        if self.state_storage is None:
+            return None, None
+        return await self.state_storage.get_state_group_delta(state_group)
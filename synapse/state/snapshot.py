@@ -0,0 +1,232 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshots of everything a state resolution reads from the database: the state
+groups being resolved, the events in them and their auth chains, and the chain
+cover index of those events.
+
+Snapshots are exported from a database with the `export-state-res-snapshot`
+admin command, and can be replayed without a database, e.g. by
+`synmark.state_res_replay` to benchmark state resolution on real rooms.
+"""
+
+import itertools
+from typing import IO, TYPE_CHECKING, Dict, Optional, Tuple, cast
+
+import attr
+
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS, RoomVersion
+from synapse.events import EventBase, make_event_from_dict
+from synapse.storage.databases.main.events_worker import EventRedactBehaviour
+from synapse.types import JsonDict, StateMap
+from synapse.util.caches.auth_chain_cover_index import AuthChainCoverIndexUpdate
+from synapse.util.json_codec import json_codec
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+# The version of the snapshot file format.
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class SnapshotFormatError(Exception):
+    """The file is not a snapshot that we understand."""
+
+
+@attr.s(slots=True, auto_attribs=True)
+class StateResSnapshot:
+    """The inputs to a state resolution."""
+
+    room_id: str
+    room_version: RoomVersion
+
+    # The state groups being resolved, by state group ID.
+    state_groups: Dict[int, StateMap[str]]
+
+    # The events in the state groups, and their auth chains.
+    events: Dict[str, EventBase]
+
+    # The chain cover index of the events, if the room has one.
+    auth_chain_cover_index: Optional[AuthChainCoverIndexUpdate] = None
+
+    # The event whose prev events have the state groups, if the snapshot was
+    # taken at an event rather than the room's forward extremities.
+    event_id: Optional[str] = None
+
+    def dump(self, f: IO[str]) -> None:
+        """Write the snapshot as JSON.
+
+        Everything is written in a fixed order, so that the same snapshot always
+        gives the same file.
+        """
+        snapshot: JsonDict = {
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "room_id": self.room_id,
+            "room_version": self.room_version.identifier,
+            "event_id": self.event_id,
+            "state_groups": {
+                str(state_group): sorted(
+                    [event_type, state_key, event_id]
+                    for (event_type, state_key), event_id in state.items()
+                )
+                for state_group, state in sorted(self.state_groups.items())
+            },
+            "events": [
+                {
+                    "event": event.get_pdu_json(),
+                    "internal_metadata": event.internal_metadata.get_dict(),
+                    "rejected_reason": event.rejected_reason,
+                }
+                for _, event in sorted(self.events.items())
+            ],
+        }
+
+        index = self.auth_chain_cover_index
+        if index is not None:
+            snapshot["auth_chain_cover_index"] = {
+                "events": sorted(index.events),
+                "links": sorted(index.links),
+            }
+
+        f.write(json_codec.encode(snapshot))
+
+    @classmethod
+    def load(cls, f: IO[str]) -> "StateResSnapshot":
+        """Read a snapshot written by `dump`.
+
+        Raises:
+            SnapshotFormatError if the file isn't a snapshot, or is of a newer
+                format or an unknown room version.
+        """
+        try:
+            snapshot = json_codec.decode(f.read())
+        except ValueError as e:
+            raise SnapshotFormatError("Not a JSON file: %s" % (e,))
+
+        if not isinstance(snapshot, dict) or "format" not in snapshot:
+            raise SnapshotFormatError("Not a state resolution snapshot")
+        if snapshot["format"] != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotFormatError(
+                "Unsupported snapshot format %r" % (snapshot["format"],)
+            )
+
+        room_version = KNOWN_ROOM_VERSIONS.get(snapshot["room_version"])
+        if room_version is None:
+            raise SnapshotFormatError(
+                "Unknown room version %r" % (snapshot["room_version"],)
+            )
+
+        events = {}
+        for entry in snapshot["events"]:
+            event = make_event_from_dict(
+                entry["event"],
+                room_version,
+                internal_metadata_dict=entry["internal_metadata"],
+                rejected_reason=entry["rejected_reason"],
+            )
+            events[event.event_id] = event
+
+        index = None
+        if "auth_chain_cover_index" in snapshot:
+            index = AuthChainCoverIndexUpdate(
+                events=[
+                    cast(Tuple[str, int, int], tuple(row))
+                    for row in snapshot["auth_chain_cover_index"]["events"]
+                ],
+                links=[
+                    cast(Tuple[int, int, int, int], tuple(row))
+                    for row in snapshot["auth_chain_cover_index"]["links"]
+                ],
+            )
+            for _, chain_id, seq in index.events:
+                index.complete_up_to[chain_id] = max(
+                    seq, index.complete_up_to.get(chain_id, 0)
+                )
+
+        return cls(
+            room_id=snapshot["room_id"],
+            room_version=room_version,
+            state_groups={
+                int(state_group): {
+                    (event_type, state_key): event_id
+                    for event_type, state_key, event_id in state
+                }
+                for state_group, state in snapshot["state_groups"].items()
+            },
+            events=events,
+            auth_chain_cover_index=index,
+            event_id=snapshot["event_id"],
+        )
+
+
+async def export_state_res_snapshot(
+    hs: "HomeServer", room_id: str, event_id: Optional[str] = None
+) -> StateResSnapshot:
+    """Take a snapshot of the inputs to resolving the state of a room.
+
+    Args:
+        hs
+        room_id
+        event_id: The event whose prev events' state should be resolved. If
+            None, the state at the room's forward extremities is resolved.
+
+    Raises:
+        ValueError if the event isn't in the room.
+    """
+    store = hs.get_datastores().main
+    state_storage = hs.get_storage_controllers().state
+
+    room_version = await store.get_room_version(room_id)
+
+    if event_id is None:
+        prev_event_ids = await store.get_latest_event_ids_in_room(room_id)
+    else:
+        event = await store.get_event(event_id, allow_rejected=True)
+        if event.room_id != room_id:
+            raise ValueError("Event %s is not in room %s" % (event_id, room_id))
+        prev_event_ids = list(event.prev_event_ids())
+
+    state_groups = await state_storage.get_state_groups_ids(room_id, prev_event_ids)
+
+    # The state resolution needs the events in the state, and any of their
+    # auth events.
+    event_ids = await store.get_auth_chain_ids(
+        room_id,
+        set(itertools.chain.from_iterable(s.values() for s in state_groups.values())),
+        include_given=True,
+    )
+    events = await store.get_events(
+        event_ids,
+        redact_behaviour=EventRedactBehaviour.as_is,
+        get_prev_content=False,
+        allow_rejected=True,
+    )
+
+    index: Optional[AuthChainCoverIndexUpdate] = None
+    room = await store.get_room(room_id)
+    if room and room["has_auth_chain_index"]:
+        index = await store.get_auth_chain_cover_index_for_events(events)
+        if len(index.events) < len(events):
+            # Not all the events have a chain cover, so the resolution would
+            # have used the auth events instead.
+            index = None
+
+    return StateResSnapshot(
+        room_id=room_id,
+        room_version=room_version,
+        state_groups=dict(state_groups),
+        events=events,
+        auth_chain_cover_index=index,
+        event_id=event_id,
+    )
@@ -20,7 +20,9 @@ from typing import (
     Awaitable,
     Callable,
     Collection,
+    Coroutine,
     Dict,
+    FrozenSet,
     Generator,
     Iterable,
     List,
@@ -29,20 +31,26 @@ from typing import (
     Sequence,
     Set,
     Tuple,
+    TypeVar,
     overload,
 )
 
+import attr
 from typing_extensions import Literal, Protocol
 
 from synapse import event_auth
 from synapse.api.constants import EventTypes
 from synapse.api.errors import AuthError
-from synapse.api.room_versions import RoomVersion
-from synapse.events import EventBase
-from synapse.types import MutableStateMap, StateMap
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS, RoomVersion
+from synapse.events import EventBase, make_event_from_dict
+from synapse.types import MutableStateMap, StateKey, StateMap
+from synapse.util.json_codec import json_codec
+from synapse.util.process_pool import ProcessPool
 
 logger = logging.getLogger(__name__)
 
+R = TypeVar("R")
+
 
 class Clock(Protocol):
     # This is usually synapse.util.Clock, but it's replaced with a FakeClock in tests.
@@ -73,9 +81,53 @@ _AWAIT_AFTER_ITERATIONS = 100
 
 
 __all__ = [
+    "ResolutionSummary",
+    "resolve_events_incrementally",
     "resolve_events_with_store",
+    "resolve_events_with_summary",
 ]
 
+POWER_KEY = (EventTypes.PowerLevels, "")
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class ResolutionSummary:
+    """What is needed from a resolution to resolve similar state sets later
+    with `resolve_events_incrementally`.
+    """
+
+    # The keys of the conflicted state, and the events in it.
+    conflicted_keys: FrozenSet[StateKey]
+    conflicted_event_ids: FrozenSet[str]
+
+    full_conflicted_set: FrozenSet[str]
+
+    # The keys of the events in the full conflicted set, of the non-power events
+    # in it, and that their auth checks could depend on.
+    written_keys: FrozenSet[StateKey]
+    leftover_keys: FrozenSet[StateKey]
+    read_keys: FrozenSet[StateKey]
+
+    # The auth events of the events in the full conflicted set.
+    auth_event_ids: FrozenSet[str]
+
+    # The resolved state before the unconflicted state was reapplied, where it
+    # differs from the unconflicted state.
+    resolved_diff: StateMap[str]
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _Resolution:
+    """The result of `_resolve_events`."""
+
+    unconflicted_state: StateMap[str]
+    conflicted_state: StateMap[Set[str]]
+    full_conflicted_set: Set[str]
+    # The resolved state, before the unconflicted state is reapplied. This may
+    # be missing unconflicted state which the resolution didn't need.
+    resolved_state: StateMap[str]
+    event_map: Dict[str, EventBase]
+
 
 async def resolve_events_with_store(
     clock: Clock,
@@ -84,6 +136,8 @@ async def resolve_events_with_store(
     state_sets: Sequence[StateMap[str]],
     event_map: Optional[Dict[str, EventBase]],
     state_res_store: StateResolutionStore,
+    process_pool: Optional[ProcessPool] = None,
+    process_pool_min_conflicted_events: int = 0,
 ) -> StateMap[str]:
     """Resolves the state using the v2 state resolution algorithm
 
@@ -103,9 +157,289 @@ async def resolve_events_with_store(
 
         state_res_store:
 
+        process_pool: if given, a pool to do the sorting and auth checks in once
+            the events have been fetched, if there are at least
+            `process_pool_min_conflicted_events` events in the full conflicted
+            set.
+
+        process_pool_min_conflicted_events:
+
     Returns:
         A map from (type, state_key) to event_id.
     """
+    resolution = await _resolve_events(
+        clock,
+        room_id,
+        room_version,
+        state_sets,
+        event_map,
+        state_res_store,
+        process_pool,
+        process_pool_min_conflicted_events,
+    )
+
+    # We make sure that unconflicted state always still applies.
+    resolved_state = dict(resolution.resolved_state)
+    resolved_state.update(resolution.unconflicted_state)
+    return resolved_state
+
+
+async def resolve_events_with_summary(
+    clock: Clock,
+    room_id: str,
+    room_version: RoomVersion,
+    state_sets: Sequence[StateMap[str]],
+    event_map: Optional[Dict[str, EventBase]],
+    state_res_store: StateResolutionStore,
+    process_pool: Optional[ProcessPool] = None,
+    process_pool_min_conflicted_events: int = 0,
+) -> Tuple[StateMap[str], ResolutionSummary]:
+    """As `resolve_events_with_store`, but also returns a summary of the
+    resolution, to pass to `resolve_events_incrementally` later.
+    """
+    resolution = await _resolve_events(
+        clock,
+        room_id,
+        room_version,
+        state_sets,
+        event_map,
+        state_res_store,
+        process_pool,
+        process_pool_min_conflicted_events,
+    )
+
+    resolved_state = dict(resolution.resolved_state)
+    resolved_state.update(resolution.unconflicted_state)
+
+    full_conflicted_events = [
+        resolution.event_map[event_id] for event_id in resolution.full_conflicted_set
+    ]
+    summary = ResolutionSummary(
+        conflicted_keys=frozenset(resolution.conflicted_state),
+        conflicted_event_ids=frozenset(
+            itertools.chain.from_iterable(resolution.conflicted_state.values())
+        ),
+        full_conflicted_set=frozenset(resolution.full_conflicted_set),
+        written_keys=frozenset(
+            (event.type, event.state_key) for event in full_conflicted_events
+        ),
+        leftover_keys=frozenset(
+            (event.type, event.state_key)
+            for event in full_conflicted_events
+            if not _is_power_event(event)
+        ),
+        read_keys=frozenset(_get_auth_types(room_version, full_conflicted_events)),
+        auth_event_ids=frozenset(
+            itertools.chain.from_iterable(
+                event.auth_event_ids() for event in full_conflicted_events
+            )
+        ),
+        resolved_diff=_diff_state(
+            resolution.resolved_state, resolution.unconflicted_state
+        ),
+    )
+
+    return resolved_state, summary
+
+
+async def resolve_events_incrementally(
+    clock: Clock,
+    room_id: str,
+    room_version: RoomVersion,
+    state_sets: Sequence[StateMap[str]],
+    changed_keys: Collection[StateKey],
+    previous: ResolutionSummary,
+    event_map: Optional[Dict[str, EventBase]],
+    state_res_store: StateResolutionStore,
+) -> Optional[Tuple[StateMap[str], ResolutionSummary]]:
+    """Resolves the state using the v2 state resolution algorithm, given a
+    previous resolution of similar state sets, if that gives the same result as
+    resolving them from scratch.
+
+    The state sets must differ from the ones previously resolved only at the
+    given keys. That is, each state set must be either one of the previous state
+    sets or one which has changed from one of them only at those keys, and each
+    previous state set must be either one of the state sets or have changed to
+    one of them.
+
+    This is possible when the events newly in the full conflicted set are not
+    power events, and can't interact with the events previously in it: none of
+    the previous events can have a new event in its auth events, or be at or
+    depend on the state at a changed key, and none of the new events can depend
+    on the state at the key of a previous non-power event. The previous power
+    events are then sorted and authed exactly as before, and so are the
+    previous non-power events, as they are sorted by the same mainline. So only
+    the new events need to be sorted and authed, against the state the previous
+    resolution ended with.
+
+    Args:
+        clock
+        room_id: the room we are working in
+        room_version: The room version
+        state_sets: List of dicts of (type, state_key) -> event_id,
+            which are the different state groups to resolve.
+        changed_keys: The keys at which the state sets may differ from the
+            previous state sets.
+        previous: The summary of the previous resolution.
+        event_map: as for `resolve_events_with_store`.
+        state_res_store:
+
+    Returns:
+        A map from (type, state_key) to event_id, and a summary of the
+        resolution, or None if the state sets must be resolved from scratch.
+    """
+    changed_key_set = frozenset(changed_keys)
+    if (
+        not changed_key_set.isdisjoint(previous.conflicted_keys)
+        or not changed_key_set.isdisjoint(previous.written_keys)
+        or not changed_key_set.isdisjoint(previous.read_keys)
+    ):
+        return None
+
+    if event_map is None:
+        event_map = {}
+
+    # The state sets only differ from the previous ones at the changed keys, so
+    # the conflicted state at the other keys is as it was.
+    newly_conflicted_state: Dict[StateKey, Set[str]] = {}
+    for key in changed_key_set:
+        event_ids = {state_set.get(key) for state_set in state_sets}
+        if len(event_ids) > 1:
+            newly_conflicted_state[key] = {
+                event_id for event_id in event_ids if event_id is not None
+            }
+
+    conflicted_keys = previous.conflicted_keys.union(newly_conflicted_state)
+    unconflicted_state = {
+        key: event_id
+        for key, event_id in state_sets[0].items()
+        if key not in conflicted_keys
+    }
+
+    auth_diff = await _get_auth_chain_difference(
+        room_id, state_sets, event_map, state_res_store
+    )
+
+    conflicted_event_ids = previous.conflicted_event_ids.union(
+        *newly_conflicted_state.values()
+    )
+    full_conflicted_set = set(itertools.chain(conflicted_event_ids, auth_diff))
+    if not previous.full_conflicted_set.issubset(full_conflicted_set):
+        return None
+
+    events = await state_res_store.get_events(
+        [eid for eid in full_conflicted_set if eid not in event_map],
+        allow_rejected=True,
+    )
+    event_map.update(events)
+
+    new_events = []
+    for event_id in full_conflicted_set - previous.full_conflicted_set:
+        event = event_map.get(event_id)
+        if event is None:
+            full_conflicted_set.discard(event_id)
+            continue
+        if event.room_id != room_id:
+            raise Exception(
+                "Attempting to state-resolve for room %s with event %s which is in %s"
+                % (room_id, event.event_id, event.room_id)
+            )
+        if _is_power_event(event) or event_id in previous.auth_event_ids:
+            return None
+        new_events.append(event)
+
+    new_written_keys = {(event.type, event.state_key) for event in new_events}
+    new_read_keys = _get_auth_types(room_version, new_events)
+    if (
+        not new_written_keys.isdisjoint(previous.written_keys)
+        or not new_written_keys.isdisjoint(previous.read_keys)
+        or not new_read_keys.isdisjoint(previous.leftover_keys)
+    ):
+        return None
+
+    logger.debug(
+        "resolving %d new events incrementally, of %d in the full conflicted set",
+        len(new_events),
+        len(full_conflicted_set),
+    )
+
+    # The state the previous resolution ended with, before the unconflicted
+    # state was reapplied.
+    base_state = dict(unconflicted_state)
+    base_state.update(previous.resolved_diff)
+
+    leftover_events = await _mainline_sort(
+        clock,
+        room_id,
+        [event.event_id for event in new_events],
+        base_state.get(POWER_KEY),
+        event_map,
+        state_res_store,
+    )
+
+    resolved_state = await _iterative_auth_checks(
+        clock,
+        room_id,
+        room_version,
+        leftover_events,
+        base_state,
+        event_map,
+        state_res_store,
+    )
+
+    summary = ResolutionSummary(
+        conflicted_keys=conflicted_keys,
+        conflicted_event_ids=conflicted_event_ids,
+        full_conflicted_set=frozenset(full_conflicted_set),
+        written_keys=previous.written_keys.union(new_written_keys),
+        leftover_keys=previous.leftover_keys.union(new_written_keys),
+        read_keys=previous.read_keys.union(new_read_keys),
+        auth_event_ids=previous.auth_event_ids.union(
+            *(event.auth_event_ids() for event in new_events)
+        ),
+        resolved_diff=_diff_state(resolved_state, unconflicted_state),
+    )
+
+    # We make sure that unconflicted state always still applies.
+    resolved_state.update(unconflicted_state)
+
+    return resolved_state, summary
+
+
+def _get_auth_types(
+    room_version: RoomVersion, events: Iterable[EventBase]
+) -> Set[StateKey]:
+    """Get the keys of the state that the auth checks of the given events could
+    depend on, including the power levels, which the mainline sort depends on.
+    """
+    auth_types = {POWER_KEY}
+    for event in events:
+        auth_types.update(event_auth.auth_types_for_event(room_version, event))
+    return auth_types
+
+
+def _diff_state(state: StateMap[str], base_state: StateMap[str]) -> Dict[StateKey, str]:
+    """Get the entries of the state which differ from the base state."""
+    return {
+        key: event_id
+        for key, event_id in state.items()
+        if base_state.get(key) != event_id
+    }
+
+
+async def _resolve_events(
+    clock: Clock,
+    room_id: str,
+    room_version: RoomVersion,
+    state_sets: Sequence[StateMap[str]],
+    event_map: Optional[Dict[str, EventBase]],
+    state_res_store: StateResolutionStore,
+    process_pool: Optional[ProcessPool],
+    process_pool_min_conflicted_events: int,
+) -> _Resolution:
+    """Resolves the state using the v2 state resolution algorithm, as
+    `resolve_events_with_store`, without reapplying the unconflicted state.
+    """
 
     logger.debug("Computing conflicted state")
 
@@ -117,7 +451,7 @@ async def resolve_events_with_store(
     unconflicted_state, conflicted_state = _seperate(state_sets)
 
     if not conflicted_state:
-        return unconflicted_state
+        return _Resolution(unconflicted_state, conflicted_state, set(), {}, event_map)
 
     logger.debug("%d conflicted state entries", len(conflicted_state))
     logger.debug("Calculating auth chain difference")
@@ -156,6 +490,80 @@ async def resolve_events_with_store(
 
     logger.debug("%d full_conflicted_set entries", len(full_conflicted_set))
 
+    if (
+        process_pool is not None
+        and len(full_conflicted_set) >= process_pool_min_conflicted_events
+    ):
+        try:
+            resolved_state = await _resolve_conflicted_state_in_process_pool(
+                process_pool,
+                room_id,
+                room_version,
+                unconflicted_state,
+                full_conflicted_set,
+                event_map,
+                state_res_store,
+            )
+        except Exception:
+            logger.warning(
+                "Failed to resolve state for %s in a subprocess: resolving it here",
+                room_id,
+                exc_info=True,
+            )
+        else:
+            return _Resolution(
+                unconflicted_state,
+                conflicted_state,
+                full_conflicted_set,
+                resolved_state,
+                event_map,
+            )
+
+    resolved_state = await _resolve_conflicted_state(
+        clock,
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        event_map,
+        state_res_store,
+    )
+    return _Resolution(
+        unconflicted_state,
+        conflicted_state,
+        full_conflicted_set,
+        resolved_state,
+        event_map,
+    )
+
+
+async def _resolve_conflicted_state(
+    clock: Clock,
+    room_id: str,
+    room_version: RoomVersion,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: StateResolutionStore,
+) -> MutableStateMap[str]:
+    """Resolves the conflicted state, once the events in the full conflicted set
+    have been fetched.
+
+    Args:
+        clock
+        room_id: the room we are working in
+        room_version: The room version
+        unconflicted_state: The state which all the state sets agree on.
+        full_conflicted_set: The event IDs of the conflicted state, and of the
+            auth chain difference.
+        event_map: a dict from event_id to event, containing at least the events
+            in the full conflicted set.
+        state_res_store:
+
+    Returns:
+        A map from (type, state_key) to event_id, before the unconflicted
+        state is reapplied.
+    """
     # Get and sort all the power events (kicks/bans/etc)
     power_events = (
         eid for eid in full_conflicted_set if _is_power_event(event_map[eid])
@@ -209,14 +617,221 @@ async def resolve_events_with_store(
 
     logger.debug("resolved")
 
-    # We make sure that unconflicted state always still applies.
-    resolved_state.update(unconflicted_state)
+    return resolved_state
 
-    logger.debug("done")
+
+async def _resolve_conflicted_state_in_process_pool(
+    process_pool: ProcessPool,
+    room_id: str,
+    room_version: RoomVersion,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: StateResolutionStore,
+) -> MutableStateMap[str]:
+    """Resolves the conflicted state in a subprocess.
+
+    All the events that the resolution could need are fetched first, so that
+    the subprocess doesn't need to access the database. Only the unconflicted
+    state that the auth checks could need is sent to it.
+
+    Args:
+        process_pool
+        room_id: the room we are working in
+        room_version: The room version
+        unconflicted_state: The state which all the state sets agree on.
+        full_conflicted_set: The event IDs of the conflicted state, and of the
+            auth chain difference.
+        event_map: a dict from event_id to event, containing at least the events
+            in the full conflicted set. Any other events needed are added to it.
+        state_res_store:
+
+    Returns:
+        A map from (type, state_key) to event_id, before the unconflicted
+        state is reapplied. Only the unconflicted state sent to the subprocess
+        is included.
+    """
+    auth_types = _get_auth_types(
+        room_version, (event_map[event_id] for event_id in full_conflicted_set)
+    )
+    base_state = {
+        key: unconflicted_state[key] for key in auth_types if key in unconflicted_state
+    }
+
+    missing_event_ids = await _fetch_events_for_resolution(
+        base_state.values(), full_conflicted_set, event_map, state_res_store
+    )
+
+    logger.debug(
+        "resolving %d events in a subprocess, with %d other events",
+        len(full_conflicted_set),
+        len(event_map) - len(full_conflicted_set),
+    )
+
+    resolved_state = await process_pool.run(
+        _resolve_serialized_conflicted_state,
+        room_id,
+        room_version.identifier,
+        base_state,
+        list(full_conflicted_set),
+        [_serialize_event(event) for event in event_map.values()],
+        list(missing_event_ids),
+    )
 
     return resolved_state
 
 
+async def _fetch_events_for_resolution(
+    state_event_ids: Iterable[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: StateResolutionStore,
+) -> Set[str]:
+    """Fetch all the events which `_resolve_conflicted_state` could look up,
+    into the event map.
+
+    These are the given state events, the auth events of the events in the full
+    conflicted set, and the auth events of every power levels event, recursively
+    (which are followed to find the mainline of an event).
+
+    Returns:
+        The IDs of the events which weren't found.
+    """
+    missing_event_ids: Set[str] = set()
+
+    to_fetch = set(state_event_ids)
+    for event_id in full_conflicted_set:
+        to_fetch.update(event_map[event_id].auth_event_ids())
+
+    new_events: Iterable[EventBase] = list(event_map.values())
+    while True:
+        for event in new_events:
+            if event.type == EventTypes.PowerLevels and event.get_state_key() == "":
+                to_fetch.update(event.auth_event_ids())
+
+        to_fetch = {
+            event_id
+            for event_id in to_fetch
+            if event_id not in event_map and event_id not in missing_event_ids
+        }
+        if not to_fetch:
+            return missing_event_ids
+
+        events = await state_res_store.get_events(to_fetch, allow_rejected=True)
+        event_map.update(events)
+        missing_event_ids.update(to_fetch.difference(events))
+
+        new_events = events.values()
+        to_fetch = set()
+
+
+def _serialize_event(event: EventBase) -> Tuple[str, Optional[str]]:
+    """Serialize an event to send to a subprocess.
+
+    Returns:
+        The JSON of the event, and the reason it was rejected (if it was).
+    """
+    return json_codec.encode(event.get_pdu_json()), event.rejected_reason
+
+
+def _resolve_serialized_conflicted_state(
+    room_id: str,
+    room_version_id: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: List[str],
+    serialized_events: List[Tuple[str, Optional[str]]],
+    missing_event_ids: List[str],
+) -> MutableStateMap[str]:
+    """Runs `_resolve_conflicted_state` in a subprocess, given everything it
+    needs by `_resolve_conflicted_state_in_process_pool`.
+    """
+    room_version = KNOWN_ROOM_VERSIONS[room_version_id]
+
+    event_map = {}
+    for event_json, rejected_reason in serialized_events:
+        event = make_event_from_dict(
+            json_codec.decode(event_json), room_version, rejected_reason=rejected_reason
+        )
+        event_map[event.event_id] = event
+
+    return _run_to_completion(
+        _resolve_conflicted_state(
+            _NoSleepClock(),
+            room_id,
+            room_version,
+            unconflicted_state,
+            set(full_conflicted_set),
+            event_map,
+            _PrefetchedStateResolutionStore(set(missing_event_ids)),
+        )
+    )
+
+
+class _Completed:
+    """An awaitable which has already completed with the given value."""
+
+    def __init__(self, value: Any):
+        self._value = value
+
+    def __await__(self) -> Generator[Any, None, Any]:
+        yield from ()
+        return self._value
+
+
+class _NoSleepClock:
+    """A `Clock` for use where there is no reactor to yield to."""
+
+    def sleep(self, duration_ms: float) -> Awaitable[None]:
+        return _Completed(None)
+
+
+class _EventNotFetched(Exception):
+    """An event which wasn't fetched by `_fetch_events_for_resolution` was
+    needed.
+    """
+
+
+class _PrefetchedStateResolutionStore:
+    """A `StateResolutionStore` for use once all the events needed have been
+    fetched, which knows which events don't exist.
+    """
+
+    def __init__(self, missing_event_ids: Set[str]):
+        self._missing_event_ids = missing_event_ids
+
+    def get_events(
+        self, event_ids: Collection[str], allow_rejected: bool = False
+    ) -> Awaitable[Dict[str, EventBase]]:
+        for event_id in event_ids:
+            if event_id not in self._missing_event_ids:
+                raise _EventNotFetched(event_id)
+        return _Completed({})
+
+    def get_auth_chain_difference(
+        self, room_id: str, state_sets: List[Set[str]]
+    ) -> Awaitable[Set[str]]:
+        """Not supported: the auth chain difference is part of the full
+        conflicted set, so is calculated before the subprocess is used.
+
+        Raises:
+            RuntimeError: always.
+        """
+        raise RuntimeError(
+            "The auth chain difference can't be calculated in a subprocess"
+        )
+
+
+def _run_to_completion(coroutine: Coroutine[Any, Any, R]) -> R:
+    """Run a coroutine which only awaits things which have already completed."""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+
+    coroutine.close()
+    raise RuntimeError("Coroutine awaited something which hadn't completed")
+
+
 async def _get_power_level_for_sender(
     room_id: str,
     event_id: str,
@@ -501,29 +1116,26 @@ async def _reverse_topological_power_sort(
         if idx % _AWAIT_AFTER_ITERATIONS == 0:
             await clock.sleep(0)
 
-    event_to_pl = {}
-    for idx, event_id in enumerate(graph, start=1):
+    # Intern the event IDs to integers, so that the sort can work with lists
+    # indexed by them.
+    nodes, outdegrees, parents = _index_graph(graph)
+
+    powers = []
+    for idx, event_id in enumerate(nodes, start=1):
         pl = await _get_power_level_for_sender(
             room_id, event_id, event_map, state_res_store
         )
-        event_to_pl[event_id] = pl
+        powers.append(-pl)
 
         # We await occasionally when we're working with large data sets to
         # ensure that we don't block the reactor loop for too long.
         if idx % _AWAIT_AFTER_ITERATIONS == 0:
             await clock.sleep(0)
 
-    def _get_power_order(event_id: str) -> Tuple[int, int, str]:
-        ev = event_map[event_id]
-        pl = event_to_pl[event_id]
-
-        return -pl, ev.origin_server_ts, event_id
-
-    # Note: graph is modified during the sort
-    it = lexicographical_topological_sort(graph, key=_get_power_order)
-    sorted_events = list(it)
+    timestamps = [event_map[event_id].origin_server_ts for event_id in nodes]
+    ranks = _rank(len(nodes), lambda i: (powers[i], timestamps[i], nodes[i]))
 
-    return sorted_events
+    return [nodes[i] for i in _topological_sort_by_rank(outdegrees, parents, ranks)]
 
 
 async def _iterative_auth_checks(
@@ -660,25 +1272,33 @@ async def _mainline_sort(
 
         idx += 1
 
-    mainline_map = {ev_id: i + 1 for i, ev_id in enumerate(reversed(mainline))}
+    # Map from power levels event ID to mainline depth. This starts off with
+    # the events in the mainline, and the depths of the power levels events
+    # found while looking up the events' depths are added to it, so that each
+    # power levels event is only looked at once.
+    depths = {ev_id: i + 1 for i, ev_id in enumerate(reversed(mainline))}
 
     event_ids = list(event_ids)
 
-    order_map = {}
+    event_depths = []
     for idx, ev_id in enumerate(event_ids, start=1):
         depth = await _get_mainline_depth_for_event(
-            event_map[ev_id], mainline_map, event_map, state_res_store
+            event_map[ev_id], depths, event_map, state_res_store
         )
-        order_map[ev_id] = (depth, event_map[ev_id].origin_server_ts, ev_id)
+        event_depths.append(depth)
 
         # We await occasionally when we're working with large data sets to
         # ensure that we don't block the reactor loop for too long.
         if idx % _AWAIT_AFTER_ITERATIONS == 0:
             await clock.sleep(0)
 
-    event_ids.sort(key=lambda ev_id: order_map[ev_id])
+    timestamps = [event_map[ev_id].origin_server_ts for ev_id in event_ids]
+    order = sorted(
+        range(len(event_ids)),
+        key=lambda i: (event_depths[i], timestamps[i], event_ids[i]),
+    )
 
-    return event_ids
+    return [event_ids[i] for i in order]
 
 
 async def _get_mainline_depth_for_event(
@@ -691,7 +1311,9 @@ async def _get_mainline_depth_for_event(
 
     Args:
         event
-        mainline_map: Map from event_id to mainline depth for events in the mainline.
+        mainline_map: Map from event_id to mainline depth for events in the
+            mainline. The depths of the events looked at are added to it, to
+            save looking at them again for later events.
         event_map
         state_res_store
 
@@ -702,12 +1324,19 @@ async def _get_mainline_depth_for_event(
     room_id = event.room_id
     tmp_event: Optional[EventBase] = event
 
+    # The events we've looked at, which all have the same depth.
+    seen = []
+
     # We do an iterative search, replacing `event with the power level in its
     # auth events (if any)
+    depth = 0
     while tmp_event:
-        depth = mainline_map.get(tmp_event.event_id)
-        if depth is not None:
-            return depth
+        known_depth = mainline_map.get(tmp_event.event_id)
+        if known_depth is not None:
+            depth = known_depth
+            break
+
+        seen.append(tmp_event.event_id)
 
         auth_events = tmp_event.auth_event_ids()
         tmp_event = None
@@ -720,8 +1349,11 @@ async def _get_mainline_depth_for_event(
                 tmp_event = aev
                 break
 
-    # Didn't find a power level auth event, so we just return 0
-    return 0
+    # If we didn't find a power level auth event, the depth is 0.
+    for event_id in seen:
+        mainline_map[event_id] = depth
+
+    return depth
 
 
 @overload
@@ -794,46 +1426,97 @@ def lexicographical_topological_sort(
     appears before A in the sort), with ties broken lexicographically based on
     return value of the `key` function.
 
-    NOTE: `graph` is modified during the sort.
-
     Args:
         graph: A representation of the graph where each node is a key in the
-            dict and its value are the nodes edges.
+            dict and its value are the nodes edges. Nodes which only appear as
+            edges are not returned, nor are the nodes which reference them.
         key: A function that takes a node and returns a value that is comparable
             and used to order nodes
 
     Yields:
         The next node in the topological sort
     """
+    nodes, outdegrees, parents = _index_graph(graph)
+    keys = [key(node) for node in nodes]
+    ranks = _rank(len(nodes), lambda i: (keys[i], nodes[i]))
+
+    for i in _topological_sort_by_rank(outdegrees, parents, ranks):
+        yield nodes[i]
 
-    # Note, this is basically Kahn's algorithm except we look at nodes with no
-    # outgoing edges, c.f.
-    # https://en.wikipedia.org/wiki/Topological_sorting#Kahn's_algorithm
-    outdegree_map = graph
-    reverse_graph: Dict[str, Set[str]] = {}
 
-    # Lists of nodes with zero out degree. Is actually a tuple of
-    # `(key(node), node)` so that sorting does the right thing
-    zero_outdegree = []
+def _index_graph(
+    graph: Dict[str, Set[str]]
+) -> Tuple[List[str], List[int], List[List[int]]]:
+    """Converts a graph to a form indexed by integers.
+
+    Args:
+        graph: A map from each node to its edges.
 
-    for node, edges in graph.items():
-        if len(edges) == 0:
-            zero_outdegree.append((key(node), node))
+    Returns:
+        A tuple of the nodes, the number of edges of each node, and the indices
+        of the nodes which have an edge to each node. Edges to nodes which are
+        not in the graph are counted, but have no index.
+    """
+    nodes = list(graph)
+    index = {node: i for i, node in enumerate(nodes)}
 
-        reverse_graph.setdefault(node, set())
+    outdegrees = []
+    parents: List[List[int]] = [[] for _ in nodes]
+    for i, edges in enumerate(graph.values()):
+        outdegrees.append(len(edges))
         for edge in edges:
-            reverse_graph.setdefault(edge, set()).add(node)
+            j = index.get(edge)
+            if j is not None:
+                parents[j].append(i)
+
+    return nodes, outdegrees, parents
+
+
+def _rank(size: int, key: Callable[[int], Any]) -> List[int]:
+    """Returns the position of each of the indices `0..size` when they are
+    sorted by the given key, which must be unique.
+    """
+    ranks = [0] * size
+    for rank, i in enumerate(sorted(range(size), key=key)):
+        ranks[i] = rank
+    return ranks
+
+
+def _topological_sort_by_rank(
+    outdegrees: List[int], parents: List[List[int]], ranks: List[int]
+) -> List[int]:
+    """Performs a reverse topological sort of a graph indexed by integers, with
+    ties broken by rank.
+
+    Args:
+        outdegrees: The number of edges of each node. Modified during the sort.
+        parents: The nodes which have an edge to each node.
+        ranks: The rank of each node, which must be unique.
+
+    Returns:
+        The indices of the nodes, sorted.
+    """
+
+    # Note, this is basically Kahn's algorithm except we look at nodes with no
+    # outgoing edges, c.f.
+    # https://en.wikipedia.org/wiki/Topological_sorting#Kahn's_algorithm
+    nodes_by_rank = [0] * len(ranks)
+    for i, rank in enumerate(ranks):
+        nodes_by_rank[rank] = i
 
-    # heapq is a built in implementation of a sorted queue.
+    # The ranks of the nodes with zero out degree. heapq is a built in
+    # implementation of a sorted queue.
+    zero_outdegree = [ranks[i] for i, out in enumerate(outdegrees) if out == 0]
     heapq.heapify(zero_outdegree)
 
+    result = []
     while zero_outdegree:
-        _, node = heapq.heappop(zero_outdegree)
+        node = nodes_by_rank[heapq.heappop(zero_outdegree)]
+        result.append(node)
 
-        for parent in reverse_graph[node]:
-            out = outdegree_map[parent]
-            out.discard(node)
-            if len(out) == 0:
-                heapq.heappush(zero_outdegree, (key(parent), parent))
+        for parent in parents[node]:
+            outdegrees[parent] -= 1
+            if outdegrees[parent] == 0:
+                heapq.heappush(zero_outdegree, ranks[parent])
 
-        yield node
+    return result
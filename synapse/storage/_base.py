@@ -20,8 +20,8 @@ from typing import TYPE_CHECKING, Any, Collection, Dict, Iterable, Optional, Uni
 from synapse.storage.database import make_in_list_sql_clause  # noqa: F401; noqa: F401
 from synapse.storage.database import DatabasePool, LoggingDatabaseConnection
 from synapse.types import get_domain_from_id
-from synapse.util import json_decoder
 from synapse.util.caches.descriptors import CachedFunction
+from synapse.util.json_codec import json_codec
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -168,18 +168,10 @@ def db_to_json(db_content: Union[memoryview, bytes, bytearray, str]) -> Any:
     Returns:
         The object decoded from JSON.
     """
-    # psycopg2 on Python 3 returns memoryview objects, which we need to
-    # cast to bytes to decode
-    if isinstance(db_content, memoryview):
-        db_content = db_content.tobytes()
-
-    # Decode it to a Unicode string before feeding it to the JSON decoder, since
-    # it only supports handling strings
-    if isinstance(db_content, (bytes, bytearray)):
-        db_content = db_content.decode("utf8")
-
+    # psycopg2 on Python 3 returns memoryview objects, which the codec accepts
+    # directly, saving a copy when it doesn't need a string.
     try:
-        return json_decoder.decode(db_content)
+        return json_codec.decode(db_content)
     except Exception:
         logging.warning("Tried to decode '%r' as JSON and failed", db_content)
         raise
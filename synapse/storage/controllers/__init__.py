@@ -14,6 +14,7 @@
 
 from typing import TYPE_CHECKING
 
+from synapse.storage.controllers.cache_snapshot import CacheSnapshotStorageController
 from synapse.storage.controllers.persist_events import (
     EventsPersistenceStorageController,
 )
@@ -40,6 +41,7 @@ class StorageControllers:
 
         self.purge_events = PurgeEventsStorageController(hs, stores)
         self.state = StateStorageController(hs, stores)
+        self.cache_snapshot = CacheSnapshotStorageController(hs, stores)
 
         self.persistence = None
         if stores.persist_events:
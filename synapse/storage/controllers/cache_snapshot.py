@@ -0,0 +1,305 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import logging
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from synapse.api.constants import EventTypes
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.storage.databases import Databases
+from synapse.storage.databases.main.cache import CURRENT_STATE_CACHE_NAME
+from synapse.types import JsonDict
+from synapse.util import json_decoder, json_encoder
+from synapse.util.caches.dictionary_cache import DictionaryCache
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.iterutils import batch_iter
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the format of the snapshot changes, so that we ignore
+# snapshots written by older versions.
+_SNAPSHOT_VERSION = 1
+
+# The maximum number of changes made since a snapshot was taken that we check
+# when restoring it. If there have been more, we don't restore the caches which
+# the changes may have invalidated.
+_MAX_CHANGES_TO_CHECK = 10000
+
+# The number of events to fetch at a time when refilling the event cache.
+_EVENT_FETCH_BATCH_SIZE = 200
+
+
+class CacheSnapshotStorageController:
+    """Saves the contents of some of the caches to a file when the process shuts
+    down, and reloads them when it starts up again, so that we don't start with
+    cold caches after a restart.
+
+    The snapshot records the position of the events stream (and, on Postgres,
+    the cache invalidation stream) at the time it was taken. When restoring it,
+    we look at the changes made since those positions and discard any entries
+    they may have invalidated.
+    """
+
+    def __init__(self, hs: "HomeServer", stores: Databases):
+        self.stores = stores
+
+        self._path: Optional[str] = None
+        if hs.config.caches.snapshot_directory:
+            self._path = os.path.join(
+                hs.config.caches.snapshot_directory,
+                "%s.json.gz" % (hs.get_instance_name(),),
+            )
+
+    def _get_stream_change_caches(self) -> Dict[str, StreamChangeCache]:
+        # These are all caches of the events stream.
+        main = self.stores.main
+        return {
+            cache.name: cache
+            for cache in (
+                main._events_stream_cache,
+                main._membership_stream_cache,
+                main._curr_state_delta_stream_cache,
+            )
+        }
+
+    def _get_state_group_caches(self) -> Dict[str, DictionaryCache]:
+        state = self.stores.state
+        return {
+            cache.name: cache
+            for cache in (
+                state._state_group_cache,
+                state._state_group_members_cache,
+            )
+        }
+
+    def write_snapshot(self) -> None:
+        """Write the contents of the caches to the snapshot file, if configured."""
+        if self._path is None:
+            return
+
+        main = self.stores.main
+
+        snapshot = {
+            "version": _SNAPSHOT_VERSION,
+            "stream_token": main.get_room_max_stream_ordering(),
+            "cache_stream_token": main.get_cache_stream_token(),
+            "users_in_room": main.get_users_in_room.cache.cache.items(),
+            "rooms_for_user": [
+                (user_id, list(room_ids))
+                for user_id, room_ids in main.get_rooms_for_user.cache.cache.items()
+            ],
+            "event_ids": [key[0] for key, _ in main._get_event_cache.local_items()],
+            "state_groups": {
+                name: [
+                    (
+                        state_group,
+                        [
+                            (event_type, state_key, event_id)
+                            for (event_type, state_key), event_id in state.items()
+                        ],
+                    )
+                    for state_group, state in cache.get_full_dicts()
+                ]
+                for name, cache in self._get_state_group_caches().items()
+            },
+            "stream_change_caches": {
+                name: cache.get_snapshot()
+                for name, cache in self._get_stream_change_caches().items()
+            },
+        }
+
+        # We write to a temporary file first so that we never leave a partially
+        # written snapshot behind.
+        temp_path = self._path + ".tmp"
+        try:
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+                for chunk in json_encoder.iterencode(snapshot):
+                    f.write(chunk)
+            os.replace(temp_path, self._path)
+        except Exception:
+            logger.exception("Failed to write cache snapshot to %s", self._path)
+            return
+
+        logger.info("Wrote cache snapshot to %s", self._path)
+
+    async def restore_snapshot(self) -> None:
+        """Reload the caches from the snapshot file, if configured and present.
+
+        The file is deleted once it has been read, whether or not the snapshot
+        could be used.
+        """
+        if self._path is None:
+            return
+
+        try:
+            with gzip.open(self._path, "rt", encoding="utf-8") as f:
+                snapshot = json_decoder.decode(f.read())
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.exception("Failed to read cache snapshot from %s", self._path)
+            snapshot = None
+
+        os.remove(self._path)
+
+        if not isinstance(snapshot, dict):
+            return
+
+        if snapshot.get("version") != _SNAPSHOT_VERSION:
+            logger.info("Ignoring cache snapshot written by a different version")
+            return
+
+        await self._restore_snapshot(snapshot)
+
+    async def _restore_snapshot(self, snapshot: JsonDict) -> None:
+        main = self.stores.main
+
+        snapshot_stream_token = snapshot["stream_token"]
+        current_stream_token = main.get_room_max_stream_ordering()
+        if snapshot_stream_token > current_stream_token:
+            # This can happen if e.g. the database has been restored from a
+            # backup.
+            logger.warning(
+                "Ignoring cache snapshot taken at stream position %d, which is ahead of the current position %d",
+                snapshot_stream_token,
+                current_stream_token,
+            )
+            return
+
+        # State groups never change, so we can restore them as is.
+        for name, state_group_cache in self._get_state_group_caches().items():
+            for state_group, state in snapshot["state_groups"].get(name, []):
+                state_group_cache.update(
+                    state_group_cache.sequence,
+                    state_group,
+                    {
+                        (event_type, state_key): event_id
+                        for event_type, state_key, event_id in state
+                    },
+                )
+
+        for name, cache in self._get_stream_change_caches().items():
+            if name not in snapshot["stream_change_caches"]:
+                continue
+
+            earliest_known_stream_pos, changes = snapshot["stream_change_caches"][name]
+            if not cache.restore_snapshot(
+                earliest_known_stream_pos, snapshot_stream_token, changes
+            ):
+                logger.info("Cache snapshot of %s is too old to be restored", name)
+
+        invalidated = await self._get_invalidated_membership(
+            snapshot, current_stream_token
+        )
+        if invalidated is None:
+            logger.info(
+                "Too much has changed since the cache snapshot was taken to restore the membership caches"
+            )
+        else:
+            invalidated_rooms, invalidated_users = invalidated
+
+            for room_id, user_ids in snapshot["users_in_room"]:
+                if room_id not in invalidated_rooms:
+                    main.get_users_in_room.prefill((room_id,), user_ids)
+
+            for user_id, room_ids in snapshot["rooms_for_user"]:
+                if user_id not in invalidated_users:
+                    main.get_rooms_for_user.prefill((user_id,), frozenset(room_ids))
+
+        # Events can be redacted (or otherwise change) at any point, so rather
+        # than saving them we refetch them from the database in the background.
+        run_as_background_process(
+            "refill_event_cache", self._fetch_events, snapshot["event_ids"]
+        )
+
+        logger.info(
+            "Restored caches from snapshot taken at stream position %d",
+            snapshot_stream_token,
+        )
+
+    async def _get_invalidated_membership(
+        self, snapshot: JsonDict, current_stream_token: int
+    ) -> Optional[Tuple[Set[str], Set[str]]]:
+        """Work out which entries of the membership caches in the snapshot may
+        have been invalidated since it was taken.
+
+        Returns:
+            The rooms whose membership may have changed, and the users whose
+            membership may have changed, or None if we couldn't tell.
+        """
+        main = self.stores.main
+
+        invalidated_rooms: Set[str] = set()
+        invalidated_users: Set[str] = set()
+
+        deltas = await main.get_current_state_deltas_between(
+            snapshot["stream_token"], current_stream_token, _MAX_CHANGES_TO_CHECK + 1
+        )
+        if len(deltas) > _MAX_CHANGES_TO_CHECK:
+            return None
+
+        for room_id, event_type, state_key in deltas:
+            if event_type == EventTypes.Member:
+                invalidated_rooms.add(room_id)
+                invalidated_users.add(state_key)
+
+        # The caches may also have been invalidated for other reasons, e.g. a
+        # room being purged, so we check the cache invalidation stream too.
+        # There is no such stream on SQLite, but then there are no workers either.
+        current_cache_stream_token = main.get_cache_stream_token()
+        if current_cache_stream_token is None:
+            return invalidated_rooms, invalidated_users
+
+        snapshot_cache_stream_token = snapshot["cache_stream_token"]
+        if (
+            snapshot_cache_stream_token is None
+            or snapshot_cache_stream_token > current_cache_stream_token
+        ):
+            return None
+
+        users_in_room_name = main.get_users_in_room.__name__
+        rooms_for_user_name = main.get_rooms_for_user.__name__
+
+        invalidations = await main.get_cache_invalidations_between(
+            snapshot_cache_stream_token,
+            current_cache_stream_token,
+            (CURRENT_STATE_CACHE_NAME, users_in_room_name, rooms_for_user_name),
+            _MAX_CHANGES_TO_CHECK + 1,
+        )
+        if len(invalidations) > _MAX_CHANGES_TO_CHECK:
+            return None
+
+        for cache_name, keys in invalidations:
+            if keys is None:
+                # The entire cache was invalidated.
+                return None
+
+            if cache_name == CURRENT_STATE_CACHE_NAME:
+                invalidated_rooms.add(keys[0])
+                invalidated_users.update(keys[1:])
+            elif cache_name == users_in_room_name:
+                invalidated_rooms.add(keys[0])
+            else:
+                invalidated_users.add(keys[0])
+
+        return invalidated_rooms, invalidated_users
+
+    async def _fetch_events(self, event_ids: List[str]) -> None:
+        for batch in batch_iter(event_ids, _EVENT_FETCH_BATCH_SIZE):
+            await self.stores.main.get_events_as_list(batch, allow_rejected=True)
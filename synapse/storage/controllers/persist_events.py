@@ -528,7 +528,9 @@ class EventsPersistenceStorageController:
             room_version,
             state_maps_by_state_group,
             event_map=None,
-            state_res_store=StateResolutionStore(self.main_store),
+            state_res_store=StateResolutionStore(
+                self.main_store, self._state_controller
+            ),
         )
 
         return await res.get_state(self._state_controller, StateFilter.all())
@@ -939,7 +941,9 @@ class EventsPersistenceStorageController:
             room_version,
             state_groups,
             events_map,
-            state_res_store=StateResolutionStore(self.main_store),
+            state_res_store=StateResolutionStore(
+                self.main_store, self._state_controller
+            ),
         )
 
         state_resolutions_during_persistence.inc()
@@ -554,6 +554,10 @@ class DatabasePool:
         """Is the database pool currently running"""
         return self._db_pool.running
 
+    def max_connections(self) -> int:
+        """The maximum number of connections in the database pool"""
+        return self._db_pool.max
+
     async def _check_safe_to_upsert(self) -> None:
         """
         Is it safe to use native UPSERT?
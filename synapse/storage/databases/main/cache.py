@@ -30,6 +30,7 @@ from synapse.storage.database import (
     DatabasePool,
     LoggingDatabaseConnection,
     LoggingTransaction,
+    make_in_list_sql_clause,
 )
 from synapse.storage.engines import PostgresEngine
 from synapse.storage.util.id_generators import MultiWriterIdGenerator
@@ -46,6 +47,10 @@ logger = logging.getLogger(__name__)
 # based on the current state when notifying workers over replication.
 CURRENT_STATE_CACHE_NAME = "cs_cache_fake"
 
+# This is a special cache name we use to batch the invalidation of purged events
+# from the event caches, including the shared event cache, over replication.
+PURGED_EVENTS_CACHE_NAME = "purged_events_fake"
+
 
 class CacheInvalidationWorkerStore(SQLBaseStore):
     def __init__(
@@ -151,7 +156,7 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
     ) -> None:
         if stream_name == EventsStream.NAME:
             for row in rows:
-                self._process_event_stream_row(token, row)
+                self._process_event_stream_row(token, row, instance_name)
         elif stream_name == BackfillStream.NAME:
             for row in rows:
                 self._invalidate_caches_for_event(
@@ -175,6 +180,14 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                     room_id = row.keys[0]
                     members_changed = set(row.keys[1:])
                     self._invalidate_state_caches(room_id, members_changed)
+                elif row.cache_func == PURGED_EVENTS_CACHE_NAME:
+                    if row.keys is None:
+                        raise Exception(
+                            "Can't send an 'invalidate all' for purged events cache"
+                        )
+
+                    for event_id in row.keys:
+                        self._invalidate_purged_event(event_id)
                 else:
                     self._attempt_to_invalidate_cache(row.cache_func, row.keys)
 
@@ -188,7 +201,9 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                 self._cache_id_gen.advance(instance_name, token)
         super().process_replication_position(stream_name, instance_name, token)
 
-    def _process_event_stream_row(self, token: int, row: EventsStreamRow) -> None:
+    def _process_event_stream_row(
+        self, token: int, row: EventsStreamRow, instance_name: str
+    ) -> None:
         data = row.data
 
         if row.type == EventsStreamEventRow.TypeId:
@@ -202,6 +217,8 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                 data.redacts,
                 data.relates_to,
                 backfilled=False,
+                membership=data.membership,
+                instance_name=instance_name,
             )
         elif row.type == EventsStreamCurrentStateRow.TypeId:
             assert isinstance(data, EventsStreamCurrentStateRow)
@@ -225,14 +242,27 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
         redacts: Optional[str],
         relates_to: Optional[str],
         backfilled: bool,
+        membership: Optional[str] = None,
+        instance_name: Optional[str] = None,
     ) -> None:
+        """Invalidate the caches affected by a newly persisted event.
+
+        Args:
+            membership: For membership events, the membership. None if the event
+                is not a (valid) membership event.
+            instance_name: The event persister which persisted the event.
+        """
         # This invalidates any local in-memory cached event objects, the original
         # process triggering the invalidation is responsible for clearing any external
         # cached objects.
         self._invalidate_local_get_event_cache(event_id)
 
+        self._add_to_event_existence_filter(event_id)
         self._attempt_to_invalidate_cache("have_seen_event", (room_id, event_id))
         self._attempt_to_invalidate_cache("get_latest_event_ids_in_room", (room_id,))
+
+        if state_key is not None:
+            self._auth_chain_cover_index_has_new_event(room_id, event_id)
         self._attempt_to_invalidate_cache(
             "get_unread_event_push_actions_by_room_for_user", (room_id,)
         )
@@ -243,6 +273,7 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
 
         if not backfilled:
             self._events_stream_cache.entity_has_changed(room_id, stream_ordering)
+            self._room_has_new_event(room_id, stream_ordering)
 
         if redacts:
             self._invalidate_local_get_event_cache(redacts)
@@ -255,6 +286,16 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
 
         if etype == EventTypes.Member:
             self._membership_stream_cache.entity_has_changed(state_key, stream_ordering)
+            if not backfilled and membership is not None:
+                assert state_key is not None
+                self._membership_has_changed(
+                    state_key,
+                    stream_ordering,
+                    instance_name or self._instance_name,
+                    event_id,
+                    room_id,
+                    membership,
+                )
             self._attempt_to_invalidate_cache(
                 "get_invited_rooms_for_local_user", (state_key,)
             )
@@ -352,6 +393,26 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                 txn, CURRENT_STATE_CACHE_NAME, [room_id]
             )
 
+    def _invalidate_purged_events_and_stream(
+        self, txn: LoggingTransaction, event_ids: Collection[str]
+    ) -> None:
+        """Special case invalidation of the event caches for purged events.
+
+        Unlike the other event caches, the shared event cache survives restarts,
+        so every process must drop the purged events from it.
+
+        Args:
+            txn
+            event_ids: The IDs of the purged events
+        """
+        for event_id in event_ids:
+            self.invalidate_get_event_cache_after_txn(txn, event_id)
+
+        # Max line length is 16K, and max event ID length is 255, so 50 should
+        # be safe.
+        for chunk in batch_iter(event_ids, 50):
+            self._send_invalidation_to_replication(txn, PURGED_EVENTS_CACHE_NAME, chunk)
+
     async def send_invalidation_to_replication(
         self, cache_name: str, keys: Optional[Collection[Any]]
     ) -> None:
@@ -380,6 +441,11 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
                 "Can't stream invalidate all with magic current state cache"
             )
 
+        if cache_name == PURGED_EVENTS_CACHE_NAME and keys is None:
+            raise Exception(
+                "Can't stream invalidate all with magic purged events cache"
+            )
+
         if isinstance(self.database_engine, PostgresEngine):
             # get_next() returns a context manager which is designed to wrap
             # the transaction. However, we want to only get an ID when we want
@@ -408,3 +474,55 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
             return self._cache_id_gen.get_current_token_for_writer(instance_name)
         else:
             return 0
+
+    def get_cache_stream_token(self) -> Optional[int]:
+        """Get the position up to which all cache invalidations have been
+        persisted, or None if there is no cache invalidation stream (i.e. on
+        SQLite).
+        """
+        if self._cache_id_gen:
+            return self._cache_id_gen.get_current_token()
+        else:
+            return None
+
+    async def get_cache_invalidations_between(
+        self, from_id: int, to_id: int, cache_names: Collection[str], limit: int
+    ) -> List[Tuple[str, Optional[List[str]]]]:
+        """Get the invalidations of the given caches between two positions in
+        the cache invalidation stream.
+
+        Args:
+            from_id: The stream position to fetch invalidations from. Exclusive.
+            to_id: The stream position to fetch invalidations up to. Inclusive.
+            cache_names: The names of the caches to fetch invalidations for.
+            limit: The maximum number of invalidations to return.
+
+        Returns:
+            A list of the names of the invalidated caches and the invalidated
+            keys, in stream order. The keys are None if the entire cache was
+            invalidated.
+        """
+        assert isinstance(self.database_engine, PostgresEngine)
+
+        if from_id >= to_id or not cache_names:
+            return []
+
+        def get_cache_invalidations_between_txn(
+            txn: LoggingTransaction,
+        ) -> List[Tuple[str, Optional[List[str]]]]:
+            clause, args = make_in_list_sql_clause(
+                self.database_engine, "cache_func", cache_names
+            )
+            sql = f"""
+                SELECT cache_func, keys
+                FROM cache_invalidation_stream_by_instance
+                WHERE ? < stream_id AND stream_id <= ? AND {clause}
+                ORDER BY stream_id ASC
+                LIMIT ?
+            """
+            txn.execute(sql, (from_id, to_id, *args, limit))
+            return [(cache_func, keys) for cache_func, keys in txn]
+
+        return await self.db_pool.runInteraction(
+            "get_cache_invalidations_between", get_cache_invalidations_between_txn
+        )
@@ -47,6 +47,11 @@ from synapse.storage.databases.main.signatures import SignatureWorkerStore
 from synapse.storage.engines import PostgresEngine, Sqlite3Engine
 from synapse.types import JsonDict
 from synapse.util import json_encoder
+from synapse.util.caches.auth_chain_cover_index import (
+    AuthChainCoverIndexCache,
+    AuthChainCoverIndexUpdate,
+    RoomAuthChainCoverIndex,
+)
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.lrucache import LruCache
 from synapse.util.cancellation import cancellable
@@ -97,6 +102,11 @@ _LONGEST_BACKOFF_PERIOD_MILLISECONDS = (
 ) * BACKFILL_EVENT_EXPONENTIAL_BACKOFF_STEP_MILLISECONDS
 assert 0 < _LONGEST_BACKOFF_PERIOD_MILLISECONDS <= ((2**31) - 1)
 
+# The total number of events to keep in the in-memory chain cover indices of
+# rooms, before the cache factor is applied. Rooms with more events than this
+# are never kept in memory.
+AUTH_CHAIN_COVER_INDEX_MAX_EVENTS = 500000
+
 
 # All the info we need while iterating the DAG while backfilling
 @attr.s(frozen=True, slots=True, auto_attribs=True)
@@ -133,6 +143,12 @@ class EventFederationWorkerStore(SignatureWorkerStore, EventsWorkerStore, SQLBas
             500000, "_event_auth_cache", size_callback=len
         )
 
+        # In-memory chain cover indices of rooms, so that auth chains can be
+        # calculated without querying the database.
+        self._auth_chain_cover_index = AuthChainCoverIndexCache(
+            "auth_chain_cover_index", max_events=AUTH_CHAIN_COVER_INDEX_MAX_EVENTS
+        )
+
         self._clock.looping_call(self._get_stats_for_federation_staging, 30 * 1000)
 
     async def get_auth_chain(
@@ -176,6 +192,10 @@ class EventFederationWorkerStore(SignatureWorkerStore, EventsWorkerStore, SQLBas
         # algorithm.
         room = await self.get_room(room_id)  # type: ignore[attr-defined]
         if room["has_auth_chain_index"]:
+            index = await self._get_auth_chain_cover_index(room_id, event_ids)
+            if index is not None:
+                return index.get_auth_chain_ids(event_ids, include_given)
+
             try:
                 return await self.db_pool.runInteraction(
                     "get_auth_chain_ids_chains",
@@ -196,6 +216,269 @@ class EventFederationWorkerStore(SignatureWorkerStore, EventsWorkerStore, SQLBas
             include_given,
         )
 
+    async def _get_auth_chain_cover_index(
+        self, room_id: str, event_ids: Collection[str]
+    ) -> Optional[RoomAuthChainCoverIndex]:
+        """Get the in-memory chain cover index of the room, loading it or adding
+        the given events to it as necessary.
+
+        Returns:
+            The index, or None if the room is too large to keep in memory or the
+            events aren't all in the database's index.
+        """
+        cache = self._auth_chain_cover_index
+        if cache.is_too_large(room_id):
+            return None
+
+        index = cache.get(room_id)
+        if index is None:
+            index = await self.db_pool.runInteraction(
+                "load_auth_chain_cover_index",
+                self._load_auth_chain_cover_index_txn,
+                room_id,
+                cache.max_room_size,
+            )
+            if index is None:
+                cache.mark_too_large(room_id)
+                return None
+            cache.set(room_id, index)
+
+        # Add the new events we've been told about over replication, as well as
+        # any of the given events we don't know about (e.g. outliers, which
+        # don't go over replication).
+        to_add = index.pending.union(
+            event_id for event_id in event_ids if event_id not in index.events
+        )
+        if to_add:
+            index.pending.difference_update(to_add)
+            update = await self.db_pool.runInteraction(
+                "update_auth_chain_cover_index",
+                self._fetch_auth_chain_cover_index_update_txn,
+                index,
+                to_add,
+            )
+            index.apply(update)
+
+            # Update the size of the index in the cache, unless it has been
+            # invalidated in the meantime.
+            if cache.get(room_id) is index:
+                cache.set(room_id, index)
+
+        missing = [event_id for event_id in event_ids if event_id not in index.events]
+        if missing:
+            logger.info(
+                "Unexpectedly found that events don't have chain IDs in room %s: %s",
+                room_id,
+                missing,
+            )
+            return None
+
+        return index
+
+    def _load_auth_chain_cover_index_txn(
+        self, txn: LoggingTransaction, room_id: str, max_events: int
+    ) -> Optional[RoomAuthChainCoverIndex]:
+        """Load the chain cover index of the room.
+
+        Returns:
+            The index, or None if the room has more than `max_events` events in
+            the index.
+        """
+        sql = """
+            SELECT event_id, chain_id, sequence_number
+            FROM event_auth_chains
+            INNER JOIN events USING (event_id)
+            WHERE room_id = ?
+            LIMIT ?
+        """
+        txn.execute(sql, (room_id, max_events + 1))
+        update = AuthChainCoverIndexUpdate(
+            events=cast(List[Tuple[str, int, int]], txn.fetchall())
+        )
+        if len(update.events) > max_events:
+            return None
+
+        for _, chain_id, seq in update.events:
+            update.complete_up_to[chain_id] = max(
+                seq, update.complete_up_to.get(chain_id, 0)
+            )
+
+        sql = """
+            SELECT
+                origin_chain_id, origin_sequence_number,
+                target_chain_id, target_sequence_number
+            FROM event_auth_chain_links
+            WHERE %s
+        """
+        for batch in batch_iter(update.complete_up_to, 1000):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "origin_chain_id", batch
+            )
+            txn.execute(sql % (clause,), args)
+            update.links.extend(cast(List[Tuple[int, int, int, int]], txn.fetchall()))
+
+        index = RoomAuthChainCoverIndex()
+        index.apply(update)
+        return index
+
+    def _fetch_auth_chain_cover_index_update_txn(
+        self,
+        txn: LoggingTransaction,
+        index: RoomAuthChainCoverIndex,
+        event_ids: Collection[str],
+    ) -> AuthChainCoverIndexUpdate:
+        """Fetch the rows to add the given events to the room's index, along with
+        the rest of their chains and the events they can reach which aren't in
+        the index.
+
+        The index is only read here, and is updated on the main thread.
+        """
+        update = AuthChainCoverIndexUpdate()
+
+        # Map from chain ID to the sequence number we need to fetch it up to.
+        to_fetch: Dict[int, int] = {}
+
+        def complete_up_to(chain_id: int) -> int:
+            return max(
+                index.complete_up_to.get(chain_id, 0),
+                update.complete_up_to.get(chain_id, 0),
+            )
+
+        def need(chain_id: int, seq: int) -> None:
+            if seq > complete_up_to(chain_id):
+                to_fetch[chain_id] = max(seq, to_fetch.get(chain_id, 0))
+
+        sql = """
+            SELECT event_id, chain_id, sequence_number
+            FROM event_auth_chains
+            WHERE %s
+        """
+        for batch in batch_iter(event_ids, 1000):
+            clause, args = make_in_list_sql_clause(
+                txn.database_engine, "event_id", batch
+            )
+            txn.execute(sql % (clause,), args)
+            for event_id, chain_id, seq in txn:
+                update.events.append((event_id, chain_id, seq))
+                need(chain_id, seq)
+
+        links_sql = """
+            SELECT
+                origin_chain_id, origin_sequence_number,
+                target_chain_id, target_sequence_number
+            FROM event_auth_chain_links
+            WHERE %s
+        """
+
+        # Fetch the rest of the chains, and the links from the new parts of
+        # them, until everything reachable is in the index.
+        while to_fetch:
+            chains = to_fetch
+            to_fetch = {}
+
+            known_up_to = {chain_id: complete_up_to(chain_id) for chain_id in chains}
+            for chain_id, seq in chains.items():
+                update.complete_up_to[chain_id] = seq
+
+            targets = []
+            for batch2 in batch_iter(chains, 1000):
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "chain_id", batch2
+                )
+                txn.execute(sql % (clause,), args)
+                for event_id, chain_id, seq in txn:
+                    if seq > known_up_to[chain_id]:
+                        update.events.append((event_id, chain_id, seq))
+                        update.complete_up_to[chain_id] = max(
+                            seq, update.complete_up_to[chain_id]
+                        )
+
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "origin_chain_id", batch2
+                )
+                txn.execute(links_sql % (clause,), args)
+                for origin_chain_id, origin_seq, target_chain_id, target_seq in txn:
+                    if origin_seq > known_up_to[origin_chain_id]:
+                        update.links.append(
+                            (origin_chain_id, origin_seq, target_chain_id, target_seq)
+                        )
+                        targets.append((target_chain_id, target_seq))
+
+            for target_chain_id, target_seq in targets:
+                need(target_chain_id, target_seq)
+
+        return update
+
+    async def get_auth_chain_cover_index_for_events(
+        self, event_ids: Collection[str]
+    ) -> AuthChainCoverIndexUpdate:
+        """Get the chain cover index of the given events.
+
+        The events should include all the events they can reach, e.g. their
+        auth chains, so that the index is complete.
+
+        Returns:
+            The positions of the events which are in the index, and the links
+            from them.
+        """
+
+        def _get_auth_chain_cover_index_for_events_txn(
+            txn: LoggingTransaction,
+        ) -> AuthChainCoverIndexUpdate:
+            update = AuthChainCoverIndexUpdate()
+
+            sql = """
+                SELECT event_id, chain_id, sequence_number
+                FROM event_auth_chains
+                WHERE %s
+            """
+            for batch in batch_iter(event_ids, 1000):
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "event_id", batch
+                )
+                txn.execute(sql % (clause,), args)
+                update.events.extend(cast(List[Tuple[str, int, int]], txn.fetchall()))
+
+            positions = set()
+            for _, chain_id, seq in update.events:
+                positions.add((chain_id, seq))
+                update.complete_up_to[chain_id] = max(
+                    seq, update.complete_up_to.get(chain_id, 0)
+                )
+
+            sql = """
+                SELECT
+                    origin_chain_id, origin_sequence_number,
+                    target_chain_id, target_sequence_number
+                FROM event_auth_chain_links
+                WHERE %s
+            """
+            for batch2 in batch_iter(update.complete_up_to, 1000):
+                clause, args = make_in_list_sql_clause(
+                    txn.database_engine, "origin_chain_id", batch2
+                )
+                txn.execute(sql % (clause,), args)
+                for origin_chain_id, origin_seq, target_chain_id, target_seq in txn:
+                    if (origin_chain_id, origin_seq) in positions:
+                        update.links.append(
+                            (origin_chain_id, origin_seq, target_chain_id, target_seq)
+                        )
+
+            return update
+
+        return await self.db_pool.runInteraction(
+            "get_auth_chain_cover_index_for_events",
+            _get_auth_chain_cover_index_for_events_txn,
+        )
+
+    def _auth_chain_cover_index_has_new_event(
+        self, room_id: str, event_id: str
+    ) -> None:
+        """Note that a state event has been persisted in the room, so should be
+        added to the room's in-memory chain cover index.
+        """
+        self._auth_chain_cover_index.add_pending(room_id, event_id)
+
     def _get_auth_chain_ids_using_cover_index_txn(
         self,
         txn: LoggingTransaction,
@@ -394,6 +677,12 @@ class EventFederationWorkerStore(SignatureWorkerStore, EventsWorkerStore, SQLBas
         # algorithm.
         room = await self.get_room(room_id)  # type: ignore[attr-defined]
         if room["has_auth_chain_index"]:
+            index = await self._get_auth_chain_cover_index(
+                room_id, set().union(*state_sets)
+            )
+            if index is not None:
+                return index.get_auth_chain_difference(state_sets)
+
             try:
                 return await self.db_pool.runInteraction(
                     "get_auth_chain_difference_chains",
@@ -53,8 +53,8 @@ from synapse.storage.engines import PostgresEngine
 from synapse.storage.util.id_generators import AbstractStreamIdGenerator
 from synapse.storage.util.sequence import SequenceGenerator
 from synapse.types import JsonDict, StateMap, get_domain_from_id
-from synapse.util import json_encoder
 from synapse.util.iterutils import batch_iter, sorted_topologically
+from synapse.util.json_codec import json_codec
 from synapse.util.stringutils import non_null_str_or_none
 
 if TYPE_CHECKING:
@@ -409,7 +409,7 @@ class PersistEventsStore:
 
         # Once the txn completes, invalidate all of the relevant caches. Note that we do this
         # up here because it captures all the events_and_contexts before any are removed.
-        for event, _ in events_and_contexts:
+        for event, context in events_and_contexts:
             self.store.invalidate_get_event_cache_after_txn(txn, event.event_id)
             if event.redacts:
                 self.store.invalidate_get_event_cache_after_txn(txn, event.redacts)
@@ -430,6 +430,11 @@ class PersistEventsStore:
                 event.redacts,
                 relates_to,
                 backfilled=False,
+                # Rejected events aren't stored as memberships.
+                membership=event.membership
+                if event.type == EventTypes.Member and not context.rejected
+                else None,
+                instance_name=self._instance_name,
             )
 
         self._update_forward_extremities_txn(
@@ -1465,8 +1470,8 @@ class PersistEventsStore:
                 (
                     event.event_id,
                     event.room_id,
-                    json_encoder.encode(event.internal_metadata.get_dict()),
-                    json_encoder.encode(event_dict(event)),
+                    json_codec.encode(event.internal_metadata.get_dict()),
+                    json_codec.encode(event_dict(event)),
                     event.format_version,
                 )
                 for event, _ in events_and_contexts
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import logging
+import struct
 import threading
 import weakref
 from enum import Enum, auto
@@ -33,7 +34,7 @@ from typing import (
 )
 
 import attr
-from prometheus_client import Gauge
+from prometheus_client import Gauge, Histogram
 from typing_extensions import Literal
 
 from twisted.internet import defer
@@ -46,7 +47,7 @@ from synapse.api.room_versions import (
     RoomVersion,
     RoomVersions,
 )
-from synapse.events import EventBase, make_event_from_dict
+from synapse.events import EventBase, make_event_from_dict, make_event_from_json
 from synapse.events.snapshot import EventContext
 from synapse.events.utils import prune_event
 from synapse.logging.context import (
@@ -79,10 +80,12 @@ from synapse.storage.util.id_generators import (
 from synapse.storage.util.sequence import build_sequence_generator
 from synapse.types import JsonDict, get_domain_from_id
 from synapse.types.state import StateFilter
-from synapse.util import unwrapFirstError
+from synapse.util import json_encoder, unwrapFirstError
 from synapse.util.async_helpers import ObservableDeferred, delay_cancellation
+from synapse.util.caches.bloom_filter import ScalableBloomFilter
 from synapse.util.caches.descriptors import cached, cachedList
 from synapse.util.caches.lrucache import AsyncLruCache
+from synapse.util.caches.shared_memory import SharedMemoryCache
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 from synapse.util.cancellation import cancellable
 from synapse.util.iterutils import batch_iter
@@ -99,16 +102,56 @@ logger = logging.getLogger(__name__)
 # The values are plucked out of thing air to make initial sync run faster
 # on jki.re
 # TODO: Make these configurable.
-EVENT_QUEUE_THREADS = 3  # Max number of threads that will fetch events
+EVENT_QUEUE_THREADS = 3  # Number of threads that will fetch events when quiet
+EVENT_QUEUE_MAX_THREADS = 10  # Max number of threads that will fetch events
 EVENT_QUEUE_ITERATIONS = 3  # No. times we block waiting for requests for events
 EVENT_QUEUE_TIMEOUT_S = 0.1  # Timeout when waiting for requests for events
 
+# How long a fetch made outside of a request (e.g. by a pusher) can be held back
+# in favour of fetches made by requests.
+EVENT_QUEUE_BACKGROUND_MAX_DELAY_S = 0.5
+
+# The number of events to add to the event existence filter per transaction when
+# building it.
+EVENT_EXISTENCE_FILTER_BATCH_SIZE = 10000
+
 
 event_fetch_ongoing_gauge = Gauge(
     "synapse_event_fetch_ongoing",
     "The number of event fetchers that are running",
 )
 
+event_fetch_queue_timer = Histogram(
+    "synapse_event_fetch_queue_seconds",
+    "Time requests to fetch events from the database spend queued",
+    ["priority"],
+)
+
+event_fetch_stage_timer = Histogram(
+    "synapse_event_fetch_stage_seconds",
+    "Time spent in each stage of fetching events from the database",
+    ["stage"],
+)
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class _EventFetchRequest:
+    """A request for some events, queued in `_event_fetch_list`.
+
+    Properties:
+        event_ids: the events to fetch.
+        deferred: completed once the events have been fetched.
+        interactive: whether the events are being fetched for a request (e.g. a
+            sync), rather than in the background, in which case the fetch is
+            prioritised.
+        queued_at: when the request was queued, in seconds.
+    """
+
+    event_ids: Iterable[str]
+    deferred: "defer.Deferred[Dict[str, _EventRow]]"
+    interactive: bool
+    queued_at: float
+
 
 @attr.s(slots=True, auto_attribs=True)
 class EventCacheEntry:
@@ -116,6 +159,16 @@ class EventCacheEntry:
     redacted_event: Optional[EventBase]
 
 
+def _estimate_event_cache_entry_memory(entry: EventCacheEntry) -> int:
+    """Estimate the memory used by an event cache entry from the length of the
+    event's JSON.
+
+    Decoded events use a few times more memory than their JSON encoding, and we
+    ignore the redacted event (if any) as it is much smaller than the original.
+    """
+    return 4 * entry.event.get_json_size_estimate()
+
+
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class _EventRow:
     """
@@ -144,6 +197,11 @@ class _EventRow:
         redactions: a list of event-ids which (claim to) redact this event.
 
         outlier: True if this event is an outlier.
+
+        header: the type, room ID, sender and (for state events) state key of the
+            event, from the columns of the `events` and `state_events` tables, if
+            known. This lets us avoid decoding the JSON of the event until it is
+            needed.
     """
 
     event_id: str
@@ -155,6 +213,71 @@ class _EventRow:
     rejected_reason: Optional[str]
     redactions: List[str]
     outlier: bool
+    header: Optional[Dict[str, str]] = None
+
+
+# The fixed size part of an `_EventRow` in the shared event cache: the stream
+# ordering, format version (or -1), whether the event is an outlier, and the
+# lengths of the (UTF-8 encoded) string fields that follow, with -1 meaning None.
+_SHARED_EVENT_ROW_HEADER = struct.Struct("<qi?iiiii")
+
+
+def _encode_event_row(row: _EventRow) -> bytes:
+    """Serialize an `_EventRow` for storing in the shared event cache."""
+    fields = [
+        field.encode("utf-8") if field is not None else None
+        for field in (
+            row.json,
+            row.internal_metadata,
+            row.room_version_id,
+            row.rejected_reason,
+            json_encoder.encode(row.redactions),
+        )
+    ]
+    header = _SHARED_EVENT_ROW_HEADER.pack(
+        row.stream_ordering,
+        row.format_version if row.format_version is not None else -1,
+        row.outlier,
+        *(len(field) if field is not None else -1 for field in fields),
+    )
+    return header + b"".join(field for field in fields if field)
+
+
+def _decode_event_row(event_id: str, data: bytes) -> _EventRow:
+    """Deserialize an `_EventRow` encoded with `_encode_event_row`."""
+    (
+        stream_ordering,
+        format_version,
+        outlier,
+        *lengths,
+    ) = _SHARED_EVENT_ROW_HEADER.unpack_from(data)
+
+    fields: List[Optional[str]] = []
+    offset = _SHARED_EVENT_ROW_HEADER.size
+    for length in lengths:
+        if length < 0:
+            fields.append(None)
+            continue
+
+        fields.append(data[offset : offset + length].decode("utf-8"))
+        offset += length
+
+    event_json, internal_metadata, room_version_id, rejected_reason, redactions = fields
+    assert event_json is not None
+    assert internal_metadata is not None
+    assert redactions is not None
+
+    return _EventRow(
+        event_id=event_id,
+        stream_ordering=stream_ordering,
+        json=event_json,
+        internal_metadata=internal_metadata,
+        format_version=format_version if format_version >= 0 else None,
+        room_version_id=room_version_id,
+        rejected_reason=rejected_reason,
+        redactions=db_to_json(redactions),
+        outlier=outlier,
+    )
 
 
 class EventRedactBehaviour(Enum):
@@ -261,8 +384,46 @@ class EventsWorkerStore(SQLBaseStore):
         ] = AsyncLruCache(
             cache_name="*getEvent*",
             max_size=hs.config.caches.event_cache_size,
+            memory_size_callback=_estimate_event_cache_entry_memory,
         )
 
+        # A cache of event rows shared with the other Synapse processes on this
+        # host (if configured), which we check before going to the database.
+        self._shared_event_cache: Optional[SharedMemoryCache] = None
+        if hs.config.caches.shared_event_cache_path:
+            try:
+                self._shared_event_cache = SharedMemoryCache(
+                    "shared_event_cache",
+                    hs.config.caches.shared_event_cache_path,
+                    hs.config.caches.shared_event_cache_size,
+                )
+            except ValueError as e:
+                # The file is in use by processes with a different
+                # configuration, which we mustn't disturb.
+                logger.warning("Not using the shared event cache: %s", e)
+
+        # A filter of the IDs of all the events in the database (if configured),
+        # which lets us skip asking the database about events we don't have.
+        #
+        # Events are added to the filter as they are persisted, or as we hear
+        # about them over replication, so it is as up to date as the
+        # `have_seen_event` cache. Purged events aren't removed, but that only
+        # causes false positives, which we check against the database anyway.
+        #
+        # The filter can only be used once we've added all the events that were
+        # already in the database, which we do in the background.
+        self._event_existence_filter: Optional[ScalableBloomFilter] = None
+        self._event_existence_filter_ready = False
+        if hs.config.caches.event_existence_filter_enabled:
+            self._event_existence_filter = ScalableBloomFilter(
+                # Roughly the number of events in the database.
+                initial_capacity=max(
+                    events_max - self._backfill_id_gen.get_current_token(), 100000
+                ),
+                error_rate=hs.config.caches.event_existence_filter_error_rate,
+            )
+            self._clock.call_later(0, self._build_event_existence_filter)
+
         # Map from event ID to a deferred that will result in a map from event
         # ID to cache entry. Note that the returned dict may not have the
         # requested event in it if the event isn't in the DB.
@@ -277,12 +438,19 @@ class EventsWorkerStore(SQLBaseStore):
         self._event_ref: MutableMapping[str, EventBase] = weakref.WeakValueDictionary()
 
         self._event_fetch_lock = threading.Condition()
-        self._event_fetch_list: List[
-            Tuple[Iterable[str], "defer.Deferred[Dict[str, _EventRow]]"]
-        ] = []
+        self._event_fetch_list: List[_EventFetchRequest] = []
         self._event_fetch_ongoing = 0
+        # The number of fetchers waiting for requests.
+        self._event_fetch_idle = 0
         event_fetch_ongoing_gauge.set(self._event_fetch_ongoing)
 
+        # We run more fetchers when there is a backlog of requests, but leave at
+        # least half of the database connections for everything else.
+        self._max_event_fetchers = max(
+            EVENT_QUEUE_THREADS,
+            min(EVENT_QUEUE_MAX_THREADS, self.db_pool.max_connections() // 2),
+        )
+
         # We define this sequence here so that it can be referenced from both
         # the DataStore and PersistEventStore.
         def get_chain_id_txn(txn: Cursor) -> int:
@@ -322,6 +490,71 @@ class EventsWorkerStore(SQLBaseStore):
                 "stream_id",
             )
 
+    @wrap_as_background_process("build_event_existence_filter")
+    async def _build_event_existence_filter(self) -> None:
+        """Add all the events in the database to the event existence filter, and
+        then start using it.
+        """
+        event_existence_filter = self._event_existence_filter
+        assert event_existence_filter is not None
+
+        def get_event_ids_txn(
+            txn: LoggingTransaction, from_stream_ordering: int
+        ) -> List[Tuple[int, str]]:
+            sql = """
+                SELECT stream_ordering, event_id FROM events
+                WHERE stream_ordering > ?
+                ORDER BY stream_ordering ASC
+                LIMIT ?
+            """
+            txn.execute(sql, (from_stream_ordering, EVENT_EXISTENCE_FILTER_BATCH_SIZE))
+            return cast(List[Tuple[int, str]], txn.fetchall())
+
+        # Backfilled events have negative stream orderings, so we start from below
+        # the lowest one. Any events persisted while we scan the table will be
+        # added as they are persisted, even if we've already scanned past them.
+        from_stream_ordering = self._backfill_id_gen.get_current_token() - 1
+        while True:
+            rows = await self.db_pool.runInteraction(
+                "build_event_existence_filter",
+                get_event_ids_txn,
+                from_stream_ordering,
+            )
+            for _, event_id in rows:
+                event_existence_filter.add(event_id)
+
+            if len(rows) < EVENT_EXISTENCE_FILTER_BATCH_SIZE:
+                break
+
+            from_stream_ordering = rows[-1][0]
+
+        self._event_existence_filter_ready = True
+        logger.info(
+            "Built event existence filter of %d events (%d bytes)",
+            len(event_existence_filter),
+            event_existence_filter.memory_usage(),
+        )
+
+    def _add_to_event_existence_filter(self, event_id: str) -> None:
+        """Record that the given event has been persisted."""
+        if self._event_existence_filter is not None:
+            self._event_existence_filter.add(event_id)
+
+    def _filter_unknown_events(self, event_ids: Collection[str]) -> Collection[str]:
+        """Drop the events which are definitely not in the database, according
+        to the event existence filter.
+        """
+        if (
+            self._event_existence_filter is None
+            or not self._event_existence_filter_ready
+        ):
+            return event_ids
+
+        event_existence_filter = self._event_existence_filter
+        return [
+            event_id for event_id in event_ids if event_id in event_existence_filter
+        ]
+
     def get_un_partial_stated_events_token(self) -> int:
         # TODO(faster_joins, multiple writers): This is inappropriate if there are multiple
         #     writers because workers that don't write often will hold all
@@ -889,6 +1122,11 @@ class EventsWorkerStore(SQLBaseStore):
 
         await self._get_event_cache.invalidate((event_id,))
 
+        # Other processes only invalidate their local caches when they see the
+        # event over replication, so it's up to us to invalidate the shared cache.
+        if self._shared_event_cache is not None:
+            self._shared_event_cache.invalidate(event_id)
+
     def _invalidate_local_get_event_cache(self, event_id: str) -> None:
         """
         Invalidates an event in local in-memory get event caches.
@@ -901,6 +1139,19 @@ class EventsWorkerStore(SQLBaseStore):
         self._event_ref.pop(event_id, None)
         self._current_event_fetches.pop(event_id, None)
 
+    def _invalidate_purged_event(self, event_id: str) -> None:
+        """
+        Invalidates a purged event in the local in-memory and shared event caches,
+        on seeing its purge over replication.
+
+        Arguments:
+            event_id: the event ID to invalidate
+        """
+
+        self._invalidate_local_get_event_cache(event_id)
+        if self._shared_event_cache is not None:
+            self._shared_event_cache.invalidate(event_id)
+
     async def _get_events_from_cache(
         self, events: Iterable[str], update_metrics: bool = True
     ) -> Dict[str, EventCacheEntry]:
@@ -916,7 +1167,7 @@ class EventsWorkerStore(SQLBaseStore):
             events, update_metrics=update_metrics
         )
 
-        missing_event_ids = (e for e in events if e not in event_map)
+        missing_event_ids = [e for e in events if e not in event_map]
         event_map.update(
             await self._get_events_from_external_cache(
                 events=missing_event_ids,
@@ -927,26 +1178,27 @@ class EventsWorkerStore(SQLBaseStore):
         return event_map
 
     async def _get_events_from_external_cache(
-        self, events: Iterable[str], update_metrics: bool = True
+        self, events: Collection[str], update_metrics: bool = True
     ) -> Dict[str, EventCacheEntry]:
         """Fetch events from any configured external cache.
 
+        The events are fetched in a single batch, rather than making a request
+        per event.
+
         May return rejected events.
 
         Args:
             events: list of event_ids to fetch
             update_metrics: Whether to update the cache hit ratio metrics
         """
-        event_map = {}
+        if not events:
+            return {}
 
-        for event_id in events:
-            ret = await self._get_event_cache.get_external(
-                (event_id,), None, update_metrics=update_metrics
-            )
-            if ret:
-                event_map[event_id] = ret
+        results = await self._get_event_cache.get_external_many(
+            [(event_id,) for event_id in events], update_metrics=update_metrics
+        )
 
-        return event_map
+        return {key[0]: entry for key, entry in results.items()}
 
     def _get_events_from_local_cache(
         self, events: Iterable[str], update_metrics: bool = True
@@ -1045,11 +1297,15 @@ class EventsWorkerStore(SQLBaseStore):
         ]
 
     def _maybe_start_fetch_thread(self) -> None:
-        """Starts an event fetch thread if we are not yet at the maximum number."""
+        """Starts an event fetch thread if there are requests waiting, none of the
+        fetchers are free to pick them up, and we are not yet at the maximum
+        number.
+        """
         with self._event_fetch_lock:
             if (
                 self._event_fetch_list
-                and self._event_fetch_ongoing < EVENT_QUEUE_THREADS
+                and self._event_fetch_idle == 0
+                and self._event_fetch_ongoing < self._max_event_fetchers
             ):
                 self._event_fetch_ongoing += 1
                 event_fetch_ongoing_gauge.set(self._event_fetch_ongoing)
@@ -1125,8 +1381,8 @@ class EventsWorkerStore(SQLBaseStore):
                 # Fail any outstanding fetches since no one else will handle them.
                 assert exc is not None
                 with PreserveLoggingContext():
-                    for _, deferred in event_fetches_to_fail:
-                        deferred.errback(exc)
+                    for request in event_fetches_to_fail:
+                        request.deferred.errback(exc)
 
     def _fetch_loop(self, conn: LoggingDatabaseConnection) -> None:
         """Takes a database connection and waits for requests for events from
@@ -1135,32 +1391,74 @@ class EventsWorkerStore(SQLBaseStore):
         i = 0
         while True:
             with self._event_fetch_lock:
-                event_list = self._event_fetch_list
-                self._event_fetch_list = []
+                event_list = self._take_event_fetch_requests()
 
                 if not event_list:
                     # There are no requests waiting. If we haven't yet reached the
                     # maximum iteration limit, wait for some more requests to turn up.
-                    # Otherwise, bail out.
+                    # Otherwise, bail out. Fetchers started to deal with a backlog
+                    # bail out straight away, rather than holding on to a
+                    # database connection.
                     single_threaded = self.database_engine.single_threaded
                     if (
                         not self.USE_DEDICATED_DB_THREADS_FOR_EVENT_FETCHING
                         or single_threaded
                         or i > EVENT_QUEUE_ITERATIONS
+                        or self._event_fetch_ongoing > EVENT_QUEUE_THREADS
                     ):
                         return
 
-                    self._event_fetch_lock.wait(EVENT_QUEUE_TIMEOUT_S)
+                    self._event_fetch_idle += 1
+                    try:
+                        self._event_fetch_lock.wait(EVENT_QUEUE_TIMEOUT_S)
+                    finally:
+                        self._event_fetch_idle -= 1
                     i += 1
                     continue
                 i = 0
 
+            now = self._clock.time()
+            for request in event_list:
+                event_fetch_queue_timer.labels(
+                    "interactive" if request.interactive else "background"
+                ).observe(now - request.queued_at)
+
             self._fetch_event_list(conn, event_list)
 
+    def _take_event_fetch_requests(self) -> List[_EventFetchRequest]:
+        """Take the next requests to handle off `_event_fetch_list`.
+
+        Requests made for interactive requests (e.g. syncs) are handled before
+        those made in the background, unless the latter have been waiting for
+        too long. Must be called with `_event_fetch_lock` held.
+        """
+        event_list = self._event_fetch_list
+
+        if any(request.interactive for request in event_list):
+            cutoff = self._clock.time() - EVENT_QUEUE_BACKGROUND_MAX_DELAY_S
+            self._event_fetch_list = [
+                request
+                for request in event_list
+                if not request.interactive and request.queued_at > cutoff
+            ]
+            if self._event_fetch_list:
+                # Some background requests are being held back, so there's still
+                # work for another fetcher.
+                self._event_fetch_lock.notify()
+                return [
+                    request
+                    for request in event_list
+                    if request.interactive or request.queued_at <= cutoff
+                ]
+        else:
+            self._event_fetch_list = []
+
+        return event_list
+
     def _fetch_event_list(
         self,
         conn: LoggingDatabaseConnection,
-        event_list: List[Tuple[Iterable[str], "defer.Deferred[Dict[str, _EventRow]]"]],
+        event_list: List[_EventFetchRequest],
     ) -> None:
         """Handle a load of requests from the _event_fetch_list queue
 
@@ -1168,18 +1466,14 @@ class EventsWorkerStore(SQLBaseStore):
             conn: database connection
 
             event_list:
-                The fetch requests. Each entry consists of a list of event
-                ids to be fetched, and a deferred to be completed once the
-                events have been fetched.
-
-                The deferreds are callbacked with a dictionary mapping from event id
-                to event row. Note that it may well contain additional events that
-                were not part of this request.
+                The fetch requests. The deferred of each is callbacked with a
+                dictionary mapping from event id to event row. Note that it may
+                well contain additional events that were not part of this request.
         """
         with Measure(self._clock, "_fetch_event_list"):
             try:
                 events_to_fetch = {
-                    event_id for events, _ in event_list for event_id in events
+                    event_id for request in event_list for event_id in request.event_ids
                 }
 
                 row_dict = self.db_pool.new_transaction(
@@ -1194,8 +1488,8 @@ class EventsWorkerStore(SQLBaseStore):
 
                 # We only want to resolve deferreds from the main thread
                 def fire() -> None:
-                    for _, d in event_list:
-                        d.callback(row_dict)
+                    for request in event_list:
+                        request.deferred.callback(row_dict)
 
                 with PreserveLoggingContext():
                     self.hs.get_reactor().callFromThread(fire)
@@ -1204,8 +1498,8 @@ class EventsWorkerStore(SQLBaseStore):
 
                 # We only want to resolve deferreds from the main thread
                 def fire_errback(exc: Exception) -> None:
-                    for _, d in event_list:
-                        d.errback(exc)
+                    for request in event_list:
+                        request.deferred.errback(exc)
 
                 with PreserveLoggingContext():
                     self.hs.get_reactor().callFromThread(fire_errback, e)
@@ -1225,62 +1519,99 @@ class EventsWorkerStore(SQLBaseStore):
             event_ids: The event_ids of the events to fetch
 
         Returns:
-            map from event id to result. May return extra events which
-            weren't asked for.
+            map from event id to result.
         """
-        fetched_event_ids: Set[str] = set()
         fetched_events: Dict[str, _EventRow] = {}
 
-        async def _fetch_event_ids_and_get_outstanding_redactions(
-            event_ids_to_fetch: Collection[str],
-        ) -> Collection[str]:
-            """
-            Fetch all of the given event_ids and return any associated redaction event_ids
-            that we still need to fetch in the next iteration.
-            """
-            row_map = await self._enqueue_events(event_ids_to_fetch)
+        with event_fetch_stage_timer.labels("fetch").time():
+            row_map = await self._get_event_rows(event_ids)
 
-            # we need to recursively fetch any redactions of those events
-            redaction_ids: Set[str] = set()
-            for event_id in event_ids_to_fetch:
+            # We also need the events which redact the events we fetched. Rows
+            # from the database come with those of their redactions, but rows
+            # from the shared event cache don't.
+            missing_redaction_ids: Set[str] = set()
+            for event_id in event_ids:
                 row = row_map.get(event_id)
-                fetched_event_ids.add(event_id)
                 if row:
                     fetched_events[event_id] = row
-                    redaction_ids.update(row.redactions)
+                    for redaction_id in row.redactions:
+                        redaction_row = row_map.get(redaction_id)
+                        if redaction_row:
+                            fetched_events[redaction_id] = redaction_row
+                        else:
+                            missing_redaction_ids.add(redaction_id)
+
+            missing_redaction_ids.difference_update(fetched_events)
+            if missing_redaction_ids:
+                logger.debug("Also fetching redaction events %s", missing_redaction_ids)
+                with start_active_span("fetching redactions"):
+                    redaction_row_map = await self._get_event_rows(
+                        missing_redaction_ids
+                    )
+                for redaction_id in missing_redaction_ids:
+                    redaction_row = redaction_row_map.get(redaction_id)
+                    if redaction_row:
+                        fetched_events[redaction_id] = redaction_row
 
-            event_ids_to_fetch = redaction_ids.difference(fetched_event_ids)
-            return event_ids_to_fetch
+        with event_fetch_stage_timer.labels("decode").time():
+            event_map = self._build_events_from_rows(fetched_events)
 
-        # Grab the initial list of events requested
-        event_ids_to_fetch = await _fetch_event_ids_and_get_outstanding_redactions(
-            event_ids
-        )
-        # Then go and recursively find all of the associated redactions
-        with start_active_span("recursively fetching redactions"):
-            while event_ids_to_fetch:
-                logger.debug("Also fetching redaction events %s", event_ids_to_fetch)
-
-                event_ids_to_fetch = (
-                    await _fetch_event_ids_and_get_outstanding_redactions(
-                        event_ids_to_fetch
-                    )
+        # finally, we can decide whether each one needs redacting, and build
+        # the cache entries. We only do this for the events that were asked for,
+        # since we don't know about the redactions of the redaction events.
+        result_map: Dict[str, EventCacheEntry] = {}
+        with event_fetch_stage_timer.labels("redact").time():
+            for event_id in event_ids:
+                original_ev = event_map.get(event_id)
+                if original_ev is None:
+                    continue
+
+                redacted_event = self._maybe_redact_event_row(
+                    original_ev, fetched_events[event_id].redactions, event_map
                 )
+                result_map[event_id] = EventCacheEntry(
+                    event=original_ev, redacted_event=redacted_event
+                )
+
+        for event_id, cache_entry in result_map.items():
+            await self._get_event_cache.set((event_id,), cache_entry)
+
+            if not cache_entry.redacted_event:
+                # We only cache references to unredacted events.
+                self._event_ref[event_id] = cache_entry.event
 
-        # build a map from event_id to EventBase
+        return result_map
+
+    def _build_events_from_rows(
+        self, fetched_events: Dict[str, _EventRow]
+    ) -> Dict[str, EventBase]:
+        """Build the events from their rows in the database.
+
+        Events which can't be parsed, or are in rooms of unknown versions, are
+        logged and omitted.
+
+        Returns:
+            map from event id to event.
+        """
         event_map: Dict[str, EventBase] = {}
         for event_id, row in fetched_events.items():
             assert row.event_id == event_id
 
             rejected_reason = row.rejected_reason
 
-            # If the event or metadata cannot be parsed, log the error and act
-            # as if the event is unknown.
-            try:
-                d = db_to_json(row.json)
-            except ValueError:
-                logger.error("Unable to parse json from event: %s", event_id)
-                continue
+            # If we know the fields of the event we're likely to need, we don't
+            # decode the rest of it until it's needed.
+            header = row.header
+            if header is not None:
+                d = header
+            else:
+                # If the event or metadata cannot be parsed, log the error and act
+                # as if the event is unknown.
+                try:
+                    d = db_to_json(row.json)
+                except ValueError:
+                    logger.error("Unable to parse json from event: %s", event_id)
+                    continue
             try:
                 internal_metadata = db_to_json(row.internal_metadata)
             except ValueError:
@@ -1355,19 +1686,39 @@ class EventsWorkerStore(SQLBaseStore):
                     )
                     continue
 
-            original_ev = make_event_from_dict(
-                event_dict=d,
-                room_version=room_version,
-                internal_metadata_dict=internal_metadata,
-                rejected_reason=rejected_reason,
-            )
+            if header is not None:
+                original_ev = make_event_from_json(
+                    event_json=row.json,
+                    event_id=event_id,
+                    header=header,
+                    room_version=room_version,
+                    internal_metadata_dict=internal_metadata,
+                    rejected_reason=rejected_reason,
+                )
+
+                # The decoded event isn't kept until it's needed, but we check
+                # now that it can be decoded and matches its event ID (raising a
+                # `RuntimeError` as below if not), so that corrupt rows don't
+                # fail whenever the event is first used.
+                try:
+                    original_ev.check_lazy_json()
+                except ValueError:
+                    logger.error("Unable to parse json from event: %s", event_id)
+                    continue
+            else:
+                original_ev = make_event_from_dict(
+                    event_dict=d,
+                    room_version=room_version,
+                    internal_metadata_dict=internal_metadata,
+                    rejected_reason=rejected_reason,
+                )
             original_ev.internal_metadata.stream_ordering = row.stream_ordering
             original_ev.internal_metadata.outlier = row.outlier
 
             # Consistency check: if the content of the event has been modified in the
             # database, then the calculated event ID will not match the event id in the
             # database.
-            if original_ev.event_id != event_id:
+            if header is None and original_ev.event_id != event_id:
                 # it's difficult to see what to do here. Pretty much all bets are off
                 # if Synapse cannot rely on the consistency of its database.
                 raise RuntimeError(
@@ -1378,27 +1729,54 @@ class EventsWorkerStore(SQLBaseStore):
 
             event_map[event_id] = original_ev
 
-        # finally, we can decide whether each one needs redacting, and build
-        # the cache entries.
-        result_map: Dict[str, EventCacheEntry] = {}
-        for event_id, original_ev in event_map.items():
-            redactions = fetched_events[event_id].redactions
-            redacted_event = self._maybe_redact_event_row(
-                original_ev, redactions, event_map
-            )
+        return event_map
 
-            cache_entry = EventCacheEntry(
-                event=original_ev, redacted_event=redacted_event
-            )
+    async def _get_event_rows(self, event_ids: Collection[str]) -> Dict[str, _EventRow]:
+        """Fetch the rows for the given events from the shared event cache, if
+        configured, falling back to the database.
 
-            await self._get_event_cache.set((event_id,), cache_entry)
-            result_map[event_id] = cache_entry
+        Rows fetched from the database are added to the shared event cache.
 
-            if not redacted_event:
-                # We only cache references to unredacted events.
-                self._event_ref[event_id] = original_ev
+        Args:
+            event_ids: events to be fetched.
 
-        return result_map
+        Returns:
+            A map from event id to row data. May contain events that weren't
+            requested.
+        """
+        shared_cache = self._shared_event_cache
+        if shared_cache is None:
+            return await self._enqueue_events(event_ids)
+
+        row_map: Dict[str, _EventRow] = {}
+
+        # Map from event ID to the version of its slot in the shared cache,
+        # for the events we need to fetch from the database.
+        versions: Dict[str, int] = {}
+
+        for event_id in event_ids:
+            data = shared_cache.get(event_id)
+            if data is not None:
+                try:
+                    row_map[event_id] = _decode_event_row(event_id, data)
+                    continue
+                except (struct.error, ValueError):
+                    logger.warning(
+                        "Unable to parse event %s from shared event cache", event_id
+                    )
+
+            versions[event_id] = shared_cache.get_version(event_id)
+
+        if versions:
+            db_row_map = await self._enqueue_events(list(versions))
+            for event_id, row in db_row_map.items():
+                version = versions.get(event_id)
+                if version is not None:
+                    shared_cache.set(event_id, _encode_event_row(row), version)
+
+            row_map.update(db_row_map)
+
+        return row_map
 
     async def _enqueue_events(self, events: Collection[str]) -> Dict[str, _EventRow]:
         """Fetches events from the database using the _event_fetch_list. This
@@ -1414,8 +1792,16 @@ class EventsWorkerStore(SQLBaseStore):
         """
 
         events_d: "defer.Deferred[Dict[str, _EventRow]]" = defer.Deferred()
+        request = _EventFetchRequest(
+            event_ids=events,
+            deferred=events_d,
+            # Fetches made outside of a request are made by background
+            # processes, e.g. pushers.
+            interactive=current_context().request is not None,
+            queued_at=self._clock.time(),
+        )
         with self._event_fetch_lock:
-            self._event_fetch_list.append((events, events_d))
+            self._event_fetch_list.append(request)
             self._event_fetch_lock.notify()
 
         self._maybe_start_fetch_thread()
@@ -1434,6 +1820,10 @@ class EventsWorkerStore(SQLBaseStore):
 
         Events which are not found are omitted from the result.
 
+        The rows of the events which redact the given events are fetched in the
+        same query, and included in the result. Note that the `redactions` of
+        those rows are only filled in if they were also asked for.
+
         Args:
             txn: The database transaction.
             event_ids: event IDs to fetch
@@ -1441,32 +1831,81 @@ class EventsWorkerStore(SQLBaseStore):
         Returns:
             A map from event id to event info.
         """
-        event_dict = {}
-        for evs in batch_iter(event_ids, 200):
-            sql = """\
-                SELECT
-                  e.event_id,
-                  e.stream_ordering,
-                  ej.internal_metadata,
-                  ej.json,
-                  ej.format_version,
-                  r.room_version,
-                  rej.reason,
-                  e.outlier
-                FROM events AS e
-                  JOIN event_json AS ej USING (event_id)
-                  LEFT JOIN rooms r ON r.room_id = e.room_id
-                  LEFT JOIN rejections as rej USING (event_id)
-                WHERE """
+        # On Postgres the event IDs are passed as a single array, so we can
+        # fetch a large batch at once. SQLite has a limit on the number of
+        # parameters in a query, and we pass the event IDs twice.
+        if isinstance(txn.database_engine, PostgresEngine):
+            batch_size = 1000
+        else:
+            batch_size = 200
+
+        columns = """
+            e.event_id,
+            e.stream_ordering,
+            ej.internal_metadata,
+            ej.json,
+            ej.format_version,
+            r.room_version,
+            rej.reason,
+            e.outlier,
+            e.type,
+            e.room_id,
+            e.sender,
+            se.state_key
+        """
+        joins = """
+            JOIN event_json AS ej ON ej.event_id = e.event_id
+            LEFT JOIN rooms r ON r.room_id = e.room_id
+            LEFT JOIN rejections as rej ON rej.event_id = e.event_id
+            LEFT JOIN state_events AS se ON se.event_id = e.event_id
+        """
 
-            clause, args = make_in_list_sql_clause(
+        event_dict: Dict[str, _EventRow] = {}
+        for evs in batch_iter(event_ids, batch_size):
+            # The first half of the query fetches the events, and the second the
+            # events which redact them, along with the ID of the event redacted.
+            events_clause, events_args = make_in_list_sql_clause(
                 txn.database_engine, "e.event_id", evs
             )
+            redactions_clause, redactions_args = make_in_list_sql_clause(
+                txn.database_engine, "red.redacts", evs
+            )
+            sql = f"""
+                SELECT {columns}, NULL
+                FROM events AS e
+                {joins}
+                WHERE {events_clause}
+                UNION ALL
+                SELECT {columns}, red.redacts
+                FROM redactions AS red
+                JOIN events AS e ON e.event_id = red.event_id
+                {joins}
+                WHERE {redactions_clause}
+            """
 
-            txn.execute(sql + clause, args)
+            txn.execute(sql, events_args + redactions_args)
 
+            redactions: List[Tuple[str, str]] = []
             for row in txn:
                 event_id = row[0]
+
+                redacted = row[12]
+                if redacted is not None:
+                    redactions.append((event_id, redacted))
+
+                if event_id in event_dict:
+                    # We've already seen this event, e.g. because it redacts
+                    # more than one of the events.
+                    continue
+
+                header: Optional[Dict[str, str]] = None
+                # Very old events don't have a sender in the events table, and
+                # the JSON of rows from SQLite isn't always a string.
+                if row[10] is not None and isinstance(row[3], str):
+                    header = {"type": row[8], "room_id": row[9], "sender": row[10]}
+                    if row[11] is not None:
+                        header["state_key"] = row[11]
+
                 event_dict[event_id] = _EventRow(
                     event_id=event_id,
                     stream_ordering=row[1],
@@ -1477,16 +1916,10 @@ class EventsWorkerStore(SQLBaseStore):
                     rejected_reason=row[6],
                     redactions=[],
                     outlier=row[7],
+                    header=header,
                 )
 
-            # check for redactions
-            redactions_sql = "SELECT event_id, redacts FROM redactions WHERE "
-
-            clause, args = make_in_list_sql_clause(txn.database_engine, "redacts", evs)
-
-            txn.execute(redactions_sql + clause, args)
-
-            for (redacter, redacted) in txn:
+            for redacter, redacted in redactions:
                 d = event_dict.get(redacted)
                 if d:
                     d.redactions.append(redacter)
@@ -1572,11 +2005,15 @@ class EventsWorkerStore(SQLBaseStore):
         """Given a list of event ids, check if we have already processed and
         stored them as non outliers.
         """
+        event_ids = self._filter_unknown_events(list(event_ids))
+        if not event_ids:
+            return set()
+
         rows = await self.db_pool.simple_select_many_batch(
             table="events",
             retcols=("event_id",),
             column="event_id",
-            iterable=list(event_ids),
+            iterable=event_ids,
             keyvalues={"outlier": False},
             desc="have_events_in_timeline",
         )
@@ -1636,7 +2073,13 @@ class EventsWorkerStore(SQLBaseStore):
         #  not being invalidated when purging events from a room. The optimisation can
         #  be re-added after https://github.com/matrix-org/synapse/issues/13476
 
-        def have_seen_events_txn(txn: LoggingTransaction) -> Dict[str, bool]:
+        # Most of the events we get asked about are ones we don't have, which the
+        # event existence filter (if enabled) can tell us without a DB query.
+        events_to_check = self._filter_unknown_events(event_ids)
+        if not events_to_check:
+            return {eid: False for eid in event_ids}
+
+        def have_seen_events_txn(txn: LoggingTransaction) -> Set[str]:
             # we deliberately do *not* query the database for room_id, to make the
             # query an index-only lookup on `events_event_id_key`.
             #
@@ -1644,18 +2087,18 @@ class EventsWorkerStore(SQLBaseStore):
 
             sql = "SELECT event_id FROM events AS e WHERE "
             clause, args = make_in_list_sql_clause(
-                txn.database_engine, "e.event_id", event_ids
+                txn.database_engine, "e.event_id", events_to_check
             )
             txn.execute(sql + clause, args)
-            found_events = {eid for eid, in txn}
-
-            # ... and then we can update the results for each key
-            return {eid: (eid in found_events) for eid in event_ids}
+            return {eid for eid, in txn}
 
-        return await self.db_pool.runInteraction(
+        found_events = await self.db_pool.runInteraction(
             "have_seen_events", have_seen_events_txn
         )
 
+        # ... and then we can update the results for each key
+        return {eid: (eid in found_events) for eid in event_ids}
+
     @cached(max_entries=100000, tree=True)
     async def have_seen_event(self, room_id: str, event_id: str) -> bool:
         res = await self._have_seen_events_dict(room_id, [event_id])
@@ -304,7 +304,11 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
                 self._invalidate_cache_and_stream(
                     txn, self.have_seen_event, (room_id, event_id)
                 )
-                self.invalidate_get_event_cache_after_txn(txn, event_id)
+
+        self._invalidate_purged_events_and_stream(
+            txn,
+            [event_id for event_id, should_delete in event_rows if should_delete],
+        )
 
         logger.info("[purge] done")
 
@@ -364,6 +368,11 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
 
         state_groups = [row[0] for row in txn]
 
+        # Fetch the IDs of the events that are to be deleted, so that they can be
+        # dropped from the event caches.
+        txn.execute("SELECT event_id FROM events WHERE room_id = ?", (room_id,))
+        event_ids = [row[0] for row in txn]
+
         # Get all the auth chains that are referenced by events that are to be
         # deleted.
         txn.execute(
@@ -483,6 +492,15 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
         # XXX: as with purge_history, this is racy, but no worse than other races
         #   that already exist.
         self._invalidate_cache_and_stream(txn, self.have_seen_event, (room_id,))
+        self._invalidate_purged_events_and_stream(txn, event_ids)
+
+        # The room's events have been removed from the chain cover index.
+        txn.call_after(
+            self._attempt_to_invalidate_cache, "_auth_chain_cover_index", (room_id,)
+        )
+        self._send_invalidation_to_replication(
+            txn, "_auth_chain_cover_index", [room_id]
+        )
 
         logger.info("[purge] done")
 
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import logging
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Tuple, cast
 
 from synapse.storage._base import SQLBaseStore
 from synapse.storage.database import LoggingTransaction
@@ -133,3 +133,37 @@ class StateDeltasStore(SQLBaseStore):
             "get_max_stream_id_in_current_state_deltas",
             self._get_max_stream_id_in_current_state_deltas_txn,
         )
+
+    async def get_current_state_deltas_between(
+        self, from_id: int, to_id: int, limit: int
+    ) -> List[Tuple[str, str, str]]:
+        """Get the room state changes between two stream positions.
+
+        Args:
+            from_id: The stream position to fetch changes from. Exclusive.
+            to_id: The stream position to fetch changes up to. Inclusive.
+            limit: The maximum number of changes to return.
+
+        Returns:
+            A list of the room ID, event type and state key of each change, in
+            stream order.
+        """
+        if from_id >= to_id:
+            return []
+
+        def get_current_state_deltas_between_txn(
+            txn: LoggingTransaction,
+        ) -> List[Tuple[str, str, str]]:
+            sql = """
+                SELECT room_id, type, state_key
+                FROM current_state_delta_stream
+                WHERE ? < stream_id AND stream_id <= ?
+                ORDER BY stream_id ASC
+                LIMIT ?
+            """
+            txn.execute(sql, (from_id, to_id, limit))
+            return cast(List[Tuple[str, str, str]], txn.fetchall())
+
+        return await self.db_pool.runInteraction(
+            "get_current_state_deltas_between", get_current_state_deltas_between_txn
+        )
@@ -70,9 +70,14 @@ from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.engines import BaseDatabaseEngine, PostgresEngine
 from synapse.storage.util.id_generators import MultiWriterIdGenerator
 from synapse.types import PersistedEventPosition, RoomStreamToken
-from synapse.util.caches.descriptors import cached
+from synapse.util.caches.descriptors import cached, cachedList
+from synapse.util.caches.membership_change_index import (
+    MembershipChange,
+    MembershipChangeIndex,
+)
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 from synapse.util.cancellation import cancellable
+from synapse.util.iterutils import batch_iter
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -413,6 +418,11 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
         self._membership_stream_cache = StreamChangeCache(
             "MembershipStreamChangeCache", events_max
         )
+        # The recent membership changes of local users, so that incremental syncs
+        # don't need to query the database for them.
+        self._membership_change_index = MembershipChangeIndex(
+            "MembershipChangeIndex", events_max
+        )
 
         self._stream_order_on_start = self.get_room_max_stream_ordering()
         self._min_stream_order_on_start = self.get_room_min_stream_ordering()
@@ -642,6 +652,16 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
             if not has_changed:
                 return []
 
+        index_rows = self._get_membership_changes_for_user_from_index(
+            user_id, from_key, to_key, excluded_rooms
+        )
+        if index_rows is not None:
+            ret = await self.get_events_as_list(
+                [r.event_id for r in index_rows], get_prev_content=True
+            )
+            self._set_before_and_after(ret, index_rows, topo_order=False)
+            return ret
+
         def f(txn: LoggingTransaction) -> List[_EventDictReturn]:
             # To handle tokens with a non-empty instance_map we fetch more
             # results than necessary and then filter down
@@ -695,6 +715,68 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
 
         return ret
 
+    def _get_membership_changes_for_user_from_index(
+        self,
+        user_id: str,
+        from_key: RoomStreamToken,
+        to_key: RoomStreamToken,
+        excluded_rooms: Optional[List[str]],
+    ) -> Optional[List[_EventDictReturn]]:
+        """Get the user's membership changes between the two (live) tokens from
+        the in-memory index, if it knows about all of them.
+
+        Returns:
+            The changes, in ascending stream order, or None if they have to be
+            fetched from the database.
+        """
+        if from_key.topological is not None or to_key.topological is not None:
+            return None
+
+        changes = self._membership_change_index.get_changes(user_id, from_key.stream)
+        if changes is None:
+            return None
+
+        excluded = set(excluded_rooms or ())
+        return [
+            _EventDictReturn(change.event_id, None, change.stream_ordering)
+            for change in changes
+            if change.room_id not in excluded
+            and _filter_results(
+                from_key,
+                to_key,
+                change.instance_name,
+                0,
+                change.stream_ordering,
+            )
+        ]
+
+    def _membership_has_changed(
+        self,
+        user_id: str,
+        stream_ordering: int,
+        instance_name: str,
+        event_id: str,
+        room_id: str,
+        membership: str,
+    ) -> None:
+        """Update the in-memory membership change index for a newly persisted
+        membership event.
+        """
+        # Only local users sync.
+        if not self.hs.is_mine_id(user_id):
+            return
+
+        self._membership_change_index.record_change(
+            user_id,
+            MembershipChange(
+                stream_ordering=stream_ordering,
+                instance_name=instance_name,
+                event_id=event_id,
+                room_id=room_id,
+                membership=membership,
+            ),
+        )
+
     async def get_recent_events_for_room(
         self, room_id: str, limit: int, end_token: RoomStreamToken
     ) -> Tuple[List[EventBase], RoomStreamToken]:
@@ -1242,6 +1324,107 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
     def has_room_changed_since(self, room_id: str, stream_id: int) -> bool:
         return self._events_stream_cache.has_entity_changed(room_id, stream_id)
 
+    @cached(max_entries=100000)
+    async def get_room_last_stream_ordering(self, room_id: str) -> Optional[int]:
+        """Get the stream ordering of the most recent event in a room, i.e. how
+        recently the room was active.
+
+        The cache is kept up to date as events are persisted (see
+        `_room_has_new_event`), rather than invalidated, so that ordering a
+        user's rooms by recency doesn't need to hit the database.
+
+        Returns:
+            The stream ordering, or None if we have no events in the room.
+        """
+        results = await self.db_pool.runInteraction(
+            "get_room_last_stream_ordering",
+            self._get_room_last_stream_orderings_txn,
+            [room_id],
+        )
+        return results.get(room_id)
+
+    @cachedList(
+        cached_method_name="get_room_last_stream_ordering", list_name="room_ids"
+    )
+    async def get_room_last_stream_orderings(
+        self, room_ids: Collection[str]
+    ) -> Dict[str, Optional[int]]:
+        """A batched version of `get_room_last_stream_ordering`.
+
+        Returns:
+            Map from room ID to the stream ordering of its most recent event.
+        """
+        results: Dict[str, Optional[int]] = {}
+        for batch in batch_iter(room_ids, 1000):
+            results.update(
+                await self.db_pool.runInteraction(
+                    "get_room_last_stream_orderings",
+                    self._get_room_last_stream_orderings_txn,
+                    batch,
+                )
+            )
+        return results
+
+    async def get_room_last_stream_orderings_before(
+        self, room_ids: Collection[str], stream_ordering: int
+    ) -> Dict[str, Optional[int]]:
+        """Like `get_room_last_stream_orderings`, but only considers events at or
+        before the given stream ordering.
+        """
+        results: Dict[str, Optional[int]] = {}
+        for batch in batch_iter(room_ids, 1000):
+            results.update(
+                await self.db_pool.runInteraction(
+                    "get_room_last_stream_orderings_before",
+                    self._get_room_last_stream_orderings_txn,
+                    batch,
+                    stream_ordering,
+                )
+            )
+        return results
+
+    def _get_room_last_stream_orderings_txn(
+        self,
+        txn: LoggingTransaction,
+        room_ids: Collection[str],
+        before_stream_ordering: Optional[int] = None,
+    ) -> Dict[str, Optional[int]]:
+        # We use a subquery per room, rather than a `GROUP BY`, so that the
+        # database can look up the maximum using the `events_room_stream` index
+        # instead of scanning all the events in each room.
+        clause, args = make_in_list_sql_clause(
+            self.database_engine, "r.room_id", room_ids
+        )
+        before_clause = ""
+        if before_stream_ordering is not None:
+            before_clause = "AND e.stream_ordering <= ?"
+            args.insert(0, before_stream_ordering)
+
+        sql = f"""
+            SELECT r.room_id, (
+                SELECT MAX(stream_ordering) FROM events AS e
+                WHERE e.room_id = r.room_id {before_clause}
+            )
+            FROM rooms AS r
+            WHERE {clause}
+        """
+        txn.execute(sql, args)
+        return {room_id: stream_ordering for room_id, stream_ordering in txn}
+
+    def _room_has_new_event(self, room_id: str, stream_ordering: int) -> None:
+        """Update the cache of `get_room_last_stream_ordering` for a newly
+        persisted event.
+        """
+        cached_stream_ordering = self.get_room_last_stream_ordering.cache.get_immediate(
+            room_id, None, update_metrics=False
+        )
+        if cached_stream_ordering is None:
+            # Make sure that any lookup in flight doesn't miss this event.
+            self.get_room_last_stream_ordering.invalidate((room_id,))
+        elif cached_stream_ordering < stream_ordering:
+            # With multiple event persisters, events can arrive out of order.
+            self.get_room_last_stream_ordering.prefill((room_id,), stream_ordering)
+
     def _paginate_room_events_txn(
         self,
         txn: LoggingTransaction,
@@ -30,7 +30,7 @@ from synapse.storage.util.sequence import build_sequence_generator
 from synapse.types import MutableStateMap, StateKey, StateMap
 from synapse.types.state import StateFilter
 from synapse.util.caches.descriptors import cached
-from synapse.util.caches.dictionary_cache import DictionaryCache
+from synapse.util.caches.dictionary_cache import DictionaryCache, DictionaryEntry
 from synapse.util.cancellation import cancellable
 
 if TYPE_CHECKING:
@@ -120,7 +120,10 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             id_column="id",
         )
 
-    @cached(max_entries=10000, iterable=True)
+    # This also acts as a second tier of the state group caches: see
+    # `_get_state_for_group_using_deltas`. It's sized by the number of entries
+    # in the deltas.
+    @cached(max_entries=50000, iterable=True)
     async def get_state_group_delta(self, state_group: int) -> _GetStateGroupDelta:
         """Given a state group try to return a previous group and a delta between
         the old and the new.
@@ -219,6 +222,17 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             # `is_all` tells us whether we've gotten everything.
             return state_filter.filter_state(state_dict_ids), cache_entry.full
 
+        got_all = self._got_all_state_from_cache_entry(cache_entry, state_filter)
+        return state_filter.filter_state(state_dict_ids), got_all
+
+    def _got_all_state_from_cache_entry(
+        self, cache_entry: DictionaryEntry, state_filter: StateFilter
+    ) -> bool:
+        """Checks whether a (non-full) entry from a state group cache contains
+        all the state matching the filter.
+        """
+        state_dict_ids = cache_entry.value
+
         # tracks whether any of our requested types are missing from the cache
         missing_types = False
 
@@ -235,7 +249,75 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
                     missing_types = True
                     break
 
-        return state_filter.filter_state(state_dict_ids), not missing_types
+        return not missing_types
+
+    def _get_state_for_group_using_deltas(
+        self,
+        cache: DictionaryCache[int, StateKey, str],
+        group: int,
+        state_filter: StateFilter,
+    ) -> Optional[MutableStateMap[str]]:
+        """Try to work out the state at a group from the state at one of its
+        ancestors in the given state group cache, plus the cached deltas between
+        them (from `get_state_group_delta`).
+
+        This means we don't need to go to the database for (or cache a copy of
+        the full state of) new state groups which are stored as deltas against
+        groups we already have cached, which is the common case in large rooms.
+
+        Args:
+            cache: the state group cache to use
+            group: The state group to lookup
+            state_filter: The state filter used to fetch state from the
+                database. Must only match member or non-member state, depending
+                on the cache.
+
+        Returns:
+            The state matching the filter, or None if it couldn't be worked out
+            from the caches.
+        """
+        is_member_cache = cache is self._state_group_members_cache
+
+        dict_keys = None
+        if not state_filter.has_wildcards():
+            dict_keys = state_filter.concrete_types()
+
+        deltas = []
+        for _ in range(MAX_STATE_DELTA_HOPS):
+            delta = self.get_state_group_delta.cache.get_immediate(
+                group, None, update_metrics=False
+            )
+            if delta is None or delta.prev_group is None:
+                return None
+            assert delta.delta_ids is not None
+
+            deltas.append(delta.delta_ids)
+            group = delta.prev_group
+
+            cache_entry = cache.get(group, dict_keys=dict_keys)
+            if cache_entry.full or (
+                not state_filter.is_full()
+                and self._got_all_state_from_cache_entry(cache_entry, state_filter)
+            ):
+                break
+        else:
+            return None
+
+        # State is never removed from a room, so the deltas only add or
+        # replace entries.
+        state = state_filter.filter_state(cache_entry.value)
+        for delta_ids in reversed(deltas):
+            state.update(
+                state_filter.filter_state(
+                    {
+                        key: event_id
+                        for key, event_id in delta_ids.items()
+                        if (key[0] == EventTypes.Member) == is_member_cache
+                    }
+                )
+            )
+
+        return state
 
     @cancellable
     async def _get_state_for_groups(
@@ -334,6 +416,26 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             state_dict_ids, got_all = self._get_state_for_group_using_cache(
                 cache, group, state_filter
             )
+
+            if not got_all:
+                state_from_deltas = self._get_state_for_group_using_deltas(
+                    cache, group, state_filter
+                )
+                if state_from_deltas is not None:
+                    state_dict_ids = state_from_deltas
+                    got_all = True
+
+                    # Cache the entries we asked for explicitly, so that we get
+                    # hits on them directly next time. We don't cache full state
+                    # maps, as we can cheaply rebuild them from the deltas.
+                    if not state_filter.has_wildcards():
+                        cache.update(
+                            cache.sequence,
+                            key=group,
+                            value=dict(state_dict_ids),
+                            fetched_keys=state_filter.concrete_types(),
+                        )
+
             results[group] = state_dict_ids
 
             if not got_all:
@@ -491,6 +593,15 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
                 ],
             )
 
+            # Prefill the delta cache, so that we can work out the state of
+            # this group from the state of the previous group if we have that
+            # cached. As with the full state below, the delta is immutable.
+            txn.call_after(
+                self.get_state_group_delta.prefill,
+                (state_group,),
+                _GetStateGroupDelta(prev_group, delta_ids),
+            )
+
             return state_group
 
         def insert_full_state_txn(
@@ -17,7 +17,7 @@ import logging
 import typing
 from enum import Enum, auto
 from sys import intern
-from typing import Any, Callable, Dict, List, Optional, Sized, TypeVar
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sized, TypeVar
 
 import attr
 from prometheus_client import REGISTRY
@@ -32,6 +32,11 @@ logger = logging.getLogger(__name__)
 # Whether to track estimated memory usage of the LruCaches.
 TRACK_MEMORY_USAGE = False
 
+# Whether to keep cheap, incremental estimates of the memory usage of the
+# LruCaches, so that `caches.global_max_memory` can be enforced. These are used
+# when `TRACK_MEMORY_USAGE` is off.
+USE_MEMORY_BUDGET = False
+
 # We track cache metrics in a special registry that lets us update the metrics
 # just before they are returned from the scrape endpoint.
 CACHE_METRIC_REGISTRY = DynamicCollectorRegistry()
@@ -94,6 +99,7 @@ class EvictionReason(Enum):
     size = auto()
     time = auto()
     invalidation = auto()
+    memory = auto()
 
 
 @attr.s(slots=True, auto_attribs=True)
@@ -161,7 +167,7 @@ class CacheMetric:
                 if max_size:
                     cache_max_size.labels(self._cache_name).set(max_size)
 
-                if TRACK_MEMORY_USAGE:
+                if TRACK_MEMORY_USAGE or USE_MEMORY_BUDGET:
                     # self.memory_usage can be None if nothing has been inserted
                     # into the cache yet.
                     cache_memory_usage.labels(self._cache_name).set(
@@ -181,6 +187,7 @@ def register_cache(
     collect_callback: Optional[Callable] = None,
     resizable: bool = True,
     resize_callback: Optional[Callable] = None,
+    eviction_policy_callback: Optional[Callable[[str], None]] = None,
 ) -> CacheMetric:
     """Register a cache object for metric collection and resizing.
 
@@ -195,6 +202,8 @@ def register_cache(
         resizable: Whether this cache supports being resized, in which case either
             resize_callback must be provided, or the cache must support set_max_size().
         resize_callback: A function which can be called to resize the cache.
+        eviction_policy_callback: A function which can be called to change the
+            eviction policy of the cache. Ignored if the cache is not resizable.
 
     Returns:
         an object which provides inc_{hits,misses,evictions} methods
@@ -202,7 +211,7 @@ def register_cache(
     if resizable:
         if not resize_callback:
             resize_callback = cache.set_cache_factor  # type: ignore
-        add_resizable_cache(cache_name, resize_callback)
+        add_resizable_cache(cache_name, resize_callback, eviction_policy_callback)
 
     metric = CacheMetric(cache, cache_type, cache_name, collect_callback)
     metric_name = "cache_%s_%s" % (cache_type, cache_name)
@@ -261,3 +270,20 @@ def _intern_known_values(key: str, value: Any) -> Any:
         return intern_string(value)
 
     return value
+
+
+def estimate_json_size(value: Any) -> int:
+    """Cheaply estimate the length of the JSON encoding of a value.
+
+    This ignores escaping and assumes a fixed length for numbers, so is only
+    approximate. It is used to estimate the memory used by cached values.
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, Mapping):
+        return 2 + sum(
+            len(key) + 4 + estimate_json_size(item) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(estimate_json_size(item) + 1 for item in value)
+    return 8
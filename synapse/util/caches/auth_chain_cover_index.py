@@ -0,0 +1,254 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory copies of the chain cover index of rooms, so that auth chains can be
+calculated without querying the database.
+
+See docs/auth_chain_difference_algorithm.md for how the index works.
+"""
+
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+import attr
+
+from synapse.util.caches.lrucache import LruCache
+
+
+@attr.s(slots=True, auto_attribs=True)
+class AuthChainCoverIndexUpdate:
+    """Rows fetched from the database to add to a room's index."""
+
+    # The (event ID, chain ID, sequence number) of events.
+    events: List[Tuple[str, int, int]] = attr.Factory(list)
+
+    # The (origin chain ID, origin sequence number, target chain ID, target
+    # sequence number) of links from the events.
+    links: List[Tuple[int, int, int, int]] = attr.Factory(list)
+
+    # Map from chain ID to the sequence number up to which all of the chain's
+    # events and links are included (or were already in the index).
+    complete_up_to: Dict[int, int] = attr.Factory(dict)
+
+
+class RoomAuthChainCoverIndex:
+    """The chain cover index of a room.
+
+    The index must be closed, i.e. for each chain it has the events (and their
+    links) up to a sequence number, which includes all the events reachable
+    from those events. That's true of all of a room's index, which the
+    database's index always is, and is kept true when adding events by also
+    adding the events they can reach.
+    """
+
+    __slots__ = ["events", "chains", "complete_up_to", "links", "pending", "size"]
+
+    def __init__(self) -> None:
+        # Map from event ID to its chain ID and sequence number.
+        self.events: Dict[str, Tuple[int, int]] = {}
+
+        # Map from chain ID to sequence number to event ID.
+        self.chains: Dict[int, Dict[int, str]] = {}
+
+        # Map from chain ID to the sequence number up to which all of the
+        # chain's events and links are in the index.
+        self.complete_up_to: Dict[int, int] = {}
+
+        # Map from origin chain ID to the links from it, as (origin sequence
+        # number, target chain ID, target sequence number). The links are
+        # transitively closed, so there's no need to follow them recursively.
+        self.links: Dict[int, List[Tuple[int, int, int]]] = {}
+
+        # Events which have been persisted since the index was loaded, and
+        # should be added to it.
+        self.pending: Set[str] = set()
+
+        # The size of the index when it was last added to the cache.
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def apply(self, update: AuthChainCoverIndexUpdate) -> None:
+        """Add the rows fetched from the database to the index.
+
+        Updates can overlap, e.g. if two were fetched at the same time, so links
+        from positions that are already known are ignored.
+        """
+        for origin_chain_id, origin_seq, target_chain_id, target_seq in update.links:
+            if origin_seq <= self.complete_up_to.get(origin_chain_id, 0):
+                continue
+            self.links.setdefault(origin_chain_id, []).append(
+                (origin_seq, target_chain_id, target_seq)
+            )
+
+        for event_id, chain_id, seq in update.events:
+            self.events[event_id] = (chain_id, seq)
+            self.chains.setdefault(chain_id, {})[seq] = event_id
+
+        for chain_id, seq in update.complete_up_to.items():
+            if seq > self.complete_up_to.get(chain_id, 0):
+                self.complete_up_to[chain_id] = seq
+
+    def _get_chains(self, event_ids: Collection[str]) -> Dict[int, int]:
+        """Get a map from chain ID to the maximum sequence number of the given
+        events in it.
+        """
+        chains: Dict[int, int] = {}
+        for event_id in event_ids:
+            chain_id, seq = self.events[event_id]
+            chains[chain_id] = max(seq, chains.get(chain_id, 0))
+        return chains
+
+    def _get_linked_chains(self, chains: Dict[int, int]) -> Dict[int, int]:
+        """Get a map from chain ID to the maximum sequence number reachable by
+        links from the given chain positions.
+        """
+        linked: Dict[int, int] = {}
+        for chain_id, max_seq in chains.items():
+            for origin_seq, target_chain_id, target_seq in self.links.get(chain_id, ()):
+                # Chains are only reachable if the origin sequence number of
+                # the link is at most the max sequence number in the origin
+                # chain.
+                if origin_seq <= max_seq:
+                    linked[target_chain_id] = max(
+                        target_seq, linked.get(target_chain_id, 0)
+                    )
+        return linked
+
+    def _get_events_in_range(
+        self, chain_id: int, min_seq: int, max_seq: int
+    ) -> List[str]:
+        """Get the events in the chain with `min_seq < seq <= max_seq`."""
+        chain = self.chains.get(chain_id, {})
+        return [chain[seq] for seq in range(min_seq + 1, max_seq + 1) if seq in chain]
+
+    def get_auth_chain_ids(
+        self, event_ids: Collection[str], include_given: bool
+    ) -> Set[str]:
+        """Get the auth chain of the given events, which must be in the index.
+
+        Mirrors `EventFederationWorkerStore._get_auth_chain_ids_using_cover_index_txn`.
+        """
+        event_chains = self._get_chains(event_ids)
+        chains = self._get_linked_chains(event_chains)
+
+        # Add the initial set of chains, excluding the sequence corresponding to
+        # initial event.
+        for chain_id, seq in event_chains.items():
+            chains[chain_id] = max(seq - 1, chains.get(chain_id, 0))
+
+        results = set(event_ids) if include_given else set()
+        for chain_id, max_seq in chains.items():
+            results.update(self._get_events_in_range(chain_id, 0, max_seq))
+        return results
+
+    def get_auth_chain_difference(self, state_sets: List[Set[str]]) -> Set[str]:
+        """Get the auth chain difference of the given sets of state events,
+        which must be in the index.
+
+        Mirrors
+        `EventFederationWorkerStore._get_auth_chain_difference_using_cover_index_txn`.
+        """
+        # Corresponds to `state_sets`, except as a map from chain ID to max
+        # sequence number reachable from the state set.
+        set_to_chain = []
+        for state_set in state_sets:
+            chains = self._get_chains(state_set)
+            for chain_id, seq in self._get_linked_chains(chains).items():
+                chains[chain_id] = max(seq, chains.get(chain_id, 0))
+            set_to_chain.append(chains)
+
+        seen_chains: Set[int] = set()
+        for chains in set_to_chain:
+            seen_chains.update(chains)
+
+        # For each chain the events between the minimum sequence number
+        # reachable from *all* state sets and the maximum reachable from *any*
+        # are in the auth chain difference.
+        result: Set[str] = set()
+        for chain_id in seen_chains:
+            min_seq_no = min(chains.get(chain_id, 0) for chains in set_to_chain)
+            max_seq_no = max(chains.get(chain_id, 0) for chains in set_to_chain)
+            if min_seq_no < max_seq_no:
+                result.update(
+                    self._get_events_in_range(chain_id, min_seq_no, max_seq_no)
+                )
+
+        return result
+
+
+class AuthChainCoverIndexCache:
+    """A cache of the chain cover indices of rooms, bounded by the total number
+    of events in them.
+
+    Can be invalidated over replication like a cached function, with the room ID
+    as the key.
+    """
+
+    def __init__(self, name: str, max_events: int):
+        self._rooms: LruCache[str, RoomAuthChainCoverIndex] = LruCache(
+            max_size=max_events,
+            cache_name=name,
+            size_callback=lambda index: index.size,
+        )
+
+        # Rooms whose index is too large to keep in memory.
+        self._too_large: LruCache[str, bool] = LruCache(
+            max_size=10000, cache_name=name + "_too_large"
+        )
+
+    @property
+    def max_room_size(self) -> int:
+        """The number of events in the index of the largest room that can be
+        kept.
+        """
+        return self._rooms.max_size
+
+    def get(self, room_id: str) -> Optional[RoomAuthChainCoverIndex]:
+        return self._rooms.get(room_id)
+
+    def is_too_large(self, room_id: str) -> bool:
+        return self._too_large.get(room_id, False)
+
+    def set(self, room_id: str, index: RoomAuthChainCoverIndex) -> None:
+        """Add or re-add the room's index, e.g. after adding events to it."""
+        self._rooms.pop(room_id)
+
+        index.size = len(index)
+        if index.size > self.max_room_size:
+            self._too_large[room_id] = True
+            return
+
+        self._rooms[room_id] = index
+
+    def mark_too_large(self, room_id: str) -> None:
+        self._too_large[room_id] = True
+
+    def add_pending(self, room_id: str, event_id: str) -> None:
+        """Note that a new state event has been persisted in the room, which
+        should be added to its index the next time it is used.
+        """
+        index = self._rooms.get(room_id, update_metrics=False)
+        if index is not None:
+            index.pending.add(event_id)
+
+    def invalidate(self, key: Tuple[str]) -> None:
+        """Forget the room's index, e.g. because the room has been purged."""
+        (room_id,) = key
+        self._rooms.pop(room_id)
+        self._too_large.pop(room_id)
+
+    def invalidate_all(self) -> None:
+        self._rooms.clear()
+        self._too_large.clear()
@@ -0,0 +1,134 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bloom filters, for cheaply ruling out keys that we have never seen."""
+
+import math
+from typing import Hashable, List
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+class BloomFilter:
+    """A fixed size bloom filter.
+
+    Membership tests may return false positives, but never false negatives. The
+    false positive rate stays below `error_rate` until `capacity` keys have been
+    added, after which it degrades.
+
+    Note that this uses the built-in `hash`, so the filter is only meaningful
+    within a single process.
+    """
+
+    __slots__ = ["capacity", "error_rate", "count", "_num_bits", "_num_hashes", "_bits"]
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        Args:
+            capacity: the number of keys the filter is sized for.
+            error_rate: the target false positive rate, between 0 and 1.
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.count = 0
+
+        # The standard optimal sizing for a bloom filter.
+        self._num_bits = max(
+            int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8
+        )
+        self._num_hashes = max(
+            int(round(math.log(2) * self._num_bits / self.capacity)), 1
+        )
+        self._bits = bytearray((self._num_bits + 7) // 8)
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        # We derive the bit indexes from a single hash using double hashing,
+        # which doesn't noticeably affect the false positive rate.
+        key_hash = hash(key) & _MASK_64
+        h1 = key_hash & 0xFFFFFFFF
+        # Make sure the step is odd so that it never gets stuck on one index.
+        h2 = (key_hash >> 32) | 1
+        return [(h1 + i * h2) % self._num_bits for i in range(self._num_hashes)]
+
+    def add(self, key: Hashable) -> None:
+        bits = self._bits
+        for index in self._indexes(key):
+            bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        bits = self._bits
+        return all(
+            bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(key)
+        )
+
+    def memory_usage(self) -> int:
+        """The approximate size of the filter in bytes."""
+        return len(self._bits)
+
+
+class ScalableBloomFilter:
+    """A bloom filter which grows as keys are added to it, so that it doesn't need
+    to be sized up front.
+
+    This is a series of `BloomFilter`s: once the newest one is full we start adding
+    keys to a bigger one, with a tighter false positive rate so that the overall
+    false positive rate stays below `error_rate`.
+
+    See "Scalable Bloom Filters" by Almeida et al.
+    """
+
+    # How much bigger each new filter is than the last.
+    GROWTH_FACTOR = 2
+
+    # How much tighter the false positive rate of each new filter is than the last.
+    TIGHTENING_RATIO = 0.5
+
+    def __init__(self, initial_capacity: int = 1000000, error_rate: float = 0.01):
+        """
+        Args:
+            initial_capacity: the capacity of the first filter.
+            error_rate: the target overall false positive rate, between 0 and 1.
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+        self.error_rate = error_rate
+        self._filters = [
+            BloomFilter(initial_capacity, error_rate * (1 - self.TIGHTENING_RATIO))
+        ]
+
+    def add(self, key: Hashable) -> None:
+        current = self._filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(
+                current.capacity * self.GROWTH_FACTOR,
+                current.error_rate * self.TIGHTENING_RATIO,
+            )
+            self._filters.append(current)
+
+        current.add(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Recently added keys are more likely to be looked up, so we check the
+        # newest filter first.
+        return any(key in f for f in reversed(self._filters))
+
+    def __len__(self) -> int:
+        """The number of keys that have been added, including any duplicates."""
+        return sum(f.count for f in self._filters)
+
+    def memory_usage(self) -> int:
+        """The approximate size of the filter in bytes."""
+        return sum(f.memory_usage() for f in self._filters)
@@ -14,7 +14,19 @@
 import enum
 import logging
 import threading
-from typing import Any, Dict, Generic, Iterable, Optional, Set, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Sized,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import attr
 from typing_extensions import Literal
@@ -85,6 +97,16 @@ class _PerKeyValue(Generic[DV]):
         return 1
 
 
+def _estimate_memory(value: Sized) -> int:
+    """Estimate the memory used by a cached dict (or single dict value) from its
+    number of items.
+
+    The dicts we cache (e.g. state maps of `(type, state_key)` to event ID) have
+    small keys and values, which take up a couple of hundred bytes per item.
+    """
+    return 200 * len(value)
+
+
 class DictionaryCache(Generic[KT, DKT, DV]):
     """Caches key -> dictionary lookups, supporting caching partial dicts, i.e.
     fetching a subset of dictionary keys for a particular key.
@@ -141,6 +163,7 @@ class DictionaryCache(Generic[KT, DKT, DV]):
             cache_name=name,
             cache_type=TreeCache,
             size_callback=len,
+            memory_size_callback=_estimate_memory,
         )
 
         self.name = name
@@ -246,6 +269,17 @@ class DictionaryCache(Generic[KT, DKT, DV]):
 
         return DictionaryEntry(False, set(), {})
 
+    def get_full_dicts(self) -> List[Tuple[KT, Dict[DKT, DV]]]:
+        """Get all the full dicts in the cache.
+
+        Entries for individual dict keys are not included.
+        """
+        return [
+            (key[0], value)  # type: ignore[misc]
+            for key, value in self.cache.items()
+            if key[1] is _FullCacheKey.KEY
+        ]
+
     def invalidate(self, key: KT) -> None:
         self.check_thread()
 
@@ -0,0 +1,258 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tracks which membership events have been sent to each client when it is
+lazy-loading members, so that they aren't sent again.
+"""
+
+import itertools
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import attr
+
+from synapse.util.caches.expiringcache import ExpiringCache
+from synapse.util.caches.lrucache import LruCache
+
+if TYPE_CHECKING:
+    from synapse.types import StreamToken
+    from synapse.util import Clock
+
+# (user ID, device ID)
+LazyLoadedMembersKey = Tuple[str, Optional[str]]
+
+# Used to tell apart the tables of a room which has been evicted and re-added.
+_generations = itertools.count()
+
+
+class _RoomMembers:
+    """The membership events of a room which have been sent to any client, each
+    with a small integer index, so that the events sent to a client can be stored
+    as a bitset.
+    """
+
+    __slots__ = ["generation", "indices"]
+
+    def __init__(self) -> None:
+        self.generation = next(_generations)
+        self.indices: Dict[str, int] = {}
+
+    def index_of(self, event_id: str) -> int:
+        index = self.indices.get(event_id)
+        if index is None:
+            index = self.indices[event_id] = len(self.indices)
+        return index
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _ClientMembers:
+    """The membership events sent to a client."""
+
+    # Map from room ID to the generation of the room's table, and the bitset of
+    # indices in it of the events sent.
+    rooms: Dict[str, Tuple[int, int]] = attr.Factory(dict)
+
+    # The token at the end of the last sync for which this is known to be up to
+    # date.
+    token: Optional["StreamToken"] = None
+
+    # The rooms whose events have changed since they were last exported.
+    changed_rooms: Set[str] = attr.Factory(set)
+
+    # Whether the set of rooms has changed since it was last exported.
+    room_ids_changed: bool = False
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class LazyLoadedMembersChanges:
+    """The changes to the membership events sent to a client since they were
+    last exported.
+    """
+
+    # The IDs of all the rooms with events sent to the client, if they have
+    # changed, or None if they haven't.
+    room_ids: Optional[List[str]]
+
+    # Map from room ID to the IDs of all the events sent to the client in the
+    # room, for each room which has changed.
+    rooms: Dict[str, List[str]]
+
+
+class LazyLoadedMembersCache:
+    """Tracks which membership events have been sent to each client.
+
+    The event IDs are interned per room, and shared between all clients, so the
+    memory used per client is one bit for each membership event sent to it.
+
+    The membership events sent to a client can be exported and imported, to
+    share them between processes. Only the rooms which have changed are
+    exported, so that a client in many rooms doesn't export all of them on every
+    sync.
+    """
+
+    def __init__(
+        self,
+        clock: "Clock",
+        expiry_ms: int,
+        max_rooms: int = 10000,
+        max_members_per_room: int = 100000,
+    ):
+        """
+        Args:
+            clock
+            expiry_ms: How long to remember the events sent to a client for,
+                after it last synced.
+            max_rooms: The number of rooms to keep tables of event IDs for.
+            max_members_per_room: The size at which a room's table is thrown
+                away and started afresh.
+        """
+        self._max_members_per_room = max_members_per_room
+
+        self._rooms: LruCache[str, _RoomMembers] = LruCache(
+            max_size=max_rooms, cache_name="lazy_loaded_members_rooms"
+        )
+        self._clients: ExpiringCache[
+            LazyLoadedMembersKey, _ClientMembers
+        ] = ExpiringCache(
+            "lazy_loaded_members_cache",
+            clock,
+            max_len=0,
+            expiry_ms=expiry_ms,
+            reset_expiry_on_get=True,
+        )
+
+    def _get_room(self, room_id: str) -> _RoomMembers:
+        room = self._rooms.get(room_id)
+        if room is None or len(room.indices) >= self._max_members_per_room:
+            # Clients that have been sent events from the old table will send
+            # them again, as the generation won't match.
+            room = _RoomMembers()
+            self._rooms[room_id] = room
+        return room
+
+    def _get_client(self, key: LazyLoadedMembersKey) -> _ClientMembers:
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = _ClientMembers()
+        return client
+
+    def has_sent(self, key: LazyLoadedMembersKey, room_id: str, event_id: str) -> bool:
+        """Whether the given membership event has been sent to the client."""
+        client = self._clients.get(key)
+        if client is None or room_id not in client.rooms:
+            return False
+
+        room = self._rooms.get(room_id)
+        if room is None:
+            return False
+
+        generation, bits = client.rooms[room_id]
+        index = room.indices.get(event_id)
+        return (
+            generation == room.generation
+            and index is not None
+            and bool(bits & (1 << index))
+        )
+
+    def mark_sent(
+        self, key: LazyLoadedMembersKey, room_id: str, event_ids: Iterable[str]
+    ) -> None:
+        """Record that the given membership events have been sent to the client."""
+        client = self._get_client(key)
+        room = self._get_room(room_id)
+
+        generation, old_bits = client.rooms.get(room_id, (room.generation, 0))
+        if generation != room.generation:
+            old_bits = 0
+        bits = old_bits
+        for event_id in event_ids:
+            bits |= 1 << room.index_of(event_id)
+
+        if bits != old_bits:
+            if room_id not in client.rooms:
+                client.room_ids_changed = True
+            client.rooms[room_id] = (room.generation, bits)
+            client.changed_rooms.add(room_id)
+
+    def clear(self, key: LazyLoadedMembersKey) -> None:
+        """Forget the events sent to the client, e.g. because it has started
+        syncing afresh.
+        """
+        self._clients[key] = _ClientMembers(room_ids_changed=True)
+
+    def is_current(
+        self, key: LazyLoadedMembersKey, token: Optional["StreamToken"]
+    ) -> bool:
+        """Whether we know the events sent to the client up to the given token,
+        i.e. whether we handled the sync which returned that token.
+        """
+        client = self._clients.get(key)
+        return client is not None and token is not None and client.token == token
+
+    def set_token(self, key: LazyLoadedMembersKey, token: "StreamToken") -> None:
+        """Record that the events sent to the client are known up to the given
+        token.
+        """
+        self._get_client(key).token = token
+
+    def has_changed(self, key: LazyLoadedMembersKey) -> bool:
+        """Whether the events sent to the client have changed since they were
+        last exported.
+        """
+        client = self._clients.get(key)
+        return client is not None and (
+            client.room_ids_changed or bool(client.changed_rooms)
+        )
+
+    def export_changes(self, key: LazyLoadedMembersKey) -> LazyLoadedMembersChanges:
+        """Get the changes to the events sent to the client since they were last
+        exported.
+        """
+        client = self._clients.get(key)
+        if client is None:
+            return LazyLoadedMembersChanges(room_ids=None, rooms={})
+
+        room_ids = None
+        if client.room_ids_changed:
+            room_ids = list(client.rooms)
+
+        rooms = {}
+        for room_id in client.changed_rooms:
+            generation, bits = client.rooms[room_id]
+            room = self._rooms.get(room_id)
+            if room is None or room.generation != generation:
+                # We've forgotten which events these are. What was last exported
+                # for the room is still true, so leave it be.
+                continue
+            rooms[room_id] = [
+                event_id
+                for event_id, index in room.indices.items()
+                if bits & (1 << index)
+            ]
+
+        client.room_ids_changed = False
+        client.changed_rooms = set()
+        return LazyLoadedMembersChanges(room_ids=room_ids, rooms=rooms)
+
+    def load(self, key: LazyLoadedMembersKey, rooms: Dict[str, Any]) -> None:
+        """Replace the events sent to the client with those exported, given as a
+        map from room ID to event IDs.
+        """
+        client = self._clients[key] = _ClientMembers()
+        for room_id, event_ids in rooms.items():
+            self.mark_sent(key, room_id, event_ids)
+        client.room_ids_changed = False
+        client.changed_rooms = set()
+
+    def __len__(self) -> int:
+        return len(self._clients)
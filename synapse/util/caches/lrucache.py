@@ -46,14 +46,15 @@ from synapse.metrics.background_process_metrics import wrap_as_background_proces
 from synapse.metrics.jemalloc import get_jemalloc_stats
 from synapse.util import Clock, caches
 from synapse.util.caches import CacheMetric, EvictionReason, register_cache
+from synapse.util.caches.tinylfu import CountMinSketch
 from synapse.util.caches.treecache import (
     TreeCache,
     iterate_tree_cache_entry,
     iterate_tree_cache_items,
 )
-from synapse.util.linked_list import ListNode
 
 if TYPE_CHECKING:
+    from synapse.config.homeserver import HomeServerConfig
     from synapse.server import HomeServer
 
 logger = logging.getLogger(__name__)
@@ -93,16 +94,57 @@ VT = TypeVar("VT")
 # a general type var, distinct from either KT or VT
 T = TypeVar("T")
 
-P = TypeVar("P")
 
+class _ListRoot:
+    """The root of a circular doubly linked list of `_Node`s, ordered from most
+    to least recently used.
+
+    The list pointers are stored directly on the nodes, rather than in separate
+    list node objects, to keep the per-entry memory overhead down.
+    """
+
+    __slots__ = ["prev_node", "next_node"]
+
+    def __init__(self) -> None:
+        self.prev_node: Union[_ListRoot, _Node] = self
+        self.next_node: Union[_ListRoot, _Node] = self
+
+    def tail(self) -> "Optional[_Node]":
+        """Get the least recently used node in the list, if any."""
+        node = self.prev_node
+        if node is self:
+            return None
+        assert isinstance(node, _Node)
+        return node
+
+
+class _GlobalListRoot:
+    """The root of the global list of `_TimedNode`s, across all caches."""
+
+    __slots__ = ["global_prev_node", "global_next_node"]
+
+    def __init__(self) -> None:
+        self.global_prev_node: Union[_GlobalListRoot, _TimedNode] = self
+        self.global_next_node: Union[_GlobalListRoot, _TimedNode] = self
 
-class _TimedListNode(ListNode[P]):
-    """A `ListNode` that tracks last access time."""
 
-    __slots__ = ["last_access_ts_secs"]
+# The segments that a `_Node` can be in. Caches using the default LRU eviction
+# policy keep all their nodes in the "window"; see `_TinyLfuPolicy`.
+_SEGMENT_WINDOW = 0
+_SEGMENT_PROBATION = 1
+_SEGMENT_PROTECTED = 2
 
-    def update_last_access(self, clock: Clock) -> None:
-        self.last_access_ts_secs = int(clock.time())
+
+# Rough estimates, in bytes, of the memory used by a cache entry, used to
+# enforce `caches.global_max_memory`. The overhead covers the `_Node`, its list
+# nodes and its slot in the cache's dict.
+_NODE_MEMORY_OVERHEAD = 300
+# The default estimate of the size of a cached value (or of each item in it,
+# for caches with a `size_callback`).
+_DEFAULT_VALUE_MEMORY = 100
+
+# All named caches, which are subject to `caches.global_max_memory`.
+_MEMORY_BUDGET_CACHES: "weakref.WeakSet[LruCache]" = weakref.WeakSet()
 
 
 # Whether to insert new cache entries to the global list. We only add to it if
@@ -110,7 +152,24 @@ class _TimedListNode(ListNode[P]):
 USE_GLOBAL_LIST = False
 
 # A linked list of all cache entries, allowing efficient time based eviction.
-GLOBAL_ROOT = ListNode["_Node"].create_root_node()
+GLOBAL_ROOT = _GlobalListRoot()
+
+# A lock protecting the pointers of the global list, as (unlike the lists of
+# individual caches) it is shared between caches.
+_GLOBAL_LIST_LOCK = threading.Lock()
+
+# The last access time most recently given to a node, which we reuse when we
+# can so that nodes accessed within the same second share an int object.
+_last_access_ts_secs = 0
+
+
+def _get_last_access_ts_secs(clock: Clock) -> int:
+    global _last_access_ts_secs
+
+    now = int(clock.time())
+    if now != _last_access_ts_secs:
+        _last_access_ts_secs = now
+    return _last_access_ts_secs
 
 
 @wrap_as_background_process("LruCache._expire_old_entries")
@@ -126,8 +185,7 @@ async def _expire_old_entries(
         min_cache_ttl = autotune_config["min_cache_ttl"] / 1000
 
     now = int(clock.time())
-    node = GLOBAL_ROOT.prev_node
-    assert node is not None
+    node = GLOBAL_ROOT.global_prev_node
 
     i = 0
 
@@ -150,8 +208,8 @@ async def _expire_old_entries(
             )
 
     while node is not GLOBAL_ROOT:
-        # Only the root node isn't a `_TimedListNode`.
-        assert isinstance(node, _TimedListNode)
+        # Only the root node isn't a `_TimedNode`.
+        assert isinstance(node, _TimedNode)
 
         # if node has not aged past expiry_seconds and we are not evicting due to memory usage, there's
         # nothing to do here
@@ -165,15 +223,12 @@ async def _expire_old_entries(
         if evicting_due_to_memory and now - node.last_access_ts_secs < min_cache_ttl:
             break
 
-        cache_entry = node.get_cache_entry()
-        next_node = node.prev_node
+        next_node = node.global_prev_node
 
-        # The node should always have a reference to a cache entry and a valid
-        # `prev_node`, as we only drop them when we remove the node from the
-        # list.
+        # The node should always have a valid `global_prev_node`, as we only
+        # drop it when we remove the node from the list.
         assert next_node is not None
-        assert cache_entry is not None
-        cache_entry.drop_from_cache()
+        node.drop_from_cache()
 
         # Check mem allocation periodically if we are evicting a bunch of caches
         if jemalloc_interface and evicting_due_to_memory and (i + 1) % 100 == 0:
@@ -204,7 +259,7 @@ async def _expire_old_entries(
 
         # If we've yielded then our current node may have been evicted, so we
         # need to check that its still valid.
-        if node.prev_node is None:
+        if node.global_prev_node is None:
             break
 
         i += 1
@@ -239,32 +294,101 @@ def setup_expire_lru_cache_entries(hs: "HomeServer") -> None:
     )
 
 
+@wrap_as_background_process("LruCache._enforce_memory_budget")
+async def _enforce_memory_budget(config: "HomeServerConfig") -> None:
+    """Evicts entries from the caches if their (estimated) total memory usage
+    exceeds `caches.global_max_memory`.
+
+    We evict from the caches that get the fewest hits per byte first, since
+    those are the ones where the marginal cost of losing entries is lowest. No
+    cache gives up more than half of its memory in each round.
+    """
+    max_memory = config.caches.global_max_memory
+    if not max_memory:
+        return
+
+    scored_caches = []
+    total_memory = 0
+    for cache in list(_MEMORY_BUDGET_CACHES):
+        memory = cache.memory_usage()
+        total_memory += memory
+        if memory:
+            scored_caches.append((cache.take_recent_hits() / memory, cache))
+
+    excess = total_memory - max_memory
+    if excess <= 0:
+        return
+
+    logger.info(
+        "Caches are using an estimated %d bytes, evicting %d bytes",
+        total_memory,
+        excess,
+    )
+
+    scored_caches.sort(key=lambda scored: scored[0])
+    caches_to_evict = [cache for _, cache in scored_caches]
+    while excess > 0 and caches_to_evict:
+        remaining = []
+        for cache in caches_to_evict:
+            freed = cache.evict_memory(min(excess, cache.memory_usage() // 2 + 1))
+            excess -= freed
+            if freed:
+                remaining.append(cache)
+            if excess <= 0:
+                break
+
+        caches_to_evict = remaining
+
+
+def setup_cache_memory_budget(hs: "HomeServer") -> None:
+    """Start a background job that keeps the estimated memory usage of all
+    caches below `caches.global_max_memory`, if it is set.
+    """
+    if not hs.config.caches.global_max_memory:
+        return
+
+    logger.info(
+        "Limiting caches to an estimated %d bytes",
+        hs.config.caches.global_max_memory,
+    )
+
+    caches.USE_MEMORY_BUDGET = True
+
+    clock = hs.get_clock()
+    clock.looping_call(_enforce_memory_budget, 5 * 1000, hs.config)
+
+
 class _Node(Generic[KT, VT]):
+    """An entry in an `LruCache`.
+
+    Nodes are also the elements of the cache's linked list (or lists, if the
+    cache uses the TinyLFU policy), as with millions of cache entries the
+    overhead of separate list node objects adds up.
+    """
+
     __slots__ = [
-        "_list_node",
-        "_global_list_node",
+        "prev_node",
+        "next_node",
         "_cache",
         "key",
         "value",
         "callbacks",
         "memory",
+        "segment",
     ]
 
     def __init__(
         self,
-        root: "ListNode[_Node]",
+        root: _ListRoot,
         key: KT,
         value: VT,
         cache: "weakref.ReferenceType[LruCache[KT, VT]]",
         clock: Clock,
         callbacks: Collection[Callable[[], None]] = (),
-        prune_unread_entries: bool = True,
     ):
-        self._list_node = ListNode.insert_after(self, root)
-        self._global_list_node: Optional[_TimedListNode] = None
-        if USE_GLOBAL_LIST and prune_unread_entries:
-            self._global_list_node = _TimedListNode.insert_after(self, GLOBAL_ROOT)
-            self._global_list_node.update_last_access(clock)
+        self.prev_node: Union[_ListRoot, _Node, None] = None
+        self.next_node: Union[_ListRoot, _Node, None] = None
+        self._insert_after(root)
 
         # We store a weak reference to the cache object so that this _Node can
         # remove itself from the cache. If the cache is dropped we ensure we
@@ -274,6 +398,10 @@ class _Node(Generic[KT, VT]):
         self.key = key
         self.value = value
 
+        # The segment of the cache this node is in. Only caches using the
+        # TinyLFU eviction policy ever move nodes out of the window.
+        self.segment = _SEGMENT_WINDOW
+
         # Set of callbacks to run when the node gets deleted. We store as a list
         # rather than a set to keep memory usage down (and since we expect few
         # entries per node, the performance of checking for duplication in a
@@ -292,15 +420,44 @@ class _Node(Generic[KT, VT]):
             self.memory = (
                 _get_size_of(key)
                 + _get_size_of(value)
-                + _get_size_of(self._list_node, recurse=False)
                 + _get_size_of(self.callbacks, recurse=False)
                 + _get_size_of(self, recurse=False)
             )
             self.memory += _get_size_of(self.memory, recurse=False)
 
-            if self._global_list_node:
-                self.memory += _get_size_of(self._global_list_node, recurse=False)
-                self.memory += _get_size_of(self._global_list_node.last_access_ts_secs)
+    def _insert_after(self, node: Union[_ListRoot, "_Node"]) -> None:
+        """Insert this node into a cache list, after the given node."""
+        next_node = node.next_node
+        assert next_node is not None
+
+        self.prev_node = node
+        self.next_node = next_node
+        node.next_node = self
+        next_node.prev_node = self
+
+    def _remove_from_list(self) -> None:
+        """Remove this node from its cache list, if it is in one."""
+        prev_node = self.prev_node
+        next_node = self.next_node
+        if prev_node is None or next_node is None:
+            # We've already been removed from the list.
+            return
+
+        prev_node.next_node = next_node
+        next_node.prev_node = prev_node
+
+        # We set these to None so that we don't get circular references,
+        # allowing us to be dropped without having to go via the GC.
+        self.prev_node = None
+        self.next_node = None
+
+    def move_after(self, node: Union[_ListRoot, "_Node"]) -> None:
+        """Move this node to after the given node, which may be in a different
+        list (e.g. a different TinyLFU segment).
+        """
+        assert self is not node
+        self._remove_from_list()
+        self._insert_after(node)
 
     def add_callbacks(self, callbacks: Collection[Callable[[], None]]) -> None:
         """Add to stored list of callbacks, removing duplicates."""
@@ -345,17 +502,86 @@ class _Node(Generic[KT, VT]):
 
     def drop_from_lists(self) -> None:
         """Remove this node from the cache lists."""
-        self._list_node.remove_from_list()
+        self._remove_from_list()
 
-        if self._global_list_node:
-            self._global_list_node.remove_from_list()
+    def move_to_front(self, clock: Clock, cache_list_root: _ListRoot) -> None:
+        """Moves this node to the front of all the lists its in."""
+        self.move_after(cache_list_root)
+
+
+class _TimedNode(_Node[KT, VT]):
+    """A `_Node` which is also in the global list of all cache entries, and
+    tracks its last access time, so that it can be expired.
+    """
+
+    __slots__ = [
+        "global_prev_node",
+        "global_next_node",
+        "last_access_ts_secs",
+    ]
+
+    def __init__(
+        self,
+        root: _ListRoot,
+        key: KT,
+        value: VT,
+        cache: "weakref.ReferenceType[LruCache[KT, VT]]",
+        clock: Clock,
+        callbacks: Collection[Callable[[], None]] = (),
+    ):
+        self.global_prev_node: Union[_GlobalListRoot, _TimedNode, None] = None
+        self.global_next_node: Union[_GlobalListRoot, _TimedNode, None] = None
+        self.last_access_ts_secs = _get_last_access_ts_secs(clock)
+        with _GLOBAL_LIST_LOCK:
+            self._global_insert_at_front()
+
+        super().__init__(root, key, value, cache, clock, callbacks)
+
+    def _global_insert_at_front(self) -> None:
+        next_node = GLOBAL_ROOT.global_next_node
+        self.global_prev_node = GLOBAL_ROOT
+        self.global_next_node = next_node
+        GLOBAL_ROOT.global_next_node = self
+        next_node.global_prev_node = self
+
+    def _global_remove(self) -> None:
+        prev_node = self.global_prev_node
+        next_node = self.global_next_node
+        if prev_node is None or next_node is None:
+            return
+
+        prev_node.global_next_node = next_node
+        next_node.global_prev_node = prev_node
+        self.global_prev_node = None
+        self.global_next_node = None
+
+    def drop_from_lists(self) -> None:
+        """Remove this node from the cache lists and the global list."""
+        self._remove_from_list()
+        if self.global_prev_node is None:
+            # Already removed, e.g. by the expiry job.
+            return
+        with _GLOBAL_LIST_LOCK:
+            self._global_remove()
 
-    def move_to_front(self, clock: Clock, cache_list_root: ListNode) -> None:
+    def move_to_front(self, clock: Clock, cache_list_root: _ListRoot) -> None:
         """Moves this node to the front of all the lists its in."""
-        self._list_node.move_after(cache_list_root)
-        if self._global_list_node:
-            self._global_list_node.move_after(GLOBAL_ROOT)
-            self._global_list_node.update_last_access(clock)
+        self.move_after(cache_list_root)
+
+        # The global list only needs to be ordered by last access time, which
+        # has a resolution of a second, so there is no need to move (and take
+        # the lock) if the node has already been accessed this second.
+        last_access_ts_secs = _get_last_access_ts_secs(clock)
+        if last_access_ts_secs == self.last_access_ts_secs:
+            return
+        self.last_access_ts_secs = last_access_ts_secs
+
+        with _GLOBAL_LIST_LOCK:
+            # The node may have been concurrently expired, in which case we
+            # leave it out of the global list.
+            if self.global_prev_node is not None:
+                self._global_remove()
+                self._global_insert_at_front()
 
 
 class _Sentinel(Enum):
@@ -364,6 +590,154 @@ class _Sentinel(Enum):
     sentinel = object()
 
 
+class _TinyLfuPolicy:
+    """Implements the W-TinyLFU admission and eviction policy for an `LruCache`.
+
+    New entries are added to a small LRU "window". Entries that fall out of the
+    window become candidates for admission to the main space, which is a
+    segmented LRU made up of a "probation" and a "protected" segment. Entries
+    in probation are promoted to protected when they are accessed again.
+
+    When the cache is full, the most recent candidate is compared against the
+    least recently used entry in probation, and whichever has been accessed
+    less often (according to a `CountMinSketch`) is evicted. This means that a
+    burst of one-off accesses (e.g. a large backfill) cannot flush frequently
+    used entries out of the cache.
+
+    See https://arxiv.org/abs/1512.00727 for details.
+    """
+
+    def __init__(self, window_root: _ListRoot, max_size: int):
+        """
+        Args:
+            window_root: the root of the cache's list of nodes, which becomes
+                the window. All nodes in that list are moved into the main space.
+            max_size: the maximum size of the cache.
+        """
+        self._roots = (window_root, _ListRoot(), _ListRoot())
+
+        # The number of nodes in each segment.
+        self._lens = [0, 0, 0]
+
+        # The node most recently moved from the window into probation, if it
+        # hasn't been evicted or accessed since.
+        self._candidate: Optional[_Node] = None
+
+        self._sketch = CountMinSketch(max_size)
+        self.resize(max_size)
+
+        # Move the existing entries into probation, preserving their order.
+        entry = window_root.tail()
+        while entry is not None:
+            entry.segment = _SEGMENT_PROBATION
+            entry.move_after(self._roots[_SEGMENT_PROBATION])
+            self._lens[_SEGMENT_PROBATION] += 1
+            entry = window_root.tail()
+
+    def resize(self, max_size: int) -> None:
+        """Update the sizes of the segments for a new maximum cache size."""
+        self._window_max = max(1, max_size // 100)
+        self._protected_max = int((max_size - self._window_max) * 0.8)
+
+        if max_size != self._sketch.max_entries:
+            self._sketch = CountMinSketch(max_size)
+
+    def _tail(self, segment: int) -> "Optional[_Node]":
+        """Get the least recently used node in the given segment, if any."""
+        return self._roots[segment].tail()
+
+    def _move(self, node: "_Node", segment: int) -> None:
+        """Move the node to the front of a different segment."""
+        self._lens[node.segment] -= 1
+        self._lens[segment] += 1
+        node.segment = segment
+        node.move_after(self._roots[segment])
+
+    def record_miss(self, key: Any) -> None:
+        """Record a lookup of a key which is not in the cache."""
+        self._sketch.increment(key)
+
+    def on_add(self, node: "_Node") -> None:
+        """Called when a node has been added to the front of the window."""
+        self._sketch.increment(node.key)
+        self._lens[_SEGMENT_WINDOW] += 1
+
+        while self._lens[_SEGMENT_WINDOW] > self._window_max:
+            candidate = self._tail(_SEGMENT_WINDOW)
+            assert candidate is not None
+            self._move(candidate, _SEGMENT_PROBATION)
+            self._candidate = candidate
+
+    def on_access(self, node: "_Node", clock: Clock) -> None:
+        """Called when a node in the cache is accessed."""
+        self._sketch.increment(node.key)
+
+        if node.segment == _SEGMENT_PROBATION:
+            if node is self._candidate:
+                self._candidate = None
+
+            self._lens[_SEGMENT_PROBATION] -= 1
+            self._lens[_SEGMENT_PROTECTED] += 1
+            node.segment = _SEGMENT_PROTECTED
+
+        node.move_to_front(clock, self._roots[node.segment])
+
+        # Demote the least recently used protected entries if the promotion
+        # above made the protected segment too large.
+        while self._lens[_SEGMENT_PROTECTED] > self._protected_max:
+            demoted = self._tail(_SEGMENT_PROTECTED)
+            assert demoted is not None
+            self._move(demoted, _SEGMENT_PROBATION)
+
+    def on_remove(self, node: "_Node") -> None:
+        """Called when a node has been removed from the cache's lists."""
+        self._lens[node.segment] -= 1
+        if node is self._candidate:
+            self._candidate = None
+
+    def clear(self) -> None:
+        """Called when the cache has been cleared."""
+        self._lens = [0, 0, 0]
+        self._candidate = None
+
+    def select_victim(self) -> "_Node":
+        """Pick the node to evict next. Must only be called on a non-empty cache."""
+        victim = (
+            self._tail(_SEGMENT_PROBATION)
+            or self._tail(_SEGMENT_PROTECTED)
+            or self._tail(_SEGMENT_WINDOW)
+        )
+        assert victim is not None
+
+        candidate = self._candidate
+        self._candidate = None
+        if candidate is None or candidate is victim:
+            return victim
+
+        # Only admit the candidate if it is used more often than the entry it
+        # would replace. On a tie we keep the existing entry, so that a scan of
+        # previously unseen keys can't displace anything.
+        if self._sketch.estimate(candidate.key) > self._sketch.estimate(victim.key):
+            return victim
+        return candidate
+
+    def release(self) -> None:
+        """Move all nodes back into the window, behind the existing entries, so
+        that the cache can go back to being a plain LRU cache.
+        """
+        window_root = self._roots[_SEGMENT_WINDOW]
+        for segment in (_SEGMENT_PROTECTED, _SEGMENT_PROBATION):
+            root = self._roots[segment]
+            node: Union[_ListRoot, _Node, None] = root.next_node
+            while isinstance(node, _Node):
+                next_node = node.next_node
+                node.segment = _SEGMENT_WINDOW
+                node.move_after(window_root.prev_node)
+                node = next_node
+
+        self.clear()
+
+
 class LruCache(Generic[KT, VT]):
     """
     Least-recently-used cache, supporting prometheus metrics and invalidation callbacks.
@@ -381,6 +755,7 @@ class LruCache(Generic[KT, VT]):
         apply_cache_factor_from_config: bool = True,
         clock: Optional[Clock] = None,
         prune_unread_entries: bool = True,
+        memory_size_callback: Optional[Callable[[VT], int]] = None,
     ):
         """
         Args:
@@ -411,6 +786,11 @@ class LruCache(Generic[KT, VT]):
             prune_unread_entries: If True, cache entries that haven't been read recently
                 will be evicted from the cache in the background. Set to False to
                 opt-out of this behaviour.
+
+            memory_size_callback: A function which cheaply estimates the memory
+                used by a value, in bytes. Used to enforce `caches.global_max_memory`
+                for named caches. If unset, a fixed amount is assumed per value
+                (or per item in the value, if `size_callback` is given).
         """
         # Default `clock` to something sensible. Note that we rename it to
         # `real_clock` so that mypy doesn't think its still `Optional`.
@@ -437,12 +817,18 @@ class LruCache(Generic[KT, VT]):
         # do yet when we get resized.
         self._on_resize: Optional[Callable[[], None]] = None
 
+        # Likewise it might call our "set_eviction_policy" callback, in which case
+        # we record the policy and apply it once we're set up.
+        self.eviction_policy = cache_config.EVICTION_POLICY_LRU
+        self._on_set_eviction_policy: Optional[Callable[[str], None]] = None
+
         if cache_name is not None:
             metrics: Optional[CacheMetric] = register_cache(
                 "lru_cache",
                 cache_name,
                 self,
                 collect_callback=metrics_collection_callback,
+                eviction_policy_callback=self.set_eviction_policy,
             )
         else:
             metrics = None
@@ -450,33 +836,47 @@ class LruCache(Generic[KT, VT]):
         # this is exposed for access from outside this class
         self.metrics = metrics
 
+        # The number of hits on this cache when `take_recent_hits` was last called.
+        self._last_hits = 0
+
+        if metrics is not None:
+            _MEMORY_BUDGET_CACHES.add(self)
+
         # We create a single weakref to self here so that we don't need to keep
         # creating more each time we create a `_Node`.
         weak_ref_to_self = weakref.ref(self)
 
-        list_root = ListNode[_Node[KT, VT]].create_root_node()
+        list_root = _ListRoot()
+
+        # The TinyLFU policy in use, if any. If this is None then all the nodes are
+        # in `list_root`, in LRU order.
+        tinylfu: List[Optional[_TinyLfuPolicy]] = [None]
 
         lock = threading.Lock()
 
-        def evict() -> None:
-            while cache_len() > self.max_size:
+        def evict_one(reason: EvictionReason) -> _Node[KT, VT]:
+            """Evict the next entry that the eviction policy picks, which must
+            exist. Returns the evicted node.
+            """
+            policy = tinylfu[0]
+            if policy is not None:
+                node: Optional[_Node[KT, VT]] = policy.select_victim()
+            else:
                 # Get the last node in the list (i.e. the oldest node).
-                todelete = list_root.prev_node
+                node = list_root.tail()
 
-                # The list root should always have a valid `prev_node` if the
-                # cache is not empty.
-                assert todelete is not None
+            assert node is not None
 
-                # The node should always have a reference to a cache entry, as
-                # we only drop the cache entry when we remove the node from the
-                # list.
-                node = todelete.get_cache_entry()
-                assert node is not None
+            evicted_len = delete_node(node)
+            cache.pop(node.key, None)
+            if metrics:
+                metrics.inc_evictions(reason, evicted_len)
 
-                evicted_len = delete_node(node)
-                cache.pop(node.key, None)
-                if metrics:
-                    metrics.inc_evictions(EvictionReason.size, evicted_len)
+            return node
+
+        def evict() -> None:
+            while cache_len() > self.max_size:
+                evict_one(EvictionReason.size)
 
         def synchronized(f: FT) -> FT:
             @wraps(f)
@@ -499,32 +899,51 @@ class LruCache(Generic[KT, VT]):
 
         self.len = synchronized(cache_len)
 
+        def estimate_memory(value: VT) -> int:
+            if memory_size_callback is not None:
+                return _NODE_MEMORY_OVERHEAD + memory_size_callback(value)
+            if size_callback is not None:
+                return _NODE_MEMORY_OVERHEAD + _DEFAULT_VALUE_MEMORY * size_callback(
+                    value
+                )
+            return _NODE_MEMORY_OVERHEAD + _DEFAULT_VALUE_MEMORY
+
         def add_node(
             key: KT, value: VT, callbacks: Collection[Callable[[], None]] = ()
         ) -> None:
-            node: _Node[KT, VT] = _Node(
-                list_root,
-                key,
-                value,
-                weak_ref_to_self,
-                real_clock,
-                callbacks,
-                prune_unread_entries,
+            # Only nodes in the global list need to track their last access time.
+            node_type = (
+                _TimedNode if USE_GLOBAL_LIST and prune_unread_entries else _Node
+            )
+            node: _Node[KT, VT] = node_type(
+                list_root, key, value, weak_ref_to_self, real_clock, callbacks
             )
             cache[key] = node
 
+            if tinylfu[0] is not None:
+                tinylfu[0].on_add(node)
+
             if size_callback:
                 cached_cache_len[0] += size_callback(node.value)
 
-            if caches.TRACK_MEMORY_USAGE and metrics:
+            if metrics and not caches.TRACK_MEMORY_USAGE and caches.USE_MEMORY_BUDGET:
+                node.memory = estimate_memory(value)
+
+            if metrics and node.memory:
                 metrics.inc_memory_usage(node.memory)
 
         def move_node_to_front(node: _Node[KT, VT]) -> None:
-            node.move_to_front(real_clock, list_root)
+            if tinylfu[0] is not None:
+                tinylfu[0].on_access(node, real_clock)
+            else:
+                node.move_to_front(real_clock, list_root)
 
         def delete_node(node: _Node[KT, VT]) -> int:
             node.drop_from_lists()
 
+            if tinylfu[0] is not None:
+                tinylfu[0].on_remove(node)
+
             deleted_len = 1
             if size_callback:
                 deleted_len = size_callback(node.value)
@@ -532,7 +951,7 @@ class LruCache(Generic[KT, VT]):
 
             node.run_and_clear_callbacks()
 
-            if caches.TRACK_MEMORY_USAGE and metrics:
+            if metrics and node.memory:
                 metrics.dec_memory_usage(node.memory)
 
             return deleted_len
@@ -591,6 +1010,8 @@ class LruCache(Generic[KT, VT]):
             else:
                 if update_metrics and metrics:
                     metrics.inc_misses()
+                if update_last_access and tinylfu[0] is not None:
+                    tinylfu[0].record_miss(key)
                 return default
 
         @overload
@@ -672,6 +1093,17 @@ class LruCache(Generic[KT, VT]):
                     cached_cache_len[0] -= size_callback(node.value)
                     cached_cache_len[0] += size_callback(value)
 
+                if (
+                    metrics
+                    and not caches.TRACK_MEMORY_USAGE
+                    and caches.USE_MEMORY_BUDGET
+                ):
+                    new_memory = estimate_memory(value)
+                    if node.memory:
+                        metrics.dec_memory_usage(node.memory)
+                    metrics.inc_memory_usage(new_memory)
+                    node.memory = new_memory
+
                 node.add_callbacks(callbacks)
 
                 move_node_to_front(node)
@@ -743,15 +1175,54 @@ class LruCache(Generic[KT, VT]):
             if size_callback:
                 cached_cache_len[0] = 0
 
-            if caches.TRACK_MEMORY_USAGE and metrics:
+            if tinylfu[0] is not None:
+                tinylfu[0].clear()
+
+            if metrics:
                 metrics.clear_memory_usage()
 
         @synchronized
         def cache_contains(key: KT) -> bool:
             return key in cache
 
+        @synchronized
+        def cache_items() -> List[Tuple[KT, VT]]:
+            return [(node.key, node.value) for node in cache.values()]
+
+        @synchronized
+        def cache_evict_memory(target: int) -> int:
+            """Evict entries until at least `target` bytes (as estimated) have
+            been freed, or the cache is empty.
+
+            Returns:
+                The estimated number of bytes freed.
+            """
+            freed = 0
+            while freed < target and len(cache) > 0:
+                freed += evict_one(EvictionReason.memory).memory
+            return freed
+
+        @synchronized
+        def cache_resize() -> None:
+            if tinylfu[0] is not None:
+                tinylfu[0].resize(self.max_size)
+
+            evict()
+
+        @synchronized
+        def cache_set_eviction_policy(policy: str) -> None:
+            if policy == cache_config.EVICTION_POLICY_TINYLFU:
+                if tinylfu[0] is None:
+                    tinylfu[0] = _TinyLfuPolicy(list_root, self.max_size)
+            elif tinylfu[0] is not None:
+                tinylfu[0].release()
+                tinylfu[0] = None
+
         # make sure that we clear out any excess entries after we get resized.
-        self._on_resize = evict
+        self._on_resize = cache_resize
+
+        self._on_set_eviction_policy = cache_set_eviction_policy
+        cache_set_eviction_policy(self.eviction_policy)
 
         self.get = cache_get
         self.set = cache_set
@@ -765,7 +1236,9 @@ class LruCache(Generic[KT, VT]):
         self.invalidate = cache_del_multi
         self.len = synchronized(cache_len)
         self.contains = cache_contains
+        self.items = cache_items
         self.clear = cache_clear
+        self.evict_memory = cache_evict_memory
 
     def __getitem__(self, key: KT) -> VT:
         result = self.get(key, _Sentinel.sentinel)
@@ -804,6 +1277,37 @@ class LruCache(Generic[KT, VT]):
             if self._on_resize:
                 self._on_resize()
 
+    def memory_usage(self) -> int:
+        """Get the estimated memory usage of this cache, in bytes.
+
+        This is only tracked for named caches, and only if either
+        `caches.track_memory_usage` or `caches.global_max_memory` is set.
+        """
+        if self.metrics is None:
+            return 0
+        return self.metrics.memory_usage or 0
+
+    def take_recent_hits(self) -> int:
+        """Get the number of hits on this cache since this was last called."""
+        if self.metrics is None:
+            return 0
+
+        hits = self.metrics.hits
+        recent_hits = hits - self._last_hits
+        self._last_hits = hits
+        return recent_hits
+
+    def set_eviction_policy(self, policy: str) -> None:
+        """
+        Set the eviction policy for this individual cache.
+
+        Args:
+            policy: one of the `EVICTION_POLICY_*` constants in `synapse.config.cache`.
+        """
+        self.eviction_policy = policy
+        if self._on_set_eviction_policy:
+            self._on_set_eviction_policy(policy)
+
     def __del__(self) -> None:
         # We're about to be deleted, so we make sure to clear up all the nodes
         # and run callbacks, etc.
@@ -838,6 +1342,18 @@ class AsyncLruCache(Generic[KT, VT]):
         # This method should fetch from any configured external cache, in this case noop.
         return None
 
+    async def get_external_many(
+        self, keys: Collection[KT], update_metrics: bool = True
+    ) -> Dict[KT, VT]:
+        """Fetch multiple keys from any configured external cache, with as few
+        round trips as possible.
+
+        Returns:
+            A map from key to value, for the keys that were found.
+        """
+        # This method should fetch from any configured external cache, in this case noop.
+        return {}
+
     def get_local(
         self, key: KT, default: Optional[T] = None, update_metrics: bool = True
     ) -> Optional[VT]:
@@ -864,5 +1380,9 @@ class AsyncLruCache(Generic[KT, VT]):
     async def contains(self, key: KT) -> bool:
         return self._lru_cache.contains(key)
 
+    def local_items(self) -> List[Tuple[KT, VT]]:
+        """Get the keys and values of all the entries in the local cache."""
+        return self._lru_cache.items()
+
     async def clear(self) -> None:
         self._lru_cache.clear()
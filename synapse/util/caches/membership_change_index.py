@@ -0,0 +1,139 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import attr
+from sortedcontainers import SortedList
+
+from synapse.util import caches
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class MembershipChange:
+    """A change to a user's membership of a room."""
+
+    stream_ordering: int
+    # The event persister which persisted the membership event.
+    instance_name: str
+    event_id: str
+    room_id: str
+    membership: str
+
+
+class MembershipChangeIndex:
+    """Keeps the recent membership changes of each user, so that the changes
+    since a stream position can be found without querying the database.
+
+    Only tracks up to a maximum number of changes. As with `StreamChangeCache`,
+    any position earlier than the earliest known stream position must be treated
+    as unknown.
+    """
+
+    def __init__(self, name: str, current_stream_pos: int, max_size: int = 100000):
+        self._original_max_size = max_size
+        self._max_size = math.floor(max_size)
+
+        # The earliest stream position for which we know about all later changes.
+        self._earliest_known_stream_pos = current_stream_pos
+
+        # Map from user ID to their changes, in stream order.
+        self._changes_by_user: Dict[str, List[MembershipChange]] = {}
+
+        # All the changes, as (stream ordering, user ID), so that we can evict the
+        # oldest.
+        self._changes: "SortedList[Tuple[int, str]]" = SortedList()
+
+        self.name = name
+        self.metrics = caches.register_cache(
+            "cache", self.name, self, resize_callback=self.set_cache_factor
+        )
+
+    def __len__(self) -> int:
+        """The number of changes in the index."""
+        return len(self._changes)
+
+    def set_cache_factor(self, factor: float) -> bool:
+        """
+        Set the cache factor for this individual cache.
+
+        Returns:
+            Whether the cache changed size or not.
+        """
+        new_size = math.floor(self._original_max_size * factor)
+        if new_size != self._max_size:
+            self._max_size = new_size
+            self._evict()
+            return True
+        return False
+
+    def get_changes(
+        self, user_id: str, stream_pos: int
+    ) -> Optional[List[MembershipChange]]:
+        """Get the user's membership changes after the given stream position, in
+        stream order.
+
+        Returns:
+            The changes, or None if the stream position is too old for the index
+            to know about all of them.
+        """
+        if stream_pos < self._earliest_known_stream_pos:
+            self.metrics.inc_misses()
+            return None
+
+        self.metrics.inc_hits()
+
+        changes = self._changes_by_user.get(user_id)
+        if not changes:
+            return []
+
+        index = len(changes)
+        while index > 0 and changes[index - 1].stream_ordering > stream_pos:
+            index -= 1
+        return changes[index:]
+
+    def record_change(self, user_id: str, change: MembershipChange) -> None:
+        """Informs the index of a change to the user's membership."""
+        # For a change before the index is valid there's nothing to do.
+        if change.stream_ordering <= self._earliest_known_stream_pos:
+            return
+
+        changes = self._changes_by_user.setdefault(user_id, [])
+
+        # Changes almost always arrive in order.
+        index = len(changes)
+        while index > 0 and changes[index - 1].stream_ordering > change.stream_ordering:
+            index -= 1
+        if index > 0 and changes[index - 1].stream_ordering == change.stream_ordering:
+            # We've already seen this change.
+            return
+        changes.insert(index, change)
+
+        self._changes.add((change.stream_ordering, user_id))
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._changes) > self._max_size:
+            stream_pos, user_id = self._changes.pop(0)
+
+            changes = self._changes_by_user[user_id]
+            changes.pop(0)
+            if not changes:
+                del self._changes_by_user[user_id]
+
+            self._earliest_known_stream_pos = max(
+                stream_pos, self._earliest_known_stream_pos
+            )
+            self.metrics.inc_evictions(caches.EvictionReason.size)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
+import sys
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -21,6 +22,7 @@ from typing import (
     Generic,
     Iterable,
     Optional,
+    Tuple,
     TypeVar,
 )
 
@@ -28,21 +30,28 @@ import attr
 
 from twisted.internet import defer
 
-from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.logging.context import (
+    PreserveLoggingContext,
+    make_deferred_yieldable,
+    run_in_background,
+)
 from synapse.logging.opentracing import (
     active_span,
     start_active_span,
     start_active_span_follows_from,
 )
-from synapse.util import Clock
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.util import Clock, json_encoder
 from synapse.util.async_helpers import AbstractObservableDeferred, ObservableDeferred
-from synapse.util.caches import register_cache
+from synapse.util.caches import EvictionReason, register_cache
 
 logger = logging.getLogger(__name__)
 
 if TYPE_CHECKING:
     import opentracing
 
+    from synapse.config.cache import CacheConfig
+
 # the type of the key in the cache
 KV = TypeVar("KV")
 
@@ -50,6 +59,13 @@ KV = TypeVar("KV")
 RV = TypeVar("RV")
 
 
+def _estimate_memory(result: Any) -> int:
+    try:
+        return len(json_encoder.encode(result))
+    except TypeError:
+        return sys.getsizeof(result)
+
+
 @attr.s(auto_attribs=True)
 class ResponseCacheContext(Generic[KV]):
     """Information about a missed ResponseCache hit
@@ -85,6 +101,19 @@ class ResponseCacheEntry:
     opentracing_span_context: "Optional[opentracing.SpanContext]"
     """The opentracing span which generated/is generating the result"""
 
+    completed: bool = False
+    """Whether the operation has completed (successfully or otherwise)."""
+
+    stale_at_ms: Optional[int] = None
+    """If the cache serves stale results, the time at which the (completed)
+    result goes stale and should be recalculated."""
+
+    refresh: "Optional[ResponseCacheEntry]" = None
+    """The entry for the recalculation of this (stale) result, if in progress."""
+
+    memory: int = 0
+    """The estimated memory used by the (completed) result, in bytes."""
+
 
 class ResponseCache(Generic[KV]):
     """
@@ -92,17 +121,86 @@ class ResponseCache(Generic[KV]):
     returned from the cache. This means that if the client retries the request
     while the response is still being computed, that original response will be
     used rather than trying to compute a new response.
+
+    If `stale_timeout_ms` is set, completed responses are kept for that much
+    longer after `timeout_ms` has elapsed. During that time they are still
+    returned from the cache, but the first such request also starts
+    recalculating the response in the background, which replaces the stale one
+    once complete ("stale-while-revalidate").
     """
 
-    def __init__(self, clock: Clock, name: str, timeout_ms: float = 0):
+    def __init__(
+        self,
+        clock: Clock,
+        name: str,
+        timeout_ms: float = 0,
+        stale_timeout_ms: float = 0,
+        max_entries: Optional[int] = None,
+        max_memory_bytes: Optional[int] = None,
+        memory_size_callback: Optional[Callable[[Any], int]] = None,
+    ):
+        """
+        Args:
+            clock
+            name: The name of the cache, for metrics and logging.
+            timeout_ms: How long to keep completed responses for.
+            stale_timeout_ms: How long to keep serving completed responses for
+                after `timeout_ms` has elapsed, while they are recalculated.
+            max_entries: The maximum number of responses to keep. The oldest
+                completed responses are evicted first. Responses which are still
+                being calculated are never evicted.
+            max_memory_bytes: An (estimated) limit on the memory used by the
+                completed responses.
+            memory_size_callback: A function which estimates the memory used by
+                a response, in bytes. Defaults to the length of its JSON
+                encoding. Only used if `max_memory_bytes` is set.
+        """
         self._result_cache: Dict[KV, ResponseCacheEntry] = {}
 
         self.clock = clock
         self.timeout_sec = timeout_ms / 1000.0
+        self.stale_timeout_sec = stale_timeout_ms / 1000.0
+
+        self._max_entries = max_entries
+        self._max_memory_bytes = max_memory_bytes
+        self._memory_size_callback = memory_size_callback or _estimate_memory
+        self._memory_usage = 0
 
         self._name = name
         self._metrics = register_cache("response_cache", name, self, resizable=False)
 
+    @classmethod
+    def from_config(
+        cls,
+        config: "CacheConfig",
+        clock: Clock,
+        name: str,
+        timeout_ms: float = 0,
+        memory_size_callback: Optional[Callable[[Any], int]] = None,
+    ) -> "ResponseCache[KV]":
+        """Create a cache using the settings configured for it in
+        `caches.response_caches`, if any.
+
+        Args:
+            config: The cache config.
+            clock
+            name: The name of the cache.
+            timeout_ms: The timeout to use if one isn't configured.
+            memory_size_callback: See `__init__`.
+        """
+        settings = config.get_response_cache_settings(name)
+        return cls(
+            clock,
+            name,
+            timeout_ms=timeout_ms
+            if settings.timeout_ms is None
+            else settings.timeout_ms,
+            stale_timeout_ms=settings.stale_timeout_ms,
+            max_entries=settings.max_entries,
+            max_memory_bytes=settings.max_memory_bytes,
+            memory_size_callback=memory_size_callback,
+        )
+
     def size(self) -> int:
         return len(self._result_cache)
 
@@ -142,6 +240,7 @@ class ResponseCache(Generic[KV]):
         context: ResponseCacheContext[KV],
         deferred: "defer.Deferred[RV]",
         opentracing_span_context: "Optional[opentracing.SpanContext]",
+        refreshing: Optional[ResponseCacheEntry] = None,
     ) -> ResponseCacheEntry:
         """Set the entry for the given key to the given deferred.
 
@@ -153,6 +252,8 @@ class ResponseCache(Generic[KV]):
             context: Information about the cache miss
             deferred: The deferred which resolves to the result.
             opentracing_span_context: An opentracing span wrapping the calculation
+            refreshing: if set, the stale entry which the result will replace once
+                complete. Until then the entry is not added to the cache.
 
         Returns:
             The cache entry object.
@@ -160,17 +261,59 @@ class ResponseCache(Generic[KV]):
         result = ObservableDeferred(deferred, consumeErrors=True)
         key = context.cache_key
         entry = ResponseCacheEntry(result, opentracing_span_context)
-        self._result_cache[key] = entry
+        if refreshing is None:
+            self._result_cache[key] = entry
+        else:
+            refreshing.refresh = entry
 
         def on_complete(r: RV) -> RV:
+            entry.completed = True
+
+            current_entry = self._result_cache.get(key)
+            if current_entry is not entry:
+                if current_entry is None or current_entry.refresh is not entry:
+                    # We've been removed from the cache (e.g. by `unset`) in the
+                    # meantime.
+                    return r
+
+                # We're a recalculation of the stale result in the cache, which
+                # we replace, unless the recalculation failed.
+                current_entry.refresh = None
+                if not result.has_succeeded():
+                    logger.warning(
+                        "[%s]: failed to recalculate stale result for [%s]: %s",
+                        self._name,
+                        key,
+                        result.get_result(),
+                    )
+                    return r
+                if not context.should_cache:
+                    return r
+
+                self._remove(key, current_entry)
+                self._result_cache[key] = entry
+
             # if this cache has a non-zero timeout, and the callback has not cleared
             # the should_cache bit, we leave it in the cache for now and schedule
             # its removal later.
             if self.timeout_sec and context.should_cache:
-                self.clock.call_later(self.timeout_sec, self.unset, key)
+                timeout_sec = self.timeout_sec
+                if result.has_succeeded():
+                    if self.stale_timeout_sec:
+                        entry.stale_at_ms = self.clock.time_msec() + int(
+                            self.timeout_sec * 1000
+                        )
+                        timeout_sec += self.stale_timeout_sec
+
+                    if self._max_memory_bytes is not None:
+                        entry.memory = self._memory_size_callback(r)
+                        self._memory_usage += entry.memory
+
+                self.clock.call_later(timeout_sec, self._expire, key, entry)
+                self._evict()
             else:
                 # otherwise, remove the result immediately.
-                self.unset(key)
+                self._remove(key, entry)
             return r
 
         # make sure we do this *after* adding the entry to result_cache,
@@ -185,7 +328,111 @@ class ResponseCache(Generic[KV]):
         Args:
             key: key used to remove the cached value
         """
-        self._result_cache.pop(key, None)
+        entry = self._result_cache.pop(key, None)
+        if entry is not None:
+            self._memory_usage -= entry.memory
+
+    def _remove(self, key: KV, entry: ResponseCacheEntry) -> None:
+        """Remove the given entry from the cache, if it is still there."""
+        if self._result_cache.get(key) is entry:
+            self.unset(key)
+
+    def _expire(self, key: KV, entry: ResponseCacheEntry) -> None:
+        if self._result_cache.get(key) is not entry:
+            return
+
+        self.unset(key)
+        self._metrics.inc_evictions(EvictionReason.time)
+
+        if entry.refresh is not None:
+            # The result is being recalculated, so we use that for any new
+            # requests rather than starting another calculation.
+            self._result_cache[key] = entry.refresh
+
+    def _is_full(self) -> bool:
+        return (
+            self._max_entries is not None
+            and len(self._result_cache) > self._max_entries
+        ) or (
+            self._max_memory_bytes is not None
+            and self._memory_usage > self._max_memory_bytes
+        )
+
+    def _evict(self) -> None:
+        """Evict the oldest completed results until the cache is within its
+        limits.
+        """
+        if not self._is_full():
+            return
+
+        # Dicts are ordered by insertion, so this iterates oldest first.
+        for key, entry in list(self._result_cache.items()):
+            if not self._is_full():
+                break
+
+            if entry.completed:
+                self.unset(key)
+                self._metrics.inc_evictions(EvictionReason.size)
+
+    def _calculate(
+        self,
+        key: KV,
+        callback: Callable[..., Awaitable[RV]],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        cache_context: bool,
+        refreshing: Optional[ResponseCacheEntry] = None,
+    ) -> ResponseCacheEntry:
+        """Start calculating the result for the given key, and add it to the
+        cache.
+
+        Args:
+            key: key to set in the cache
+            callback: function to call to calculate the result
+            args: positional parameters to pass to the callback
+            kwargs: named parameters to pass to the callback
+            cache_context: whether to pass a ResponseCacheContext to the callback
+            refreshing: if set, the stale entry which this calculation will
+                replace once complete.
+
+        Returns:
+            The cache entry object.
+        """
+        context = ResponseCacheContext(cache_key=key)
+        if cache_context:
+            kwargs = {**kwargs, "cache_context": context}
+
+        span_context: Optional[opentracing.SpanContext] = None
+
+        async def cb() -> RV:
+            # NB it is important that we do not `await` before setting span_context!
+            nonlocal span_context
+            with start_active_span(f"ResponseCache[{self._name}].calculate"):
+                span = active_span()
+                if span:
+                    span_context = span.context
+                return await callback(*args, **kwargs)
+
+        if refreshing is None:
+            d = run_in_background(cb)
+        else:
+            # The recalculation isn't tied to the request that triggered it, so we
+            # run it as a background process, passing its result on to `d` (in
+            # the sentinel logcontext).
+            d = defer.Deferred()
+
+            async def refresh() -> None:
+                try:
+                    r = await cb()
+                except Exception:
+                    with PreserveLoggingContext():
+                        d.errback()
+                else:
+                    with PreserveLoggingContext():
+                        d.callback(r)
+
+            run_as_background_process(f"ResponseCache[{self._name}].refresh", refresh)
+        return self._set(context, d, span_context, refreshing)
 
     async def wrap(
         self,
@@ -236,25 +483,21 @@ class ResponseCache(Generic[KV]):
             logger.debug(
                 "[%s]: no cached result for [%s], calculating new one", self._name, key
             )
-            context = ResponseCacheContext(cache_key=key)
-            if cache_context:
-                kwargs["cache_context"] = context
-
-            span_context: Optional[opentracing.SpanContext] = None
-
-            async def cb() -> RV:
-                # NB it is important that we do not `await` before setting span_context!
-                nonlocal span_context
-                with start_active_span(f"ResponseCache[{self._name}].calculate"):
-                    span = active_span()
-                    if span:
-                        span_context = span.context
-                    return await callback(*args, **kwargs)
-
-            d = run_in_background(cb)
-            entry = self._set(context, d, span_context)
+            entry = self._calculate(key, callback, args, kwargs, cache_context)
             return await make_deferred_yieldable(entry.result.observe())
 
+        if (
+            entry.stale_at_ms is not None
+            and entry.refresh is None
+            and self.clock.time_msec() >= entry.stale_at_ms
+        ):
+            logger.info(
+                "[%s]: cached result for [%s] is stale, recalculating", self._name, key
+            )
+            self._calculate(
+                key, callback, args, kwargs, cache_context, refreshing=entry
+            )
+
         result = entry.result.observe()
         if result.called:
             logger.info("[%s]: using completed cached result for [%s]", self._name, key)
@@ -0,0 +1,246 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache stored in a memory-mapped file, which can be shared between all the
+Synapse processes running on the same host.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from synapse.util.caches import EvictionReason, register_cache
+
+logger = logging.getLogger(__name__)
+
+# The header of the file: magic, number of slots, slot size and the number of
+# occupied slots.
+_HEADER = struct.Struct("<8sIIQ")
+_MAGIC = b"SYNSHM01"
+
+_COUNT_OFFSET = 16
+_COUNT = struct.Struct("<Q")
+
+# The header of each slot: a version number (which is odd while the slot is
+# being written, and bumped whenever the slot is changed or invalidated), and
+# the lengths of the key and value.
+_SLOT_HEADER = struct.Struct("<IHI")
+_VERSION = struct.Struct("<I")
+_VERSION_MASK = 0xFFFFFFFF
+
+
+class SharedMemoryCache:
+    """A fixed size cache of string keys to bytes, backed by a memory-mapped file.
+
+    The file is divided into equally sized slots, and each key is stored in the
+    slot given by the (process independent) hash of the key, replacing whatever
+    was there before. Values that don't fit in a slot are not cached.
+
+    Writes are serialised between processes with a file lock. Reads don't take
+    the lock: instead each slot has a version number which is bumped before and
+    after it is written, and reads that see the version change are treated as
+    misses.
+
+    To avoid racing with invalidations (i.e. caching a value read from the
+    database before an invalidation, after the invalidation happened) callers
+    must call `get_version` before fetching a value from the source of truth,
+    and pass the version when adding the value to the cache. The value is only
+    added if its slot hasn't been invalidated (or otherwise changed) since.
+    """
+
+    def __init__(self, name: str, path: str, size: int, slot_size: int = 4096):
+        """
+        Args:
+            name: the name of the cache, for metrics.
+            path: the path to the file to use. All processes using the same
+                file share the cache.
+            size: the size of the file, in bytes.
+            slot_size: the size of each slot, in bytes. Entries larger than
+                this (less the slot header) are not cached.
+        """
+        self._name = name
+        self._slot_size = slot_size
+        self.max_size = max(1, (size - _HEADER.size) // slot_size)
+        self._size = _HEADER.size + self.max_size * slot_size
+
+        # fcntl locks are held by the process, so we also need a lock to
+        # serialise writes from different threads.
+        self._lock = threading.Lock()
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self._locked():
+                self._attach(path)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self._metrics = register_cache("shared_memory", name, self, resizable=False)
+
+    def _attach(self, path: str) -> None:
+        """Map the file, initialising it if it is new.
+
+        Raises:
+            ValueError: if the file is in use with different settings.
+        """
+        file_size = os.fstat(self._fd).st_size
+        if file_size == 0:
+            # Extending the file fills it with zeroes, i.e. empty slots.
+            logger.info("Initialising shared cache %s at %s", self._name, path)
+            os.ftruncate(self._fd, self._size)
+        elif file_size != self._size:
+            # We mustn't resize the file, as any other processes using it would
+            # crash when accessing the pages beyond its new end.
+            raise ValueError(
+                "Shared cache file %s has size %d, expected %d"
+                % (path, file_size, self._size)
+            )
+
+        self._mmap = mmap.mmap(self._fd, self._size)
+
+        magic, max_size, slot_size, _ = _HEADER.unpack_from(self._mmap)
+        if magic == bytes(len(_MAGIC)):
+            # The file is new, or whoever created it didn't get as far as
+            # writing the header.
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, self.max_size, self._slot_size, 0)
+        elif (magic, max_size, slot_size) != (_MAGIC, self.max_size, self._slot_size):
+            self._mmap.close()
+            raise ValueError(
+                "Shared cache file %s was created with different settings" % (path,)
+            )
+
+    def __len__(self) -> int:
+        if self._mmap.closed:
+            # The cache stays registered for metrics after it has been closed.
+            return 0
+        return _COUNT.unpack_from(self._mmap, _COUNT_OFFSET)[0]
+
+    def close(self) -> None:
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _slot_offset(self, key: bytes) -> int:
+        # We can't use `hash(...)` as it differs between processes.
+        return _HEADER.size + (zlib.crc32(key) % self.max_size) * self._slot_size
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Take an exclusive lock on the file, against both other processes and
+        other threads in this process.
+        """
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key: str, update_metrics: bool = True) -> Optional[bytes]:
+        """Look up the given key, returning None if it is not in the cache."""
+        encoded_key = key.encode("utf-8")
+        offset = self._slot_offset(encoded_key)
+
+        version, key_len, value_len = _SLOT_HEADER.unpack_from(self._mmap, offset)
+        value = None
+        if version & 1 == 0 and key_len == len(encoded_key):
+            start = offset + _SLOT_HEADER.size
+            if self._read_key(offset, key_len) == encoded_key:
+                value = self._mmap[start + key_len : start + key_len + value_len]
+
+                # Check the slot wasn't modified while we were reading it.
+                if _VERSION.unpack_from(self._mmap, offset)[0] != version:
+                    value = None
+
+        if update_metrics:
+            if value is None:
+                self._metrics.inc_misses()
+            else:
+                self._metrics.inc_hits()
+
+        return value
+
+    def get_version(self, key: str) -> int:
+        """Get the current version of the slot for the given key, to pass to
+        `set`.
+        """
+        offset = self._slot_offset(key.encode("utf-8"))
+        return _VERSION.unpack_from(self._mmap, offset)[0]
+
+    def set(self, key: str, value: bytes, version: int) -> None:
+        """Add the given value to the cache, replacing any entry in its slot.
+
+        Args:
+            key: the key to store the value under.
+            value: the value to store.
+            version: the result of `get_version` from before the value was
+                fetched. If the slot has changed since then the value is not
+                stored, as the value may have been invalidated.
+        """
+        encoded_key = key.encode("utf-8")
+        if _SLOT_HEADER.size + len(encoded_key) + len(value) > self._slot_size:
+            return
+
+        offset = self._slot_offset(encoded_key)
+        with self._locked():
+            current_version, key_len, _ = _SLOT_HEADER.unpack_from(self._mmap, offset)
+            if current_version != version:
+                return
+
+            if not key_len:
+                self._add_to_count(1)
+            elif self._read_key(offset, key_len) != encoded_key:
+                self._metrics.inc_evictions(EvictionReason.size)
+
+            _VERSION.pack_into(self._mmap, offset, (version + 1) & _VERSION_MASK)
+            start = offset + _SLOT_HEADER.size
+            self._mmap[start : start + len(encoded_key)] = encoded_key
+            start += len(encoded_key)
+            self._mmap[start : start + len(value)] = value
+            _SLOT_HEADER.pack_into(
+                self._mmap,
+                offset,
+                (version + 2) & _VERSION_MASK,
+                len(encoded_key),
+                len(value),
+            )
+
+    def invalidate(self, key: str) -> None:
+        """Remove the given key from the cache, if present."""
+        encoded_key = key.encode("utf-8")
+        offset = self._slot_offset(encoded_key)
+        with self._locked():
+            version, key_len, value_len = _SLOT_HEADER.unpack_from(self._mmap, offset)
+            if key_len and self._read_key(offset, key_len) == encoded_key:
+                self._add_to_count(-1)
+                self._metrics.inc_evictions(EvictionReason.invalidation)
+                key_len = value_len = 0
+
+            # We bump the version even if the key isn't in the cache, as a
+            # concurrent `set` may be about to add it.
+            _SLOT_HEADER.pack_into(
+                self._mmap, offset, (version + 2) & _VERSION_MASK, key_len, value_len
+            )
+
+    def _read_key(self, offset: int, key_len: int) -> bytes:
+        start = offset + _SLOT_HEADER.size
+        return self._mmap[start : start + key_len]
+
+    def _add_to_count(self, delta: int) -> None:
+        _COUNT.pack_into(self._mmap, _COUNT_OFFSET, len(self) + delta)
@@ -14,10 +14,23 @@
 
 import logging
 import math
-from typing import Collection, Dict, FrozenSet, List, Mapping, Optional, Set, Union
+from array import array
+from bisect import bisect_left, bisect_right
+from sys import intern
+from typing import (
+    Collection,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import attr
-from sortedcontainers import SortedDict
+from prometheus_client import Counter
 
 from synapse.util import caches
 
@@ -26,6 +39,24 @@ logger = logging.getLogger(__name__)
 # for now, assume all entities in the cache are strings
 EntityType = str
 
+fallback_counter = Counter(
+    "synapse_util_caches_stream_change_cache_fallback",
+    "The number of queries for stream positions too old for the cache to answer, "
+    "which the caller then has to answer from the database",
+    ["name"],
+)
+
+# Queries are grouped into windows of this many, at the end of each of which we
+# decide whether to resize the cache.
+_RESIZE_WINDOW = 1000
+
+# The cache grows if more than this fraction of the queries in a window were for
+# stream positions it couldn't answer.
+_GROW_THRESHOLD = 0.01
+
+# The cache never grows beyond this multiple of its configured size.
+_MAX_GROWTH_FACTOR = 8
+
 
 @attr.s(auto_attribs=True, frozen=True, slots=True)
 class AllEntitiesChangedResult:
@@ -62,6 +93,11 @@ class StreamChangeCache:
 
     Only tracks to a maximum cache size, any position earlier than the earliest
     known stream position must be treated as unknown.
+
+    The maximum size adapts to how the cache is used: if queries regularly ask
+    about stream positions that have already been evicted, it grows (up to
+    `_MAX_GROWTH_FACTOR` times the configured size), and if none do and the older
+    half of the cache is never used, it shrinks back towards the configured size.
     """
 
     def __init__(
@@ -72,30 +108,62 @@ class StreamChangeCache:
         prefilled_cache: Optional[Mapping[EntityType, int]] = None,
     ) -> None:
         self._original_max_size: int = max_size
-        self._max_size = math.floor(max_size)
+        # The configured size of the cache, i.e. the smallest it shrinks to...
+        self._configured_max_size = math.floor(max_size)
+        # ... and its current size, which adapts between that and
+        # `_MAX_GROWTH_FACTOR` times it.
+        self._max_size = self._configured_max_size
+
+        # The changes in the cache, as the stream positions of the changes (in
+        # ascending order) and the entities that changed at each of them. An
+        # entity is replaced with None when it changes again, as only its latest
+        # change is tracked.
+        #
+        # Only the entries from `_start` onwards are valid: rather than shifting
+        # the arrays every time we evict their oldest entries, we compact them
+        # once enough of them are no longer needed.
+        self._positions = array("q")
+        self._entities: List[Optional[EntityType]] = []
+        self._start = 0
+        # The number of valid entries which have been replaced with None.
+        self._superseded = 0
 
-        # map from stream id to the set of entities which changed at that stream id.
-        self._cache: SortedDict[int, Set[EntityType]] = SortedDict()
         # map from entity to the stream ID of the latest change for that entity.
         #
-        # Must be kept in sync with _cache.
+        # Must be kept in sync with _positions and _entities.
         self._entity_to_key: Dict[EntityType, int] = {}
 
         # the earliest stream_pos for which we can reliably answer
         # get_all_entities_changed. In other words, one less than the earliest
-        # stream_pos for which we know _cache is valid.
+        # stream_pos for which we know the cache is valid.
         #
         self._earliest_known_stream_pos = current_stream_pos
 
+        # Statistics about the queries in the current resize window: the number
+        # of queries, how many of them we couldn't answer, and the oldest stream
+        # position queried.
+        self._window_queries = 0
+        self._window_fallbacks = 0
+        self._window_oldest_query: Optional[int] = None
+
         self.name = name
         self.metrics = caches.register_cache(
-            "cache", self.name, self._cache, resize_callback=self.set_cache_factor
+            "cache", self.name, self, resize_callback=self.set_cache_factor
         )
+        self._fallback_counter = fallback_counter.labels(name)
 
         if prefilled_cache:
             for entity, stream_pos in prefilled_cache.items():
                 self.entity_has_changed(entity, stream_pos)
 
+    def __len__(self) -> int:
+        """The number of entities in the cache."""
+        return len(self._entity_to_key)
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
     def set_cache_factor(self, factor: float) -> bool:
         """
         Set the cache factor for this individual cache.
@@ -107,12 +175,67 @@ class StreamChangeCache:
             Whether the cache changed size or not.
         """
         new_size = math.floor(self._original_max_size * factor)
-        if new_size != self._max_size:
-            self.max_size = new_size
+        if new_size != self._configured_max_size:
+            # Keep as much of any growth as the new size allows.
+            growth = self._max_size / max(self._configured_max_size, 1)
+            self._configured_max_size = new_size
+            self._max_size = math.floor(new_size * growth)
             self._evict()
             return True
         return False
 
+    def _record_query(self, stream_pos: int) -> bool:
+        """Record that the cache was queried for changes after the given stream
+        position, resizing the cache if necessary.
+
+        Returns:
+            True if the cache can answer the query, or False if the position is
+            at or before the earliest known stream position.
+        """
+        known = stream_pos > self._earliest_known_stream_pos
+        if not known:
+            self._window_fallbacks += 1
+            self._fallback_counter.inc()
+
+        if self._window_oldest_query is None or stream_pos < self._window_oldest_query:
+            self._window_oldest_query = stream_pos
+
+        self._window_queries += 1
+        if self._window_queries >= _RESIZE_WINDOW:
+            self._adapt_size()
+
+        return known
+
+    def _adapt_size(self) -> None:
+        """Resize the cache based on the queries in the current window, and
+        start a new window.
+        """
+        max_growth = self._configured_max_size * _MAX_GROWTH_FACTOR
+
+        if self._window_fallbacks > _GROW_THRESHOLD * self._window_queries:
+            if self._max_size < max_growth:
+                self._max_size = min(self._max_size * 2, max_growth)
+                logger.debug("Growing %s to %d entries", self.name, self._max_size)
+        elif (
+            self._window_fallbacks == 0
+            and self._max_size > self._configured_max_size
+            and len(self) >= self._max_size
+            and self._window_oldest_query is not None
+        ):
+            # If every query could have been answered by the newer half of the
+            # cache, we don't need the older half.
+            middle = self._positions[
+                self._start + (len(self._positions) - self._start) // 2
+            ]
+            if self._window_oldest_query >= middle:
+                self._max_size = max(self._max_size // 2, self._configured_max_size)
+                logger.debug("Shrinking %s to %d entries", self.name, self._max_size)
+                self._evict()
+
+        self._window_queries = 0
+        self._window_fallbacks = 0
+        self._window_oldest_query = None
+
     def has_entity_changed(self, entity: EntityType, stream_pos: int) -> bool:
         """
         Returns True if the entity may have been updated after stream_pos.
@@ -135,9 +258,9 @@ class StreamChangeCache:
         """
         assert isinstance(stream_pos, int)
 
-        # _cache is not valid at or before the earliest known stream position, so
-        # return that the entity has changed.
-        if stream_pos <= self._earliest_known_stream_pos:
+        # The cache is not valid at or before the earliest known stream position,
+        # so return that the entity has changed.
+        if not self._record_query(stream_pos):
             self.metrics.inc_misses()
             return True
 
@@ -213,19 +336,21 @@ class StreamChangeCache:
         """
         assert isinstance(stream_pos, int)
 
-        # _cache is not valid at or before the earliest known stream position, so
-        # return that an entity has changed.
-        if stream_pos <= self._earliest_known_stream_pos:
+        # The cache is not valid at or before the earliest known stream position,
+        # so return that an entity has changed.
+        if not self._record_query(stream_pos):
             self.metrics.inc_misses()
             return True
 
         # If the cache is empty, nothing can have changed.
-        if not self._cache:
+        if not self._entity_to_key:
             self.metrics.inc_misses()
             return False
 
+        # The latest entry is never superseded, as the change that superseded it
+        # would be later.
         self.metrics.inc_hits()
-        return stream_pos < self._cache.peekitem()[0]
+        return stream_pos < self._positions[-1]
 
     def get_all_entities_changed(self, stream_pos: int) -> AllEntitiesChangedResult:
         """
@@ -245,15 +370,15 @@ class StreamChangeCache:
         """
         assert isinstance(stream_pos, int)
 
-        # _cache is not valid at or before the earliest known stream position, so
-        # return None to mark that it is unknown if an entity has changed.
-        if stream_pos <= self._earliest_known_stream_pos:
+        # The cache is not valid at or before the earliest known stream position,
+        # so return None to mark that it is unknown if an entity has changed.
+        if not self._record_query(stream_pos):
             return AllEntitiesChangedResult(None)
 
-        changed_entities: List[EntityType] = []
-
-        for k in self._cache.islice(start=self._cache.bisect_right(stream_pos)):
-            changed_entities.extend(self._cache[k])
+        index = bisect_right(self._positions, stream_pos, lo=self._start)
+        changed_entities = [
+            entity for entity in self._entities[index:] if entity is not None
+        ]
         return AllEntitiesChangedResult(changed_entities)
 
     def entity_has_changed(self, entity: EntityType, stream_pos: int) -> None:
@@ -266,8 +391,8 @@ class StreamChangeCache:
         """
         assert isinstance(stream_pos, int)
 
-        # For a change before _cache is valid (e.g. at or before the earliest known
-        # stream position) there's nothing to do.
+        # For a change before the cache is valid (e.g. at or before the earliest
+        # known stream position) there's nothing to do.
         if stream_pos <= self._earliest_known_stream_pos:
             return
 
@@ -276,16 +401,26 @@ class StreamChangeCache:
             if old_pos >= stream_pos:
                 # nothing to do
                 return
-            e = self._cache[old_pos]
-            e.remove(entity)
-            if not e:
-                # cache at this point is now empty
-                del self._cache[old_pos]
-
-        e1 = self._cache.get(stream_pos)
-        if e1 is None:
-            e1 = self._cache[stream_pos] = set()
-        e1.add(entity)
+
+            index = bisect_left(self._positions, old_pos, lo=self._start)
+            while self._entities[index] != entity:
+                index += 1
+            self._entities[index] = None
+            self._superseded += 1
+        else:
+            # Many caches track the same entities, so make sure they share a
+            # single copy of each.
+            entity = intern(entity)
+
+        if not self._positions or stream_pos >= self._positions[-1]:
+            # Changes almost always arrive in order.
+            self._positions.append(stream_pos)
+            self._entities.append(entity)
+        else:
+            index = bisect_right(self._positions, stream_pos, lo=self._start)
+            self._positions.insert(index, stream_pos)
+            self._entities.insert(index, entity)
+
         self._entity_to_key[entity] = stream_pos
         self._evict()
 
@@ -296,11 +431,94 @@ class StreamChangeCache:
         Evicts entries until it is at the maximum size.
         """
         # if the cache is too big, remove entries
-        while len(self._cache) > self._max_size:
-            k, r = self._cache.popitem(0)
-            self._earliest_known_stream_pos = max(k, self._earliest_known_stream_pos)
-            for entity in r:
-                self._entity_to_key.pop(entity, None)
+        while len(self._entity_to_key) > self._max_size:
+            self._pop_oldest()
+
+        # There's no point keeping any other changes at the earliest known stream
+        # position, as they can't be queried for.
+        while (
+            self._start < len(self._positions)
+            and self._positions[self._start] <= self._earliest_known_stream_pos
+        ):
+            self._pop_oldest()
+
+        # Compact the arrays once at least half of them is no longer needed.
+        if self._start + self._superseded > len(self._positions) // 2:
+            self._compact()
+
+    def _pop_oldest(self) -> None:
+        stream_pos = self._positions[self._start]
+        entity = self._entities[self._start]
+        self._entities[self._start] = None
+        self._start += 1
+
+        if entity is None:
+            self._superseded -= 1
+        else:
+            self._entity_to_key.pop(entity, None)
+            self._earliest_known_stream_pos = max(
+                stream_pos, self._earliest_known_stream_pos
+            )
+
+    def _compact(self) -> None:
+        """Remove the evicted and superseded entries from the arrays."""
+        positions = array("q")
+        entities: List[Optional[EntityType]] = []
+        for index in range(self._start, len(self._positions)):
+            entity = self._entities[index]
+            if entity is not None:
+                positions.append(self._positions[index])
+                entities.append(entity)
+
+        self._positions = positions
+        self._entities = entities
+        self._start = 0
+        self._superseded = 0
+
+    def get_snapshot(self) -> Tuple[int, Dict[EntityType, int]]:
+        """Get a copy of the contents of the cache, which can later be passed to
+        `restore_snapshot`.
+
+        Return:
+            A tuple of the earliest known stream position and a map from entity
+            to the stream position of its latest change.
+        """
+        return self._earliest_known_stream_pos, dict(self._entity_to_key)
+
+    def restore_snapshot(
+        self,
+        earliest_known_stream_pos: int,
+        stream_pos: int,
+        changes: Mapping[EntityType, int],
+    ) -> bool:
+        """Extend the cache backwards with the contents of an older copy of it,
+        e.g. one saved before a restart.
+
+        This is only possible if the snapshot overlaps with the range of stream
+        positions this cache already knows about, as otherwise there would be a
+        gap in which we don't know what changed.
+
+        Args:
+            earliest_known_stream_pos: The earliest known stream position of the
+                snapshot.
+            stream_pos: The stream position the snapshot is complete up to.
+            changes: Map from entity to the stream position of its latest change,
+                as returned by `get_snapshot`.
+
+        Return:
+            Whether the snapshot was used.
+        """
+        if (
+            stream_pos < self._earliest_known_stream_pos
+            or earliest_known_stream_pos >= self._earliest_known_stream_pos
+        ):
+            return False
+
+        self._earliest_known_stream_pos = earliest_known_stream_pos
+        for entity, entity_stream_pos in changes.items():
+            self.entity_has_changed(entity, entity_stream_pos)
+
+        return True
 
     def get_max_pos_of_last_change(self, entity: EntityType) -> int:
         """Returns an upper bound of the stream id of the last change to an
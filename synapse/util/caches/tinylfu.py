@@ -0,0 +1,123 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Frequency estimation used by the TinyLFU cache admission policy."""
+
+from typing import Hashable, List
+
+# Odd multipliers used to derive an independent index into each row of the
+# sketch, via multiply-shift hashing.
+_SEEDS = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+# Counters saturate at this value, i.e. we use (the equivalent of) 4-bit counters.
+_MAX_COUNT = 15
+
+
+class CountMinSketch:
+    """An approximate, aging frequency counter for hashable keys.
+
+    The sketch is a table of `len(_SEEDS)` rows of small saturating counters.
+    Each key maps to one counter in each row; incrementing a key bumps all of
+    them, and the estimate of a key's frequency is the smallest of its counters.
+    Collisions can therefore only ever cause over-estimates.
+
+    The first access to a key is only recorded in a "doorkeeper" bloom filter,
+    so that the (typically many) keys that are only ever seen once don't
+    pollute the counters.
+
+    To allow the cache to adapt to changing workloads, all counters are halved
+    (and the doorkeeper cleared) once the number of increments reaches ten times
+    the number of entries in the cache.
+    """
+
+    __slots__ = [
+        "max_entries",
+        "width",
+        "_shift",
+        "_table",
+        "_doorkeeper",
+        "_additions",
+        "_sample_size",
+    ]
+
+    def __init__(self, max_entries: int):
+        """
+        Args:
+            max_entries: the maximum number of entries in the cache being tracked.
+        """
+        self.max_entries = max_entries
+
+        # We use four counters per entry in each row, which keeps the chance of
+        # a rarely used key colliding with frequently used ones in every row low.
+        bits = max(4 * max_entries - 1, 1).bit_length()
+        self.width = 1 << bits
+        self._shift = 64 - bits
+        self._table = bytearray(self.width * len(_SEEDS))
+        # A bit for each counter in the table.
+        self._doorkeeper = bytearray(len(self._table) // 8 + 1)
+        self._additions = 0
+        self._sample_size = 10 * max(max_entries, 1)
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        key_hash = hash(key) & _MASK_64
+        width = self.width
+        shift = self._shift
+        return [
+            row * width + (((key_hash * seed) & _MASK_64) >> shift)
+            for row, seed in enumerate(_SEEDS)
+        ]
+
+    def _in_doorkeeper(self, indexes: List[int]) -> bool:
+        doorkeeper = self._doorkeeper
+        return all(doorkeeper[index >> 3] & (1 << (index & 7)) for index in indexes)
+
+    def increment(self, key: Hashable) -> None:
+        """Record an access to the given key."""
+        indexes = self._indexes(key)
+
+        if not self._in_doorkeeper(indexes):
+            doorkeeper = self._doorkeeper
+            for index in indexes:
+                doorkeeper[index >> 3] |= 1 << (index & 7)
+        else:
+            table = self._table
+            for index in indexes:
+                if table[index] < _MAX_COUNT:
+                    table[index] += 1
+
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def estimate(self, key: Hashable) -> int:
+        """Get the estimated (recent) access frequency of the given key."""
+        indexes = self._indexes(key)
+        table = self._table
+        count = min(table[index] for index in indexes)
+        if self._in_doorkeeper(indexes):
+            count += 1
+        return count
+
+    def _reset(self) -> None:
+        """Halve all the counters, so that old accesses count for less."""
+        self._table = bytearray(count >> 1 for count in self._table)
+        self._doorkeeper = bytearray(len(self._doorkeeper))
+        self._additions //= 2
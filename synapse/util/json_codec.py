@@ -0,0 +1,201 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""JSON encoding and decoding for the hot paths: event JSON in the database,
+non-canonical HTTP responses and replication commands.
+
+These use orjson if it is installed (it is the optional `fast-json` extra),
+which is several times faster than the standard library, falling back to the
+standard library for anything orjson can't handle in the same way (e.g.
+integers which don't fit in 64 bits, or dictionaries with non-string keys).
+
+The output is equivalent to that of `synapse.util.json_encoder`, but not
+byte-for-byte identical: orjson doesn't escape non-ASCII characters, and
+encodes NaN and infinite floats as null rather than rejecting them. Where the
+exact bytes matter, i.e. canonical JSON for signing, hashing and federation
+responses, use `canonicaljson` instead, which always uses the standard library.
+
+The backend can be forced by setting the `SYNAPSE_JSON_BACKEND` environment
+variable to `stdlib` or `orjson`.
+"""
+
+import abc
+import os
+from json.encoder import encode_basestring_ascii  # type: ignore[attr-defined]
+from typing import Any, Dict, Iterator, Optional, Union
+
+from frozendict import frozendict
+
+from synapse.util import json_decoder, json_encoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# The number of items of a list that `JsonCodec.iterencode_bytes` encodes at a
+# time.
+_LIST_ITEMS_PER_CHUNK = 50
+
+
+class JsonCodec(metaclass=abc.ABCMeta):
+    """Encodes and decodes JSON."""
+
+    # The name of the backend, for logging and benchmarks.
+    name: str
+
+    @abc.abstractmethod
+    def encode(self, value: Any) -> str:
+        """Encode a value as compact JSON."""
+
+    @abc.abstractmethod
+    def encode_bytes(self, value: Any) -> bytes:
+        """Encode a value as compact, UTF-8 encoded JSON."""
+
+    @abc.abstractmethod
+    def decode(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        """Decode JSON, rejecting the Python extensions to JSON (e.g. NaN).
+
+        Raises:
+            ValueError if the data isn't valid JSON.
+        """
+
+    def iterencode_bytes(self, value: Any, max_depth: int = 6) -> Iterator[bytes]:
+        """Encode a value as compact, UTF-8 encoded JSON, a piece at a time.
+
+        Dictionaries nested up to `max_depth` deep are walked, and lists are
+        encoded `_LIST_ITEMS_PER_CHUNK` items at a time. Since events are sent in
+        lists, this means that a large response (e.g. an initial sync) never
+        needs to be held in memory all at once.
+
+        Unlike `json.JSONEncoder.iterencode`, this doesn't fall back to the
+        (much slower) pure Python encoder.
+        """
+        if isinstance(value, (list, tuple)):
+            separator = b"["
+            for i in range(0, len(value), _LIST_ITEMS_PER_CHUNK):
+                # Encoding each item separately would have a noticeable overhead
+                # per item, so we encode a slice of the list and strip off the
+                # brackets.
+                chunk = self.encode_bytes(value[i : i + _LIST_ITEMS_PER_CHUNK])
+                yield separator + chunk[1:-1]
+                separator = b","
+            yield b"[]" if separator == b"[" else b"]"
+            return
+
+        if (
+            max_depth > 0
+            and isinstance(value, (dict, frozendict))
+            and all(isinstance(key, str) for key in value)
+        ):
+            separator = b"{"
+            for key, item in value.items():
+                yield separator + self._encode_key(key) + b":"
+                yield from self.iterencode_bytes(item, max_depth - 1)
+                separator = b","
+            yield b"{}" if separator == b"{" else b"}"
+            return
+
+        yield self.encode_bytes(value)
+
+    def _encode_key(self, key: str) -> bytes:
+        return self.encode_bytes(key)
+
+
+class StdlibJsonCodec(JsonCodec):
+    """A `JsonCodec` using the standard library `json` module."""
+
+    name = "stdlib"
+
+    def encode(self, value: Any) -> str:
+        return json_encoder.encode(value)
+
+    def encode_bytes(self, value: Any) -> bytes:
+        return json_encoder.encode(value).encode("utf-8")
+
+    def _encode_key(self, key: str) -> bytes:
+        # This skips the setup that `JSONEncoder.encode` does on every call.
+        return encode_basestring_ascii(key).encode("ascii")
+
+    def decode(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return json_decoder.decode(data)
+
+
+def _orjson_default(value: Any) -> Dict[Any, Any]:
+    if isinstance(value, frozendict):
+        return dict(value)
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+class OrjsonJsonCodec(JsonCodec):
+    """A `JsonCodec` using orjson, falling back to the standard library for
+    values that orjson can't handle.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        assert orjson is not None
+        self._fallback = StdlibJsonCodec()
+
+    def encode(self, value: Any) -> str:
+        return self.encode_bytes(value).decode("utf-8")
+
+    def encode_bytes(self, value: Any) -> bytes:
+        try:
+            return orjson.dumps(value, default=_orjson_default)
+        except TypeError:
+            # orjson raises `JSONEncodeError`, a subclass of `TypeError`, for
+            # anything it can't encode. The standard library either handles it
+            # or raises the appropriate error.
+            return self._fallback.encode_bytes(value)
+
+    def decode(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # orjson raises `JSONDecodeError`, a subclass of `ValueError`, for
+            # some valid JSON (e.g. lone surrogates), so we let the standard
+            # library decide.
+            return self._fallback.decode(data)
+
+
+def get_json_codec(backend: Optional[str] = None) -> JsonCodec:
+    """Get a `JsonCodec` for the given backend.
+
+    Args:
+        backend: "stdlib", "orjson", or None to use orjson if it is installed.
+
+    Raises:
+        ValueError if the backend is unknown, or isn't installed.
+    """
+    if backend is None:
+        backend = "orjson" if orjson is not None else "stdlib"
+
+    if backend == "stdlib":
+        return StdlibJsonCodec()
+    elif backend == "orjson":
+        if orjson is None:
+            raise ValueError("The orjson JSON backend is not installed")
+        return OrjsonJsonCodec()
+    else:
+        raise ValueError("Unknown JSON backend %r" % (backend,))
+
+
+# The codec to use.
+json_codec = get_json_codec(os.environ.get("SYNAPSE_JSON_BACKEND") or None)
@@ -0,0 +1,114 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.types import ISynapseReactor
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+class ProcessPool:
+    """Runs CPU-bound functions in a pool of subprocesses, so that they don't
+    block the reactor.
+
+    The function and its arguments and result are pickled to be sent between
+    processes, so the function must be defined at the top level of a module, and
+    large arguments should be passed in a compact form.
+
+    The subprocesses are started when the pool is first used, with the "spawn"
+    start method: forking a process which is running a reactor and database
+    threads is not safe.
+    """
+
+    def __init__(self, reactor: ISynapseReactor, name: str, max_workers: int):
+        """
+        Args:
+            reactor
+            name: A name for the pool, for logging.
+            max_workers: The number of subprocesses to run.
+        """
+        self._reactor = reactor
+        self._name = name
+        self._max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        reactor.addSystemEventTrigger("before", "shutdown", self.shutdown)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logger.info(
+                "Starting %d subprocesses for %s", self._max_workers, self._name
+            )
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(self, f: Callable[..., R], *args: Any) -> R:
+        """Call `f` with the given arguments in one of the subprocesses.
+
+        Raises:
+            Any exception raised by `f`, or `BrokenProcessPool` if the
+            subprocess died.
+        """
+        executor = self._get_executor()
+        try:
+            future = executor.submit(f, *args)
+        except BrokenProcessPool:
+            # A subprocess died while running an earlier function. Start afresh
+            # for next time.
+            self._reset(executor)
+            raise
+
+        d: "defer.Deferred[R]" = defer.Deferred()
+
+        def _on_done(future: "Future[R]") -> None:
+            # This is called from one of the executor's threads (or this one, if
+            # the function has already finished).
+            self._reactor.callFromThread(_fire, future)
+
+        def _fire(future: "Future[R]") -> None:
+            exception = future.exception()
+            if exception is not None:
+                if isinstance(exception, BrokenProcessPool):
+                    self._reset(executor)
+                d.errback(Failure(exception))
+            else:
+                d.callback(future.result())
+
+        future.add_done_callback(_on_done)
+        return await make_deferred_yieldable(d)
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """Stop the subprocesses, without waiting for running functions."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
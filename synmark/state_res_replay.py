@@ -0,0 +1,357 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays a state resolution from a snapshot of a real room, timing each phase
+of the resolution.
+
+Snapshots are exported from a homeserver's database with:
+
+    python -m synapse.app.admin_cmd -c homeserver.yaml \\
+        export-state-res-snapshot '!room:example.com' --output room.json.gz
+
+and replayed, without a database, with:
+
+    python -m synmark.state_res_replay room.json.gz --runs 5 --trace-memory
+
+The resolved state of every run is hashed, so that changes to the algorithms can
+be checked to give the same result.
+"""
+
+import argparse
+import gzip
+import hashlib
+import inspect
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+from unittest.mock import patch
+
+import attr
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from synapse.api.room_versions import StateResolutionVersions
+from synapse.events import EventBase
+from synapse.state import v1, v2
+from synapse.state.snapshot import StateResSnapshot
+from synapse.types import StateMap
+from synapse.util.caches.auth_chain_cover_index import RoomAuthChainCoverIndex
+from synapse.util.json_codec import json_codec
+from synmark.suites.state_res_v2 import Clock, StateResolutionStore
+
+# The functions of each algorithm which are timed, with the names of their
+# phases. Phases which run more than once are numbered, e.g. the two rounds of
+# auth checks of v2.
+V1_PHASES = [
+    ("_seperate", "separate"),
+    ("_resolve_with_state", "resolve_with_state"),
+]
+V2_PHASES = [
+    ("_seperate", "separate"),
+    ("_get_auth_chain_difference", "auth_chain_difference"),
+    ("_reverse_topological_power_sort", "power_sort"),
+    ("_iterative_auth_checks", "auth_checks"),
+    ("_mainline_sort", "mainline_sort"),
+]
+
+
+class SnapshotStateResolutionStore(StateResolutionStore):
+    """Returns events and auth chain differences from a snapshot.
+
+    Auth chain differences are calculated with the snapshot's chain cover index,
+    if it has one, as the database would.
+    """
+
+    def __init__(self, snapshot: StateResSnapshot):
+        super().__init__(snapshot.events)
+
+        self._index: Optional[RoomAuthChainCoverIndex] = None
+        if snapshot.auth_chain_cover_index is not None:
+            self._index = RoomAuthChainCoverIndex()
+            self._index.apply(snapshot.auth_chain_cover_index)
+
+    def get_events(
+        self, event_ids: Collection[str], allow_rejected: bool = False
+    ) -> "defer.Deferred[Dict[str, EventBase]]":
+        events = {}
+        for event_id in event_ids:
+            event = self._events.get(event_id)
+            if event is not None and (allow_rejected or not event.rejected_reason):
+                events[event_id] = event
+        return defer.succeed(events)
+
+    def get_auth_chain_difference(
+        self, room_id: str, auth_sets: List[Set[str]]
+    ) -> "defer.Deferred[Set[str]]":
+        if self._index is None:
+            return super().get_auth_chain_difference(room_id, auth_sets)
+        return defer.succeed(self._index.get_auth_chain_difference(auth_sets))
+
+
+class PhaseTimer:
+    """Records the time taken by each phase of a resolution, in the order they
+    ran.
+    """
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, elapsed: float) -> None:
+        label = name
+        count = 1
+        while label in self.phases:
+            count += 1
+            label = "%s[%d]" % (name, count)
+        self.phases[label] = elapsed
+
+    def wrap(self, name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(func):
+
+            async def timed_async(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.add(name, time.perf_counter() - start)
+
+            return timed_async
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+
+        return timed
+
+    @contextmanager
+    def patch(self, module: Any, phases: List[Tuple[str, str]]) -> Iterator[None]:
+        """Time the given functions of the module while in the context."""
+        with ExitStack() as stack:
+            for func_name, name in phases:
+                stack.enter_context(
+                    patch.object(
+                        module, func_name, self.wrap(name, getattr(module, func_name))
+                    )
+                )
+            yield
+
+
+@attr.s(slots=True, auto_attribs=True)
+class ReplayResult:
+    state: StateMap[str]
+
+    # The SHA-256 of the resolved state, which is the same for the same state.
+    digest: str
+
+    # The time taken by the whole resolution, and by each phase of it.
+    elapsed: float
+    phases: Dict[str, float]
+
+    # The peak memory allocated during the resolution, if it was traced.
+    peak_memory: Optional[int] = None
+
+
+def load_snapshot(path: str) -> StateResSnapshot:
+    """Load a snapshot, which is compressed if the name ends in `.gz`."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return StateResSnapshot.load(f)
+
+    with open(path, encoding="utf-8") as f:
+        return StateResSnapshot.load(f)
+
+
+def get_algorithm(snapshot: StateResSnapshot, algorithm: str) -> str:
+    """Get the algorithm to replay with, where "room" is the algorithm of the
+    snapshot's room version.
+    """
+    if algorithm != "room":
+        return algorithm
+    if snapshot.room_version.state_res == StateResolutionVersions.V1:
+        return "v1"
+    return "v2"
+
+
+def digest_state(state: StateMap[str]) -> str:
+    rows = sorted(
+        [event_type, state_key, event_id]
+        for (event_type, state_key), event_id in state.items()
+    )
+    return hashlib.sha256(json_codec.encode(rows).encode("utf-8")).hexdigest()
+
+
+def replay(
+    snapshot: StateResSnapshot, algorithm: str = "room", trace_memory: bool = False
+) -> ReplayResult:
+    """Resolve the snapshot's state groups.
+
+    Args:
+        snapshot
+        algorithm: "v1", "v2", or "room" for the algorithm of the room version.
+        trace_memory: Whether to measure the peak memory allocated, which
+            slows down the resolution.
+    """
+    store = SnapshotStateResolutionStore(snapshot)
+    state_sets = [snapshot.state_groups[sg] for sg in sorted(snapshot.state_groups)]
+    timer = PhaseTimer()
+
+    resolution: Awaitable[StateMap[str]]
+    if get_algorithm(snapshot, algorithm) == "v1":
+
+        async def state_map_factory(
+            event_ids: Collection[str],
+        ) -> Dict[str, EventBase]:
+            start = time.perf_counter()
+            events = await store.get_events(event_ids)
+            timer.add("fetch", time.perf_counter() - start)
+            return events
+
+        resolution = v1.resolve_events_with_store(
+            snapshot.room_id,
+            snapshot.room_version,
+            state_sets,
+            None,
+            state_map_factory,
+        )
+        patcher = timer.patch(v1, V1_PHASES)
+    else:
+        resolution = v2.resolve_events_with_store(
+            Clock(),
+            snapshot.room_id,
+            snapshot.room_version,
+            state_sets,
+            None,
+            store,
+        )
+        patcher = timer.patch(v2, V2_PHASES)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    try:
+        with patcher:
+            start = time.perf_counter()
+            # Everything is in memory, so the resolution completes without
+            # waiting on the reactor.
+            d = defer.ensureDeferred(resolution)
+            elapsed = time.perf_counter() - start
+
+        peak_memory = None
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    assert d.called, "Resolution did not complete"
+    if isinstance(d.result, Failure):
+        d.result.raiseException()
+    state = cast(StateMap[str], d.result)
+
+    return ReplayResult(
+        state=state,
+        digest=digest_state(state),
+        elapsed=elapsed,
+        phases=timer.phases,
+        peak_memory=peak_memory,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay a state resolution from a snapshot"
+    )
+    parser.add_argument("snapshot", help="The snapshot file to replay")
+    parser.add_argument(
+        "--algorithm",
+        choices=["room", "v1", "v2"],
+        default="room",
+        help="The state resolution algorithm to use. Defaults to the room's.",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="The number of times to resolve"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure the peak memory allocated. Slows down the resolution.",
+    )
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(args.snapshot)
+    algorithm = get_algorithm(snapshot, args.algorithm)
+    print(
+        f"{snapshot.room_id} (room version {snapshot.room_version.identifier}): "
+        f"{len(snapshot.state_groups)} state groups, "
+        f"{len(snapshot.events)} events, "
+        f"chain cover index: {'yes' if snapshot.auth_chain_cover_index else 'no'}, "
+        f"algorithm: {algorithm}"
+    )
+
+    results = []
+    for run in range(args.runs):
+        result = replay(snapshot, algorithm, args.trace_memory)
+        results.append(result)
+        print(f"run {run + 1:3}  {result.elapsed:8.3f}s  {result.digest}")
+
+    # Any time not spent in the timed phases, e.g. fetching events in v2.
+    timings: Dict[str, List[float]] = {}
+    for result in results:
+        for name, elapsed in result.phases.items():
+            timings.setdefault(name, []).append(elapsed)
+        timings.setdefault("other", []).append(
+            result.elapsed - sum(result.phases.values())
+        )
+        timings.setdefault("total", []).append(result.elapsed)
+
+    print()
+    print(f"{'phase':30} {'min':>9} {'median':>9}")
+    for name, elapsed_list in timings.items():
+        print(
+            f"{name:30} {min(elapsed_list):8.3f}s "
+            f"{statistics.median(elapsed_list):8.3f}s"
+        )
+
+    if args.trace_memory:
+        peak_memory = max(r.peak_memory or 0 for r in results)
+        print(f"{'peak memory':30} {peak_memory / 2**20:8.1f}MiB")
+
+    digests = {r.digest for r in results}
+    if len(digests) > 1:
+        print("The resolved state differed between runs", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
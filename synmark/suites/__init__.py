@@ -1,4 +1,12 @@
-from . import logging, lrucache, lrucache_evict
+from . import (
+    json_codec,
+    json_streaming,
+    logging,
+    lrucache,
+    lrucache_evict,
+    state_res_replay,
+    state_res_v2,
+)
 
 SUITES = [
     (logging, 1000),
@@ -6,4 +14,10 @@ SUITES = [
     (logging, None),
     (lrucache, None),
     (lrucache_evict, None),
+    (json_codec, None),
+    (json_streaming, None),
+    (state_res_v2, 1000),
+    (state_res_v2, 10000),
+    (state_res_v2, 100000),
+    (state_res_replay, None),
 ]
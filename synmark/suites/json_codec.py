@@ -0,0 +1,91 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the JSON codecs.
+
+By default these use a synthetic corpus of events. To use real events, point the
+`SYNMARK_EVENT_CORPUS` environment variable at a file containing one event JSON
+per line, e.g. as exported by:
+
+    psql synapse -Atc "SELECT json FROM event_json LIMIT 100000" > events.jsonl
+"""
+
+import os
+from typing import List
+
+from pyperf import perf_counter
+
+from synapse.util.json_codec import JsonCodec, get_json_codec, json_codec
+
+
+def load_corpus() -> List[str]:
+    path = os.environ.get("SYNMARK_EVENT_CORPUS")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line for line in f.read().splitlines() if line]
+
+    corpus = []
+    for i in range(1000):
+        event = {
+            "type": "m.room.message",
+            "room_id": "!abcdefghijklmnop:example.com",
+            "sender": "@user%d:example.com" % (i % 50,),
+            "origin_server_ts": 1670000000000 + i,
+            "content": {
+                "msgtype": "m.text",
+                "body": "Message number %d, with some ünïcödé 🎉 in it" % (i,),
+            },
+            "depth": i,
+            "prev_events": ["$prev%d" % (i,)],
+            "auth_events": ["$create", "$power_levels", "$join%d" % (i % 50,)],
+            "hashes": {"sha256": "a" * 43},
+            "signatures": {"example.com": {"ed25519:auto": "b" * 86}},
+            "unsigned": {"age_ts": 1670000000000 + i},
+        }
+        corpus.append(get_json_codec("stdlib").encode(event))
+    return corpus
+
+
+def run(codec: JsonCodec, corpus: List[str], loops: int) -> float:
+    """Decode and re-encode `loops` events from the corpus, returning the time
+    taken.
+    """
+    start = perf_counter()
+
+    for i in range(loops):
+        codec.encode(codec.decode(corpus[i % len(corpus)]))
+
+    return perf_counter() - start
+
+
+async def main(reactor, loops):
+    """
+    Benchmark decoding and re-encoding `loops` events with the configured codec.
+    """
+    return run(json_codec, load_corpus(), loops)
+
+
+if __name__ == "__main__":
+    # Compare the available codecs against each other.
+    corpus = load_corpus()
+    loops = 100000
+    for backend in ("stdlib", "orjson"):
+        try:
+            codec = get_json_codec(backend)
+        except ValueError:
+            print(f"{backend:6}  not installed")
+            continue
+
+        elapsed = run(codec, corpus, loops)
+        print(f"{backend:6}  {elapsed / loops * 1e6:6.2f}us/event")
@@ -0,0 +1,114 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import tracemalloc
+
+from pyperf import perf_counter
+
+from synapse.types import JsonDict
+from synapse.util.json_codec import json_codec
+
+# The size of the chunks the response is written in, as `_ByteProducer` does.
+CHUNK_SIZE = 1024
+
+
+def make_sync_response(rooms: int, events_per_room: int) -> JsonDict:
+    """Build something shaped like a large initial sync response."""
+
+    def event(room: int, i: int) -> JsonDict:
+        return {
+            "type": "m.room.message",
+            "event_id": "$event%d_%d" % (room, i),
+            "sender": "@user%d:example.com" % (i % 20,),
+            "origin_server_ts": 1670000000000 + i,
+            "content": {"msgtype": "m.text", "body": "Message %d " % (i,) * 10},
+            "unsigned": {"age": i},
+        }
+
+    return {
+        "next_batch": "s1_2_3_4_5_6_7_8_9",
+        "rooms": {
+            "join": {
+                "!room%d:example.com"
+                % (room,): {
+                    "timeline": {
+                        "events": [event(room, i) for i in range(events_per_room)],
+                        "limited": True,
+                        "prev_batch": "t1-2_3_4_5_6_7_8_9",
+                    },
+                    "state": {"events": []},
+                }
+                for room in range(rooms)
+            }
+        },
+    }
+
+
+def write_all_at_once(response: JsonDict) -> int:
+    body = json_codec.encode_bytes(response)
+    return sum(len(body[i : i + CHUNK_SIZE]) for i in range(0, len(body), CHUNK_SIZE))
+
+
+def write_streaming(response: JsonDict) -> int:
+    written = 0
+    buffer = []
+    buffered_bytes = 0
+    for data in json_codec.iterencode_bytes(response):
+        buffer.append(data)
+        buffered_bytes += len(data)
+        if buffered_bytes >= CHUNK_SIZE:
+            written += len(b"".join(buffer))
+            buffer = []
+            buffered_bytes = 0
+    return written + len(b"".join(buffer))
+
+
+async def main(reactor, loops):
+    """
+    Benchmark streaming `loops` large sync responses.
+    """
+    response = make_sync_response(100, 100)
+
+    start = perf_counter()
+
+    for _ in range(loops):
+        write_streaming(response)
+
+    return perf_counter() - start
+
+
+if __name__ == "__main__":
+    # Report the peak memory used to write a large sync response, which the
+    # pyperf runner can't measure, both all at once and streamed. tracemalloc
+    # slows things down, so the time is measured separately.
+    response = make_sync_response(500, 200)
+    for name, write in (
+        ("all at once", write_all_at_once),
+        ("streaming", write_streaming),
+    ):
+        start = perf_counter()
+        size = write(response)
+        elapsed = perf_counter() - start
+
+        gc.collect()
+        tracemalloc.start()
+        write(response)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{name:12}  response: {size / 1e6:6.1f}MB  "
+            f"peak memory: {peak / 1e6:7.2f}MB  time: {elapsed:.2f}s"
+        )
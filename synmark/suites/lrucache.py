@@ -12,8 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gc
+import tracemalloc
+from unittest.mock import patch
+
 from pyperf import perf_counter
 
+from synapse.util.caches import lrucache
 from synapse.util.caches.lrucache import LruCache
 
 
@@ -31,3 +36,51 @@ async def main(reactor, loops):
     end = perf_counter() - start
 
     return end
+
+
+def measure(entries, use_global_list):
+    """
+    Measure the memory used per entry, and the average latency of sets and
+    gets, for a cache filled with `entries` entries.
+
+    The keys and values are preallocated so that only the memory used by the
+    cache itself is counted.
+    """
+    keys = list(range(entries))
+
+    with patch.object(lrucache, "USE_GLOBAL_LIST", use_global_list):
+        cache = LruCache(entries)
+
+        gc.collect()
+        tracemalloc.start()
+        start = perf_counter()
+        for key in keys:
+            cache[key] = True
+        set_time = perf_counter() - start
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = perf_counter()
+        for key in keys:
+            cache.get(key)
+        get_time = perf_counter() - start
+
+        cache.clear()
+
+    return size / entries, set_time / entries, get_time / entries
+
+
+if __name__ == "__main__":
+    # Report the per-entry memory overhead of the cache, which the pyperf
+    # runner can't measure, alongside the set and get latencies. Note that
+    # tracemalloc slows down the sets, so the set latencies here are only
+    # useful for comparing against each other.
+    entries = 100000
+    for use_global_list in (False, True):
+        entry_bytes, set_latency, get_latency = measure(entries, use_global_list)
+        print(
+            f"global list: {use_global_list!s:5}  "
+            f"bytes/entry: {entry_bytes:6.1f}  "
+            f"set: {set_latency * 1e9:6.0f}ns  "
+            f"get: {get_latency * 1e9:6.0f}ns"
+        )
@@ -0,0 +1,59 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks replaying a state resolution from a snapshot.
+
+By default this uses the synthetic room of the `state_res_v2` suite. To use a
+real room, point the `SYNMARK_STATE_RES_SNAPSHOT` environment variable at a
+snapshot exported with the `export-state-res-snapshot` admin command; see
+`synmark.state_res_replay`.
+"""
+
+import os
+
+from synapse.api.room_versions import RoomVersions
+from synapse.state.snapshot import StateResSnapshot
+from synmark.state_res_replay import load_snapshot, replay
+from synmark.suites.state_res_v2 import ROOM_ID, build_room
+
+
+def get_snapshot() -> StateResSnapshot:
+    path = os.environ.get("SYNMARK_STATE_RES_SNAPSHOT")
+    if path:
+        return load_snapshot(path)
+
+    state_sets, events = build_room(1000)
+    return StateResSnapshot(
+        room_id=ROOM_ID,
+        room_version=RoomVersions.V2,
+        state_groups=dict(enumerate(state_sets)),
+        events=events,
+    )
+
+
+async def main(reactor, loops):
+    """
+    Benchmark resolving the snapshot's state `loops` times.
+    """
+    snapshot = get_snapshot()
+    return sum(replay(snapshot).elapsed for _ in range(loops))
+
+
+if __name__ == "__main__":
+    # Show where the time goes.
+    result = replay(get_snapshot(), trace_memory=True)
+    for name, elapsed in result.phases.items():
+        print(f"{name:30} {elapsed:8.3f}s")
+    print(f"{'total':30} {result.elapsed:8.3f}s")
+    print(f"{'peak memory':30} {(result.peak_memory or 0) / 2**20:8.1f}MiB")
@@ -0,0 +1,245 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for v2 state resolution, on a synthetic room which has forked into
+two branches, each with half of the conflicted events.
+
+Most of the conflicted events are joins of a new user, with a power levels
+change and a topic change every hundred events, so that the power and mainline
+sorts both have work to do.
+"""
+
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+from pyperf import perf_counter
+
+from twisted.internet import defer
+
+from synapse.api.constants import EventTypes, JoinRules, Membership
+from synapse.api.room_versions import RoomVersions
+from synapse.events import EventBase, make_event_from_dict
+from synapse.state import v2
+from synapse.types import StateMap
+
+ROOM_ID = "!room:example.com"
+CREATOR = "@creator:example.com"
+
+# How often each branch changes the power levels and topic.
+POWER_LEVELS_INTERVAL = 100
+TOPIC_INTERVAL = 100
+
+
+class Clock:
+    def sleep(self, duration_ms: float) -> "defer.Deferred[None]":
+        return defer.succeed(None)
+
+
+class StateResolutionStore:
+    """Returns events and auth chain differences from memory."""
+
+    def __init__(self, events: Dict[str, EventBase]):
+        self._events = events
+
+    def get_events(
+        self, event_ids: Collection[str], allow_rejected: bool = False
+    ) -> "defer.Deferred[Dict[str, EventBase]]":
+        return defer.succeed(
+            {e: self._events[e] for e in event_ids if e in self._events}
+        )
+
+    def _get_auth_chain(self, event_ids: Collection[str]) -> Set[str]:
+        result: Set[str] = set()
+        stack = list(event_ids)
+        while stack:
+            event_id = stack.pop()
+            if event_id not in result:
+                result.add(event_id)
+                stack.extend(self._events[event_id].auth_event_ids())
+        return result
+
+    def get_auth_chain_difference(
+        self, room_id: str, auth_sets: List[Set[str]]
+    ) -> "defer.Deferred[Set[str]]":
+        chains = [self._get_auth_chain(a) for a in auth_sets]
+        common = set.intersection(*chains)
+        return defer.succeed(set.union(*chains) - common)
+
+
+class RoomBuilder:
+    """Builds the events of a synthetic room."""
+
+    def __init__(self) -> None:
+        self.events: Dict[str, EventBase] = {}
+        self._ts = 0
+
+    def add(
+        self,
+        sender: str,
+        type: str,
+        state_key: str,
+        content: dict,
+        auth_events: List[str],
+        prev_event: Optional[str],
+    ) -> str:
+        event_id = "$%d:example.com" % (len(self.events),)
+        self._ts += 1
+        event = make_event_from_dict(
+            {
+                "event_id": event_id,
+                "room_id": ROOM_ID,
+                "sender": sender,
+                "type": type,
+                "state_key": state_key,
+                "content": content,
+                "auth_events": [(a, {}) for a in auth_events],
+                "prev_events": [(prev_event, {})] if prev_event else [],
+                "origin_server_ts": self._ts,
+                "depth": len(self.events),
+            },
+            RoomVersions.V2,
+        )
+        self.events[event_id] = event
+        return event_id
+
+
+def build_room(
+    conflicted_events: int,
+) -> Tuple[List[StateMap[str]], Dict[str, EventBase]]:
+    """Builds a room whose state has forked into two branches, which between
+    them have the given number of conflicted state events.
+
+    Returns:
+        The state of each branch, and the room's events.
+    """
+    room = RoomBuilder()
+
+    create = room.add(CREATOR, EventTypes.Create, "", {"creator": CREATOR}, [], None)
+    creator_join = room.add(
+        CREATOR,
+        EventTypes.Member,
+        CREATOR,
+        {"membership": Membership.JOIN},
+        [create],
+        create,
+    )
+    power_levels = room.add(
+        CREATOR,
+        EventTypes.PowerLevels,
+        "",
+        {"users": {CREATOR: 100}, "events": {EventTypes.Topic: 0}},
+        [create, creator_join],
+        creator_join,
+    )
+    join_rules = room.add(
+        CREATOR,
+        EventTypes.JoinRules,
+        "",
+        {"join_rule": JoinRules.PUBLIC},
+        [create, creator_join, power_levels],
+        power_levels,
+    )
+
+    base_state = {
+        (EventTypes.Create, ""): create,
+        (EventTypes.Member, CREATOR): creator_join,
+        (EventTypes.PowerLevels, ""): power_levels,
+        (EventTypes.JoinRules, ""): join_rules,
+    }
+
+    state_sets: List[StateMap[str]] = []
+    for branch in range(2):
+        state = dict(base_state)
+        prev_event = join_rules
+        user_id = CREATOR
+
+        for i in range(conflicted_events // 2):
+            branch_power_levels = state[(EventTypes.PowerLevels, "")]
+            if i % POWER_LEVELS_INTERVAL == POWER_LEVELS_INTERVAL - 1:
+                event_id = room.add(
+                    CREATOR,
+                    EventTypes.PowerLevels,
+                    "",
+                    {
+                        "users": {CREATOR: 100, user_id: i % 50},
+                        "events": {EventTypes.Topic: 0},
+                    },
+                    [create, creator_join, branch_power_levels],
+                    prev_event,
+                )
+                state[(EventTypes.PowerLevels, "")] = event_id
+            elif i % TOPIC_INTERVAL == TOPIC_INTERVAL // 2:
+                event_id = room.add(
+                    user_id,
+                    EventTypes.Topic,
+                    "",
+                    {"topic": "Topic %d of branch %d" % (i, branch)},
+                    [
+                        create,
+                        branch_power_levels,
+                        state[(EventTypes.Member, user_id)],
+                    ],
+                    prev_event,
+                )
+                state[(EventTypes.Topic, "")] = event_id
+            else:
+                user_id = "@user%d_%d:example.com" % (branch, i)
+                event_id = room.add(
+                    user_id,
+                    EventTypes.Member,
+                    user_id,
+                    {"membership": Membership.JOIN},
+                    [create, branch_power_levels, join_rules],
+                    prev_event,
+                )
+                state[(EventTypes.Member, user_id)] = event_id
+
+            prev_event = event_id
+
+        state_sets.append(state)
+
+    return state_sets, room.events
+
+
+async def resolve(
+    state_sets: List[StateMap[str]], events: Dict[str, EventBase]
+) -> float:
+    """Resolves the given state, returning the time taken."""
+    store = StateResolutionStore(events)
+
+    start = perf_counter()
+    await v2.resolve_events_with_store(
+        Clock(), ROOM_ID, RoomVersions.V2, state_sets, None, store
+    )
+    return perf_counter() - start
+
+
+async def main(reactor, loops):
+    """
+    Benchmark resolving the state of a room with `loops` conflicted events.
+    """
+    state_sets, events = build_room(loops)
+    return await resolve(state_sets, events)
+
+
+if __name__ == "__main__":
+    # Show how the time taken grows with the number of conflicted events.
+    for conflicted_events in (1000, 10000, 100000):
+        state_sets, events = build_room(conflicted_events)
+        d = defer.ensureDeferred(resolve(state_sets, events))
+        elapsed = d.result
+        print(
+            f"{conflicted_events:6} conflicted events  "
+            f"{elapsed:7.3f}s  "
+            f"{elapsed / conflicted_events * 1e6:6.1f}us/event"
+        )
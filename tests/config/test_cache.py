@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from synapse.config import ConfigError
 from synapse.config.cache import CacheConfig, add_resizable_cache
 from synapse.types import JsonDict
 from synapse.util.caches.lrucache import LruCache
@@ -165,3 +166,39 @@ class CacheConfigTests(TestCase):
         add_resizable_cache("event_cache", cache_resize_callback=cache.set_cache_factor)
 
         self.assertEqual(cache.max_size, 10240)
+
+    def test_eviction_policy(self) -> None:
+        """
+        Per-cache eviction policies override the default one, and are applied
+        to caches that were instantiated before the config was loaded.
+        """
+        cache: LruCache = LruCache(100)
+        other_cache: LruCache = LruCache(100)
+        add_resizable_cache(
+            "foo",
+            cache_resize_callback=cache.set_cache_factor,
+            eviction_policy_callback=cache.set_eviction_policy,
+        )
+        add_resizable_cache(
+            "bar",
+            cache_resize_callback=other_cache.set_cache_factor,
+            eviction_policy_callback=other_cache.set_eviction_policy,
+        )
+        self.assertEqual(cache.eviction_policy, "lru")
+
+        config: JsonDict = {
+            "caches": {
+                "eviction_policy": "tinylfu",
+                "per_cache_eviction_policy": {"foo": "lru"},
+            }
+        }
+        self.config.read_config(config)
+        self.config.resize_all_caches()
+
+        self.assertEqual(cache.eviction_policy, "lru")
+        self.assertEqual(other_cache.eviction_policy, "tinylfu")
+
+    def test_invalid_eviction_policy(self) -> None:
+        config: JsonDict = {"caches": {"per_cache_eviction_policy": {"foo": "mru"}}}
+        with self.assertRaises(ConfigError):
+            self.config.read_config(config)
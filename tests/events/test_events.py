@@ -0,0 +1,88 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest as stdlib_unittest
+
+from synapse.api.room_versions import RoomVersions
+from synapse.events import EventBase, make_event_from_dict, make_event_from_json
+from synapse.util import json_encoder
+
+
+class MakeEventFromJsonTestCase(stdlib_unittest.TestCase):
+    def setUp(self) -> None:
+        self.original = make_event_from_dict(
+            {
+                "type": "m.room.member",
+                "room_id": "!room:test",
+                "sender": "@user:test",
+                "state_key": "@user:test",
+                "content": {"membership": "join"},
+                "auth_events": [],
+                "prev_events": [],
+                "depth": 1,
+                "origin_server_ts": 0,
+                "hashes": {"sha256": "abc"},
+                "signatures": {"test": {"ed25519:1": "sig"}},
+                "unsigned": {"age_ts": 0},
+            },
+            RoomVersions.V10,
+        )
+        self.event_json = json_encoder.encode(self.original.get_dict())
+
+    def _make_lazy_event(self, event_id: str) -> EventBase:
+        event = make_event_from_json(
+            event_json=self.event_json,
+            event_id=event_id,
+            header={
+                "type": self.original.type,
+                "room_id": self.original.room_id,
+                "sender": self.original.sender,
+                "state_key": self.original.state_key,
+            },
+            room_version=RoomVersions.V10,
+            internal_metadata_dict={},
+        )
+
+        # As when loading events from the database, whether the event is an
+        # outlier isn't part of its internal metadata dict.
+        event.internal_metadata.outlier = True
+        return event
+
+    def test_lazy_decoding(self) -> None:
+        """The fields in the header can be read without decoding the event."""
+        event = self._make_lazy_event(self.original.event_id)
+
+        self.assertEqual(event.event_id, self.original.event_id)
+        self.assertEqual(event.type, "m.room.member")
+        self.assertEqual(event.get("room_id"), "!room:test")
+        self.assertEqual(event.sender, "@user:test")
+        self.assertTrue(event.is_state())
+        self.assertEqual(event.state_key, "@user:test")
+        self.assertTrue(event.internal_metadata.is_outlier())
+        self.assertIsNotNone(event._lazy_json)
+
+        # Reading any other field decodes it.
+        self.assertEqual(event.membership, "join")
+        self.assertIsNone(event._lazy_json)
+        self.assertEqual(event.get_dict(), self.original.get_dict())
+        self.assertEqual(event.signatures, self.original.signatures)
+        self.assertEqual(event.unsigned, {"age_ts": 0})
+
+    def test_modified_event(self) -> None:
+        """Decoding an event whose contents don't match its event ID fails."""
+        event = self._make_lazy_event("$wrong_event_id")
+
+        self.assertRaises(RuntimeError, lambda: event.content)
+        # ... every time.
+        self.assertRaises(RuntimeError, event.get_dict)
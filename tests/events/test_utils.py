@@ -14,12 +14,16 @@
 
 import unittest as stdlib_unittest
 
+import attr
+
 from synapse.api.constants import EventContentFields
 from synapse.api.room_versions import RoomVersions
-from synapse.events import make_event_from_dict
+from synapse.events import EventBase, make_event_from_dict
 from synapse.events.utils import (
+    EventClientSerializer,
     SerializeEventConfig,
     copy_and_fixup_power_levels_contents,
+    format_event_for_client_v2,
     maybe_upsert_event_field,
     prune_event,
     serialize_event,
@@ -538,6 +542,73 @@ class SerializeEventTestCase(stdlib_unittest.TestCase):
             )
 
 
+class EventClientSerializerTestCase(stdlib_unittest.TestCase):
+    def setUp(self) -> None:
+        self.serializer = EventClientSerializer()
+        self.config = SerializeEventConfig(
+            event_format=format_event_for_client_v2, token_id=5
+        )
+
+    def _make_event(self) -> EventBase:
+        event = make_event_from_dict(
+            {
+                "type": "m.room.message",
+                "event_id": "$event",
+                "room_id": "!room:test",
+                "sender": "@alice:test",
+                "content": {"body": "hello"},
+                "unsigned": {"age_ts": 1000},
+            },
+            internal_metadata_dict={"token_id": 5, "txn_id": "txn"},
+        )
+        event.internal_metadata.stream_ordering = 1
+        return event
+
+    def test_per_request_fields(self) -> None:
+        """The fields which vary between requests are correct when the serialized
+        event is cached.
+        """
+        event = self._make_event()
+        for time_now in (2000, 3000):
+            serialized = self.serializer.serialize_event(
+                event, time_now, config=self.config
+            )
+            self.assertEqual(
+                serialized,
+                serialize_event(event, time_now, config=self.config),
+            )
+            self.assertEqual(serialized["unsigned"]["age"], time_now - 1000)
+            self.assertEqual(serialized["unsigned"]["transaction_id"], "txn")
+
+        # A different access token doesn't see the transaction ID.
+        serialized = self.serializer.serialize_event(
+            event, 2000, config=attr.evolve(self.config, token_id=6)
+        )
+        self.assertNotIn("transaction_id", serialized["unsigned"])
+
+    def test_modifying_result(self) -> None:
+        """Modifying a serialized event doesn't affect later serializations."""
+        event = self._make_event()
+        serialized = self.serializer.serialize_event(event, 2000, config=self.config)
+        serialized["unsigned"]["m.relations"] = {}
+        serialized["content"] = {}
+
+        serialized = self.serializer.serialize_event(event, 2000, config=self.config)
+        self.assertNotIn("m.relations", serialized["unsigned"])
+        self.assertEqual(serialized["content"], {"body": "hello"})
+
+    def test_new_unsigned_fields(self) -> None:
+        """New fields added to `unsigned` after the event was first serialized are
+        included.
+        """
+        event = self._make_event()
+        self.serializer.serialize_event(event, 2000, config=self.config)
+
+        event.unsigned["prev_content"] = {"body": "hi"}
+        serialized = self.serializer.serialize_event(event, 2000, config=self.config)
+        self.assertEqual(serialized["unsigned"]["prev_content"], {"body": "hi"})
+
+
 class CopyPowerLevelsContentTestCase(stdlib_unittest.TestCase):
     def setUp(self) -> None:
         self.test_content = {
@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Optional
+from typing import Any, Collection, Dict, List, Mapping, Optional, Tuple
 from unittest.mock import MagicMock, Mock, patch
 
 from twisted.test.proto_helpers import MemoryReactor
@@ -20,12 +20,18 @@ from synapse.api.constants import EventTypes, JoinRules
 from synapse.api.errors import Codes, ResourceLimitError
 from synapse.api.filtering import Filtering
 from synapse.api.room_versions import RoomVersions
-from synapse.handlers.sync import SyncConfig, SyncResult
+from synapse.handlers.sync import (
+    LAZY_LOADED_MEMBERS_EXTERNAL_CACHE_NAME,
+    LAZY_LOADED_MEMBERS_ROOMS_EXTERNAL_CACHE_NAME,
+    SyncConfig,
+    SyncResult,
+)
 from synapse.rest import admin
 from synapse.rest.client import knock, login, room
 from synapse.server import HomeServer
 from synapse.types import UserID, create_requester
 from synapse.util import Clock
+from synapse.util.caches.lazy_loaded_members import LazyLoadedMembersCache
 
 import tests.unittest
 import tests.utils
@@ -280,6 +286,137 @@ class SyncTestCase(tests.unittest.HomeserverTestCase):
         )
         self.assertEqual(eve_initial_sync_after_join.joined, [])
 
+    def test_room_timeline_shared_between_users(self) -> None:
+        """Users syncing the same room at the same position share the events loaded
+        from the database, but each get their own view of them.
+        """
+        alice = self.register_user("alice", "password")
+        alice_tok = self.login(alice, "password")
+        bob = self.register_user("bob", "password")
+        bob_tok = self.login(bob, "password")
+
+        # Bob is already in the room, but can't see the events sent before he
+        # was invited.
+        room_id = self.helper.create_room_as(alice, is_public=False, tok=alice_tok)
+        self.helper.send_state(
+            room_id,
+            EventTypes.RoomHistoryVisibility,
+            {"history_visibility": "invited"},
+            tok=alice_tok,
+        )
+        self.helper.send(room_id, "before bob", tok=alice_tok)
+        self.helper.invite(room_id, alice, bob, tok=alice_tok)
+        self.helper.join(room_id, bob, tok=bob_tok)
+        self.helper.send(room_id, "after bob", tok=alice_tok)
+
+        get_recent_events_for_room = Mock(
+            side_effect=self.store.get_recent_events_for_room
+        )
+        with patch.object(
+            self.store, "get_recent_events_for_room", get_recent_events_for_room
+        ):
+            results = {}
+            for user in (alice, bob):
+                results[user] = self.get_success(
+                    self.sync_handler.wait_for_sync_for_user(
+                        create_requester(user), generate_sync_config(user)
+                    )
+                )
+
+        get_recent_events_for_room.assert_called_once()
+
+        def bodies(result: SyncResult) -> List[str]:
+            self.assertEqual(len(result.joined), 1)
+            return [
+                e.content["body"]
+                for e in result.joined[0].timeline.events
+                if e.type == EventTypes.Message
+            ]
+
+        self.assertEqual(bodies(results[alice]), ["before bob", "after bob"])
+        self.assertEqual(bodies(results[bob]), ["after bob"])
+
+    def test_lazy_loaded_members_shared(self) -> None:
+        """The membership events sent to a client are shared with other workers
+        through the external cache, writing only the rooms which have changed.
+        """
+        values: Dict[Tuple[str, str], Any] = {}
+
+        async def set(cache_name: str, key: str, value: Any, expiry_ms: int) -> None:
+            values[(cache_name, key)] = value
+
+        async def set_many(
+            cache_name: str, new_values: Mapping[str, Any], expiry_ms: int
+        ) -> None:
+            for key, value in new_values.items():
+                values[(cache_name, key)] = value
+
+        async def get(cache_name: str, key: str) -> Optional[Any]:
+            return values.get((cache_name, key))
+
+        async def get_many(cache_name: str, keys: Collection[str]) -> Dict[str, Any]:
+            return {
+                key: values[(cache_name, key)]
+                for key in keys
+                if (cache_name, key) in values
+            }
+
+        external_cache = Mock()
+        external_cache.is_enabled.return_value = True
+        external_cache.set = Mock(side_effect=set)
+        external_cache.set_many = Mock(side_effect=set_many)
+        external_cache.get = Mock(side_effect=get)
+        external_cache.get_many = Mock(side_effect=get_many)
+        self.sync_handler._external_cache = external_cache
+
+        sync_config = generate_sync_config("@user:test")
+        cache_key = ("@user:test", "device_id")
+        token = self.hs.get_event_sources().get_current_token()
+        members = self.sync_handler.lazy_loaded_members
+
+        members.mark_sent(cache_key, "!room1:test", ["$a"])
+        members.mark_sent(cache_key, "!room2:test", ["$b"])
+        self.get_success(
+            self.sync_handler._save_lazy_loaded_members(sync_config, token)
+        )
+        self.assertEqual(
+            values[
+                (LAZY_LOADED_MEMBERS_ROOMS_EXTERNAL_CACHE_NAME, "@user:test:device_id")
+            ],
+            ["!room1:test", "!room2:test"],
+        )
+
+        # Only the room which changed is written.
+        external_cache.reset_mock()
+        members.mark_sent(cache_key, "!room1:test", ["$c"])
+        self.get_success(
+            self.sync_handler._save_lazy_loaded_members(sync_config, token)
+        )
+        external_cache.set_many.assert_called_once()
+        self.assertEqual(
+            list(external_cache.set_many.call_args[0][1]),
+            ["@user:test:device_id:!room1:test"],
+        )
+        external_cache.set.assert_not_called()
+
+        # Another worker picks up where this one left off.
+        self.sync_handler.lazy_loaded_members = LazyLoadedMembersCache(
+            self.clock, expiry_ms=1000
+        )
+        self.get_success(
+            self.sync_handler._load_lazy_loaded_members(sync_config, token)
+        )
+        external_cache.get_many.assert_called_once()
+        self.assertEqual(
+            external_cache.get_many.call_args[0][0],
+            LAZY_LOADED_MEMBERS_EXTERNAL_CACHE_NAME,
+        )
+        members = self.sync_handler.lazy_loaded_members
+        self.assertTrue(members.has_sent(cache_key, "!room1:test", "$a"))
+        self.assertTrue(members.has_sent(cache_key, "!room1:test", "$c"))
+        self.assertTrue(members.has_sent(cache_key, "!room2:test", "$b"))
+        self.assertFalse(members.has_changed(cache_key))
+
 
 _request_key = 0
 
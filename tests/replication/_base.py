@@ -542,6 +542,8 @@ class FakeRedisPubSubProtocol(Protocol):
             self.send("OK")
         elif command == b"GET":
             self.send(None)
+        elif command == b"MGET":
+            self.send([None] * len(args))
 
         # Connection keep-alives.
         elif command == b"PING":
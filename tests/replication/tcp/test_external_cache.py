@@ -0,0 +1,87 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+from unittest.mock import Mock, call
+
+from twisted.internet import defer
+
+from synapse.replication.tcp.external_cache import ExternalCache
+
+from tests import unittest
+
+
+class ExternalCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.redis = Mock()
+        hs = Mock()
+        hs.config.redis.redis_enabled = True
+        hs.get_outbound_redis_connection.return_value = self.redis
+        self.cache = ExternalCache(hs)
+
+    def test_get_many(self) -> None:
+        """Keys are looked up with a single MGET, and only the keys found are
+        returned.
+        """
+        self.redis.mget.return_value = defer.succeed(['{"a": 1}', None, 5])
+
+        result = self.successResultOf(
+            defer.ensureDeferred(self.cache.get_many("test", ["key1", "key2", "key3"]))
+        )
+
+        self.redis.mget.assert_called_once_with(
+            ["cache_v1:test:key1", "cache_v1:test:key2", "cache_v1:test:key3"]
+        )
+        self.assertEqual(result, {"key1": {"a": 1}, "key3": 5})
+
+    def test_get_many_no_keys(self) -> None:
+        result = self.successResultOf(
+            defer.ensureDeferred(self.cache.get_many("test", []))
+        )
+        self.assertEqual(result, {})
+        self.redis.mget.assert_not_called()
+
+    def test_set_many(self) -> None:
+        """All the SETs are sent before waiting for any of the replies."""
+        replies: "List[defer.Deferred[None]]" = [defer.Deferred(), defer.Deferred()]
+        self.redis.set.side_effect = replies
+
+        d = defer.ensureDeferred(
+            self.cache.set_many("test", {"key1": {"a": 1}, "key2": [2]}, 1000)
+        )
+
+        self.assertEqual(
+            self.redis.set.call_args_list,
+            [
+                call("cache_v1:test:key1", '{"a":1}', pexpire=1000),
+                call("cache_v1:test:key2", "[2]", pexpire=1000),
+            ],
+        )
+
+        replies[1].callback(None)
+        self.assertNoResult(d)
+        replies[0].callback(None)
+        self.successResultOf(d)
+
+    def test_set_many_failure(self) -> None:
+        """A failed SET fails the whole request."""
+        self.redis.set.side_effect = [
+            defer.succeed(None),
+            defer.fail(Exception("Redis is down")),
+        ]
+
+        d = defer.ensureDeferred(
+            self.cache.set_many("test", {"key1": 1, "key2": 2}, 1000)
+        )
+        self.failureResultOf(d, Exception)
@@ -974,3 +974,105 @@ class ExcludeRoomTestCase(unittest.HomeserverTestCase):
 
         self.assertNotIn(self.excluded_room_id, channel.json_body["rooms"]["join"])
         self.assertIn(self.included_room_id, channel.json_body["rooms"]["join"])
+
+
+class RoomWindowSyncTestCase(unittest.HomeserverTestCase):
+    """Tests syncing a window of the user's rooms, ordered by recency."""
+
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config["experimental_features"] = {"msc3575_enabled": True}
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+        # The rooms, in order of when they were last active.
+        self.room_ids = [self.helper.create_room_as(tok=self.tok) for _ in range(4)]
+        for room_id in self.room_ids:
+            self.helper.send(room_id, "hello", tok=self.tok)
+
+    def _sync(self, room_range: str, since: Optional[str] = None) -> JsonDict:
+        url = "/sync?org.matrix.msc3575.range=" + room_range
+        if since:
+            url += "&since=" + since
+        channel = self.make_request("GET", url, access_token=self.tok)
+        self.assertEqual(channel.code, 200, channel.json_body)
+        return channel.json_body
+
+    def test_initial_sync(self) -> None:
+        """Only the rooms in the window are returned, most recent first."""
+        body = self._sync("1,2")
+
+        expected = [self.room_ids[2], self.room_ids[1]]
+        self.assertEqual(
+            body["org.matrix.msc3575.rooms"],
+            {"count": 4, "range": [1, 2], "room_ids": expected},
+        )
+        self.assertCountEqual(body["rooms"]["join"], expected)
+
+        # The rooms are returned in full.
+        for room_id in expected:
+            state_types = [
+                e["type"] for e in body["rooms"]["join"][room_id]["state"]["events"]
+            ]
+            timeline_types = [
+                e["type"] for e in body["rooms"]["join"][room_id]["timeline"]["events"]
+            ]
+            self.assertIn(EventTypes.Create, state_types + timeline_types)
+
+    def test_incremental_sync(self) -> None:
+        """Rooms which move into the window are returned in full, and rooms
+        outside it are left out.
+        """
+        body = self._sync("0,1")
+        self.assertEqual(
+            body["org.matrix.msc3575.rooms"]["room_ids"],
+            [self.room_ids[3], self.room_ids[2]],
+        )
+
+        # Activity in a room outside the window moves it to the top, so the
+        # second room drops out of the window.
+        self.helper.send(self.room_ids[0], "new", tok=self.tok)
+        body = self._sync("0,1", since=body["next_batch"])
+
+        self.assertEqual(
+            body["org.matrix.msc3575.rooms"]["room_ids"],
+            [self.room_ids[0], self.room_ids[3]],
+        )
+        self.assertEqual(list(body["rooms"]["join"]), [self.room_ids[0]])
+
+        # The client hasn't seen the room before, so it gets the full state
+        # rather than just the new event.
+        room = body["rooms"]["join"][self.room_ids[0]]
+        self.assertIn(
+            EventTypes.Create,
+            [e["type"] for e in room["state"]["events"] + room["timeline"]["events"]],
+        )
+
+        # Activity in a room already in the window is sent as normal.
+        self.helper.send(self.room_ids[3], "again", tok=self.tok)
+        body = self._sync("0,1", since=body["next_batch"])
+
+        room = body["rooms"]["join"][self.room_ids[3]]
+        self.assertEqual(
+            [e["content"]["body"] for e in room["timeline"]["events"]], ["again"]
+        )
+        self.assertEqual(room["state"]["events"], [])
+
+    def test_invalid_range(self) -> None:
+        for room_range in ("1", "2,1", "-1,3", "a,b"):
+            channel = self.make_request(
+                "GET",
+                "/sync?org.matrix.msc3575.range=" + room_range,
+                access_token=self.tok,
+            )
+            self.assertEqual(channel.code, 400, room_range)
@@ -0,0 +1,81 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from io import StringIO
+
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.api.constants import EventTypes
+from synapse.rest import admin
+from synapse.rest.client import login, room
+from synapse.server import HomeServer
+from synapse.state.snapshot import (
+    SnapshotFormatError,
+    StateResSnapshot,
+    export_state_res_snapshot,
+)
+from synapse.util import Clock
+
+from tests import unittest
+
+
+class StateResSnapshotTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.user_id = self.register_user("user", "pass")
+        self.token = self.login("user", "pass")
+
+    def test_export_and_load(self) -> None:
+        room_id = self.helper.create_room_as(self.user_id, tok=self.token)
+        self.helper.send_state(
+            room_id, EventTypes.Topic, {"topic": "Snapshots"}, tok=self.token
+        )
+        event_id = self.helper.send(room_id, body="Hello", tok=self.token)["event_id"]
+
+        snapshot = self.get_success(
+            export_state_res_snapshot(self.hs, room_id, event_id)
+        )
+        self.assertEqual(len(snapshot.state_groups), 1)
+        (state,) = snapshot.state_groups.values()
+        self.assertIn((EventTypes.Topic, ""), state)
+
+        # The events include the state and its auth chains.
+        for state_event_id in state.values():
+            self.assertIn(state_event_id, snapshot.events)
+            for auth_event_id in snapshot.events[state_event_id].auth_event_ids():
+                self.assertIn(auth_event_id, snapshot.events)
+
+        self.assertIsNotNone(snapshot.auth_chain_cover_index)
+
+        # Dumping the loaded snapshot gives the same file.
+        f = StringIO()
+        snapshot.dump(f)
+        loaded = StateResSnapshot.load(StringIO(f.getvalue()))
+        self.assertEqual(loaded.state_groups, snapshot.state_groups)
+        self.assertEqual(loaded.events.keys(), snapshot.events.keys())
+
+        f2 = StringIO()
+        loaded.dump(f2)
+        self.assertEqual(f2.getvalue(), f.getvalue())
+
+    def test_load_invalid(self) -> None:
+        with self.assertRaises(SnapshotFormatError):
+            StateResSnapshot.load(StringIO('{"format": 1000}'))
+        with self.assertRaises(SnapshotFormatError):
+            StateResSnapshot.load(StringIO("not json"))
@@ -13,7 +13,10 @@
 # limitations under the License.
 
 import itertools
+import pickle
 from typing import (
+    Any,
+    Callable,
     Collection,
     Dict,
     Iterable,
@@ -23,22 +26,28 @@ from typing import (
     Set,
     Tuple,
     TypeVar,
+    cast,
 )
+from unittest.mock import patch
 
 import attr
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 
 from synapse.api.constants import EventTypes, JoinRules, Membership
 from synapse.api.room_versions import RoomVersions
 from synapse.event_auth import auth_types_for_event
 from synapse.events import EventBase, make_event_from_dict
+from synapse.state import v2
 from synapse.state.v2 import (
     _get_auth_chain_difference,
     lexicographical_topological_sort,
+    resolve_events_incrementally,
     resolve_events_with_store,
+    resolve_events_with_summary,
 )
-from synapse.types import EventID, StateMap
+from synapse.types import EventID, ISynapseReactor, StateMap
+from synapse.util.process_pool import ProcessPool
 
 from tests import unittest
 
@@ -181,6 +190,9 @@ INITIAL_EDGES = ["START", "IMZ", "IMC", "IMB", "IJR", "IPOWER", "IMA", "CREATE"]
 
 
 class StateTestCase(unittest.TestCase):
+    # The pool to resolve state in, if any.
+    process_pool: Optional[ProcessPool] = None
+
     def test_ban_vs_pl(self) -> None:
         events = [
             FakeEvent(
@@ -508,6 +520,7 @@ class StateTestCase(unittest.TestCase):
                     [state_at_event[n] for n in prev_events],
                     event_map=event_map,
                     state_res_store=TestStateResolutionStore(event_map),
+                    process_pool=self.process_pool,
                 )
 
                 state_before = self.successResultOf(defer.ensureDeferred(state_d))
@@ -558,6 +571,61 @@ class StateTestCase(unittest.TestCase):
         self.assertEqual(expected_state, end_state)
 
 
+R = TypeVar("R")
+
+
+class InlineProcessPool:
+    """Runs functions in this process instead of a subprocess, pickling their
+    arguments and result as `ProcessPool` would.
+    """
+
+    def __init__(self) -> None:
+        # The functions run, with their arguments and results.
+        self.calls: List[Tuple[Callable[..., Any], Tuple[Any, ...], Any]] = []
+
+    async def run(self, f: Callable[..., R], *args: Any) -> R:
+        result = f(*pickle.loads(pickle.dumps(args)))
+        self.calls.append((f, args, result))
+        return pickle.loads(pickle.dumps(result))
+
+
+class ProcessPoolStateTestCase(StateTestCase):
+    """Runs the `StateTestCase` tests with the sorting and auth checks done in
+    a process pool.
+    """
+
+    def setUp(self) -> None:
+        self.inline_pool = InlineProcessPool()
+        self.process_pool = cast(ProcessPool, self.inline_pool)
+
+    def do_check(
+        self,
+        events: List[FakeEvent],
+        edges: List[List[str]],
+        expected_state_ids: List[str],
+    ) -> None:
+        # Resolving in the pool falls back to resolving in this process if it
+        # fails, with a warning.
+        with patch.object(v2.logger, "warning") as warning:
+            super().do_check(events, edges, expected_state_ids)
+
+        warning.assert_not_called()
+        self.assertGreater(len(self.inline_pool.calls), 0)
+
+    def test_real_process_pool(self) -> "defer.Deferred[None]":
+        """The resolutions give the same results in a real subprocess."""
+        self.test_ban_vs_pl()
+
+        pool = ProcessPool(cast(ISynapseReactor, reactor), "test", max_workers=1)
+        self.addCleanup(pool.shutdown)
+
+        async def run_in_pool() -> None:
+            for f, args, result in self.inline_pool.calls:
+                self.assertEqual(await pool.run(f, *args), result)
+
+        return defer.ensureDeferred(run_in_pool())
+
+
 class LexicographicalTestCase(unittest.TestCase):
     def test_simple(self) -> None:
         graph: Dict[str, Set[str]] = {
@@ -678,6 +746,123 @@ class SimpleParamStateTestCase(unittest.TestCase):
 
         self.assert_dict(self.expected_combined_state, state)
 
+    def test_incremental(self) -> None:
+        """A resolution which only adds an independent event to the conflicted
+        state can be done incrementally, with the same result as from scratch.
+        """
+        store = TestStateResolutionStore(self.event_map)
+        state, summary = self.successResultOf(
+            defer.ensureDeferred(
+                resolve_events_with_summary(
+                    FakeClock(),
+                    ROOM_ID,
+                    RoomVersions.V2,
+                    [self.state_at_bob, self.state_at_charlie],
+                    event_map=None,
+                    state_res_store=store,
+                )
+            )
+        )
+        self.assert_dict(self.expected_combined_state, state)
+
+        # Alice sets the topic on Bob's side of the fork.
+        topic = FakeEvent(
+            id="T1", sender=ALICE, type=EventTypes.Topic, state_key="", content={}
+        ).to_event(
+            auth_events=[self.create_event.event_id, self.alice_member.event_id],
+            prev_events=[self.bob_member.event_id],
+        )
+        self.event_map[topic.event_id] = topic
+        state_sets = [
+            {**self.state_at_bob, (EventTypes.Topic, ""): topic.event_id},
+            self.state_at_charlie,
+        ]
+
+        result = self.successResultOf(
+            defer.ensureDeferred(
+                resolve_events_incrementally(
+                    FakeClock(),
+                    ROOM_ID,
+                    RoomVersions.V2,
+                    state_sets,
+                    [(EventTypes.Topic, "")],
+                    summary,
+                    event_map=None,
+                    state_res_store=store,
+                )
+            )
+        )
+        assert result is not None
+        state, _ = result
+
+        expected_state = self.successResultOf(
+            defer.ensureDeferred(
+                resolve_events_with_store(
+                    FakeClock(),
+                    ROOM_ID,
+                    RoomVersions.V2,
+                    state_sets,
+                    event_map=None,
+                    state_res_store=store,
+                )
+            )
+        )
+        self.assertEqual(expected_state[(EventTypes.Topic, "")], topic.event_id)
+        self.assert_dict(expected_state, state)
+
+    def test_incremental_dependent(self) -> None:
+        """A resolution which changes previously conflicted state can't be done
+        incrementally.
+        """
+        store = TestStateResolutionStore(self.event_map)
+        _, summary = self.successResultOf(
+            defer.ensureDeferred(
+                resolve_events_with_summary(
+                    FakeClock(),
+                    ROOM_ID,
+                    RoomVersions.V2,
+                    [self.state_at_bob, self.state_at_charlie],
+                    event_map=None,
+                    state_res_store=store,
+                )
+            )
+        )
+
+        # Bob changes his displayname.
+        bob_member = FakeEvent(
+            id="IMB2",
+            sender=BOB,
+            type=EventTypes.Member,
+            state_key=BOB,
+            content={"membership": Membership.JOIN, "displayname": "Bob"},
+        ).to_event(
+            auth_events=[self.create_event.event_id, self.bob_member.event_id],
+            prev_events=[self.bob_member.event_id],
+        )
+        self.event_map[bob_member.event_id] = bob_member
+
+        result = self.successResultOf(
+            defer.ensureDeferred(
+                resolve_events_incrementally(
+                    FakeClock(),
+                    ROOM_ID,
+                    RoomVersions.V2,
+                    [
+                        {
+                            **self.state_at_bob,
+                            (EventTypes.Member, BOB): bob_member.event_id,
+                        },
+                        self.state_at_charlie,
+                    ],
+                    [(EventTypes.Member, BOB)],
+                    summary,
+                    event_map=None,
+                    state_res_store=store,
+                )
+            )
+        )
+        self.assertIsNone(result)
+
 
 class AuthChainDifferenceTestCase(unittest.TestCase):
     """We test that `_get_auth_chain_difference` correctly handles unpersisted
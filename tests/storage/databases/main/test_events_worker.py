@@ -23,14 +23,19 @@ from twisted.test.proto_helpers import MemoryReactor
 from synapse.api.room_versions import EventFormatVersions, RoomVersions
 from synapse.events import make_event_from_dict
 from synapse.logging.context import LoggingContext
+from synapse.replication.tcp.streams import CachesStream
 from synapse.rest import admin
 from synapse.rest.client import login, room
 from synapse.server import HomeServer
+from synapse.storage.databases.main.cache import PURGED_EVENTS_CACHE_NAME
 from synapse.storage.databases.main.events_worker import (
+    EVENT_QUEUE_BACKGROUND_MAX_DELAY_S,
     EVENT_QUEUE_THREADS,
     EventsWorkerStore,
+    _EventFetchRequest,
 )
 from synapse.storage.types import Connection
+from synapse.types import JsonDict
 from synapse.util import Clock
 from synapse.util.async_helpers import yieldable_gather_results
 
@@ -223,6 +228,110 @@ class EventCacheTestCase(unittest.HomeserverTestCase):
             # from the DB
             self.assertEqual(ctx.get_resource_usage().evt_db_fetch_count, 0)
 
+    def test_lazy_decoding(self) -> None:
+        """Test that events from the DB aren't decoded until we need more than
+        their type, room, sender and state key.
+        """
+        self.store._event_ref.clear()
+        event = self.get_success(self.store.get_event(self.event_id))
+
+        self.assertEqual(event.type, "m.room.message")
+        self.assertEqual(event.room_id, self.room)
+        self.assertEqual(event.sender, self.user)
+        self.assertFalse(event.is_state())
+        self.assertIsNotNone(event._lazy_json)
+
+        self.assertEqual(event.content["msgtype"], "m.text")
+        self.assertIsNone(event._lazy_json)
+
+    def test_malformed_json(self) -> None:
+        """Test that events whose JSON is corrupt are treated as unknown, even
+        though they aren't decoded when they are fetched.
+        """
+        event_json = self.get_success(
+            self.store.db_pool.simple_select_one_onecol(
+                table="event_json",
+                keyvalues={"event_id": self.event_id},
+                retcol="json",
+            )
+        )
+        self.get_success(
+            self.store.db_pool.simple_update_one(
+                table="event_json",
+                keyvalues={"event_id": self.event_id},
+                updatevalues={"json": event_json[: len(event_json) // 2]},
+            )
+        )
+        self.store._event_ref.clear()
+
+        event = self.get_success(self.store.get_event(self.event_id, allow_none=True))
+        self.assertIsNone(event)
+
+        # Corrupt JSON which still looks like an object is also caught.
+        self.get_success(
+            self.store.db_pool.simple_update_one(
+                table="event_json",
+                keyvalues={"event_id": self.event_id},
+                updatevalues={"json": event_json.replace('"', "", 1)},
+            )
+        )
+        self.get_success(self.store._get_event_cache.clear())
+
+        event = self.get_success(self.store.get_event(self.event_id, allow_none=True))
+        self.assertIsNone(event)
+
+    def test_modified_json(self) -> None:
+        """Test that events which have been modified in the database fail to be
+        fetched, even though they aren't decoded when they are fetched.
+        """
+        event_json = self.get_success(
+            self.store.db_pool.simple_select_one_onecol(
+                table="event_json",
+                keyvalues={"event_id": self.event_id},
+                retcol="json",
+            )
+        )
+        event_dict = json.loads(event_json)
+        # The event ID is calculated from the redacted event, so we need to modify
+        # a field which is kept when redacting.
+        event_dict["origin_server_ts"] += 1
+        self.get_success(
+            self.store.db_pool.simple_update_one(
+                table="event_json",
+                keyvalues={"event_id": self.event_id},
+                updatevalues={"json": json.dumps(event_dict)},
+            )
+        )
+        self.get_success(self.store._get_event_cache.clear())
+        self.store._event_ref.clear()
+
+        self.get_failure(self.store.get_event(self.event_id), RuntimeError)
+
+    def test_redactions_fetched_together(self) -> None:
+        """Test that the events which redact an event are fetched from the DB along
+        with it, rather than in another round trip.
+        """
+        channel = self.make_request(
+            "PUT",
+            f"/rooms/{self.room}/redact/{self.event_id}/txn1",
+            {},
+            access_token=self.token,
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+        redaction_id = channel.json_body["event_id"]
+
+        self.get_success(self.store._get_event_cache.clear())
+        self.store._event_ref.clear()
+
+        with mock.patch.object(
+            self.store, "_enqueue_events", wraps=self.store._enqueue_events
+        ) as enqueue_events:
+            event = self.get_success(self.store.get_event(self.event_id))
+
+        enqueue_events.assert_called_once()
+        self.assertTrue(event.internal_metadata.is_redacted())
+        self.assertEqual(event.unsigned["redacted_by"], redaction_id)
+
     def test_dedupe(self) -> None:
         """Test that if we request the same event multiple times we only pull it
         out once.
@@ -368,6 +477,44 @@ class DatabaseOutageTestCase(unittest.HomeserverTestCase):
         self.get_success(self.store.get_event(self.event_ids[0]))
 
 
+class EventFetchPriorityTestCase(unittest.HomeserverTestCase):
+    """Test that fetches made by requests are prioritised over background ones."""
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store: EventsWorkerStore = hs.get_datastores().main
+
+    def _queue(self, interactive: bool) -> _EventFetchRequest:
+        request = _EventFetchRequest(
+            event_ids=[],
+            deferred=Deferred(),
+            interactive=interactive,
+            queued_at=self.clock.time(),
+        )
+        self.store._event_fetch_list.append(request)
+        return request
+
+    def _take(self) -> List[_EventFetchRequest]:
+        with self.store._event_fetch_lock:
+            return self.store._take_event_fetch_requests()
+
+    def test_interactive_first(self) -> None:
+        background = self._queue(interactive=False)
+        interactive = self._queue(interactive=True)
+
+        self.assertEqual(self._take(), [interactive])
+        self.assertEqual(self._take(), [background])
+        self.assertEqual(self._take(), [])
+
+    def test_background_not_starved(self) -> None:
+        """Background fetches are not held back for too long."""
+        background = self._queue(interactive=False)
+        self.reactor.advance(EVENT_QUEUE_BACKGROUND_MAX_DELAY_S + 0.1)
+        interactive = self._queue(interactive=True)
+
+        self.assertEqual(self._take(), [background, interactive])
+        self.assertEqual(self._take(), [])
+
+
 class GetEventCancellationTestCase(unittest.HomeserverTestCase):
     """Test cancellation of `get_event` calls."""
 
@@ -483,3 +630,159 @@ class GetEventCancellationTestCase(unittest.HomeserverTestCase):
             unblock.callback(None)
             # The first `get_event` call should complete successfully.
             self.get_success(get_event1)
+
+
+class SharedEventCacheTestCase(unittest.HomeserverTestCase):
+    """Test that events are shared between processes via the shared event cache."""
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config["caches"] = {
+            "shared_event_cache": {"path": self.mktemp(), "size": "1M"},
+        }
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store: EventsWorkerStore = hs.get_datastores().main
+
+        self.user = self.register_user("user", "pass")
+        self.token = self.login(self.user, "pass")
+
+        self.room = self.helper.create_room_as(self.user, tok=self.token)
+
+        res = self.helper.send(self.room, tok=self.token)
+        self.event_id = res["event_id"]
+
+        self._clear_local_caches()
+
+    def _clear_local_caches(self) -> None:
+        self.get_success(self.store._get_event_cache.clear())
+        self.store._event_ref.clear()
+
+    def test_simple(self) -> None:
+        """Events fetched from the database are added to the shared cache, and
+        read back from it instead of the database.
+        """
+        event = self.get_success(self.store.get_event(self.event_id))
+        self._clear_local_caches()
+
+        with mock.patch.object(
+            self.store, "_enqueue_events", wraps=self.store._enqueue_events
+        ) as enqueue_events:
+            shared_event = self.get_success(self.store.get_event(self.event_id))
+
+        enqueue_events.assert_not_called()
+        self.assertEqual(shared_event.get_dict(), event.get_dict())
+        self.assertEqual(
+            shared_event.internal_metadata.stream_ordering,
+            event.internal_metadata.stream_ordering,
+        )
+
+    def test_invalidation(self) -> None:
+        """Invalidating an event removes it from the shared cache."""
+        self.get_success(self.store.get_event(self.event_id))
+        self.get_success(self.store._invalidate_async_get_event_cache(self.event_id))
+        self._clear_local_caches()
+
+        with mock.patch.object(
+            self.store, "_enqueue_events", wraps=self.store._enqueue_events
+        ) as enqueue_events:
+            self.get_success(self.store.get_event(self.event_id))
+
+        enqueue_events.assert_called_once()
+
+    def test_purge_room(self) -> None:
+        """Purging a room removes its events from the shared cache."""
+        self.get_success(self.store.get_event(self.event_id))
+        assert self.store._shared_event_cache is not None
+        self.assertIsNotNone(self.store._shared_event_cache.get(self.event_id))
+
+        self.get_success(
+            self.hs.get_storage_controllers().purge_events.purge_room(self.room)
+        )
+
+        self.assertIsNone(self.store._shared_event_cache.get(self.event_id))
+
+    def test_purge_over_replication(self) -> None:
+        """Purges seen over replication remove the events from the shared cache."""
+        self.get_success(self.store.get_event(self.event_id))
+        assert self.store._shared_event_cache is not None
+
+        self.store.process_replication_rows(
+            CachesStream.NAME,
+            "other_worker",
+            1,
+            [
+                CachesStream.CachesStreamRow(
+                    cache_func=PURGED_EVENTS_CACHE_NAME,
+                    keys=[self.event_id],
+                    invalidation_ts=0,
+                )
+            ],
+        )
+
+        self.assertIsNone(self.store._shared_event_cache.get(self.event_id))
+        self.assertIsNone(self.store._get_event_cache.get_local((self.event_id,), None))
+
+
+class EventExistenceFilterTestCase(unittest.HomeserverTestCase):
+    """Test that the event existence filter saves DB queries for unknown events."""
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+        config["caches"] = {"event_existence_filter": {"enabled": True}}
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store: EventsWorkerStore = hs.get_datastores().main
+
+        self.user = self.register_user("user", "pass")
+        self.token = self.login(self.user, "pass")
+
+        self.room = self.helper.create_room_as(self.user, tok=self.token)
+
+        res = self.helper.send(self.room, tok=self.token)
+        self.event_id = res["event_id"]
+
+    def test_simple(self) -> None:
+        """Events which aren't in the filter are reported as unseen without a
+        DB query.
+        """
+        self.assertTrue(self.store._event_existence_filter_ready)
+
+        with LoggingContext(name="test") as ctx:
+            res = self.get_success(
+                self.store.have_seen_events(self.room, ["eventdoesnotexist"])
+            )
+            self.assertEqual(res, set())
+            self.assertEqual(ctx.get_resource_usage().db_txn_count, 0)
+
+        with LoggingContext(name="test") as ctx:
+            res = self.get_success(
+                self.store.have_seen_events(
+                    self.room, [self.event_id, "othereventdoesnotexist"]
+                )
+            )
+            self.assertEqual(res, {self.event_id})
+            self.assertEqual(ctx.get_resource_usage().db_txn_count, 1)
+
+    def test_new_events(self) -> None:
+        """Events persisted after the filter was built are added to it."""
+        self.get_success(self.store.have_seen_events(self.room, ["$new_event"]))
+
+        new_event_id = self.helper.send(self.room, tok=self.token)["event_id"]
+
+        res = self.get_success(self.store.have_seen_events(self.room, [new_event_id]))
+        self.assertEqual(res, {new_event_id})
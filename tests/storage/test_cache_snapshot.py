@@ -0,0 +1,112 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+from twisted.test.proto_helpers import MemoryReactor
+
+from synapse.rest import admin
+from synapse.rest.client import login, room
+from synapse.server import HomeServer
+from synapse.types import JsonDict
+from synapse.util import Clock
+
+from tests import unittest
+
+
+class CacheSnapshotTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def default_config(self) -> JsonDict:
+        config = super().default_config()
+
+        snapshot_directory = self.mktemp()
+        os.mkdir(snapshot_directory)
+        config["caches"]["snapshot_directory"] = snapshot_directory
+
+        return config
+
+    def prepare(self, reactor: MemoryReactor, clock: Clock, hs: HomeServer) -> None:
+        self.store = hs.get_datastores().main
+        self.cache_snapshot = hs.get_storage_controllers().cache_snapshot
+
+        self.alice = self.register_user("alice", "pass")
+        self.alice_tok = self.login("alice", "pass")
+        self.bob = self.register_user("bob", "pass")
+        self.bob_tok = self.login("bob", "pass")
+
+        self.room_id = self.helper.create_room_as(self.alice, tok=self.alice_tok)
+
+        # Populate the caches.
+        self.get_success(self.store.get_users_in_room(self.room_id))
+        self.get_success(self.store.get_rooms_for_user(self.alice))
+        self.get_success(self.store.get_rooms_for_user(self.bob))
+
+    def _clear_caches(self) -> None:
+        self.store.get_users_in_room.invalidate_all()
+        self.store.get_rooms_for_user.invalidate_all()
+
+    def test_restore(self) -> None:
+        """Cache entries are reloaded from the snapshot."""
+        self.cache_snapshot.write_snapshot()
+        self._clear_caches()
+
+        self.get_success(self.cache_snapshot.restore_snapshot())
+
+        self.assertEqual(
+            self.store.get_users_in_room.cache.get_immediate(self.room_id, None),
+            [self.alice],
+        )
+        self.assertEqual(
+            self.store.get_rooms_for_user.cache.get_immediate(self.alice, None),
+            frozenset([self.room_id]),
+        )
+        self.assertEqual(
+            self.store.get_rooms_for_user.cache.get_immediate(self.bob, None),
+            frozenset(),
+        )
+
+        # The snapshot is only used once.
+        self._clear_caches()
+        self.get_success(self.cache_snapshot.restore_snapshot())
+        self.assertIsNone(
+            self.store.get_users_in_room.cache.get_immediate(self.room_id, None)
+        )
+
+    def test_discard_stale_entries(self) -> None:
+        """Cache entries which were invalidated after the snapshot was taken are
+        not reloaded.
+        """
+        self.cache_snapshot.write_snapshot()
+
+        self.helper.join(self.room_id, self.bob, tok=self.bob_tok)
+        self._clear_caches()
+
+        self.get_success(self.cache_snapshot.restore_snapshot())
+
+        self.assertIsNone(
+            self.store.get_users_in_room.cache.get_immediate(self.room_id, None)
+        )
+        self.assertIsNone(
+            self.store.get_rooms_for_user.cache.get_immediate(self.bob, None)
+        )
+
+        # Alice's rooms haven't changed, so are still restored.
+        self.assertEqual(
+            self.store.get_rooms_for_user.cache.get_immediate(self.alice, None),
+            frozenset([self.room_id]),
+        )
@@ -14,6 +14,7 @@
 
 import datetime
 from typing import Dict, List, Tuple, Union, cast
+from unittest.mock import patch
 
 import attr
 from parameterized import parameterized
@@ -525,6 +526,95 @@ class EventFederationWorkerStoreTestCase(tests.unittest.HomeserverTestCase):
         )
         self.assertSetEqual(difference, set())
 
+    def test_auth_chain_cover_index_cache(self) -> None:
+        """Test that the in-memory chain cover index of a room picks up events
+        added after it was loaded.
+        """
+        room_id = self._setup_auth_chain(True)
+
+        # Load the room's index.
+        auth_chain_ids = self.get_success(self.store.get_auth_chain_ids(room_id, ["a"]))
+        self.assertCountEqual(auth_chain_ids, ["e", "f", "g", "h", "i", "j", "k"])
+        index = self.store._auth_chain_cover_index.get(room_id)
+        assert index is not None
+        self.assertEqual(len(index), 11)
+
+        # Add some events which build on the existing ones.
+        #
+        #   M
+        #   | \
+        #   L  C
+        #   |
+        #   A
+        auth_graph = {"l": ["a"], "m": ["l", "c"]}
+
+        def insert_event(txn: LoggingTransaction) -> None:
+            # The chains of the existing auth events are looked up through
+            # `state_events`, which `_setup_auth_chain` doesn't fill in, as all
+            # its events are persisted together.
+            self.store.db_pool.simple_insert_many_txn(
+                txn,
+                table="state_events",
+                keys=("event_id", "room_id", "type", "state_key"),
+                values=[
+                    (event_id, room_id, "m.test", event_id) for event_id in ("a", "c")
+                ],
+            )
+
+            for stream_ordering, event_id in enumerate(auth_graph, start=100):
+                self.store.db_pool.simple_insert_txn(
+                    txn,
+                    table="events",
+                    values={
+                        "event_id": event_id,
+                        "room_id": room_id,
+                        "depth": stream_ordering,
+                        "topological_ordering": stream_ordering,
+                        "type": "m.test",
+                        "processed": True,
+                        "outlier": False,
+                        "stream_ordering": stream_ordering,
+                    },
+                )
+
+            self.hs.datastores.persist_events._persist_event_auth_chain_txn(
+                txn,
+                [
+                    cast(EventBase, FakeEvent(event_id, room_id, auth_graph[event_id]))
+                    for event_id in auth_graph
+                ],
+            )
+
+        self.get_success(self.store.db_pool.runInteraction("insert", insert_event))
+
+        # The chains of the new events have been calculated, so the index (rather
+        # than the database) can answer for them.
+        with patch.object(
+            self.store,
+            "_get_auth_chain_ids_using_cover_index_txn",
+            side_effect=AssertionError("Queried the database"),
+        ), patch.object(
+            self.store,
+            "_get_auth_chain_difference_using_cover_index_txn",
+            side_effect=AssertionError("Queried the database"),
+        ):
+            auth_chain_ids = self.get_success(
+                self.store.get_auth_chain_ids(room_id, ["m"])
+            )
+            self.assertCountEqual(
+                auth_chain_ids, ["a", "c", "e", "f", "g", "h", "i", "j", "k", "l"]
+            )
+            self.assertEqual(len(index), 13)
+
+            difference = self.get_success(
+                self.store.get_auth_chain_difference(room_id, [{"m"}, {"b"}])
+            )
+            self.assertSetEqual(difference, {"a", "b", "c", "l", "m"})
+
+        # Purging the room forgets the index.
+        self.get_success(self.store.purge_room(room_id))
+        self.assertIsNone(self.store._auth_chain_cover_index.get(room_id))
+
     @parameterized.expand(
         [(room_version,) for room_version in KNOWN_ROOM_VERSIONS.values()]
     )
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import logging
+from unittest.mock import Mock
 
 from frozendict import frozendict
 
@@ -238,6 +239,18 @@ class StateStoreTestCase(HomeserverTestCase):
         )
         group = list(group_ids.keys())[0]
 
+        # The state of the final group was worked out from the cached state of
+        # an ancestor plus the deltas since, so its full state isn't cached.
+        self.assertFalse(self.state_datastore._state_group_cache.get(group).full)
+        self.assertFalse(
+            self.state_datastore._state_group_members_cache.get(group).full
+        )
+
+        # Without the deltas, its full state is loaded from the database and
+        # cached.
+        self.state_datastore.get_state_group_delta.invalidate_all()
+        self.get_success(self.state_datastore._get_state_for_groups([group]))
+
         # test _get_state_for_group_using_cache correctly filters out members
         # with types=[]
         (state_dict, is_all,) = self.state_datastore._get_state_for_group_using_cache(
@@ -494,3 +507,58 @@ class StateStoreTestCase(HomeserverTestCase):
 
         self.assertEqual(is_all, True)
         self.assertDictEqual({(e5.type, e5.state_key): e5.event_id}, state_dict)
+
+    def test_get_state_for_groups_using_deltas(self) -> None:
+        """The state of a group stored as a delta is worked out from the cached
+        state of its previous group, without going to the database.
+        """
+        room_id = self.room.to_string()
+        state = {
+            (EventTypes.Create, ""): "$create",
+            (EventTypes.Member, "@alice:test"): "$alice",
+        }
+        delta = {
+            (EventTypes.Name, ""): "$name",
+            (EventTypes.Member, "@bob:test"): "$bob",
+        }
+
+        group1 = self.get_success(
+            self.state_datastore.store_state_group("$alice", room_id, None, None, state)
+        )
+        group2 = self.get_success(
+            self.state_datastore.store_state_group("$bob", room_id, group1, delta, None)
+        )
+
+        self.state_datastore._get_state_groups_from_groups = Mock(  # type: ignore[assignment]
+            side_effect=AssertionError("Unexpected database lookup")
+        )
+
+        state_map = self.get_success(
+            self.state_datastore._get_state_for_groups([group2])
+        )
+        self.assertEqual(state_map[group2], {**state, **delta})
+
+        state_map = self.get_success(
+            self.state_datastore._get_state_for_groups(
+                [group2],
+                StateFilter.from_types(
+                    [(EventTypes.Member, "@bob:test"), (EventTypes.Topic, "")]
+                ),
+            )
+        )
+        self.assertEqual(state_map[group2], {(EventTypes.Member, "@bob:test"): "$bob"})
+
+        # The full state of the group isn't cached, but the explicitly requested
+        # entries are.
+        members_cache = self.state_datastore._state_group_members_cache
+        self.assertFalse(members_cache.get(group2).full)
+        self.assertEqual(
+            members_cache.get(group2, [(EventTypes.Member, "@bob:test")]).value,
+            {(EventTypes.Member, "@bob:test"): "$bob"},
+        )
+        self.assertEqual(
+            self.state_datastore._state_group_cache.get(
+                group2, [(EventTypes.Topic, "")]
+            ).known_absent,
+            {(EventTypes.Topic, "")},
+        )
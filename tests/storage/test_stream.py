@@ -13,6 +13,7 @@
 #  limitations under the License.
 
 from typing import List
+from unittest.mock import Mock, patch
 
 from twisted.test.proto_helpers import MemoryReactor
 
@@ -23,6 +24,7 @@ from synapse.rest.client import login, room
 from synapse.server import HomeServer
 from synapse.types import JsonDict
 from synapse.util import Clock
+from synapse.util.caches.membership_change_index import MembershipChangeIndex
 
 from tests.unittest import HomeserverTestCase
 
@@ -261,3 +263,100 @@ class PaginationTestCase(HomeserverTestCase):
         }
         chunk = self._filter_messages(filter)
         self.assertEqual(chunk, [self.event_id_1, self.event_id_2, self.event_id_none])
+
+
+class MembershipChangesTestCase(HomeserverTestCase):
+    """Tests for `get_membership_changes_for_user`."""
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(
+        self, reactor: MemoryReactor, clock: Clock, homeserver: HomeServer
+    ) -> None:
+        self.store = homeserver.get_datastores().main
+
+    def test_membership_changes_from_index(self) -> None:
+        """Recent membership changes are found without querying the database, and
+        match what the database returns.
+        """
+        user_id = self.register_user("test", "test")
+        tok = self.login("test", "test")
+        other_user_id = self.register_user("other", "test")
+        other_tok = self.login("other", "test")
+
+        from_key = self.store.get_room_max_token()
+        room_id = self.helper.create_room_as(other_user_id, tok=other_tok)
+        self.helper.invite(room_id, other_user_id, user_id, tok=other_tok)
+        self.helper.join(room_id, user_id, tok=tok)
+        self.helper.send(room_id, "hello", tok=other_tok)
+        self.helper.leave(room_id, user_id, tok=tok)
+        to_key = self.store.get_room_max_token()
+
+        run_interaction = Mock(side_effect=self.store.db_pool.runInteraction)
+        with patch.object(self.store.db_pool, "runInteraction", run_interaction):
+            from_index = self.get_success(
+                self.store.get_membership_changes_for_user(user_id, from_key, to_key)
+            )
+        self.assertNotIn(
+            "get_membership_changes_for_user",
+            [call[0][0] for call in run_interaction.call_args_list],
+        )
+        self.assertEqual(
+            [e.membership for e in from_index],
+            ["invite", "join", "leave"],
+        )
+
+        # Forget about the changes, so that we have to go to the database.
+        self.store._membership_change_index = MembershipChangeIndex(
+            "test", to_key.stream
+        )
+        from_db = self.get_success(
+            self.store.get_membership_changes_for_user(user_id, from_key, to_key)
+        )
+        self.assertEqual(
+            [e.event_id for e in from_index], [e.event_id for e in from_db]
+        )
+        self.assertEqual(
+            [e.internal_metadata.after for e in from_index],
+            [e.internal_metadata.after for e in from_db],
+        )
+
+
+class RoomLastStreamOrderingTestCase(HomeserverTestCase):
+    """Tests for `get_room_last_stream_ordering`."""
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(
+        self, reactor: MemoryReactor, clock: Clock, homeserver: HomeServer
+    ) -> None:
+        self.store = homeserver.get_datastores().main
+
+    def test_cache_updated_by_new_events(self) -> None:
+        """The cached stream ordering of a room moves forward as events are
+        persisted, rather than being invalidated.
+        """
+        user_id = self.register_user("test", "test")
+        tok = self.login("test", "test")
+        room_id = self.helper.create_room_as(user_id, tok=tok)
+
+        before = self.get_success(self.store.get_room_last_stream_ordering(room_id))
+        assert before is not None
+
+        event_id = self.helper.send(room_id, "hello", tok=tok)["event_id"]
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertGreater(event.internal_metadata.stream_ordering, before)
+
+        run_interaction = Mock(side_effect=self.store.db_pool.runInteraction)
+        with patch.object(self.store.db_pool, "runInteraction", run_interaction):
+            after = self.get_success(self.store.get_room_last_stream_ordering(room_id))
+        run_interaction.assert_not_called()
+        self.assertEqual(after, event.internal_metadata.stream_ordering)
@@ -14,7 +14,8 @@
 
 import re
 from http import HTTPStatus
-from typing import Awaitable, Callable, Dict, NoReturn, Optional, Tuple
+from typing import Awaitable, Callable, Dict, Iterator, NoReturn, Optional, Tuple
+from unittest.mock import Mock
 
 from twisted.internet.defer import Deferred
 from twisted.web.resource import Resource
@@ -26,6 +27,7 @@ from synapse.http.server import (
     DirectServeJsonResource,
     JsonResource,
     OptionsResource,
+    _ByteProducer,
 )
 from synapse.http.site import SynapseRequest, SynapseSite
 from synapse.logging.context import make_deferred_yieldable
@@ -517,3 +519,99 @@ class DirectServeHtmlResourceCancellationTests(unittest.TestCase):
         test_disconnect(
             self.reactor, channel, expect_cancellation=False, expected_body=b"ok"
         )
+
+
+class _JsonObjectResource(DirectServeJsonResource):
+    """A resource which responds with the given (non-canonical) JSON object."""
+
+    def __init__(self, json_object: object):
+        super().__init__()
+        self.json_object = json_object
+
+    async def _async_render_GET(self, request: SynapseRequest) -> Tuple[int, object]:
+        return HTTPStatus.OK, self.json_object
+
+
+class RespondWithJsonTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.reactor = ThreadedMemoryReactorClock()
+
+    def _make_request(self, json_object: object) -> FakeChannel:
+        site = FakeSite(_JsonObjectResource(json_object), self.reactor)
+        return make_request(self.reactor, site, "GET", "/")
+
+    def test_large_response(self) -> None:
+        """Responses larger than a batch are streamed to the client."""
+        json_object = {"events": [{"body": "x" * 1000}] * 200}
+
+        channel = self._make_request(json_object)
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.json_body, json_object)
+
+    def test_unserializable_response(self) -> None:
+        """Responses which can't be encoded give an error."""
+        with self.assertLogs("synapse.http.server", level="ERROR"):
+            channel = self._make_request({"a": "x" * 2000, "b": object()})
+
+        self.assertEqual(channel.code, 500)
+        self.assertEqual(channel.json_body["errcode"], Codes.UNKNOWN)
+
+
+class ByteProducerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.reactor = ThreadedMemoryReactorClock()
+        self.request = Mock()
+
+    def test_yields_to_reactor(self) -> None:
+        """Given a reactor, the producer writes a batch at a time, even if the
+        client doesn't push back.
+        """
+        chunk = b"x" * _ByteProducer.max_bytes_per_resume
+        _ByteProducer(self.request, iter([chunk, chunk, chunk]), self.reactor)
+
+        # The first batch is written, and the rest are left until the reactor
+        # gets round to them.
+        self.request.write.assert_called_once_with(chunk)
+        self.assertEqual(len(self.reactor.getDelayedCalls()), 1)
+        self.request.finish.assert_not_called()
+
+        self.reactor.advance(0)
+        self.assertEqual(self.request.write.call_count, 3)
+        self.request.finish.assert_called_once_with()
+        self.request.unregisterProducer.assert_called_once_with()
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_pause_cancels_yield(self) -> None:
+        """Pausing the producer while yielding to the reactor stops it carrying
+        on until it is resumed.
+        """
+        chunk = b"x" * _ByteProducer.max_bytes_per_resume
+        producer = _ByteProducer(self.request, iter([chunk, chunk]), self.reactor)
+
+        producer.pauseProducing()
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+        self.reactor.advance(0)
+        self.assertEqual(self.request.write.call_count, 1)
+
+        producer.resumeProducing()
+        self.reactor.advance(0)
+        self.assertEqual(self.request.write.call_count, 2)
+        self.request.finish.assert_called_once_with()
+
+    def test_iterator_failure(self) -> None:
+        """If producing the bytes fails part way through, the connection is
+        dropped.
+        """
+
+        def fail_part_way() -> Iterator[bytes]:
+            yield b"x" * _ByteProducer.min_chunk_size
+            raise ValueError("Out of range integer")
+
+        with self.assertLogs("synapse.http.server", level="ERROR"):
+            _ByteProducer(self.request, fail_part_way(), self.reactor)
+
+        self.request.write.assert_called_once()
+        self.request.unregisterProducer.assert_called_once_with()
+        self.request.loseConnection.assert_called_once_with()
+        self.request.finish.assert_not_called()
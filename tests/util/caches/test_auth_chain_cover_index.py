@@ -0,0 +1,100 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.auth_chain_cover_index import (
+    AuthChainCoverIndexCache,
+    AuthChainCoverIndexUpdate,
+    RoomAuthChainCoverIndex,
+)
+
+from tests.unittest import TestCase
+
+
+def make_index() -> RoomAuthChainCoverIndex:
+    """Builds the index of:
+
+        C   D
+        |   |
+        B   |
+         \\ /
+          A
+
+    with A and B in chain 1, and C and D in chains 2 and 3.
+    """
+    index = RoomAuthChainCoverIndex()
+    index.apply(
+        AuthChainCoverIndexUpdate(
+            events=[("A", 1, 1), ("B", 1, 2), ("C", 2, 1), ("D", 3, 1)],
+            links=[(2, 1, 1, 2), (3, 1, 1, 1)],
+            complete_up_to={1: 2, 2: 1, 3: 1},
+        )
+    )
+    return index
+
+
+class RoomAuthChainCoverIndexTestCase(TestCase):
+    def test_auth_chain_ids(self) -> None:
+        index = make_index()
+        self.assertEqual(index.get_auth_chain_ids(["C"], False), {"A", "B"})
+        self.assertEqual(index.get_auth_chain_ids(["B"], False), {"A"})
+        self.assertEqual(index.get_auth_chain_ids(["D"], True), {"A", "D"})
+        self.assertEqual(index.get_auth_chain_ids(["C", "B"], False), {"A", "B"})
+
+    def test_auth_chain_difference(self) -> None:
+        index = make_index()
+        self.assertEqual(
+            index.get_auth_chain_difference([{"C"}, {"D"}]), {"B", "C", "D"}
+        )
+        self.assertEqual(index.get_auth_chain_difference([{"B"}, {"C"}]), {"C"})
+
+    def test_overlapping_updates(self) -> None:
+        """Links which are already known aren't added again."""
+        index = make_index()
+        index.apply(
+            AuthChainCoverIndexUpdate(
+                events=[("C", 2, 1), ("E", 2, 2)],
+                links=[(2, 1, 1, 2), (2, 2, 3, 1)],
+                complete_up_to={2: 2},
+            )
+        )
+        self.assertEqual(index.links[2], [(1, 1, 2), (2, 3, 1)])
+        self.assertEqual(index.get_auth_chain_ids(["E"], False), {"A", "B", "C", "D"})
+
+
+class AuthChainCoverIndexCacheTestCase(TestCase):
+    def test_too_large(self) -> None:
+        cache = AuthChainCoverIndexCache("test", max_events=10)
+        cache.set("!room", make_index())
+        self.assertIsNotNone(cache.get("!room"))
+
+        # Grow the index past the maximum size, which is subject to the cache
+        # factor.
+        index = make_index()
+        events = [("E%d" % (i,), 4, i) for i in range(1, cache.max_room_size)]
+        index.apply(AuthChainCoverIndexUpdate(events=events))
+        cache.set("!room", index)
+        self.assertIsNone(cache.get("!room"))
+        self.assertTrue(cache.is_too_large("!room"))
+
+    def test_pending_and_invalidate(self) -> None:
+        cache = AuthChainCoverIndexCache("test", max_events=100)
+        cache.add_pending("!room", "$event")
+
+        index = make_index()
+        cache.set("!room", index)
+        cache.add_pending("!room", "$event")
+        self.assertEqual(index.pending, {"$event"})
+
+        cache.invalidate(("!room",))
+        self.assertIsNone(cache.get("!room"))
@@ -0,0 +1,39 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.bloom_filter import ScalableBloomFilter
+
+from tests.unittest import TestCase
+
+
+class ScalableBloomFilterTestCase(TestCase):
+    def test_no_false_negatives(self) -> None:
+        bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+        keys = ["$event%d" % (i,) for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        # The filter should have grown to accommodate all the keys.
+        self.assertEqual(len(bloom), 1000)
+        for key in keys:
+            self.assertIn(key, bloom)
+
+    def test_false_positive_rate(self) -> None:
+        bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+        for i in range(1000):
+            bloom.add("$event%d" % (i,))
+
+        false_positives = sum("$other%d" % (i,) in bloom for i in range(10000))
+        # Allow some slack, since this is probabilistic.
+        self.assertLess(false_positives, 200)
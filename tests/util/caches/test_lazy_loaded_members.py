@@ -0,0 +1,139 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.lazy_loaded_members import LazyLoadedMembersCache
+
+from tests.server import get_clock
+from tests.unittest import TestCase
+
+ALICE = ("@alice:test", "DEVICE")
+BOB = ("@bob:test", "DEVICE")
+
+
+class LazyLoadedMembersCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.reactor, self.clock = get_clock()
+        self.cache = LazyLoadedMembersCache(self.clock, expiry_ms=1000)
+
+    def test_mark_sent(self) -> None:
+        self.assertFalse(self.cache.has_sent(ALICE, "!room", "$a"))
+
+        self.cache.mark_sent(ALICE, "!room", ["$a", "$b"])
+        self.cache.mark_sent(BOB, "!room", ["$b", "$c"])
+
+        self.assertTrue(self.cache.has_sent(ALICE, "!room", "$a"))
+        self.assertTrue(self.cache.has_sent(ALICE, "!room", "$b"))
+        self.assertFalse(self.cache.has_sent(ALICE, "!room", "$c"))
+        self.assertFalse(self.cache.has_sent(ALICE, "!other", "$a"))
+        self.assertFalse(self.cache.has_sent(BOB, "!room", "$a"))
+        self.assertTrue(self.cache.has_sent(BOB, "!room", "$c"))
+
+    def test_clear(self) -> None:
+        self.cache.mark_sent(ALICE, "!room", ["$a"])
+        self.cache.mark_sent(BOB, "!room", ["$a"])
+        self.cache.clear(ALICE)
+
+        self.assertFalse(self.cache.has_sent(ALICE, "!room", "$a"))
+        self.assertTrue(self.cache.has_sent(BOB, "!room", "$a"))
+
+    def test_expiry(self) -> None:
+        self.cache.mark_sent(ALICE, "!room", ["$a"])
+        self.reactor.advance(2)
+        self.assertEqual(len(self.cache), 0)
+        self.assertFalse(self.cache.has_sent(ALICE, "!room", "$a"))
+
+    def test_room_table_full(self) -> None:
+        """When a room's table fills up, clients are sent its members again."""
+        cache = LazyLoadedMembersCache(
+            self.clock, expiry_ms=1000, max_members_per_room=2
+        )
+        cache.mark_sent(ALICE, "!room", ["$a", "$b"])
+        self.assertTrue(cache.has_sent(ALICE, "!room", "$a"))
+
+        cache.mark_sent(BOB, "!room", ["$c"])
+        self.assertTrue(cache.has_sent(BOB, "!room", "$c"))
+        self.assertFalse(cache.has_sent(ALICE, "!room", "$a"))
+
+    def test_export_and_load(self) -> None:
+        self.cache.mark_sent(ALICE, "!room", ["$a", "$b"])
+        self.cache.mark_sent(ALICE, "!other", ["$c"])
+        self.assertTrue(self.cache.has_changed(ALICE))
+
+        changes = self.cache.export_changes(ALICE)
+        self.assertFalse(self.cache.has_changed(ALICE))
+        assert changes.room_ids is not None
+        self.assertCountEqual(changes.room_ids, ["!room", "!other"])
+        exported = {
+            room_id: sorted(event_ids) for room_id, event_ids in changes.rooms.items()
+        }
+        self.assertEqual(exported, {"!room": ["$a", "$b"], "!other": ["$c"]})
+
+        other = LazyLoadedMembersCache(self.clock, expiry_ms=1000)
+        other.load(ALICE, exported)
+        self.assertFalse(other.has_changed(ALICE))
+        self.assertTrue(other.has_sent(ALICE, "!room", "$b"))
+        self.assertTrue(other.has_sent(ALICE, "!other", "$c"))
+        self.assertFalse(other.has_sent(ALICE, "!other", "$a"))
+
+        # Sending an event again doesn't count as a change.
+        other.mark_sent(ALICE, "!room", ["$a"])
+        self.assertFalse(other.has_changed(ALICE))
+        other.mark_sent(ALICE, "!room", ["$d"])
+        self.assertTrue(other.has_changed(ALICE))
+
+    def test_export_changes(self) -> None:
+        """Only the rooms which have changed are exported, along with the list of
+        rooms if that has changed.
+        """
+        self.cache.mark_sent(ALICE, "!room", ["$a"])
+        self.cache.mark_sent(ALICE, "!other", ["$b"])
+        self.cache.export_changes(ALICE)
+
+        # An existing room changes.
+        self.cache.mark_sent(ALICE, "!room", ["$c"])
+        changes = self.cache.export_changes(ALICE)
+        self.assertIsNone(changes.room_ids)
+        self.assertEqual(
+            {
+                room_id: sorted(event_ids)
+                for room_id, event_ids in changes.rooms.items()
+            },
+            {"!room": ["$a", "$c"]},
+        )
+
+        # A new room is added.
+        self.cache.mark_sent(ALICE, "!new", ["$d"])
+        changes = self.cache.export_changes(ALICE)
+        assert changes.room_ids is not None
+        self.assertCountEqual(changes.room_ids, ["!room", "!other", "!new"])
+        self.assertEqual(changes.rooms, {"!new": ["$d"]})
+
+        # Nothing has changed.
+        changes = self.cache.export_changes(ALICE)
+        self.assertIsNone(changes.room_ids)
+        self.assertEqual(changes.rooms, {})
+
+        # Clearing empties the list of rooms.
+        self.cache.clear(ALICE)
+        self.assertTrue(self.cache.has_changed(ALICE))
+        changes = self.cache.export_changes(ALICE)
+        self.assertEqual(changes.room_ids, [])
+        self.assertEqual(changes.rooms, {})
+
+    def test_token(self) -> None:
+        token = object()
+        self.assertFalse(self.cache.is_current(ALICE, token))  # type: ignore[arg-type]
+        self.cache.set_token(ALICE, token)  # type: ignore[arg-type]
+        self.assertTrue(self.cache.is_current(ALICE, token))  # type: ignore[arg-type]
+        self.assertFalse(self.cache.is_current(BOB, token))  # type: ignore[arg-type]
@@ -0,0 +1,76 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.membership_change_index import (
+    MembershipChange,
+    MembershipChangeIndex,
+)
+
+from tests.unittest import TestCase
+
+
+def _change(stream_ordering: int, room_id: str = "!room") -> MembershipChange:
+    return MembershipChange(
+        stream_ordering=stream_ordering,
+        instance_name="master",
+        event_id="$event%d" % (stream_ordering,),
+        room_id=room_id,
+        membership="join",
+    )
+
+
+class MembershipChangeIndexTestCase(TestCase):
+    def test_get_changes(self) -> None:
+        index = MembershipChangeIndex("#test", 1)
+        index.record_change("@a:test", _change(2))
+        index.record_change("@b:test", _change(3))
+        # Changes can arrive out of order.
+        index.record_change("@a:test", _change(5))
+        index.record_change("@a:test", _change(4))
+
+        self.assertEqual(
+            index.get_changes("@a:test", 1), [_change(2), _change(4), _change(5)]
+        )
+        self.assertEqual(index.get_changes("@a:test", 3), [_change(4), _change(5)])
+        self.assertEqual(index.get_changes("@a:test", 5), [])
+        self.assertEqual(index.get_changes("@b:test", 1), [_change(3)])
+        self.assertEqual(index.get_changes("@c:test", 1), [])
+
+        # We know nothing about changes at or before the starting position.
+        self.assertIsNone(index.get_changes("@a:test", 0))
+        index.record_change("@c:test", _change(1))
+        self.assertEqual(index.get_changes("@c:test", 1), [])
+
+    def test_duplicate(self) -> None:
+        """Recording the same change twice has no effect."""
+        index = MembershipChangeIndex("#test", 1)
+        index.record_change("@a:test", _change(2))
+        index.record_change("@a:test", _change(2))
+
+        self.assertEqual(index.get_changes("@a:test", 1), [_change(2)])
+        self.assertEqual(len(index), 1)
+
+    def test_eviction(self) -> None:
+        """Once the oldest changes are evicted, the index can no longer answer
+        queries about positions before them.
+        """
+        index = MembershipChangeIndex("#test", 1, max_size=2)
+        index.record_change("@a:test", _change(2))
+        index.record_change("@b:test", _change(3))
+        index.record_change("@a:test", _change(4))
+
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.get_changes("@a:test", 1))
+        self.assertEqual(index.get_changes("@a:test", 2), [_change(4)])
+        self.assertEqual(index.get_changes("@b:test", 2), [_change(3)])
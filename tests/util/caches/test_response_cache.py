@@ -213,3 +213,98 @@ class ResponseCacheTestCase(TestCase):
             self.assertCountEqual(
                 [], cache.keys(), "cache should not have the result now"
             )
+
+    def test_stale_while_revalidate(self) -> None:
+        """Stale results are returned while they are recalculated in the background."""
+        cache: ResponseCache[int] = ResponseCache(
+            self.clock, "stale_cache", timeout_ms=1000, stale_timeout_ms=5000
+        )
+
+        self.assertEqual(
+            "first",
+            self.successResultOf(
+                defer.ensureDeferred(cache.wrap(0, self.instant_return, "first"))
+            ),
+        )
+
+        # Once the result is stale it is still returned, but a recalculation is
+        # started...
+        self.reactor.advance(2)
+        wrap_d = defer.ensureDeferred(cache.wrap(0, self.delayed_return, "second"))
+        self.assertEqual("first", self.successResultOf(wrap_d))
+
+        # ... and only one.
+        unexpected = Mock(spec=())
+        wrap_d = defer.ensureDeferred(cache.wrap(0, unexpected))
+        unexpected.assert_not_called()
+        self.assertEqual("first", self.successResultOf(wrap_d))
+
+        # Once the recalculation completes its result is used.
+        self.reactor.advance(1)
+        wrap_d = defer.ensureDeferred(cache.wrap(0, unexpected))
+        unexpected.assert_not_called()
+        self.assertEqual("second", self.successResultOf(wrap_d))
+
+        # The new result expires as normal.
+        self.reactor.pump((7,))
+        self.assertCountEqual([], cache.keys(), "cache should not have the result now")
+
+    def test_stale_while_revalidate_failure(self) -> None:
+        """If recalculating a stale result fails, the stale result is kept."""
+        cache: ResponseCache[int] = ResponseCache(
+            self.clock, "stale_cache", timeout_ms=1000, stale_timeout_ms=5000
+        )
+
+        self.successResultOf(
+            defer.ensureDeferred(cache.wrap(0, self.instant_return, "first"))
+        )
+        self.reactor.advance(2)
+
+        async def fail() -> str:
+            raise Exception("boom")
+
+        wrap_d = defer.ensureDeferred(cache.wrap(0, fail))
+        self.assertEqual("first", self.successResultOf(wrap_d))
+
+        # The next request retries the recalculation.
+        wrap_d = defer.ensureDeferred(cache.wrap(0, self.instant_return, "second"))
+        self.assertEqual("first", self.successResultOf(wrap_d))
+
+        wrap_d = defer.ensureDeferred(cache.wrap(0, Mock(spec=())))
+        self.assertEqual("second", self.successResultOf(wrap_d))
+
+    def test_max_entries(self) -> None:
+        """The oldest completed results are evicted once the cache is full."""
+        cache: ResponseCache[int] = ResponseCache(
+            self.clock, "small_cache", timeout_ms=9001, max_entries=2
+        )
+
+        # An incomplete result is never evicted.
+        pending_d = defer.ensureDeferred(cache.wrap(0, self.delayed_return, "zero"))
+        for key in (1, 2, 3):
+            self.successResultOf(
+                defer.ensureDeferred(cache.wrap(key, self.instant_return, str(key)))
+            )
+
+        self.assertCountEqual([0, 3], cache.keys())
+
+        self.reactor.advance(1)
+        self.assertEqual("zero", self.successResultOf(pending_d))
+        self.assertCountEqual([0, 3], cache.keys())
+
+    def test_max_memory(self) -> None:
+        """The oldest completed results are evicted once they use too much memory."""
+        cache: ResponseCache[int] = ResponseCache(
+            self.clock,
+            "small_cache",
+            timeout_ms=9001,
+            max_memory_bytes=10,
+            memory_size_callback=len,
+        )
+
+        for key, result in enumerate(("aaaa", "bbbb", "cccc")):
+            self.successResultOf(
+                defer.ensureDeferred(cache.wrap(key, self.instant_return, result))
+            )
+
+        self.assertCountEqual([1, 2], cache.keys())
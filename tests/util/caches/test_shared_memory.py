@@ -0,0 +1,74 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.util.caches.shared_memory import SharedMemoryCache
+
+from tests import unittest
+
+
+class SharedMemoryCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.path = self.mktemp()
+        self.cache = SharedMemoryCache("test_cache", self.path, 64 * 1024, 256)
+        self.addCleanup(self.cache.close)
+
+    def test_get_set(self) -> None:
+        self.assertIsNone(self.cache.get("key"))
+
+        self.cache.set("key", b"value", self.cache.get_version("key"))
+        self.assertEqual(self.cache.get("key"), b"value")
+        self.assertEqual(len(self.cache), 1)
+
+    def test_shared(self) -> None:
+        """Entries are visible to other instances using the same file."""
+        other_cache = SharedMemoryCache("other_cache", self.path, 64 * 1024, 256)
+        self.addCleanup(other_cache.close)
+
+        self.cache.set("key", b"value", self.cache.get_version("key"))
+        self.assertEqual(other_cache.get("key"), b"value")
+
+        other_cache.invalidate("key")
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_too_large(self) -> None:
+        self.cache.set("key", b"x" * 256, self.cache.get_version("key"))
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_invalidate_during_fetch(self) -> None:
+        """Values fetched before an invalidation are not added to the cache."""
+        version = self.cache.get_version("key")
+        self.cache.invalidate("key")
+        self.cache.set("key", b"stale", version)
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_len_after_close(self) -> None:
+        """Closed caches, which stay registered for metrics, report no entries."""
+        other_cache = SharedMemoryCache("other_cache", self.path, 64 * 1024, 256)
+        other_cache.set("key", b"value", other_cache.get_version("key"))
+        self.assertEqual(len(other_cache), 1)
+
+        other_cache.close()
+        self.assertEqual(len(other_cache), 0)
+
+    def test_mismatched_settings(self) -> None:
+        """Files in use with different settings are left alone."""
+        with self.assertRaises(ValueError):
+            SharedMemoryCache("other_cache", self.path, 128 * 1024, 256)
+        with self.assertRaises(ValueError):
+            SharedMemoryCache("other_cache", self.path, 64 * 1024, 128)
+
+        # The file wasn't resized or reset under the existing cache.
+        self.cache.set("key", b"value", self.cache.get_version("key"))
+        self.assertEqual(self.cache.get("key"), b"value")
@@ -0,0 +1,110 @@
+# Copyright 2023 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List, Union
+
+from frozendict import frozendict
+
+from synapse.util import json_decoder
+from synapse.util.json_codec import get_json_codec, orjson
+
+from .. import unittest
+
+
+class StdlibJsonCodecTestCase(unittest.TestCase):
+    backend = "stdlib"
+
+    def setUp(self) -> None:
+        self.codec = get_json_codec(self.backend)
+
+    def test_round_trip(self) -> None:
+        value = {"a": [1, 2.5, None, True], "b": {"c": "ünïcödé 🎉"}}
+        encoded = self.codec.encode(value)
+        self.assertEqual(self.codec.decode(encoded), value)
+        self.assertEqual(json_decoder.decode(encoded), value)
+
+    def test_compact(self) -> None:
+        self.assertEqual(self.codec.encode({"a": [1, 2]}), '{"a":[1,2]}')
+        self.assertEqual(self.codec.encode_bytes({"a": [1, 2]}), b'{"a":[1,2]}')
+
+    def test_frozendict(self) -> None:
+        encoded = self.codec.encode(frozendict({"a": frozendict({"b": 1})}))
+        self.assertEqual(encoded, '{"a":{"b":1}}')
+
+    def test_decode_types(self) -> None:
+        inputs: List[Union[str, bytes, bytearray, memoryview]] = [
+            '{"a":1}',
+            b'{"a":1}',
+            bytearray(b'{"a":1}'),
+            memoryview(b'{"a":1}'),
+        ]
+        for data in inputs:
+            self.assertEqual(self.codec.decode(data), {"a": 1})
+
+    def test_big_int(self) -> None:
+        """Integers which don't fit in 64 bits can be encoded."""
+        self.assertEqual(self.codec.encode({"a": 2**70}), '{"a":%d}' % (2**70,))
+
+    def test_reject_invalid(self) -> None:
+        """The Python extensions to JSON are rejected."""
+        for data in ("NaN", "[Infinity]", '{"a":-Infinity}', "{"):
+            with self.assertRaises(ValueError):
+                self.codec.decode(data)
+
+    def test_iterencode(self) -> None:
+        """Encoding a piece at a time gives the same result as all at once."""
+        values = [
+            {},
+            [],
+            {"a": {"b": [1, {"c": "ünïcödé"}]}, "d": ()},
+            frozendict({"a": frozendict()}),
+            {1: 2},
+            [[[[[[[["deep"]]]]]]]],
+            "string",
+        ]
+        for value in values:
+            chunks = list(self.codec.iterencode_bytes(value))
+            self.assertEqual(b"".join(chunks), self.codec.encode_bytes(value))
+
+        # Dictionaries are split up to the given depth, and lists into batches.
+        self.assertEqual(
+            list(self.codec.iterencode_bytes({"a": {"b": {"c": 1}}}, max_depth=2)),
+            [b'{"a":', b'{"b":', b'{"c":1}', b"}", b"}"],
+        )
+        self.assertEqual(
+            list(self.codec.iterencode_bytes(list(range(120)))),
+            [
+                b"[" + ",".join(str(i) for i in range(0, 50)).encode(),
+                b"," + ",".join(str(i) for i in range(50, 100)).encode(),
+                b"," + ",".join(str(i) for i in range(100, 120)).encode(),
+                b"]",
+            ],
+        )
+
+    def test_unserializable(self) -> None:
+        with self.assertRaises(TypeError):
+            self.codec.encode({"a": object()})
+
+
+class OrjsonJsonCodecTestCase(StdlibJsonCodecTestCase):
+    backend = "orjson"
+
+    if not orjson:
+        skip = "orjson is not installed"
+
+
+class GetJsonCodecTestCase(unittest.TestCase):
+    def test_unknown_backend(self) -> None:
+        with self.assertRaises(ValueError):
+            get_json_codec("ujson")
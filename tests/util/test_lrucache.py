@@ -18,7 +18,11 @@ from unittest.mock import Mock, patch
 
 from synapse.metrics.jemalloc import JemallocStats
 from synapse.types import JsonDict
-from synapse.util.caches.lrucache import LruCache, setup_expire_lru_cache_entries
+from synapse.util.caches.lrucache import (
+    LruCache,
+    setup_cache_memory_budget,
+    setup_expire_lru_cache_entries,
+)
 from synapse.util.caches.treecache import TreeCache
 
 from tests import unittest
@@ -93,6 +97,91 @@ class LruCacheTestCase(unittest.HomeserverTestCase):
         self.assertEqual(cache.max_size, 100)
 
 
+class TinyLfuTestCase(unittest.HomeserverTestCase):
+    @override_config({"caches": {"per_cache_eviction_policy": {"mycache": "tinylfu"}}})
+    def test_policy_from_config(self) -> None:
+        cache: LruCache[int, int] = LruCache(10, "mycache")
+        self.assertEqual(cache.eviction_policy, "tinylfu")
+
+        other_cache: LruCache[int, int] = LruCache(10, "othercache")
+        self.assertEqual(other_cache.eviction_policy, "lru")
+
+    def test_scan_resistance(self) -> None:
+        """Frequently used entries survive a scan of one-off keys."""
+        cache: LruCache[int, int] = LruCache(100, apply_cache_factor_from_config=False)
+        cache.set_eviction_policy("tinylfu")
+
+        for _ in range(5):
+            for i in range(50):
+                cache[i] = i
+                cache.get(i)
+
+        for i in range(1000, 2000):
+            cache[i] = i
+
+        self.assertEqual(len(cache), 100)
+        for i in range(50):
+            self.assertEqual(cache.get(i), i)
+
+    def test_eviction_callbacks(self) -> None:
+        """The callbacks of entries are called when the policy evicts them."""
+        callbacks = [Mock() for _ in range(10)]
+        cache: LruCache[int, int] = LruCache(5, apply_cache_factor_from_config=False)
+        cache.set_eviction_policy("tinylfu")
+
+        for i in range(10):
+            cache.set(i, i, callbacks=[callbacks[i]])
+
+        self.assertEqual(len(cache), 5)
+        for i in range(10):
+            self.assertEqual(callbacks[i].call_count, 0 if i in cache else 1)
+
+        # None of the keys has been seen more often than the others, so the
+        # new candidates lose the ties and the oldest entries are kept.
+        self.assertIn(0, cache)
+        self.assertEqual(callbacks[0].call_count, 0)
+
+        cache.clear()
+        for i in range(10):
+            self.assertEqual(callbacks[i].call_count, 1)
+
+    def test_switch_policy(self) -> None:
+        """Entries are preserved when switching between eviction policies."""
+        cache: LruCache[int, int] = LruCache(10, apply_cache_factor_from_config=False)
+        for i in range(10):
+            cache[i] = i
+
+        cache.set_eviction_policy("tinylfu")
+        self.assertEqual(len(cache), 10)
+        for i in range(10):
+            self.assertEqual(cache.get(i), i)
+
+        cache.set_eviction_policy("lru")
+        self.assertEqual(len(cache), 10)
+
+        # Plain LRU eviction applies again, so the least recently used entry
+        # (0) is evicted first.
+        cache[10] = 10
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(10), 10)
+
+    def test_del_multi(self) -> None:
+        cache: LruCache[Tuple[str, str], str] = LruCache(
+            4, cache_type=TreeCache, apply_cache_factor_from_config=False
+        )
+        cache.set_eviction_policy("tinylfu")
+        cache[("animal", "cat")] = "mew"
+        cache[("animal", "dog")] = "woof"
+        cache[("vehicles", "car")] = "vroom"
+
+        cache.del_multi(("animal",))  # type: ignore[arg-type]
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(("vehicles", "car")), "vroom")
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
 class LruCacheCallbacksTestCase(unittest.HomeserverTestCase):
     def test_get(self) -> None:
         m = Mock()
@@ -322,6 +411,29 @@ class TimeEvictionTestCase(unittest.HomeserverTestCase):
         self.assertEqual(cache.get("key1"), None)
         self.assertEqual(cache.get("key2"), 3)
 
+    def test_evict_tinylfu(self) -> None:
+        """Entries in every TinyLFU segment are subject to time based eviction."""
+        setup_expire_lru_cache_entries(self.hs)
+
+        cache: LruCache[str, int] = LruCache(100, clock=self.hs.get_clock())
+        cache.set_eviction_policy("tinylfu")
+
+        for i in range(10):
+            cache[f"key{i}"] = i
+
+        # Promote some of the entries to the protected segment.
+        cache.get("key1")
+        cache.get("key2")
+
+        self.reactor.advance(20 * 60)
+
+        self.assertEqual(cache.get("key1"), 1)
+
+        self.reactor.advance(20 * 60)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("key1"), 1)
+
 
 class MemoryEvictionTestCase(unittest.HomeserverTestCase):
     @override_config(
@@ -376,3 +488,62 @@ class MemoryEvictionTestCase(unittest.HomeserverTestCase):
         # the items should still be in the cache
         self.assertEqual(cache.get("key1"), 1)
         self.assertEqual(cache.get("key2"), 2)
+
+
+class MemoryBudgetTestCase(unittest.HomeserverTestCase):
+    @override_config({"caches": {"global_max_memory": "100K"}})
+    def test_evict_over_budget(self) -> None:
+        setup_cache_memory_budget(self.hs)
+
+        hot_cache: LruCache[int, str] = LruCache(
+            1000,
+            "hot_cache",
+            clock=self.hs.get_clock(),
+            memory_size_callback=len,
+        )
+        cold_cache: LruCache[int, str] = LruCache(
+            1000,
+            "cold_cache",
+            clock=self.hs.get_clock(),
+            memory_size_callback=len,
+        )
+
+        # Fill both caches with 60KB of (estimated) data.
+        for i in range(60):
+            hot_cache[i] = "a" * 700
+            cold_cache[i] = "a" * 700
+
+        self.assertGreater(hot_cache.memory_usage(), 50 * 1024)
+        self.assertGreater(cold_cache.memory_usage(), 50 * 1024)
+
+        for i in range(60):
+            hot_cache.get(i)
+
+        self.reactor.advance(10)
+
+        # We should have evicted down to the budget, starting with the cache
+        # that doesn't get any hits.
+        self.assertLessEqual(
+            hot_cache.memory_usage() + cold_cache.memory_usage(), 100 * 1024
+        )
+        self.assertEqual(len(hot_cache), 60)
+        self.assertLess(len(cold_cache), 60)
+
+        # The least recently used entries get evicted first.
+        self.assertIsNone(cold_cache.get(0))
+        self.assertEqual(cold_cache.get(59), "a" * 700)
+
+    def test_memory_usage_tracks_entries(self) -> None:
+        cache: LruCache[int, str] = LruCache(
+            10, "tracked_cache", memory_size_callback=len
+        )
+        with patch("synapse.util.caches.USE_MEMORY_BUDGET", True):
+            cache[1] = "a" * 1000
+            usage = cache.memory_usage()
+            self.assertGreater(usage, 1000)
+
+            cache[1] = "a" * 2000
+            self.assertEqual(cache.memory_usage(), usage + 1000)
+
+            cache.pop(1)
+            self.assertEqual(cache.memory_usage(), 0)
@@ -1,4 +1,4 @@
-from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.caches.stream_change_cache import _RESIZE_WINDOW, StreamChangeCache
 
 from tests import unittest
 
@@ -66,7 +66,7 @@ class StreamChangeCacheTests(unittest.HomeserverTestCase):
         cache.entity_has_changed("user@elsewhere.org", 4)
 
         # The cache is at the max size, 2
-        self.assertEqual(len(cache._cache), 2)
+        self.assertEqual(len(cache), 2)
         # The cache's earliest known position is 2.
         self.assertEqual(cache._earliest_known_stream_pos, 2)
 
@@ -240,3 +240,69 @@ class StreamChangeCacheTests(unittest.HomeserverTestCase):
 
         # Unknown entities will return the stream start position.
         self.assertEqual(cache.get_max_pos_of_last_change("not@here.website"), 1)
+
+    def test_restore_snapshot(self) -> None:
+        """
+        StreamChangeCache.restore_snapshot extends the cache backwards with an
+        older copy of it, as long as there is no gap between the two.
+        """
+        old_cache = StreamChangeCache("#test", 1)
+        old_cache.entity_has_changed("user@foo.com", 2)
+        old_cache.entity_has_changed("bar@baz.net", 3)
+        earliest_known_stream_pos, changes = old_cache.get_snapshot()
+
+        # The snapshot is complete up to stream position 5, but the new cache
+        # only knows about changes after 6: there is a gap.
+        cache = StreamChangeCache("#test", 6)
+        self.assertFalse(cache.restore_snapshot(earliest_known_stream_pos, 5, changes))
+        self.assertTrue(cache.has_entity_changed("bar@baz.net", 4))
+
+        cache = StreamChangeCache("#test", 4)
+        cache.entity_has_changed("user@foo.com", 5)
+        self.assertTrue(cache.restore_snapshot(earliest_known_stream_pos, 5, changes))
+
+        # The changes from the snapshot are now known...
+        self.assertFalse(cache.has_entity_changed("bar@baz.net", 3))
+        self.assertTrue(cache.has_entity_changed("bar@baz.net", 2))
+        self.assertFalse(cache.has_entity_changed("not@here.website", 2))
+
+        # ... but newer changes take precedence.
+        self.assertEqual(cache.get_max_pos_of_last_change("user@foo.com"), 5)
+        self.assertEqual(
+            cache.get_all_entities_changed(2).entities, ["bar@baz.net", "user@foo.com"]
+        )
+
+    def test_adaptive_size(self) -> None:
+        """
+        StreamChangeCache grows when queries are frequently for positions it
+        has already evicted, and shrinks back when its older entries go unused.
+        """
+        cache = StreamChangeCache("#test", 1, max_size=2)
+
+        cache.entity_has_changed("user@foo.com", 2)
+        cache.entity_has_changed("bar@baz.net", 3)
+        cache.entity_has_changed("user@elsewhere.org", 4)
+        self.assertEqual(cache.max_size, 2)
+
+        # Query for a position that has been evicted until the cache resizes.
+        for _ in range(_RESIZE_WINDOW):
+            self.assertTrue(cache.has_entity_changed("user@foo.com", 2))
+
+        self.assertEqual(cache.max_size, 4)
+
+        # The cache can now hold more entities.
+        cache.entity_has_changed("user@foo.com", 5)
+        cache.entity_has_changed("another@foo.com", 6)
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.get_max_pos_of_last_change("bar@baz.net"), 3)
+
+        # Only query for recent positions until the cache resizes.
+        for _ in range(_RESIZE_WINDOW):
+            self.assertFalse(cache.has_entity_changed("user@foo.com", 5))
+
+        # The cache shrinks back to its configured size, evicting the oldest
+        # entries.
+        self.assertEqual(cache.max_size, 2)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual({"user@foo.com", "another@foo.com"}, set(cache._entity_to_key))
+        self.assertFalse(cache.get_all_entities_changed(4).hit)